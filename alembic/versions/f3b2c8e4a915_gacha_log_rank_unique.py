@@ -0,0 +1,31 @@
+"""gacha_log_rank_unique
+
+Revision ID: f3b2c8e4a915
+Revises: 1220c5c80757
+Create Date: 2026-10-18 10:12:40.518204
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "f3b2c8e4a915"
+down_revision = "1220c5c80757"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # 批量写入使用 upsert，每个玩家的每种排行只能有一行，保留最后写入的一行
+    op.execute(
+        sa.text(
+            "DELETE FROM gacha_log_rank WHERE id NOT IN "
+            "(SELECT id FROM (SELECT MAX(id) AS id FROM gacha_log_rank GROUP BY player_id, type) AS t)"
+        )
+    )
+    op.create_index("index_player_type", "gacha_log_rank", ["player_id", "type"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index("index_player_type", table_name="gacha_log_rank")
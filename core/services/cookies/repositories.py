@@ -1,3 +1,57 @@
+from typing import List
+
+from sqlalchemy.orm.exc import StaleDataError
+from sqlmodel import update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.dependence.database import Database
+from gram_core.base_service import BaseService
+from gram_core.services.cookies.models import CookiesDataBase as Cookies, CookiesStatusEnum
 from gram_core.services.cookies.repositories import CookiesRepository
 
-__all__ = ("CookiesRepository",)
+__all__ = ("CookiesRepository", "CookiesBatchRepository")
+
+
+class CookiesBatchRepository(BaseService.Component):
+    """批量写入 Cookies，一批数据只使用一个事务"""
+
+    def __init__(self, database: Database):
+        self.engine = database.engine
+
+    async def update_many(self, cookies: List[Cookies]) -> List[Cookies]:
+        """批量更新 Cookies，事务因为数据已经被删除而失败时逐个更新
+        :param cookies: Cookies 数据
+        :return: 更新失败的数据
+        """
+        if not cookies:
+            return []
+        try:
+            async with AsyncSession(self.engine) as session:
+                session.add_all(cookies)
+                await session.commit()
+            return []
+        except StaleDataError:
+            pass
+        failed = []
+        for cookie in cookies:
+            try:
+                async with AsyncSession(self.engine) as session:
+                    session.add(cookie)
+                    await session.commit()
+            except StaleDataError:
+                failed.append(cookie)
+        return failed
+
+    async def set_status_many(self, ids: List[int], status: CookiesStatusEnum) -> int:
+        """批量修改 Cookies 状态
+        :param ids: Cookies 的 id
+        :param status: 状态
+        :return: 修改的行数
+        """
+        if not ids:
+            return 0
+        async with AsyncSession(self.engine) as session:
+            statement = update(Cookies).where(Cookies.id.in_(ids)).values(status=status)  # pylint: disable=E1101
+            results = await session.execute(statement)
+            await session.commit()
+            return results.rowcount
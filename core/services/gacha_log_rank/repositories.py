@@ -1,3 +1,61 @@
+import datetime
+from typing import Dict, List, Tuple
+
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.dependence.database import Database
+from gram_core.base_service import BaseService
+from gram_core.services.gacha_log_rank.models import GachaLogRank, GachaLogTypeEnum
 from gram_core.services.gacha_log_rank.repositories import GachaLogRankRepository
 
-__all__ = ("GachaLogRankRepository",)
+__all__ = ("GachaLogRankRepository", "GachaLogRankBatchRepository")
+
+# 已经存在时需要更新的列
+UPSERT_UPDATE_COLUMNS = ("score_1", "score_2", "score_3", "score_4", "score_5", "data", "time_updated")
+UPSERT_INSERT = {"mysql": mysql.insert, "postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+class GachaLogRankBatchRepository(BaseService.Component):
+    """批量写入抽卡记录排行榜，一批数据使用一条 upsert 语句
+
+    依赖 (player_id, type) 上的唯一索引 index_player_type
+    """
+
+    def __init__(self, database: Database):
+        self.engine = database.engine
+
+    @property
+    def supported(self) -> bool:
+        """当前数据库是否支持多行 upsert，不支持时调用方需要使用 GachaLogRankRepository 逐条添加或更新"""
+        return self.engine.dialect.name in UPSERT_INSERT
+
+    def get_upsert_statement(self, rows: List[Dict]):
+        """根据数据库方言生成多行 upsert 语句，只在 supported 时调用"""
+        dialect = self.engine.dialect.name
+        table = GachaLogRank.__table__  # pylint: disable=E1101
+        statement = UPSERT_INSERT[dialect](table).values(rows)
+        if dialect == "mysql":
+            return statement.on_duplicate_key_update({i: statement.inserted[i] for i in UPSERT_UPDATE_COLUMNS})
+        return statement.on_conflict_do_update(
+            index_elements=["player_id", "type"], set_={i: statement.excluded[i] for i in UPSERT_UPDATE_COLUMNS}
+        )
+
+    async def add_or_update_many(self, ranks: List[GachaLogRank]) -> int:
+        """批量添加或更新排行数据
+        :param ranks: 排行数据
+        :return: 写入的行数
+        """
+        if not ranks:
+            return 0
+        now = datetime.datetime.now()
+        # 同一条语句中不能出现重复的键，保留最后一条
+        rows: Dict[Tuple[int, GachaLogTypeEnum], Dict] = {}
+        for rank in ranks:
+            row = rank.dict(exclude={"id", "time_created"})
+            row["time_updated"] = now
+            rows[(rank.player_id, rank.type)] = row
+        async with AsyncSession(self.engine) as session:
+            await session.execute(self.get_upsert_statement(list(rows.values())))
+            await session.commit()
+        return len(rows)
@@ -1,15 +1,28 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
+from typing import List
 
 from influxdb_client import Point
 from influxdb_client.client.flux_table import FluxRecord
+from pydantic import parse_obj_as
 from simnet.models.zzz.self_help import ZZZSelfHelpActionLog
 
-from modules.action_log.date import TZ
+from modules.action_log.date import TZ, get_day, get_day_start
+from modules.action_log.models import ActionLogDay, ActionLogSession
+
+try:
+    import ujson as jsonlib
+except ImportError:
+    import json as jsonlib
 
 FIX = timedelta(minutes=6)
 
 
 class ActionLogModel:
+    @staticmethod
+    def get_time(time: datetime) -> datetime:
+        """接口返回的时间为北京时间，pytz 的时区直接替换时为 +08:06"""
+        return time.replace(tzinfo=TZ) + FIX
+
     @staticmethod
     def en(data: "ZZZSelfHelpActionLog") -> Point:
         return (
@@ -19,7 +32,7 @@ class ActionLogModel:
             .field("status", data.status)
             .field("reason", data.reason.value)
             .field("client_ip", data.client_ip)
-            .time(data.time.replace(tzinfo=TZ) + FIX)
+            .time(ActionLogModel.get_time(data.time))
         )
 
     @staticmethod
@@ -29,3 +42,52 @@ class ActionLogModel:
         return ZZZSelfHelpActionLog(
             id=data["id"], uid=data["uid"], datetime=time, action_name=data["reason"], client_ip=data["client_ip"]
         )
+
+
+class ActionLogSessionModel:
+    @staticmethod
+    def en(uid: int, data: "ActionLogSession") -> Point:
+        """导入时生成的会话，时间与登录记录相同为接口返回的时间"""
+        return (
+            Point.measurement("action_log_session")
+            .tag("uid", str(uid))
+            .field("end", int(ActionLogModel.get_time(data.end).timestamp()))
+            .field("duration", data.duration)
+            .time(ActionLogModel.get_time(data.start))
+        )
+
+    @staticmethod
+    def de(data: "FluxRecord") -> "ActionLogSession":
+        return ActionLogSession(
+            start=data.get_time().astimezone(TZ),
+            end=datetime.fromtimestamp(data["end"], TZ),
+            duration=data["duration"],
+        )
+
+
+class ActionLogDayModel:
+    @staticmethod
+    def en(uid: int, data: "ActionLogDay") -> Point:
+        return (
+            Point.measurement("action_log_day")
+            .tag("uid", str(uid))
+            .field("duration", data.duration)
+            .field("sessions", data.sessions)
+            .field("long", data.long)
+            .field("short", data.short)
+            .field("hours", ",".join(str(i) for i in data.hours))
+            .field("records", "[" + ",".join(i.json(by_alias=True) for i in data.records) + "]")
+            .time(get_day_start(data.day))
+        )
+
+    @staticmethod
+    def de(data: "FluxRecord") -> "ActionLogDay":
+        return ActionLogDay(
+            day=get_day(data.get_time()),
+            duration=data["duration"],
+            sessions=data["sessions"],
+            long=data["long"],
+            short=data["short"],
+            hours=[int(i) for i in data["hours"].split(",")],
+            records=parse_obj_as(List[ZZZSelfHelpActionLog], jsonlib.loads(data["records"])),
+        )
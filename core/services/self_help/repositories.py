@@ -1,4 +1,5 @@
-from typing import TYPE_CHECKING, List
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, List, Union
 
 from gram_core.base_service import BaseService
 from gram_core.dependence.influxdb import InfluxDatabase
@@ -16,7 +17,11 @@ class ActionLogRepository(BaseService.Component):
         self.client = influxdb.client
         self.bucket = "zzz"
 
-    async def add(self, p: List["Point"]) -> bool:
+    @staticmethod
+    def format_time(time: datetime) -> str:
+        return time.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    async def add(self, p: List[Union["Point", str]]) -> bool:
         async with self.client() as client:
             client: "InfluxDBClientAsync"
             return await client.write_api().write(self.bucket, record=p)
@@ -54,3 +59,56 @@ class ActionLogRepository(BaseService.Component):
             tables = await client.query_api().query(query)
             for table in tables:
                 return table
+
+    async def get_range(self, uid: int, start: datetime, end: datetime) -> "FluxTable":
+        """获取时间范围内的原始记录"""
+        async with self.client() as client:
+            client: "InfluxDBClientAsync"
+            query = (
+                'from(bucket: "{}")'
+                "|> range(start: {}, stop: {})"
+                '|> filter(fn: (r) => r["_measurement"] == "action_log")'
+                '|> filter(fn: (r) => r["uid"] == "{}")'
+                '|> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")'
+            ).format(self.bucket, self.format_time(start), self.format_time(end), uid)
+            tables = await client.query_api().query(query)
+            for table in tables:
+                return table
+
+    async def get_sessions(self, uid: int, start: datetime, end: datetime) -> "FluxTable":
+        """获取时间范围内开始的会话"""
+        async with self.client() as client:
+            client: "InfluxDBClientAsync"
+            query = (
+                'from(bucket: "{}")'
+                "|> range(start: {}, stop: {})"
+                '|> filter(fn: (r) => r["_measurement"] == "action_log_session")'
+                '|> filter(fn: (r) => r["uid"] == "{}")'
+                '|> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")'
+            ).format(self.bucket, self.format_time(start), self.format_time(end), uid)
+            tables = await client.query_api().query(query)
+            for table in tables:
+                return table
+
+    async def get_days(self, uid: int, start: datetime, end: datetime) -> "FluxTable":
+        """获取时间范围内的单日汇总"""
+        async with self.client() as client:
+            client: "InfluxDBClientAsync"
+            query = (
+                'from(bucket: "{}")'
+                "|> range(start: {}, stop: {})"
+                '|> filter(fn: (r) => r["_measurement"] == "action_log_day")'
+                '|> filter(fn: (r) => r["uid"] == "{}")'
+                '|> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")'
+            ).format(self.bucket, self.format_time(start), self.format_time(end), uid)
+            tables = await client.query_api().query(query)
+            for table in tables:
+                return table
+
+    async def delete_days(self, uid: int, start: datetime, end: datetime) -> bool:
+        """删除时间范围内的单日汇总"""
+        async with self.client() as client:
+            client: "InfluxDBClientAsync"
+            return await client.delete_api().delete(
+                start, end, f'_measurement="action_log_day" AND uid="{uid}"', bucket=self.bucket
+            )
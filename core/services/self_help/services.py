@@ -1,19 +1,102 @@
-from typing import List, TYPE_CHECKING, Dict
+import asyncio
+import contextlib
+from datetime import date, datetime
+from typing import List, TYPE_CHECKING, Dict, Set
 
-from core.services.self_help.models import ActionLogModel
+from core.services.self_help.models import ActionLogDayModel, ActionLogModel, ActionLogSessionModel
 from core.services.self_help.repositories import ActionLogRepository
 from gram_core.base_service import BaseService
+from modules.action_log.date import get_day_start
+from modules.action_log.client import ActionLogAnalyse
+from modules.action_log.models import ActionLogDay, ActionLogSession, ActionLogSummary
+from modules.action_log.query import ActionLogQuery, ActionLogSource
+from modules.action_log.writer import ActionLogBatchWriter
 
 if TYPE_CHECKING:
     from simnet.models.zzz.self_help import ZZZSelfHelpActionLog
 
 
+class ActionLogInfluxSource(ActionLogSource):
+    """从 InfluxDB 读取原始记录与单日汇总"""
+
+    def __init__(self, repository: ActionLogRepository):
+        self.repository = repository
+
+    async def get_records(self, uid: int, start: datetime, end: datetime) -> List["ZZZSelfHelpActionLog"]:
+        r = await self.repository.get_range(uid, start, end)
+        if not r:
+            return []
+        return [ActionLogModel.de(record) for record in r.records]
+
+    async def get_sessions(self, uid: int, start: datetime, end: datetime) -> List[ActionLogSession]:
+        r = await self.repository.get_sessions(uid, start, end)
+        if not r:
+            return []
+        return [ActionLogSessionModel.de(record) for record in r.records]
+
+    async def get_days(self, uid: int, start: date, end: date) -> List[ActionLogDay]:
+        r = await self.repository.get_days(uid, get_day_start(start), get_day_start(end))
+        if not r:
+            return []
+        return [ActionLogDayModel.de(record) for record in r.records]
+
+    async def add_days(self, uid: int, days: List[ActionLogDay]):
+        if days:
+            await self.repository.add([ActionLogDayModel.en(uid, data) for data in days])
+
+    async def delete_days(self, uid: int, start: date, end: date):
+        await self.repository.delete_days(uid, get_day_start(start), get_day_start(end))
+
+
 class ActionLogService(BaseService):
     def __init__(self, repository: ActionLogRepository):
         self.repository = repository
+        self.query = ActionLogQuery(ActionLogInfluxSource(repository))
+        # 多个用户的记录合并为一次写入
+        self.writer = ActionLogBatchWriter(self.repository.add)
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def shutdown(self) -> None:
+        await self.writer.close()
+        await self.wait_pending()
 
-    async def add(self, p: List["ZZZSelfHelpActionLog"]) -> bool:
-        return await self.repository.add([ActionLogModel.en(data) for data in p])
+    async def wait_pending(self):
+        """等待所有不等待写入的记录写入完成"""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def add(self, p: List["ZZZSelfHelpActionLog"], wait: bool = True) -> bool:
+        """写入登录记录以及配对生成的会话
+        :param p: 登录记录，按时间排列
+        :param wait: 是否等待写入完成，不等待时写入失败只记录在 writer.metrics 中
+        :return: 是否写入成功
+        """
+        points = [ActionLogModel.en(data) for data in p]
+        # 导入时配对登录、登出记录，查询时直接读取会话
+        uid_list = {data.uid for data in p}
+        for uid in uid_list:
+            sessions = ActionLogAnalyse.init_sessions([data for data in p if data.uid == uid])
+            points.extend(ActionLogSessionModel.en(uid, session) for session in sessions)
+        future = await self.writer.put([point.to_line_protocol() for point in points])
+        if wait:
+            await future
+            await self.invalidate(p)
+            return True
+        task = asyncio.create_task(self.invalidate_after(future, p))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
+
+    async def invalidate(self, p: List["ZZZSelfHelpActionLog"]):
+        """写入完成后删除受影响日期的汇总"""
+        uid_list = {data.uid for data in p}
+        for uid in uid_list:
+            await self.query.invalidate(uid, [data for data in p if data.uid == uid])
+
+    async def invalidate_after(self, future: asyncio.Future, p: List["ZZZSelfHelpActionLog"]):
+        with contextlib.suppress(Exception):
+            await future
+            await self.invalidate(p)
 
     async def count_uptime_period(self, uid: int) -> Dict[int, int]:
         """计算最近一个月不同时间点的登录次数"""
@@ -35,3 +118,7 @@ class ActionLogService(BaseService):
         for record in r.records:
             data.append(ActionLogModel.de(record))
         return data
+
+    async def get_summary(self, uid: int, day: int = 180) -> ActionLogSummary:
+        """获取指定天数内的某用户的登录汇总，只有今天的记录需要实时查询"""
+        return await self.query.get_summary(uid, day)
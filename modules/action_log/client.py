@@ -1,89 +1,128 @@
-from typing import List, Dict, Union
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Union
 
 from simnet.models.zzz.self_help import ZZZSelfHelpActionLog, ZZZSelfHelpActionLogReason
 
-from modules.action_log.date import DateUtils
-from modules.action_log.models import ActionLogPair
+from modules.action_log.date import DateUtils, get_day
+from modules.action_log.models import ActionLogSession, ActionLogSummary
+
+
+class ActionLogPeriod:
+    """时间段内的会话统计，逐个会话累加"""
+
+    __slots__ = ("start", "end", "duration", "count", "long", "short")
+
+    def __init__(self, start: datetime, end: datetime):
+        self.start = start
+        self.end = end
+        self.duration = 0
+        self.count = 0
+        self.long = 0
+        self.short = 0
+
+    def add(self, duration: int, count: int = 1, long: Optional[int] = None, short: Optional[int] = None):
+        """计入会话，count 不为 1 时为多个会话的汇总"""
+        long = duration if long is None else long
+        short = duration if short is None else short
+        self.long = max(self.long, long)
+        self.short = min(self.short, short) if self.count else short
+        self.duration += duration
+        self.count += count
+
+    @property
+    def avg(self) -> float:
+        return (self.duration / self.count) if self.count else 0
 
 
 class ActionLogAnalyse(DateUtils):
-    def __init__(self, data: List[ZZZSelfHelpActionLog], data2: Dict[int, int]):
+    def __init__(
+        self,
+        data: List[ZZZSelfHelpActionLog],
+        data2: Dict[int, int],
+        sessions: Optional[List[ActionLogSession]] = None,
+    ):
+        """
+        :param data: 登录记录
+        :param data2: 每小时的登录次数
+        :param sessions: 导入时生成的会话，为空时从登录记录配对
+        """
         super().__init__()
         self.data = data
         self.data2 = data2
-        self.pairs = self.init_pair(data)
-        self.this_week_data: List[ActionLogPair] = []
-        self.last_week_data: List[ActionLogPair] = []
-        self.this_month_data: List[ActionLogPair] = []
-        self.last_month_data: List[ActionLogPair] = []
-        self.init_pair_data()
-
-    def init_pair_data(self):
-        """通过时间点判断数据属于哪个时间段"""
-        for d in self.pairs:
-            if self.week_start <= d.start_time < self.week_end:
-                self.this_week_data.append(d)
-            elif self.week_last_start <= d.start_time < self.week_last_end:
-                self.last_week_data.append(d)
-            if self.month_start <= d.start_time < self.month_end:
-                self.this_month_data.append(d)
-            elif self.month_last_start <= d.start_time < self.month_last_end:
-                self.last_month_data.append(d)
+        self.sessions = self.init_sessions(data) if sessions is None else sessions
+        self.this_week = ActionLogPeriod(self.week_start, self.week_end)
+        self.last_week = ActionLogPeriod(self.week_last_start, self.week_last_end)
+        self.this_month = ActionLogPeriod(self.month_start, self.month_end)
+        self.last_month = ActionLogPeriod(self.month_last_start, self.month_last_end)
+        self.init_period_data()
+
+    def init_period_data(self):
+        """通过时间点判断会话属于哪个时间段，只遍历一次"""
+        for d in self.sessions:
+            if self.this_week.start <= d.start < self.this_week.end:
+                self.this_week.add(d.duration)
+            elif self.last_week.start <= d.start < self.last_week.end:
+                self.last_week.add(d.duration)
+            if self.this_month.start <= d.start < self.this_month.end:
+                self.this_month.add(d.duration)
+            elif self.last_month.start <= d.start < self.last_month.end:
+                self.last_month.add(d.duration)
 
     @staticmethod
-    def init_pair(data: List[ZZZSelfHelpActionLog]) -> List[ActionLogPair]:
-        pairs = []
+    def init_sessions(data: List[ZZZSelfHelpActionLog]) -> List[ActionLogSession]:
+        """依次配对登录、登出记录，只保留会话的时间"""
+        sessions = []
         start = None
         for d in data:
             if start:
                 if d.reason == ZZZSelfHelpActionLogReason.LOG_OUT:
-                    pairs.append(ActionLogPair(start=start, end=d))
+                    sessions.append(
+                        ActionLogSession.construct(start=start.time, end=d.time, duration=(d.time - start.time).seconds)
+                    )
                     start = None
             elif d.reason == ZZZSelfHelpActionLogReason.LOG_IN:
                 start = d
-        return pairs
+        return sessions
 
     def get_this_week_duration(self) -> int:
         """本周时长"""
-        return (sum(d.duration.seconds for d in self.this_week_data)) if self.this_week_data else 0
+        return self.this_week.duration
 
     def get_last_week_duration(self) -> int:
         """上周时长"""
-        return (sum(d.duration.seconds for d in self.last_week_data)) if self.last_week_data else 0
+        return self.last_week.duration
 
     def get_this_month_duration(self) -> int:
         """本月时长"""
-        return (sum(d.duration.seconds for d in self.this_month_data)) if self.this_month_data else 0
+        return self.this_month.duration
 
     def get_last_month_duration(self) -> int:
         """上月时长"""
-        return (sum(d.duration.seconds for d in self.last_month_data)) if self.last_month_data else 0
+        return self.last_month.duration
 
     def get_this_month_avg_duration(self) -> float:
         """本月平均时长"""
-        data_len = len(self.this_month_data)
-        return (self.get_this_month_duration() / data_len) if data_len else 0
+        return self.this_month.avg
 
     def get_last_month_avg_duration(self) -> float:
         """上月平均时长"""
-        data_len = len(self.last_month_data)
-        return (self.get_last_month_duration() / data_len) if data_len else 0
+        return self.last_month.avg
 
     def get_this_week_long_duration(self) -> int:
         """周最长会话"""
-        return (max(d.duration.seconds for d in self.this_week_data)) if self.this_week_data else 0
+        return self.this_week.long
 
     def get_this_week_short_duration(self) -> int:
         """周最短会话"""
-        return (min(d.duration.seconds for d in self.this_week_data)) if self.this_week_data else 0
+        return self.this_week.short
 
     def get_this_month_long_duration(self) -> int:
         """月最长会话"""
-        return (max(d.duration.seconds for d in self.this_month_data)) if self.this_month_data else 0
+        return self.this_month.long
 
     def get_this_month_short_duration(self) -> int:
         """月最短会话"""
-        return (min(d.duration.seconds for d in self.this_month_data)) if self.this_month_data else 0
+        return self.this_month.short
 
     @staticmethod
     def format_sec(sec: Union[int, float]) -> str:
@@ -149,3 +188,32 @@ class ActionLogAnalyse(DateUtils):
                 }
             )
         return data
+
+
+class ActionLogSummaryAnalyse(ActionLogAnalyse):
+    """使用单日汇总的登录日志分析，结果与 ActionLogAnalyse 相同"""
+
+    def __init__(self, summary: ActionLogSummary, days: int = 63):
+        """
+        :param summary: 登录汇总，最后一天为今天
+        :param days: 最近记录的天数
+        """
+        today = summary.days[-1].day if summary.days else None
+        recent = [i for i in summary.days if i.day >= today - timedelta(days=days)] if today else []
+        data2 = {k: 0 for k in range(24)}
+        for i in summary.days:
+            for hour, value in enumerate(i.hours):
+                data2[hour] += value
+        self.summary = summary
+        super().__init__([r for i in recent for r in i.records], data2, [])
+
+    def init_period_data(self):
+        """时间段的边界都是每日 4 点，整天计入"""
+        periods = [self.this_week, self.last_week, self.this_month, self.last_month]
+        ranges = [(get_day(i.start), get_day(i.end)) for i in periods]
+        for day in self.summary.days:
+            if not day.sessions:
+                continue
+            for period, (start, end) in zip(periods, ranges):
+                if start <= day.day < end:
+                    period.add(day.duration, day.sessions, day.long, day.short)
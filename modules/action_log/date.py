@@ -1,8 +1,20 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from pytz import timezone
 
 TZ = timezone("Asia/Shanghai")
+# 每日 4 点为一天的开始
+DAY_OFFSET = timedelta(hours=4)
+
+
+def get_day(time: datetime) -> date:
+    """获取时间所在的日期"""
+    return (time.astimezone(TZ) - DAY_OFFSET).date()
+
+
+def get_day_start(day: date) -> datetime:
+    """获取日期的开始时间"""
+    return TZ.localize(datetime(day.year, day.month, day.day)) + DAY_OFFSET
 
 
 class DateUtils:
@@ -1,4 +1,5 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from typing import List
 
 from pydantic import BaseModel
 from simnet.models.zzz.self_help import ZZZSelfHelpActionLog
@@ -19,3 +20,33 @@ class ActionLogPair(BaseModel):
     @property
     def duration(self) -> timedelta:
         return self.end.time - self.start.time
+
+
+class ActionLogSession(BaseModel):
+    """登录会话，导入时由登录、登出记录配对生成"""
+
+    start: datetime
+    end: datetime
+    # 与 ActionLogPair.duration.seconds 相同
+    duration: int
+
+
+class ActionLogDay(BaseModel):
+    """单日登录汇总，每日 4 点为一天的开始，会话按登录时间计入"""
+
+    day: date
+    # 会话总时长，与 ActionLogPair.duration.seconds 相同不计整天的部分
+    duration: int = 0
+    sessions: int = 0
+    long: int = 0
+    short: int = 0
+    # 每小时是否有登录，按统计窗口的结束时间计
+    hours: List[int] = [0] * 24
+    # 当天最后几条记录
+    records: List[ZZZSelfHelpActionLog] = []
+
+
+class ActionLogSummary(BaseModel):
+    """登录汇总，按日期从旧到新排列，最后一天为今天"""
+
+    days: List[ActionLogDay] = []
@@ -0,0 +1,184 @@
+"""登录记录查询"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from simnet.models.zzz.self_help import ZZZSelfHelpActionLog, ZZZSelfHelpActionLogReason
+
+from modules.action_log.client import ActionLogAnalyse
+from modules.action_log.date import TZ, get_day, get_day_start
+from modules.action_log.models import ActionLogDay, ActionLogSession, ActionLogSummary
+
+# 每天保存的最后几条记录，用于显示最近的记录
+DAY_RECORDS = 4
+
+
+def summarize(
+    records: List[ZZZSelfHelpActionLog], days: Iterable[date], sessions: Optional[List[ActionLogSession]] = None
+) -> Dict[date, ActionLogDay]:
+    """汇总登录记录
+    :param records: 按时间排列的登录记录
+    :param days: 需要汇总的日期
+    :param sessions: 导入时生成的会话，为空时从登录记录配对，此时登录记录需要包含在最后一天之后结束的会话的登出记录
+    :return: 每天的汇总，没有记录的日期为空汇总
+    """
+    result = {day: ActionLogDay(day=day) for day in days}
+    if sessions is None:
+        sessions = ActionLogAnalyse.init_sessions(records)
+    for session in sessions:
+        summary = result.get(get_day(session.start))
+        if summary is None:
+            continue
+        seconds = session.duration
+        summary.long = max(summary.long, seconds)
+        summary.short = min(summary.short, seconds) if summary.sessions else seconds
+        summary.duration += seconds
+        summary.sessions += 1
+    for record in records:
+        summary = result.get(get_day(record.time))
+        if summary is None:
+            continue
+        if record.reason == ZZZSelfHelpActionLogReason.LOG_IN:
+            # 与 aggregateWindow 相同，整点窗口的时间为窗口结束时间
+            window = record.time.astimezone(TZ).replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            summary.hours[window.hour] = 1
+        summary.records.append(record)
+        del summary.records[:-DAY_RECORDS]
+    return result
+
+
+class ActionLogSource(ABC):
+    """登录记录数据源"""
+
+    @abstractmethod
+    async def get_records(self, uid: int, start: datetime, end: datetime) -> List[ZZZSelfHelpActionLog]:
+        """获取时间范围内的原始记录，按时间排列"""
+
+    @abstractmethod
+    async def get_sessions(self, uid: int, start: datetime, end: datetime) -> List[ActionLogSession]:
+        """获取时间范围内开始的会话，按开始时间排列"""
+
+    @abstractmethod
+    async def get_days(self, uid: int, start: date, end: date) -> List[ActionLogDay]:
+        """获取已保存的单日汇总"""
+
+    @abstractmethod
+    async def add_days(self, uid: int, days: List[ActionLogDay]):
+        """保存单日汇总"""
+
+    @abstractmethod
+    async def delete_days(self, uid: int, start: date, end: date):
+        """删除单日汇总"""
+
+
+class ActionLogQuery:
+    """登录记录查询
+
+    已经结束的日期不会再变化，第一次查询时汇总为单日数据保存到数据源，并按用户与日期范围缓存，
+    之后每次查询只需要实时获取今天的原始记录。导入新记录时删除受影响日期的汇总与缓存。
+    """
+
+    def __init__(self, source: ActionLogSource, cache_size: int = 1024):
+        """
+        :param source: 数据源
+        :param cache_size: 缓存的日期范围数量
+        """
+        self.source = source
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[Tuple[int, date, date], List[ActionLogDay]]" = OrderedDict()
+
+    @staticmethod
+    def get_today(now: Optional[datetime] = None) -> date:
+        return get_day(now or datetime.now(tz=TZ))
+
+    async def materialize(self, uid: int, days: List[date]) -> List[ActionLogDay]:
+        """从原始记录汇总缺少的日期并保存"""
+        start, end = get_day_start(min(days)), get_day_start(max(days) + timedelta(days=1))
+        # 最后一天的会话可能在第二天结束
+        records = await self.source.get_records(uid, start, end + timedelta(days=1))
+        sessions = await self.source.get_sessions(uid, start, end)
+        # 导入时生成会话之前的旧记录没有会话，从登录记录配对
+        first = sessions[0].start if sessions else end + timedelta(days=1)
+        sessions = ActionLogAnalyse.init_sessions([i for i in records if i.time < first]) + sessions
+        result = list(summarize(records, days, sessions).values())
+        await self.source.add_days(uid, result)
+        return result
+
+    async def get_closed_days(self, uid: int, start: date, end: date) -> List[ActionLogDay]:
+        """获取已经结束的日期的汇总
+        :param uid: 玩家uid
+        :param start: 开始日期
+        :param end: 结束日期，不包含
+        :return: 每天的汇总，按日期排列
+        """
+        key = (uid, start, end)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        saved = {i.day: i for i in await self.source.get_days(uid, start, end) if start <= i.day < end}
+        missing = [start + timedelta(days=i) for i in range((end - start).days)]
+        missing = [i for i in missing if i not in saved]
+        if missing:
+            for summary in await self.materialize(uid, missing):
+                saved[summary.day] = summary
+        result = [saved[i] for i in sorted(saved)]
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    async def get_summary(self, uid: int, days: int = 180, now: Optional[datetime] = None) -> ActionLogSummary:
+        """获取最近几天的登录汇总
+        :param uid: 玩家uid
+        :param days: 天数，不包含今天
+        :param now: 当前时间
+        :return: 登录汇总，今天的数据实时查询
+        """
+        now = now or datetime.now(tz=TZ)
+        today = self.get_today(now)
+        closed = await self.get_closed_days(uid, today - timedelta(days=days), today)
+        records = await self.source.get_records(uid, get_day_start(today), now)
+        return ActionLogSummary(days=[*closed, summarize(records, [today])[today]])
+
+    async def invalidate(self, uid: int, records: List[ZZZSelfHelpActionLog]):
+        """导入新记录后删除受影响日期的汇总与缓存
+
+        每日导入的是完整的历史记录，只有晚于已保存汇总中最后一条记录的才是新记录。
+        从最早的新记录所在日期的前一天开始删除，重新导入没有变化的记录时保留已保存的汇总。
+        """
+        if not records:
+            return
+        days = [get_day(i.time) for i in records]
+        start, end = min(days) - timedelta(days=1), max(days) + timedelta(days=1)
+        saved = {i.day: i for i in await self.source.get_days(uid, start, end)}
+        first = None
+        for record, day in zip(records, days):
+            if not self.is_new(record, day, saved):
+                continue
+            first = day if first is None else min(first, day)
+        if first is None:
+            return
+        for key in [i for i in self.cache if i[0] == uid]:
+            del self.cache[key]
+        # 前一天的会话可能在新记录中结束
+        await self.source.delete_days(uid, first - timedelta(days=1), end)
+
+    @staticmethod
+    def is_new(record: ZZZSelfHelpActionLog, day: date, saved: Dict[date, ActionLogDay]) -> bool:
+        """判断记录是否在保存汇总之后才导入
+        :param record: 登录记录
+        :param day: 记录所在的日期
+        :param saved: 已保存的汇总
+        :return: 是否需要删除记录所在日期及前一天的汇总
+        """
+        summary = saved.get(day)
+        if summary is not None:
+            return not summary.records or record.time > summary.records[-1].time
+        # 当天没有汇总时，只有前一天没有结束的会话会受到影响
+        summary = saved.get(day - timedelta(days=1))
+        if summary is None or not summary.records:
+            return False
+        last = summary.records[-1]
+        return last.reason == ZZZSelfHelpActionLogReason.LOG_IN and record.time > last.time
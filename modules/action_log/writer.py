@@ -0,0 +1,175 @@
+"""登录记录批量写入"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class ActionLogWriterMetrics:
+    """批量写入的统计数据"""
+
+    __slots__ = ("flushes", "written", "failed", "retries", "max_flush", "queue_depth", "max_queue_depth", "max_lag")
+
+    def __init__(self):
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.max_flush = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.max_lag = 0.0
+
+    @property
+    def avg_flush(self) -> float:
+        return self.written / self.flushes if self.flushes else 0
+
+    def dict(self) -> Dict[str, Any]:
+        data = {i: getattr(self, i) for i in self.__slots__}
+        data["avg_flush"] = self.avg_flush
+        return data
+
+
+class ActionLogBatchWriter:
+    """登录记录批量写入
+
+    多个用户的记录先进入同一个队列，队列中的记录达到 batch_size 或最早的记录等待超过 flush_interval 时
+    合并为一次写入。写入失败时按指数退避重试，队列已满时 put 会等待，避免导入速度超过写入速度。
+    """
+
+    def __init__(
+        self,
+        write: Callable[[List[Any]], Awaitable[Any]],
+        batch_size: int = 5000,
+        flush_interval: float = 1.0,
+        max_queue: int = 50000,
+        retries: int = 3,
+        retry_delay: float = 1.0,
+    ):
+        """
+        :param write: 写入一批记录
+        :param batch_size: 单次写入的最大记录数
+        :param flush_interval: 记录在队列中等待的最长时间
+        :param max_queue: 队列中的最大记录数，超过时 put 等待
+        :param retries: 写入失败时的重试次数
+        :param retry_delay: 第一次重试前的等待时间，之后每次翻倍
+        """
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.metrics = ActionLogWriterMetrics()
+        # 每次 put 的记录、加入队列的时间以及写入完成后通知调用方的 future
+        self.queue: List[Tuple[List[Any], float, asyncio.Future]] = []
+        self.queue_size = 0
+        self.condition: Optional[asyncio.Condition] = None
+        self.task: Optional[asyncio.Task] = None
+        self.closing = False
+
+    def get_condition(self) -> asyncio.Condition:
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        return self.condition
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.closing = False
+            self.task = asyncio.create_task(self.run())
+
+    async def put(self, items: List[Any]) -> asyncio.Future:
+        """加入写入队列
+        :param items: 需要写入的记录
+        :return: 写入完成后设置结果的 future，写入失败时设置异常
+        """
+        future = asyncio.get_running_loop().create_future()
+        if not items:
+            future.set_result(True)
+            return future
+        self.start()
+        condition = self.get_condition()
+        async with condition:
+            # 队列已满时等待写入，单次超过队列上限的记录在队列为空时直接加入
+            await condition.wait_for(lambda: self.queue_size == 0 or self.queue_size + len(items) <= self.max_queue)
+            self.queue.append((items, time.monotonic(), future))
+            self.queue_size += len(items)
+            self.metrics.queue_depth = self.queue_size
+            self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, self.queue_size)
+            condition.notify_all()
+        return future
+
+    def take_batch(self) -> Tuple[List[Any], List[asyncio.Future], float]:
+        """从队列中取出一批记录，同一次 put 的记录不会被拆分"""
+        items, futures = [], []
+        oldest = self.queue[0][1]
+        while self.queue and (not items or len(items) + len(self.queue[0][0]) <= self.batch_size):
+            data, _, future = self.queue.pop(0)
+            items.extend(data)
+            futures.append(future)
+        self.queue_size -= len(items)
+        self.metrics.queue_depth = self.queue_size
+        return items, futures, oldest
+
+    async def wait_batch(self):
+        """等待队列中的记录达到 batch_size 或最早的记录超过 flush_interval"""
+        condition = self.get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.queue or self.closing)
+            while not self.closing and self.queue_size < self.batch_size:
+                timeout = self.queue[0][1] + self.flush_interval - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(condition.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if not self.queue:
+                return None
+            batch = self.take_batch()
+            condition.notify_all()
+            return batch
+
+    async def flush_batch(self, items: List[Any], futures: List[asyncio.Future], oldest: float):
+        self.metrics.max_lag = max(self.metrics.max_lag, time.monotonic() - oldest)
+        exc = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.metrics.retries += 1
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                await self.write(items)
+            except Exception as e:  # pylint: disable=W0703
+                exc = e
+                continue
+            self.metrics.flushes += 1
+            self.metrics.written += len(items)
+            self.metrics.max_flush = max(self.metrics.max_flush, len(items))
+            for future in futures:
+                if not future.done():
+                    future.set_result(True)
+            return
+        self.metrics.failed += len(items)
+        for future in futures:
+            if not future.done():
+                future.set_exception(exc)
+
+    async def run(self):
+        while True:
+            batch = await self.wait_batch()
+            if batch is None:
+                if self.closing:
+                    return
+                continue
+            await self.flush_batch(*batch)
+
+    async def close(self):
+        """写入队列中剩余的记录并停止"""
+        if self.task is None:
+            return
+        condition = self.get_condition()
+        async with condition:
+            self.closing = True
+            condition.notify_all()
+        await self.task
+        self.task = None
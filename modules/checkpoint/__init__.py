@@ -0,0 +1 @@
+"""任务检查点"""
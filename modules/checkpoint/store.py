@@ -0,0 +1,346 @@
+"""长时间运行的任务的检查点
+
+每个任务同一时间只有一次运行，通过 JobCheckpointManager.run 开始的运行结束前，同一个任务再次开始时抛出
+JobCheckpointRunning。运行的状态与已经完成的用户保存在检查点中。任务重启后从检查点恢复，
+跳过已经完成的用户，剩余的用户按照任务原本的并发数量继续执行。
+
+已经完成的用户每 flush_size 个写入一次存储，进程崩溃时最多有 flush_size - 1 个已经完成的用户在恢复后再次执行，
+不能重复执行的任务需要使用 flush_size=1。
+"""
+
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, TypeVar
+
+import aiofiles
+
+try:
+    import ujson as jsonlib
+except ImportError:
+    import json as jsonlib
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+T = TypeVar("T")
+
+
+class JobCheckpointRunning(Exception):
+    """同一个任务已经有一次运行"""
+
+    def __init__(self, job: str):
+        super().__init__(job)
+        self.job = job
+
+
+def get_daily_run(now: Optional[datetime] = None) -> str:
+    """每日任务的运行ID"""
+    return (now or datetime.now()).strftime("%Y%m%d")
+
+
+class JobCheckpointStore(ABC):
+    """检查点存储"""
+
+    @abstractmethod
+    async def get_state(self, job: str) -> Optional[Dict[str, Any]]:
+        """获取任务的运行状态"""
+
+    @abstractmethod
+    async def set_state(self, job: str, state: Dict[str, Any]):
+        """保存任务的运行状态"""
+
+    @abstractmethod
+    async def get_states(self, prefix: str) -> Dict[str, Dict[str, Any]]:
+        """获取名称以 prefix 开头的任务的运行状态"""
+
+    @abstractmethod
+    async def get_done(self, job: str) -> Set[str]:
+        """获取本次运行已经完成的用户"""
+
+    @abstractmethod
+    async def add_done(self, job: str, keys: List[str]):
+        """记录已经完成的用户"""
+
+    @abstractmethod
+    async def clear(self, job: str):
+        """清除本次运行已经完成的用户"""
+
+
+class JobCheckpointMemory(JobCheckpointStore):
+    def __init__(self):
+        self.states: Dict[str, Dict[str, Any]] = {}
+        self.done: Dict[str, Set[str]] = {}
+
+    async def get_state(self, job: str) -> Optional[Dict[str, Any]]:
+        state = self.states.get(job)
+        return dict(state) if state else None
+
+    async def set_state(self, job: str, state: Dict[str, Any]):
+        self.states[job] = dict(state)
+
+    async def get_states(self, prefix: str) -> Dict[str, Dict[str, Any]]:
+        return {job: dict(state) for job, state in self.states.items() if job.startswith(prefix)}
+
+    async def get_done(self, job: str) -> Set[str]:
+        return set(self.done.get(job, ()))
+
+    async def add_done(self, job: str, keys: List[str]):
+        self.done.setdefault(job, set()).update(keys)
+
+    async def clear(self, job: str):
+        self.done.pop(job, None)
+
+
+class JobCheckpointRedis(JobCheckpointStore):
+    def __init__(self, client: "Redis", qname: str = "job:checkpoint:", ttl: int = 60 * 60 * 24 * 3):
+        self.client = client
+        self.qname = qname
+        self.ttl = ttl
+
+    def get_state_key(self, job: str) -> str:
+        return f"{self.qname}{job}"
+
+    def get_done_key(self, job: str) -> str:
+        return f"{self.qname}{job}:done"
+
+    async def get_state(self, job: str) -> Optional[Dict[str, Any]]:
+        data = await self.client.get(self.get_state_key(job))
+        return jsonlib.loads(data) if data else None
+
+    async def set_state(self, job: str, state: Dict[str, Any]):
+        await self.client.set(self.get_state_key(job), jsonlib.dumps(state), ex=self.ttl)
+
+    async def get_states(self, prefix: str) -> Dict[str, Dict[str, Any]]:
+        states = {}
+        async for key in self.client.scan_iter(match=f"{self.qname}{prefix}*"):
+            key = key.decode() if isinstance(key, bytes) else key
+            if key.endswith(":done"):
+                continue
+            job = key[len(self.qname) :]
+            state = await self.get_state(job)
+            if state is not None:
+                states[job] = state
+        return states
+
+    async def get_done(self, job: str) -> Set[str]:
+        data = await self.client.smembers(self.get_done_key(job))
+        return {i.decode() if isinstance(i, bytes) else i for i in data}
+
+    async def add_done(self, job: str, keys: List[str]):
+        if not keys:
+            return
+        key = self.get_done_key(job)
+        await self.client.sadd(key, *keys)
+        await self.client.expire(key, self.ttl)
+
+    async def clear(self, job: str):
+        await self.client.delete(self.get_done_key(job))
+
+
+class JobCheckpointFile(JobCheckpointStore):
+    """保存在本地文件中的检查点，Redis 不可用时使用"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def get_name(job: str) -> str:
+        """任务名称中的 : 不能用于文件名"""
+        return job.replace(":", "_")
+
+    def get_state_path(self, job: str) -> Path:
+        return self.path / f"{self.get_name(job)}.json"
+
+    def get_done_path(self, job: str) -> Path:
+        return self.path / f"{self.get_name(job)}.done"
+
+    async def get_state(self, job: str) -> Optional[Dict[str, Any]]:
+        path = self.get_state_path(job)
+        if not path.exists():
+            return None
+        async with aiofiles.open(path, "r", encoding="utf-8") as f:
+            return jsonlib.loads(await f.read())
+
+    async def set_state(self, job: str, state: Dict[str, Any]):
+        path = self.get_state_path(job)
+        temp = path.with_suffix(".tmp")
+        async with aiofiles.open(temp, "w", encoding="utf-8") as f:
+            await f.write(jsonlib.dumps(state))
+        temp.replace(path)
+
+    async def get_states(self, prefix: str) -> Dict[str, Dict[str, Any]]:
+        states = {}
+        for path in self.path.glob(f"{self.get_name(prefix)}*.json"):
+            async with aiofiles.open(path, "r", encoding="utf-8") as f:
+                state = jsonlib.loads(await f.read())
+            # 文件名无法还原任务名称，使用状态中保存的名称
+            job = state.get("job")
+            if job is not None and job.startswith(prefix):
+                states[job] = state
+        return states
+
+    async def get_done(self, job: str) -> Set[str]:
+        path = self.get_done_path(job)
+        if not path.exists():
+            return set()
+        async with aiofiles.open(path, "r", encoding="utf-8") as f:
+            return {line for line in (await f.read()).splitlines() if line}
+
+    async def add_done(self, job: str, keys: List[str]):
+        if not keys:
+            return
+        async with aiofiles.open(self.get_done_path(job), "a", encoding="utf-8") as f:
+            await f.write("".join(f"{key}\n" for key in keys))
+
+    async def clear(self, job: str):
+        self.get_done_path(job).unlink(missing_ok=True)
+
+
+class JobCheckpoint:
+    """一次任务运行的检查点，已经完成的用户分批写入存储"""
+
+    def __init__(
+        self,
+        store: JobCheckpointStore,
+        job: str,
+        state: Dict[str, Any],
+        done: Set[str],
+        flush_size: int = 20,
+    ):
+        """
+        :param store: 检查点存储
+        :param job: 任务名称
+        :param state: 运行状态
+        :param done: 已经完成的用户
+        :param flush_size: 每完成多少个用户写入一次存储
+        """
+        self.store = store
+        self.job = job
+        self.state = state
+        self.done = done
+        self.flush_size = flush_size
+        # 从检查点恢复时跳过的用户数量
+        self.resumed = len(done)
+        self.buffer: List[str] = []
+        self.lock: Optional[asyncio.Lock] = None
+
+    @property
+    def run(self) -> str:
+        return self.state["run"]
+
+    @property
+    def finished(self) -> bool:
+        return self.state.get("finished", False)
+
+    def get_lock(self) -> asyncio.Lock:
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        return self.lock
+
+    def __contains__(self, key: Any) -> bool:
+        return str(key) in self.done
+
+    def pending(self, items: Iterable[T], key: Callable[[T], Any]) -> List[T]:
+        """过滤已经完成的用户
+        :param items: 全部用户
+        :param key: 用户的唯一标识
+        :return: 尚未完成的用户
+        """
+        return [item for item in items if str(key(item)) not in self.done]
+
+    async def mark(self, *keys: Any):
+        """记录已经完成的用户，达到 flush_size 时写入存储"""
+        for key in keys:
+            key = str(key)
+            if key not in self.done:
+                self.done.add(key)
+                self.buffer.append(key)
+        if len(self.buffer) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self.get_lock():
+            if not self.buffer:
+                return
+            buffer, self.buffer = self.buffer, []
+            await self.store.add_done(self.job, buffer)
+
+    async def finish(self):
+        """任务运行完成"""
+        await self.flush()
+        self.state["finished"] = True
+        await self.store.set_state(self.job, self.state)
+
+
+class JobCheckpointManager:
+    def __init__(self, store: JobCheckpointStore, flush_size: int = 20):
+        """
+        :param store: 检查点存储
+        :param flush_size: 每完成多少个用户写入一次存储
+        """
+        self.store = store
+        self.flush_size = flush_size
+        # 正在运行的任务
+        self.running: Set[str] = set()
+
+    async def start(self, job: str, run: str, reset: bool = False, flush_size: Optional[int] = None) -> JobCheckpoint:
+        """开始或恢复一次任务运行，不检查任务是否正在运行
+        :param job: 任务名称
+        :param run: 运行ID，与检查点中的运行ID相同时从检查点恢复
+        :param reset: 忽略检查点，重新开始运行
+        :param flush_size: 每完成多少个用户写入一次存储，默认使用 manager 的设置
+        :return: 检查点
+        """
+        flush_size = flush_size or self.flush_size
+        state = await self.store.get_state(job)
+        if state is not None and state.get("run") == run and not reset:
+            done = await self.store.get_done(job)
+            return JobCheckpoint(self.store, job, state, done, flush_size)
+        await self.store.clear(job)
+        state = {"job": job, "run": run, "finished": False, "time": time.time()}
+        await self.store.set_state(job, state)
+        return JobCheckpoint(self.store, job, state, set(), flush_size)
+
+    def is_running(self, job: str) -> bool:
+        return job in self.running
+
+    @asynccontextmanager
+    async def run(
+        self, job: str, run: str, reset: bool = False, flush_size: Optional[int] = None
+    ) -> AsyncIterator[JobCheckpoint]:
+        """开始或恢复一次任务运行，运行结束前同一个任务不能再次开始
+        :param job: 任务名称
+        :param run: 运行ID，与检查点中的运行ID相同时从检查点恢复
+        :param reset: 忽略检查点，重新开始运行
+        :param flush_size: 每完成多少个用户写入一次存储，默认使用 manager 的设置
+        :return: 检查点，运行完成时需要调用 finish
+        """
+        if job in self.running:
+            raise JobCheckpointRunning(job)
+        self.running.add(job)
+        try:
+            checkpoint = await self.start(job, run, reset, flush_size)
+            try:
+                yield checkpoint
+            finally:
+                # 运行出错时也写入已经完成的用户
+                await checkpoint.flush()
+        finally:
+            self.running.discard(job)
+
+    async def get_unfinished(self, job: str) -> Optional[Dict[str, Any]]:
+        """获取没有运行完成的任务状态，用于重启后恢复"""
+        state = await self.store.get_state(job)
+        if state is None or state.get("finished"):
+            return None
+        return state
+
+    async def get_unfinished_many(self, prefix: str) -> List[Dict[str, Any]]:
+        """获取名称以 prefix 开头的没有运行完成的任务状态"""
+        states = await self.store.get_states(prefix)
+        return [state for state in states.values() if not state.get("finished")]
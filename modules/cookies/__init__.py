@@ -0,0 +1 @@
+"""Cookies 刷新"""
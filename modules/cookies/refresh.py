@@ -0,0 +1,122 @@
+"""Cookies 批量刷新"""
+
+import asyncio
+import time
+from enum import Enum
+from typing import Any, Awaitable, Callable, Generic, List, Optional, TypeVar
+
+from modules.ratelimit.bucket import TokenBucket
+
+T = TypeVar("T")
+
+
+class CookiesRefreshResult(Enum):
+    UPDATED = 1
+    # 永久失效，批量标记为无效
+    INVALID = 2
+    # 暂时失败，不修改数据
+    SKIPPED = 3
+
+
+class CookiesRefreshMetrics:
+    """刷新的统计数据"""
+
+    __slots__ = ("total", "updated", "invalid", "skipped", "commits", "start", "end")
+
+    def __init__(self, total: int = 0):
+        self.total = total
+        self.updated = 0
+        self.invalid = 0
+        self.skipped = 0
+        # 写入数据库的事务数量
+        self.commits = 0
+        self.start = time.monotonic()
+        self.end: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end or time.monotonic()) - self.start
+
+    def text(self) -> str:
+        return (
+            f"共 {self.total} 更新 {self.updated} 失效 {self.invalid} 跳过 {self.skipped} "
+            f"事务 {self.commits} 耗时 {self.elapsed:.1f}s"
+        )
+
+
+class CookiesRefreshPipeline(Generic[T]):
+    """Cookies 批量刷新
+
+    多个账号并发刷新，请求速率由令牌桶限制。刷新成功的账号每 batch_size 个在一个事务中写入，
+    永久失效的账号在全部刷新完成后批量标记。
+    """
+
+    def __init__(
+        self,
+        refresh: Callable[[T], Awaitable[CookiesRefreshResult]],
+        update_many: Callable[[List[T]], Awaitable[Any]],
+        mark_invalid: Callable[[List[T]], Awaitable[Any]],
+        concurrency: int = 16,
+        rate: float = 10.0,
+        batch_size: int = 200,
+    ):
+        """
+        :param refresh: 刷新单个账号，修改传入的数据并返回结果
+        :param update_many: 在一个事务中写入一批刷新成功的账号
+        :param mark_invalid: 在一个事务中把一批账号标记为无效
+        :param concurrency: 同时刷新的账号数量
+        :param rate: 每秒允许刷新的账号数量
+        :param batch_size: 每个事务写入的账号数量
+        """
+        self.refresh = refresh
+        self.update_many = update_many
+        self.mark_invalid = mark_invalid
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.batch_size = batch_size
+        self.metrics = CookiesRefreshMetrics()
+        self.updated: List[T] = []
+        self.invalid: List[T] = []
+        self.lock: Optional[asyncio.Lock] = None
+
+    async def flush(self, force: bool = False):
+        """写入已经刷新成功的账号，同一时间只有一个事务"""
+        async with self.lock:
+            while self.updated and (force or len(self.updated) >= self.batch_size):
+                batch, self.updated = self.updated[: self.batch_size], self.updated[self.batch_size :]
+                await self.update_many(batch)
+                self.metrics.commits += 1
+
+    async def process(self, item: T, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            await self.bucket.acquire()
+            try:
+                result = await self.refresh(item)
+            except Exception:  # pylint: disable=W0703
+                result = CookiesRefreshResult.SKIPPED
+        if result == CookiesRefreshResult.UPDATED:
+            self.metrics.updated += 1
+            self.updated.append(item)
+            await self.flush()
+        elif result == CookiesRefreshResult.INVALID:
+            self.metrics.invalid += 1
+            self.invalid.append(item)
+        else:
+            self.metrics.skipped += 1
+
+    async def run(self, items: List[T]) -> CookiesRefreshMetrics:
+        """刷新全部账号
+        :param items: 需要刷新的账号
+        :return: 统计数据
+        """
+        self.metrics = CookiesRefreshMetrics(len(items))
+        self.updated, self.invalid = [], []
+        self.lock = asyncio.Lock()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*[self.process(item, semaphore) for item in items])
+        await self.flush(force=True)
+        for i in range(0, len(self.invalid), self.batch_size):
+            await self.mark_invalid(self.invalid[i : i + self.batch_size])
+            self.metrics.commits += 1
+        self.metrics.end = time.monotonic()
+        return self.metrics
@@ -0,0 +1 @@
+"""自动便签提醒"""
@@ -0,0 +1,103 @@
+"""根据便签预测下一次请求的时间"""
+
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, List, Optional
+
+from simnet.models.zzz.chronicle.notes import ZZZNoteVhsSaleState
+
+if TYPE_CHECKING:
+    from simnet.models.zzz.chronicle.notes import ZZZNote
+
+# 每点电量的恢复时间
+STAMINA_RECOVER = timedelta(minutes=6)
+# 每日刷新时间
+RESET_HOUR = 4
+
+
+class NotesPredictor:
+    """根据便签预测下一次请求的时间
+
+    电量按固定速度恢复，可以直接算出达到提醒数值的时间，在此之前不需要请求。每日任务只在提醒时间与
+    每日刷新时需要请求。录像店经营没有剩余时间，经营中时按原来的间隔请求。电量使用与道具恢复无法预测，
+    因此等待时间不超过 max_interval，电量已经提醒过时按 noticed_interval 检查是否已经使用。
+    """
+
+    def __init__(
+        self,
+        interval: timedelta = timedelta(minutes=20),
+        max_interval: timedelta = timedelta(hours=6),
+        noticed_interval: timedelta = timedelta(hours=2),
+        margin: timedelta = timedelta(minutes=1),
+    ):
+        """
+        :param interval: 无法预测时的请求间隔
+        :param max_interval: 最长的请求间隔
+        :param noticed_interval: 电量已经提醒过时的请求间隔
+        :param margin: 预测时间之后再等待的时间，修正预测误差
+        """
+        self.interval = interval
+        self.max_interval = max_interval
+        self.noticed_interval = noticed_interval
+        self.margin = margin
+
+    @staticmethod
+    def get_stamina_time(notes: "ZZZNote", threshold: int, now: datetime) -> Optional[datetime]:
+        """电量达到 threshold 的时间，已经达到时返回 None"""
+        current, max_stamina = notes.current_stamina, notes.max_stamina
+        if current >= threshold:
+            return None
+        restore = notes.energy.restore
+        if restore:
+            # 剩余恢复时间比按当前电量计算的更准确
+            seconds = restore - STAMINA_RECOVER * (max_stamina - threshold)
+        else:
+            seconds = STAMINA_RECOVER * (threshold - current)
+        return now + max(seconds, timedelta(0))
+
+    @staticmethod
+    def get_hour_time(now: datetime, hour: int, offset: timedelta = timedelta(0)) -> datetime:
+        """now 之后下一个 hour 点整加上 offset 的时间"""
+        result = now.replace(hour=hour % 24, minute=0, second=0, microsecond=0) + offset
+        if result <= now:
+            result += timedelta(days=1)
+        return result
+
+    def predict(
+        self,
+        notes: "ZZZNote",
+        now: datetime,
+        resin: Optional[int] = None,
+        resin_noticed: bool = False,
+        expedition: bool = False,
+        daily_hour: Optional[int] = None,
+        offset: timedelta = timedelta(0),
+    ) -> datetime:
+        """预测下一次需要请求的时间
+        :param notes: 本次请求的便签
+        :param now: 本次请求的时间，与提醒使用相同的时区
+        :param resin: 电量提醒数值，未订阅时为空
+        :param resin_noticed: 电量是否已经提醒
+        :param expedition: 是否订阅录像店经营提醒
+        :param daily_hour: 每日任务提醒时间，未订阅时为空
+        :param offset: 固定时间点之后的偏移，避免全部用户在同一时间请求
+        :return: 下一次请求的时间
+        """
+        moments: List[datetime] = [now + self.max_interval, self.get_hour_time(now, RESET_HOUR, offset)]
+        if resin is not None and notes.max_stamina > 0:
+            stamina_time = self.get_stamina_time(notes, resin, now)
+            if stamina_time is not None:
+                moments.append(stamina_time + self.margin)
+            elif resin_noticed:
+                moments.append(now + self.noticed_interval)
+            else:
+                moments.append(now + self.interval)
+        if expedition:
+            if notes.vhs_sale.sale_state == ZZZNoteVhsSaleState.FREE:
+                moments.append(now + self.noticed_interval)
+            else:
+                moments.append(now + self.interval)
+        if daily_hour is not None:
+            # 提醒时间内请求一次，之后再请求一次重置提醒状态
+            moments.append(self.get_hour_time(now, daily_hour, offset))
+            moments.append(self.get_hour_time(now, daily_hour + 1, offset))
+        return min(moments)
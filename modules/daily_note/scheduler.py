@@ -0,0 +1,156 @@
+"""自动便签提醒调度"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Iterable, List, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+class TimerWheel(Generic[K]):
+    """哈希时间轮
+
+    每个槽位保存到期时间落在该槽位上的键，到期时间超过一圈的键在之前经过时保留，
+    每次只需要检查当前槽位。
+    """
+
+    def __init__(self, slots: int):
+        """
+        :param slots: 槽位数量
+        """
+        self.slots: List[Dict[K, int]] = [{} for _ in range(slots)]
+        self.index: Dict[K, int] = {}
+        self.current: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self.index
+
+    def get(self, key: K) -> Optional[int]:
+        """键的到期时间"""
+        return self.index.get(key)
+
+    def schedule(self, key: K, tick: int):
+        """设置键的到期时间，已经存在时覆盖"""
+        self.remove(key)
+        self.slots[tick % len(self.slots)][key] = tick
+        self.index[key] = tick
+
+    def remove(self, key: K):
+        tick = self.index.pop(key, None)
+        if tick is not None:
+            del self.slots[tick % len(self.slots)][key]
+
+    def pop(self, tick: int) -> List[K]:
+        """取出槽位中已经到期的键"""
+        slot = self.slots[tick % len(self.slots)]
+        keys = [key for key, due in slot.items() if due <= tick]
+        for key in keys:
+            del slot[key]
+            del self.index[key]
+        return keys
+
+    def advance(self, tick: int) -> List[K]:
+        """前进到指定时间，取出经过的槽位中到期的键，最多经过一圈"""
+        if self.current is None or tick - self.current > len(self.slots):
+            start = tick - len(self.slots) + 1
+        else:
+            start = self.current + 1
+        self.current = tick if self.current is None else max(tick, self.current)
+        result = []
+        for i in range(start, tick + 1):
+            result.extend(self.pop(i))
+        return result
+
+
+class NotesScheduler(Generic[T]):
+    """自动便签提醒调度
+
+    用户按 user_id 均匀分布到时间轮的槽位中，每个周期的每个时间片只处理一个槽位的用户，
+    把原来每个周期一次性请求全部用户的峰值分散为持续的少量请求。
+    """
+
+    def __init__(self, interval: float = 1200, slots: int = 20, concurrency: int = 8):
+        """
+        :param interval: 每个用户的请求间隔
+        :param slots: 每个周期的时间片数量
+        :param concurrency: 同一时间片内同时请求的用户数量
+        """
+        self.interval = interval
+        self.tick = interval / slots
+        self.wheel: TimerWheel[int] = TimerWheel(slots)
+        self.users: Dict[int, T] = {}
+        self.concurrency = concurrency
+        self.loaded: Optional[float] = None
+
+    def get_tick(self, now: Optional[float] = None) -> int:
+        return int((time.time() if now is None else now) // self.tick)
+
+    def get_slot(self, user_id: int) -> int:
+        return user_id % len(self.wheel.slots)
+
+    def get_next_tick(self, user_id: int, tick: int) -> int:
+        """用户所在槽位在 tick 之后的第一个时间片"""
+        slots = len(self.wheel.slots)
+        return tick + 1 + (self.get_slot(user_id) - tick - 1) % slots
+
+    def need_load(self, now: Optional[float] = None) -> bool:
+        """每个周期重新读取一次全部用户"""
+        now = time.monotonic() if now is None else now
+        return self.loaded is None or now - self.loaded >= self.interval
+
+    def load(self, users: Dict[int, T], now: Optional[float] = None, tick: Optional[int] = None):
+        """更新全部用户，新用户加入时间轮，已经不存在的用户移除，其他用户保留原来的时间"""
+        tick = self.get_tick() if tick is None else tick
+        for user_id in [i for i in self.users if i not in users]:
+            self.remove(user_id)
+        for user_id, user in users.items():
+            self.add(user_id, user, tick)
+        self.loaded = time.monotonic() if now is None else now
+
+    def add(self, user_id: int, user: T, tick: Optional[int] = None):
+        """添加或更新用户"""
+        self.users[user_id] = user
+        if user_id not in self.wheel:
+            tick = self.get_tick() if tick is None else tick
+            self.wheel.schedule(user_id, self.get_next_tick(user_id, tick))
+
+    def schedule(self, user_id: int, when: float, tick: Optional[int] = None):
+        """安排用户在指定时间请求，不早于下一个时间片
+        :param user_id: 用户 id
+        :param when: 请求时间的时间戳
+        :param tick: 当前时间片
+        """
+        if user_id not in self.users:
+            return
+        tick = self.get_tick() if tick is None else tick
+        self.wheel.schedule(user_id, max(self.get_tick(when), tick + 1))
+
+    def remove(self, user_id: int):
+        self.users.pop(user_id, None)
+        self.wheel.remove(user_id)
+
+    def due(self, tick: Optional[int] = None) -> List[T]:
+        """取出到期的用户，并安排到下一个周期，请求成功后可以用 schedule 重新安排"""
+        tick = self.get_tick() if tick is None else tick
+        result = []
+        for user_id in self.wheel.advance(tick):
+            user = self.users.get(user_id)
+            if user is None:
+                continue
+            self.wheel.schedule(user_id, self.get_next_tick(user_id, tick))
+            result.append(user)
+        return result
+
+    async def run(self, users: Iterable[T], func: Callable[[T], Awaitable[Any]]) -> List[Any]:
+        """并发处理用户，同时处理的数量不超过 concurrency"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _run(user: T):
+            async with semaphore:
+                return await func(user)
+
+        return await asyncio.gather(*[_run(user) for user in users], return_exceptions=True)
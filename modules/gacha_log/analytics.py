@@ -0,0 +1,187 @@
+import datetime
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metadata.pool.pool import get_pool_by_id
+from modules.gacha_log.models import GachaItem, GachaLogPoolSummary, GachaLogSummaryItem, Pool
+
+# 五星物品会被统计的卡池
+FIVE_STAR_POOLS = {
+    "代理人": {"代理人调频", "常驻调频"},
+    "音擎": {"音擎调频", "常驻调频"},
+    "邦布": {"邦布调频"},
+}
+FOUR_STAR_TYPES = {"代理人", "音擎", "邦布"}
+
+
+class GachaLogColumns:
+    """单个卡池调频记录的列式数据
+
+    记录需要按时间排序。稀有度被拼接为一个字符串，查找四星、五星的位置只需要在字符串上查找，
+    时间列可以直接二分查找卡池时间范围内的记录。
+    """
+
+    __slots__ = ("rank", "time", "name", "item_type", "last_id")
+
+    def __init__(self, items: List[GachaItem]):
+        self.rank = "".join([i.rank_type for i in items])
+        self.time = [i.time for i in items]
+        self.name = [i.name for i in items]
+        self.item_type = [i.item_type for i in items]
+        self.last_id = items[-1].id if items else ""
+
+    def __len__(self) -> int:
+        return len(self.rank)
+
+    def rank_indices(self, rank: str) -> List[int]:
+        """获取指定稀有度记录的位置"""
+        result = []
+        find = self.rank.find
+        idx = find(rank)
+        while idx != -1:
+            result.append(idx)
+            idx = find(rank, idx + 1)
+        return result
+
+    @staticmethod
+    def pity_counts(indices: List[int]) -> List[int]:
+        """获取每个位置距离上一个位置的抽数"""
+        return [b - a for a, b in zip([-1] + indices, indices)]
+
+    def remaining(self, indices: List[int]) -> int:
+        """获取最后一个位置之后的抽数"""
+        return len(self) - indices[-1] - 1 if indices else len(self)
+
+    def count_window(
+        self, start: datetime.datetime, end: datetime.datetime
+    ) -> Tuple[int, Optional[datetime.datetime], Optional[datetime.datetime]]:
+        """统计时间范围内的记录
+        :param start: 开始时间（包含）
+        :param end: 结束时间（包含）
+        :return: 记录数、第一条记录时间、最后一条记录时间
+        """
+        lo = bisect_left(self.time, start)
+        hi = bisect_right(self.time, end, lo)
+        if hi <= lo:
+            return 0, None, None
+        return hi - lo, self.time[lo], self.time[hi - 1]
+
+
+def build_pool_summary(
+    columns: GachaLogColumns, pool_name: str, check_up: Callable[[str, datetime.datetime], bool]
+) -> GachaLogPoolSummary:
+    """一次性统计卡池摘要，结果与逐条统计相同
+    :param columns: 列式数据
+    :param pool_name: 卡池名称
+    :param check_up: 判断代理人是否为 UP 代理人
+    :return: 卡池摘要
+    """
+    summary = GachaLogPoolSummary()
+    five_indices = columns.rank_indices("5")
+    for idx, count in zip(five_indices, columns.pity_counts(five_indices)):
+        item_type = columns.item_type[idx]
+        if pool_name not in FIVE_STAR_POOLS.get(item_type, ()):
+            continue
+        is_up, is_big = False, False
+        if item_type == "代理人" and pool_name == "代理人调频":
+            is_up = check_up(columns.name[idx], columns.time[idx])
+            is_big = (not summary.five[-1].isUp) if summary.five else False
+        summary.five.append(
+            GachaLogSummaryItem.construct(
+                name=columns.name[idx],
+                type=item_type,
+                count=count,
+                isUp=is_up,
+                isBig=is_big,
+                time=columns.time[idx],
+            )
+        )
+    four_indices = columns.rank_indices("4")
+    summary.four = [
+        GachaLogSummaryItem.construct(
+            name=columns.name[idx],
+            type=columns.item_type[idx],
+            count=count,
+            isUp=False,
+            isBig=False,
+            time=columns.time[idx],
+        )
+        for idx, count in zip(four_indices, columns.pity_counts(four_indices))
+        if columns.item_type[idx] in FOUR_STAR_TYPES
+    ]
+    summary.five_star_up = sum(1 for i in summary.five if i.isUp)
+    summary.five_star_big = sum(1 for i in summary.five if i.isBig)
+    summary.no_five_star = columns.remaining(five_indices)
+    summary.no_four_star = columns.remaining(four_indices)
+    if len(columns):
+        summary.total = len(columns)
+        summary.last_id = columns.last_id
+        summary.start_time = columns.time[0]
+        summary.end_time = columns.time[-1]
+    return summary
+
+
+class BannerIntervalIndex:
+    """卡池时间区间索引
+
+    将所有卡池的开始、结束时间排序后切分为若干区间，每个区间预先记录覆盖它的卡池，
+    查找一条记录所属的卡池只需要一次二分查找，与卡池数量无关。同时开放的多个卡池会同时命中。
+    """
+
+    __slots__ = ("definitions", "points", "segments")
+
+    def __init__(self, definitions: List[Dict]):
+        self.definitions = definitions
+        bounds = []
+        for data in definitions:
+            start = datetime.datetime.strptime(data["from"], "%Y-%m-%d %H:%M:%S")
+            # 结束时间包含在卡池内，区间右端取下一微秒
+            end = datetime.datetime.strptime(data["to"], "%Y-%m-%d %H:%M:%S") + datetime.timedelta(microseconds=1)
+            bounds.append((start, end))
+        self.points = sorted({i for bound in bounds for i in bound})
+        self.segments: List[Tuple[int, ...]] = [
+            tuple(idx for idx, (start, end) in enumerate(bounds) if start <= point < end) for point in self.points
+        ]
+
+    def lookup(self, time: datetime.datetime) -> Tuple[int, ...]:
+        """获取时间所在的卡池
+        :param time: 记录时间
+        :return: 卡池在定义中的位置
+        """
+        idx = bisect_right(self.points, time) - 1
+        if idx < 0:
+            return ()
+        return self.segments[idx]
+
+    def create_pools(self) -> List[Pool]:
+        return [Pool(**i) for i in self.definitions]
+
+    def assign(self, items: List) -> List[Pool]:
+        """一次遍历将四星、五星记录分配到所属卡池
+        :param items: 带有 time 与 name 的记录
+        :return: 卡池，顺序与定义相同
+        """
+        pools = self.create_pools()
+        for item in items:
+            for idx in self.lookup(item.time):
+                pools[idx].parse(item)
+        return pools
+
+
+# 卡池区间索引缓存，卡池定义变化时重新生成
+BANNER_INDEX_CACHE: Dict[int, Tuple[Tuple[int, int], BannerIntervalIndex]] = {}
+
+
+def get_banner_index(pool_type: int) -> Optional[BannerIntervalIndex]:
+    """获取卡池类型对应的区间索引
+    :param pool_type: 卡池类型
+    :return: 区间索引，卡池类型不存在时返回 None
+    """
+    definitions = get_pool_by_id(pool_type)
+    if definitions is None:
+        return None
+    version = (id(definitions), len(definitions))
+    cached = BANNER_INDEX_CACHE.get(pool_type)
+    if cached is None or cached[0] != version:
+        cached = BANNER_INDEX_CACHE[pool_type] = (version, BannerIntervalIndex(definitions))
+    return cached[1]
@@ -1,6 +1,10 @@
 from simnet.models.zzz.wish import ZZZBannerType
 
 ZZZGF_VERSION = "v1.0"
+# 统计摘要的结构版本，修改统计规则后需要增加版本号以重新生成摘要
+GACHA_LOG_SUMMARY_VERSION = 1
+# 全服运气分布的结构版本
+GACHA_LOG_LUCK_VERSION = 1
 
 
 GACHA_TYPE_LIST = {
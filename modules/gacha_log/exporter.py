@@ -0,0 +1,148 @@
+import asyncio
+import json
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Iterable, Iterator, List, Tuple
+
+from modules.gacha_log.models import GachaItem, GachaLogInfo, ZZZGFInfo
+
+
+class ZZZGFExporter:
+    """ZZZGF 格式流式导出
+
+    逐条生成与 json.dumps(..., ensure_ascii=False, indent=4) 完全一致的文本，
+    按批写入缓冲区，不需要在内存中构造完整的文档。
+    """
+
+    def __init__(self, batch_size: int = 1000):
+        """
+        :param batch_size: 每批写入的记录数，每批写入后会让出事件循环
+        """
+        self.batch_size = batch_size
+
+    @staticmethod
+    def dump_item(item: GachaItem) -> str:
+        data = {
+            "id": item.id,
+            "name": item.name,
+            "count": "1",
+            "gacha_id": item.gacha_id,
+            "gacha_type": item.gacha_type,
+            "item_id": item.item_id,
+            "item_type": item.item_type,
+            "rank_type": item.rank_type,
+            "time": item.time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        return "        " + json.dumps(data, ensure_ascii=False, indent=4).replace("\n", "\n        ")
+
+    @staticmethod
+    def dump_header(info: ZZZGFInfo) -> str:
+        # 去掉末尾的 "\n}"，在 info 之后接上 list
+        return json.dumps({"info": info.dict()}, ensure_ascii=False, indent=4)[:-2] + ',\n    "list": ['
+
+    @staticmethod
+    def dump_footer(empty: bool) -> str:
+        return "]\n}" if empty else "\n    ]\n}"
+
+    def dump_batch(self, batch: Iterable[GachaItem], empty: bool) -> str:
+        return ("\n" if empty else ",\n") + ",\n".join(self.dump_item(i) for i in batch)
+
+    def iter_chunks(self, info: ZZZGFInfo, items: Iterable[GachaItem]) -> Iterator[str]:
+        """按批生成 ZZZGF 文档
+        :param info: 文档信息
+        :param items: 调频记录
+        :return: 文档片段
+        """
+        yield self.dump_header(info)
+        batch: List[GachaItem] = []
+        empty = True
+        for item in items:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield self.dump_batch(batch, empty)
+                empty = False
+                batch.clear()
+        if batch:
+            yield self.dump_batch(batch, empty)
+            empty = False
+        yield self.dump_footer(empty)
+
+    async def iter_pool_chunks(
+        self, info: ZZZGFInfo, pools: AsyncIterable[Tuple[str, List[GachaItem]]]
+    ) -> AsyncIterator[str]:
+        """按卡池依次读取并生成 ZZZGF 文档，同一时间只有一个卡池的记录在内存中
+        :param info: 文档信息
+        :param pools: 依次读取的卡池名称与记录
+        :return: 文档片段
+        """
+        yield self.dump_header(info)
+        empty = True
+        async for _, items in pools:
+            for start in range(0, len(items), self.batch_size):
+                yield self.dump_batch(items[start : start + self.batch_size], empty)
+                empty = False
+        yield self.dump_footer(empty)
+
+    async def write(self, out: BinaryIO, info: ZZZGFInfo, items: Iterable[GachaItem]) -> int:
+        """写入 ZZZGF 文档
+        :param out: 二进制缓冲区
+        :param info: 文档信息
+        :param items: 调频记录
+        :return: 写入的字节数
+        """
+        size = 0
+        for chunk in self.iter_chunks(info, items):
+            data = chunk.encode("utf-8")
+            size += len(data)
+            out.write(data)
+            await asyncio.sleep(0)
+        return size
+
+    async def write_pools(
+        self, out: BinaryIO, info: ZZZGFInfo, pools: AsyncIterable[Tuple[str, List[GachaItem]]]
+    ) -> int:
+        """按卡池依次读取并写入 ZZZGF 文档
+        :param out: 二进制缓冲区
+        :param info: 文档信息
+        :param pools: 依次读取的卡池名称与记录
+        :return: 写入的字节数
+        """
+        size = 0
+        async for chunk in self.iter_pool_chunks(info, pools):
+            data = chunk.encode("utf-8")
+            size += len(data)
+            out.write(data)
+            await asyncio.sleep(0)
+        return size
+
+
+class GachaLogJSONExporter:
+    """调频记录流式导出
+
+    生成与 GachaLogInfo.json() 完全一致的文本，记录按卡池依次读取，同一时间只有一个卡池的记录在内存中。
+    """
+
+    def __init__(self, batch_size: int = 1000):
+        """
+        :param batch_size: 每批生成的记录数，每批生成后会让出事件循环
+        """
+        self.batch_size = batch_size
+
+    async def iter_chunks(
+        self, info: GachaLogInfo, pools: AsyncIterable[Tuple[str, List[GachaItem]]]
+    ) -> AsyncIterator[bytes]:
+        """按批生成文档
+        :param info: 文档信息，item_list 会被忽略
+        :param pools: 依次读取的卡池名称与记录
+        :return: 文档片段
+        """
+        # 去掉末尾的 "}"，在其他字段之后接上 item_list
+        yield (info.json(exclude={"item_list"})[:-1] + ', "item_list": {').encode("utf-8")
+        first = True
+        async for pool_name, items in pools:
+            yield (("" if first else ", ") + json.dumps(pool_name) + ": [").encode("utf-8")
+            first = False
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start : start + self.batch_size]
+                yield (("" if start == 0 else ", ") + ", ".join(i.json() for i in batch)).encode("utf-8")
+                await asyncio.sleep(0)
+            yield b"]"
+        yield b"}}"
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from simnet import ZZZClient
+from simnet.models.zzz.wish import ZZZBannerType, ZZZWish
+from simnet.utils.enums import Game
+
+
+class GachaLogFetcher:
+    """调频记录增量获取
+
+    每个卡池从最新的记录开始向前翻页，遇到不大于水位线（本地已保存的最大 id）的记录时停止，
+    不同卡池之间互不依赖，在单个账号内以有限的并发同时获取。
+    """
+
+    def __init__(self, concurrency: int = 2, page_size: int = 20, page_delay: float = 1.0):
+        """
+        :param concurrency: 单个账号同时获取的卡池数量
+        :param page_size: 每页记录数
+        :param page_delay: 同一卡池两次翻页之间的间隔
+        """
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.page_delay = page_delay
+        self.requests = 0
+        self.elapsed = 0.0
+
+    async def fetch_pool(
+        self,
+        client: ZZZClient,
+        banner_type: ZZZBannerType,
+        authkey: str,
+        watermark: Optional[str],
+        semaphore: asyncio.Semaphore,
+    ) -> List[ZZZWish]:
+        """获取单个卡池水位线之后的记录
+        :param client: 客户端
+        :param banner_type: 卡池类型
+        :param authkey: authkey
+        :param watermark: 水位线，为空时获取全部记录
+        :param semaphore: 账号内的并发限制
+        :return: 新记录，按时间从新到旧排列
+        """
+        hwm = int(watermark) if watermark else 0
+        result = []
+        end_id = 0
+        async with semaphore:
+            while True:
+                self.requests += 1
+                data = await client.get_wish_page(
+                    end_id=end_id, banner_type=banner_type.value, game=Game.ZZZ, size=self.page_size, authkey=authkey
+                )
+                items = data["list"]
+                if not items:
+                    break
+                for item in items:
+                    if int(item["id"]) <= hwm:
+                        return result
+                    result.append(ZZZWish(**item))
+                if len(items) < self.page_size:
+                    break
+                end_id = items[-1]["id"]
+                await asyncio.sleep(self.page_delay)
+        return result
+
+    async def fetch(
+        self, client: ZZZClient, authkey: str, watermarks: Dict[ZZZBannerType, Optional[str]]
+    ) -> Dict[ZZZBannerType, List[ZZZWish]]:
+        """并发获取多个卡池的新记录
+        :param client: 客户端
+        :param authkey: authkey
+        :param watermarks: 每个卡池的水位线
+        :return: 每个卡池的新记录
+        """
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = {
+            banner_type: asyncio.create_task(self.fetch_pool(client, banner_type, authkey, watermark, semaphore))
+            for banner_type, watermark in watermarks.items()
+        }
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        finally:
+            self.elapsed += time.perf_counter() - start
+        return {banner_type: task.result() for banner_type, task in tasks.items()}
@@ -0,0 +1,107 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Set
+
+from simnet.models.zzz.wish import ZZZBannerType
+
+from metadata.shortname import buddyToId, not_real_roles, roleToId, weaponToId
+from modules.gacha_log.const import GACHA_TYPE_LIST
+from modules.gacha_log.models import GachaItem, GachaLogInfo
+
+# 所有导入共用的线程池，避免每次导入都创建新的线程池
+GACHA_LOG_IMPORT_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gacha_log_import")
+
+
+class GachaLogImporter:
+    """调频记录导入
+
+    逐行解析导入文件中的记录并合并到已有记录中。名称与时间的解析结果在单次导入内缓存，
+    使用 id 集合去重，整个导入过程为线性时间。格式不符合快速路径的记录交由 GachaItem 完整校验。
+    """
+
+    GACHA_TYPES = {"1", "2", "3", "5"}
+    ITEM_TYPES = {"代理人", "音擎", "邦布"}
+    RANK_TYPES = {"3", "4", "5"}
+
+    def __init__(self):
+        self.name_cache: Dict[str, bool] = {}
+        self.time_cache: Dict[str, datetime.datetime] = {}
+        self.total = 0
+        self.five_star = 0
+        self.four_star = 0
+        self.changed_pools: Set[str] = set()
+
+    def check_name(self, name: str) -> bool:
+        if name not in self.name_cache:
+            item_id = roleToId(name) or weaponToId(name) or buddyToId(name)
+            self.name_cache[name] = bool(item_id) and item_id not in not_real_roles
+        return self.name_cache[name]
+
+    def parse_time(self, value: str) -> datetime.datetime:
+        if value not in self.time_cache:
+            self.time_cache[value] = datetime.datetime.fromisoformat(value)
+        return self.time_cache[value]
+
+    @staticmethod
+    def to_str(value: Any) -> str:
+        if isinstance(value, str):
+            return value
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value)
+        raise TypeError
+
+    def parse_item(self, data: Dict[str, Any]) -> GachaItem:
+        """解析单条记录
+        :param data: 导入文件中的记录
+        :return: 调频记录
+        """
+        try:
+            name = data["name"]
+            gacha_type = self.to_str(data["gacha_type"])
+            item_type = data["item_type"]
+            rank_type = self.to_str(data["rank_type"])
+            if (
+                isinstance(name, str)
+                and self.check_name(name)
+                and gacha_type in self.GACHA_TYPES
+                and item_type in self.ITEM_TYPES
+                and rank_type in self.RANK_TYPES
+            ):
+                return GachaItem.construct(
+                    id=self.to_str(data["id"]),
+                    name=name,
+                    gacha_id=self.to_str(data.get("gacha_id", "")),
+                    gacha_type=gacha_type,
+                    item_id=self.to_str(data.get("item_id", "")),
+                    item_type=item_type,
+                    rank_type=rank_type,
+                    time=self.parse_time(data["time"]),
+                )
+        except (KeyError, TypeError, ValueError):
+            pass
+        return GachaItem(**data)
+
+    def import_items(self, rows: Iterable[Dict[str, Any]], gacha_log: GachaLogInfo) -> int:
+        """逐行导入记录
+        :param rows: 导入文件中的记录
+        :param gacha_log: 已有的调频记录，新记录会直接追加到其中
+        :return: 新增记录数
+        """
+        new_num = 0
+        id_data = {pool_name: {i.id for i in pool_data} for pool_name, pool_data in gacha_log.item_list.items()}
+        for row in rows:
+            item = self.parse_item(row)
+            self.total += 1
+            if item.rank_type == "5":
+                self.five_star += 1
+            elif item.rank_type == "4":
+                self.four_star += 1
+            pool_name = GACHA_TYPE_LIST[ZZZBannerType(int(item.gacha_type))]
+            pool_ids = id_data.setdefault(pool_name, set())
+            if item.id in pool_ids:
+                continue
+            pool_ids.add(item.id)
+            gacha_log.item_list.setdefault(pool_name, []).append(item)
+            self.changed_pools.add(pool_name)
+            new_num += 1
+        return new_num
@@ -1,10 +1,8 @@
 import asyncio
-import contextlib
 import datetime
 import json
-from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+from typing import BinaryIO, Dict, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING
 
 import aiofiles
 from simnet import ZZZClient, Region
@@ -12,9 +10,14 @@ from simnet.errors import AuthkeyTimeout, InvalidAuthkey
 from simnet.models.zzz.wish import ZZZBannerType
 from simnet.utils.player import recognize_zzz_server
 
+from core.services.gacha_log_rank.repositories import GachaLogRankBatchRepository
 from gram_core.services.gacha_log_rank.services import GachaLogRankService
-from metadata.pool.pool import get_pool_by_id
+from modules.gacha_log.analytics import GachaLogColumns, get_banner_index
 from modules.gacha_log.const import GACHA_TYPE_LIST
+from modules.gacha_log.exporter import ZZZGFExporter
+from modules.gacha_log.fetcher import GachaLogFetcher
+from modules.gacha_log.importer import GACHA_LOG_IMPORT_EXECUTOR, GachaLogImporter
+from modules.gacha_log.luck import GachaLogLuck
 from modules.gacha_log.error import (
     GachaLogAccountNotFound,
     GachaLogAuthkeyTimeout,
@@ -29,15 +32,18 @@ from modules.gacha_log.models import (
     FourStarItem,
     GachaItem,
     GachaLogInfo,
+    GachaLogPoolSummary,
     ImportType,
     Pool,
     ZZZGFInfo,
-    ZZZGFItem,
-    ZZZGFModel,
 )
 from modules.gacha_log.online_view import GachaLogOnlineView
 from modules.gacha_log.ranks import GachaLogRanks
+from modules.gacha_log.storage import GachaLogStorage
+from modules.gacha_log.summary import GachaLogSummaries
+from modules.gacha_log.writer import GachaLogUpdate, GachaLogWriteCoordinator
 from utils.const import PROJECT_ROOT
+from utils.log import logger
 from utils.uid import mask_number
 
 if TYPE_CHECKING:
@@ -48,20 +54,21 @@ GACHA_LOG_PATH = PROJECT_ROOT.joinpath("data", "apihelper", "signal_log")
 GACHA_LOG_PATH.mkdir(parents=True, exist_ok=True)
 
 
-class GachaLog(GachaLogOnlineView, GachaLogRanks):
+class GachaLog(GachaLogOnlineView, GachaLogRanks, GachaLogSummaries, GachaLogLuck):
     def __init__(
         self,
         gacha_log_path: Path = GACHA_LOG_PATH,
         gacha_log_rank_service: GachaLogRankService = None,
+        gacha_log_rank_batch: GachaLogRankBatchRepository = None,
     ):
         GachaLogOnlineView.__init__(self)
-        GachaLogRanks.__init__(self, gacha_log_rank_service)
+        GachaLogRanks.__init__(self, gacha_log_rank_service, gacha_log_rank_batch)
         self.gacha_log_path = gacha_log_path
-
-    @staticmethod
-    async def load_json(path):
-        async with aiofiles.open(path, "r", encoding="utf-8") as f:
-            return json.loads(await f.read())
+        self.storage = GachaLogStorage(gacha_log_path)
+        self.exporter = ZZZGFExporter()
+        self.writer = GachaLogWriteCoordinator(
+            self.load_gacha_log_info, self.save_gacha_log_info, namespace=str(gacha_log_path)
+        )
 
     @staticmethod
     async def save_json(path, data):
@@ -71,23 +78,29 @@ class GachaLog(GachaLogOnlineView, GachaLogRanks):
             await f.write(data)
 
     async def load_history_info(
-        self, user_id: str, uid: str, only_status: bool = False
+        self, user_id: str, uid: str, only_status: bool = False, pools: Optional[Iterable[str]] = None
     ) -> Tuple[Optional[GachaLogInfo], bool]:
         """读取历史调频记录数据
         :param user_id: 用户id
         :param uid: 原神uid
         :param only_status: 是否只读取状态
+        :param pools: 只读取指定的卡池，为空时读取全部卡池
         :return: 调频记录数据
         """
-        file_path = self.gacha_log_path / f"{user_id}-{uid}.json"
         if only_status:
-            return None, file_path.exists()
-        if not file_path.exists():
-            return GachaLogInfo(user_id=user_id, uid=uid, update_time=datetime.datetime.now()), False
+            return None, self.storage.exists(user_id, uid)
         try:
-            return GachaLogInfo.parse_obj(await self.load_json(file_path)), True
-        except json.decoder.JSONDecodeError:
+            gacha_log = await self.storage.load(user_id, uid, pools)
+        except ValueError:
+            gacha_log = None
+        if gacha_log is None:
             return GachaLogInfo(user_id=user_id, uid=uid, update_time=datetime.datetime.now()), False
+        return gacha_log, True
+
+    async def load_gacha_log_info(self, user_id: str, uid: str) -> GachaLogInfo:
+        """读取调频记录数据，不存在时返回空记录"""
+        gacha_log, _ = await self.load_history_info(user_id, uid)
+        return gacha_log
 
     async def remove_history_info(self, user_id: str, uid: str) -> bool:
         """删除历史调频记录数据
@@ -95,20 +108,12 @@ class GachaLog(GachaLogOnlineView, GachaLogRanks):
         :param uid: 原神uid
         :return: 是否删除成功
         """
-        file_path = self.gacha_log_path / f"{user_id}-{uid}.json"
-        file_bak_path = self.gacha_log_path / f"{user_id}-{uid}.json.bak"
-        file_export_path = self.gacha_log_path / f"{user_id}-{uid}-uigf.json"
-        with contextlib.suppress(Exception):
-            file_bak_path.unlink(missing_ok=True)
-        with contextlib.suppress(Exception):
-            file_export_path.unlink(missing_ok=True)
-        if file_path.exists():
-            try:
-                file_path.unlink()
-            except PermissionError:
-                return False
-            return True
-        return False
+        async with self.writer.lock(user_id, uid):
+            summary = await self.load_summary(user_id, uid)
+            status = await self.storage.remove(user_id, uid)
+            if status and summary is not None:
+                await self.update_luck(summary, None)
+            return status
 
     async def move_history_info(self, user_id: str, uid: str, new_user_id: str) -> bool:
         """移动历史抽卡记录数据
@@ -117,99 +122,64 @@ class GachaLog(GachaLogOnlineView, GachaLogRanks):
         :param new_user_id: 新用户id
         :return: 是否移动成功
         """
-        old_file_path = self.gacha_log_path / f"{user_id}-{uid}.json"
-        new_file_path = self.gacha_log_path / f"{new_user_id}-{uid}.json"
-        if (not old_file_path.exists()) or new_file_path.exists():
-            return False
-        try:
-            old_file_path.rename(new_file_path)
-            return True
-        except PermissionError:
-            return False
+        first, second = sorted([(user_id, uid), (new_user_id, uid)])
+        async with self.writer.lock(*first), self.writer.lock(*second):
+            return await self.storage.move(user_id, uid, new_user_id)
 
-    async def save_gacha_log_info(self, user_id: str, uid: str, info: GachaLogInfo):
-        """保存调频记录数据
+    async def save_gacha_log_info(self, user_id: str, uid: str, info: GachaLogInfo, rewrite: Optional[Set[str]] = None):
+        """保存调频记录数据，只追加写入新增的记录
         :param user_id: 用户id
         :param uid: 玩家uid
         :param info: 调频记录数据
+        :param rewrite: 旧记录被修改过、需要完整重写的卡池
         """
-        save_path = self.gacha_log_path / f"{user_id}-{uid}.json"
-        save_path_bak = self.gacha_log_path / f"{user_id}-{uid}.json.bak"
-        # 将旧数据备份一次
-        with contextlib.suppress(PermissionError):
-            if save_path.exists():
-                if save_path_bak.exists():
-                    save_path_bak.unlink()
-                save_path.rename(save_path.parent / f"{save_path.name}.bak")
-        # 写入数据
-        await self.save_json(save_path, info.json())
-
-    async def gacha_log_to_zzzgf(self, user_id: str, uid: str) -> Optional[Path]:
+        info.user_id, info.uid = str(user_id), str(uid)
+        old_summary = await self.load_summary(info.user_id, info.uid)
+        await self.storage.save(info, rewrite, manifest=False)
+        summary = await self.update_summary(info)
+        # 清单项包含统计摘要的校验值，写入摘要之后只更新一次
+        await self.storage.update_manifest(info.user_id, info.uid)
+        # 根据新旧统计摘要增量更新全服运气分布
+        await self.update_luck(old_summary, summary)
+
+    async def gacha_log_to_zzzgf(self, user_id: str, uid: str, out: BinaryIO) -> int:
         """调频日记转换为 ZZZGF 格式
         :param user_id: 用户ID
         :param uid: 游戏UID
-        :return: 转换是否成功、转换信息、ZZZGF 文件目录
+        :param out: 写入的缓冲区
+        :return: 写入的字节数
         """
-        data, state = await self.load_history_info(user_id, uid)
-        if not state:
+        if not self.storage.exists(user_id, uid):
             raise GachaLogNotFound
-        save_path = self.gacha_log_path / f"{user_id}-{uid}-zzzgf.json"
-        info = ZZZGFModel(
-            info=ZZZGFInfo(uid=uid, export_app=ImportType.PaiGram.value, export_app_version="v4"), list=[]
-        )
-        for items in data.item_list.values():
-            for item in items:
-                info.list.append(
-                    ZZZGFItem(
-                        id=item.id,
-                        name=item.name,
-                        gacha_id=item.gacha_id,
-                        gacha_type=item.gacha_type,
-                        item_id=item.item_id,
-                        item_type=item.item_type,
-                        rank_type=item.rank_type,
-                        time=item.time.strftime("%Y-%m-%d %H:%M:%S"),
-                    )
-                )
-        await self.save_json(save_path, json.loads(info.json()))
-        return save_path
+        info = ZZZGFInfo(uid=uid, export_app=ImportType.PaiGram.value, export_app_version="v4")
+        # 按卡池依次读取，不需要先读取全部记录
+        try:
+            return await self.exporter.write_pools(out, info, self.storage.iter_pools(user_id, uid))
+        except ValueError as exc:
+            raise GachaLogNotFound from exc
 
     @staticmethod
-    async def verify_data(data: List[GachaItem]) -> bool:
+    def verify_count(total: int, five_star: int, four_star: int) -> bool:
+        if total > 50:
+            if total <= five_star * 15:
+                raise GachaLogFileError(
+                    "检测到您将要导入的调频记录中五星数量过多，可能是由于文件错误导致的，请检查后重新导入。"
+                )
+            if four_star < five_star:
+                raise GachaLogFileError(
+                    "检测到您将要导入的调频记录中五星数量过多，可能是由于文件错误导致的，请检查后重新导入。"
+                )
+        return True
+
+    async def verify_data(self, data: List[GachaItem]) -> bool:
         try:
-            total = len(data)
-            five_star = len([i for i in data if i.rank_type == "5"])
-            four_star = len([i for i in data if i.rank_type == "4"])
-            if total > 50:
-                if total <= five_star * 15:
-                    raise GachaLogFileError(
-                        "检测到您将要导入的调频记录中五星数量过多，可能是由于文件错误导致的，请检查后重新导入。"
-                    )
-                if four_star < five_star:
-                    raise GachaLogFileError(
-                        "检测到您将要导入的调频记录中五星数量过多，可能是由于文件错误导致的，请检查后重新导入。"
-                    )
-            return True
+            five_star = sum(1 for i in data if i.rank_type == "5")
+            four_star = sum(1 for i in data if i.rank_type == "4")
+            return self.verify_count(len(data), five_star, four_star)
         except Exception as exc:  # pylint: disable=W0703
             raise GachaLogFileError from exc
 
-    @staticmethod
-    def import_data_backend(all_items: List[GachaItem], gacha_log: GachaLogInfo, temp_id_data: Dict) -> int:
-        new_num = 0
-        for item_info in all_items:
-            pool_name = GACHA_TYPE_LIST[ZZZBannerType(int(item_info.gacha_type))]
-            if pool_name not in temp_id_data:
-                temp_id_data[pool_name] = []
-            if pool_name not in gacha_log.item_list:
-                gacha_log.item_list[pool_name] = []
-            if item_info.id not in temp_id_data[pool_name]:
-                gacha_log.item_list[pool_name].append(item_info)
-                temp_id_data[pool_name].append(item_info.id)
-                new_num += 1
-        return new_num
-
     async def import_gacha_log_data(self, user_id: int, player_id: int, data: dict, verify_uid: bool = True) -> int:
-        new_num = 0
         try:
             uid = data["info"]["uid"]
             if not verify_uid:
@@ -220,29 +190,28 @@ class GachaLog(GachaLogOnlineView, GachaLogRanks):
                 import_type = ImportType(data["info"]["export_app"])
             except ValueError:
                 import_type = ImportType.UNKNOWN
-            # 检查导入数据是否合法
-            all_items = [GachaItem(**i) for i in data["list"]]
-            await self.verify_data(all_items)
-            gacha_log, status = await self.load_history_info(str(user_id), uid)
-            # 将唯一 id 放入临时数据中，加快查找速度
-            temp_id_data = {
-                pool_name: [i.id for i in pool_data] for pool_name, pool_data in gacha_log.item_list.items()
-            }
-            # 使用新线程进行遍历，避免堵塞主线程
-            loop = asyncio.get_event_loop()
-            # 可以使用with语句来确保线程执行完成后及时被清理
-            with ThreadPoolExecutor() as executor:
-                new_num = await loop.run_in_executor(
-                    executor, self.import_data_backend, all_items, gacha_log, temp_id_data
+
+            async def merge(gacha_log: GachaLogInfo) -> GachaLogUpdate:
+                # 在共用的线程池中逐条解析并合并，避免堵塞主线程
+                importer = GachaLogImporter()
+                loop = asyncio.get_running_loop()
+                _new_num = await loop.run_in_executor(
+                    GACHA_LOG_IMPORT_EXECUTOR, importer.import_items, data["list"], gacha_log
                 )
-            for i in gacha_log.item_list.values():
-                # 检查导入后的数据是否合法
-                await self.verify_data(i)
-                i.sort(key=lambda x: (x.time, x.id))
-            gacha_log.update_time = datetime.datetime.now()
-            gacha_log.import_type = import_type.value
-            await self.save_gacha_log_info(str(user_id), uid, gacha_log)
-            return new_num
+                # 检查导入数据是否合法
+                try:
+                    self.verify_count(importer.total, importer.five_star, importer.four_star)
+                except Exception as exc:  # pylint: disable=W0703
+                    raise GachaLogFileError from exc
+                for pool_name in importer.changed_pools:
+                    # 检查导入后的数据是否合法
+                    await self.verify_data(gacha_log.item_list[pool_name])
+                gacha_log.update_time = datetime.datetime.now()
+                gacha_log.import_type = import_type.value
+                return GachaLogUpdate(_new_num)
+
+            # 同一账号的修改由写入协调器串行执行，短时间内的多次修改只写入一次
+            return await self.writer.update(str(user_id), str(uid), merge)
         except GachaLogAccountNotFound as e:
             raise GachaLogAccountNotFound("导入失败，文件包含的调频记录所属 uid 与你当前绑定的 uid 不同") from e
         except GachaLogMixedProvider as e:
@@ -264,56 +233,69 @@ class GachaLog(GachaLogOnlineView, GachaLogRanks):
         :param authkey: authkey
         :return: 更新结果
         """
-        new_num = 0
-        gacha_log, _ = await self.load_history_info(str(user_id), str(player_id))
-        # 将唯一 id 放入临时数据中，加快查找速度
-        temp_id_data = {pool_name: {i.id: i for i in pool_data} for pool_name, pool_data in gacha_log.item_list.items()}
+        # 每个卡池的水位线从索引头读取，旧记录缺少 gacha_id 或 item_id 时完整获取一次以补全
+        pool_watermarks = await self.storage.get_watermarks(str(user_id), str(player_id))
+        watermarks = {pool_id: pool_watermarks.get(pool_name) for pool_id, pool_name in GACHA_TYPE_LIST.items()}
         client = self.get_game_client(player_id)
+        fetcher = GachaLogFetcher()
         try:
-            for pool_id, pool_name in GACHA_TYPE_LIST.items():
-                wish_history = await client.wish_history(pool_id.value, authkey=authkey)
-                for data in wish_history:
-                    item = GachaItem(
-                        id=str(data.id),
-                        name=data.name,
-                        gacha_id=str(data.banner_id),
-                        gacha_type=str(data.banner_type.value),
-                        item_id=str(data.item_id),
-                        item_type=data.type,
-                        rank_type=str(data.rarity),
-                        time=datetime.datetime(
-                            data.time.year,
-                            data.time.month,
-                            data.time.day,
-                            data.time.hour,
-                            data.time.minute,
-                            data.time.second,
-                        ),
-                    )
-
-                    if pool_name not in temp_id_data:
-                        temp_id_data[pool_name] = {}
-                    if pool_name not in gacha_log.item_list:
-                        gacha_log.item_list[pool_name] = []
-                    if item.id not in temp_id_data[pool_name].keys():
-                        gacha_log.item_list[pool_name].append(item)
-                        temp_id_data[pool_name][item.id] = item
-                        new_num += 1
-                    else:
-                        old_item: GachaItem = temp_id_data[pool_name][item.id]
-                        old_item.gacha_id = item.gacha_id
-                        old_item.item_id = item.item_id
+            wish_histories = await fetcher.fetch(client, authkey, watermarks)
         except AuthkeyTimeout as exc:
             raise GachaLogAuthkeyTimeout from exc
         except InvalidAuthkey as exc:
             raise GachaLogInvalidAuthkey from exc
         finally:
             await client.shutdown()
-        for i in gacha_log.item_list.values():
-            i.sort(key=lambda x: (x.time, x.id))
-        gacha_log.update_time = datetime.datetime.now()
-        gacha_log.import_type = ImportType.PaiGram.value
-        await self.save_gacha_log_info(str(user_id), str(player_id), gacha_log)
+        logger.debug(
+            "获取调频记录完成 player_id[%s] requests[%s] elapsed[%.2fs]", player_id, fetcher.requests, fetcher.elapsed
+        )
+        new_items: Dict[str, List[GachaItem]] = {}
+        for pool_id, wish_history in wish_histories.items():
+            new_items[GACHA_TYPE_LIST[pool_id]] = [
+                GachaItem(
+                    id=str(data.id),
+                    name=data.name,
+                    gacha_id=str(data.banner_id),
+                    gacha_type=str(data.banner_type.value),
+                    item_id=str(data.item_id),
+                    item_type=data.type,
+                    rank_type=str(data.rarity),
+                    time=datetime.datetime(
+                        data.time.year,
+                        data.time.month,
+                        data.time.day,
+                        data.time.hour,
+                        data.time.minute,
+                        data.time.second,
+                    ),
+                )
+                for data in reversed(wish_history)
+            ]
+
+        async def merge(_gacha_log: GachaLogInfo) -> GachaLogUpdate:
+            new_num = 0
+            # 旧记录被修改过的卡池需要完整重写
+            changed_pools = set()
+            for pool_name, items in new_items.items():
+                pool_data = _gacha_log.item_list.setdefault(pool_name, [])
+                # 将唯一 id 放入临时数据中，加快查找速度
+                temp_id_data = {i.id: i for i in pool_data}
+                for item in items:
+                    if item.id not in temp_id_data:
+                        pool_data.append(item)
+                        temp_id_data[item.id] = item
+                        new_num += 1
+                    else:
+                        old_item: GachaItem = temp_id_data[item.id]
+                        if old_item.gacha_id != item.gacha_id or old_item.item_id != item.item_id:
+                            changed_pools.add(pool_name)
+                        old_item.gacha_id = item.gacha_id
+                        old_item.item_id = item.item_id
+            _gacha_log.update_time = datetime.datetime.now()
+            _gacha_log.import_type = ImportType.PaiGram.value
+            return GachaLogUpdate(new_num, rewrite=changed_pools)
+
+        new_num = await self.writer.update(str(user_id), str(player_id), merge)
         await self.recount_one_from_uid(user_id, player_id)
         return new_num
 
@@ -331,98 +313,18 @@ class GachaLog(GachaLogOnlineView, GachaLogRanks):
         :param pool_name: 池子名称
         :return: 5星代理人列表
         """
-        count = 0
-        result = []
-        for item in data:
-            count += 1
-            if item.rank_type == "5":
-                if item.item_type == "代理人" and pool_name in {"代理人调频", "常驻调频"}:
-                    if pool_name == "代理人调频":
-                        isUp, isBig = (
-                            self.check_avatar_up(item.name, item.time),
-                            (not result[-1].isUp) if result else False,
-                        )
-                    else:
-                        isUp, isBig = False, False
-                    data = {
-                        "name": item.name,
-                        "icon": assets.avatar.normal(item.name).as_uri() if assets else "",
-                        "count": count,
-                        "type": "代理人",
-                        "isUp": isUp,
-                        "isBig": isBig,
-                        "time": item.time,
-                    }
-                    result.append(FiveStarItem.construct(**data))
-                elif item.item_type == "音擎" and pool_name in {"音擎调频", "常驻调频"}:
-                    data = {
-                        "name": item.name,
-                        "icon": assets.weapon.icon(item.name).as_uri() if assets else "",
-                        "count": count,
-                        "type": "音擎",
-                        "isUp": False,
-                        "isBig": False,
-                        "time": item.time,
-                    }
-                    result.append(FiveStarItem.construct(**data))
-                elif item.item_type == "邦布" and pool_name in {"邦布调频"}:
-                    data = {
-                        "name": item.name,
-                        "icon": assets.buddy.icon(item.name).as_uri() if assets else "",
-                        "count": count,
-                        "type": "邦布",
-                        "isUp": False,
-                        "isBig": False,
-                        "time": item.time,
-                    }
-                    result.append(FiveStarItem.construct(**data))
-                count = 0
-        result.reverse()
-        return result, count
+        summary = self.build_pool_summary(pool_name, GachaLogColumns(data))
+        return self.get_summary_5_star_items(summary, assets), summary.no_five_star
 
-    @staticmethod
-    async def get_all_4_star_items(data: List[GachaItem], assets: "AssetsService"):
+    async def get_all_4_star_items(self, data: List[GachaItem], assets: "AssetsService"):
         """
         获取 no_fout_star
         :param data: 调频记录
         :param assets: 资源服务
         :return: no_fout_star
         """
-        count = 0
-        result = []
-        for item in data:
-            count += 1
-            if item.rank_type == "4":
-                if item.item_type == "代理人":
-                    data = {
-                        "name": item.name,
-                        "icon": assets.avatar.normal(item.name).as_uri() if assets else "",
-                        "count": count,
-                        "type": "代理人",
-                        "time": item.time,
-                    }
-                    result.append(FourStarItem.construct(**data))
-                elif item.item_type == "音擎":
-                    data = {
-                        "name": item.name,
-                        "icon": assets.weapon.icon(item.name).as_uri() if assets else "",
-                        "count": count,
-                        "type": "音擎",
-                        "time": item.time,
-                    }
-                    result.append(FourStarItem.construct(**data))
-                elif item.item_type == "邦布":
-                    data = {
-                        "name": item.name,
-                        "icon": assets.buddy.icon(item.name).as_uri() if assets else "",
-                        "count": count,
-                        "type": "邦布",
-                        "time": item.time,
-                    }
-                    result.append(FourStarItem.construct(**data))
-                count = 0
-        result.reverse()
-        return result, count
+        summary = self.build_pool_summary("", GachaLogColumns(data))
+        return self.get_summary_4_star_items(summary, assets), summary.no_four_star
 
     @staticmethod
     def get_2_pool_data(total: int, all_five: List[FiveStarItem], no_five_star: int, no_four_star: int):
@@ -525,14 +427,21 @@ class GachaLog(GachaLogOnlineView, GachaLogRanks):
         ]
 
     @staticmethod
-    def count_fortune(pool_name: str, summon_data, weapon: bool = False):
+    def count_fortune(pool_name: str, summon_data, weapon: bool = False, percent: Optional[float] = None):
         """
             代理人  音擎
         欧 50以下 45以下
         吉 50-60 45-55
         中 60-70 55-65
         非 70以上 65以上
+
+        有全服排名时按排名划分：前 25% 为欧，前 50% 为吉，前 75% 为普通，其余为非
         """
+        if percent is not None:
+            for limit, name in ((25, "欧"), (50, "吉"), (75, "普通")):
+                if percent <= limit:
+                    return f"{pool_name} · {name} · 前 {percent}%"
+            return f"{pool_name} · 非 · 前 {percent}%"
         data = [45, 55, 65] if weapon else [50, 60, 70]
         for i in summon_data:
             for j in i:
@@ -558,7 +467,11 @@ class GachaLog(GachaLogOnlineView, GachaLogRanks):
         :param assets: 资源服务
         :return: 分析数据
         """
-        gacha_log, status = await self.load_history_info(str(user_id), str(player_id))
+        pool_name = GACHA_TYPE_LIST[pool]
+        summary = await self.get_pool_summary(str(user_id), str(player_id), pool_name)
+        if summary is not None:
+            return await self.get_analysis_data_by_summary(str(player_id), pool, summary, assets)
+        gacha_log, status = await self.load_history_info(str(user_id), str(player_id), pools=[pool_name])
         if not status:
             raise GachaLogNotFound
         return await self.get_analysis_data(gacha_log, pool, assets)
@@ -573,28 +486,43 @@ class GachaLog(GachaLogOnlineView, GachaLogRanks):
         :param assets: 资源服务
         :return: 分析数据
         """
-        player_id = gacha_log.uid
         pool_name = GACHA_TYPE_LIST[pool]
         if pool_name not in gacha_log.item_list:
             raise GachaLogNotFound
-        data = gacha_log.item_list[pool_name]
-        total = len(data)
+        summary = self.update_pool_summary(pool_name, GachaLogPoolSummary(), gacha_log.item_list[pool_name])
+        return await self.get_analysis_data_by_summary(gacha_log.uid, pool, summary, assets)
+
+    async def get_analysis_data_by_summary(
+        self, player_id: str, pool: ZZZBannerType, summary: GachaLogPoolSummary, assets: Optional["AssetsService"]
+    ):
+        """
+        通过统计摘要获取抽卡记录分析数据
+        :param player_id: 玩家id
+        :param pool: 池子类型
+        :param summary: 卡池统计摘要
+        :param assets: 资源服务
+        :return: 分析数据
+        """
+        pool_name = GACHA_TYPE_LIST[pool]
+        total = summary.total
         if total == 0:
             raise GachaLogNotFound
-        all_five, no_five_star = await self.get_all_5_star_items(data, assets, pool_name)
-        all_four, no_four_star = await self.get_all_4_star_items(data, assets)
+        all_five, no_five_star = self.get_summary_5_star_items(summary, assets), summary.no_five_star
+        all_four, no_four_star = self.get_summary_4_star_items(summary, assets), summary.no_four_star
         summon_data = None
+        # 五星平均抽数的全服排名
+        percent, _ = await self.get_luck_rank(pool_name, summary)
         if pool == ZZZBannerType.CHARACTER:
             summon_data = self.get_2_pool_data(total, all_five, no_five_star, no_four_star)
-            pool_name = self.count_fortune(pool_name, summon_data)
+            pool_name = self.count_fortune(pool_name, summon_data, percent=percent)
         elif pool in [ZZZBannerType.WEAPON, ZZZBannerType.BANGBOO]:
             summon_data = self.get_3_pool_data(total, all_five, all_four, no_five_star, no_four_star)
-            pool_name = self.count_fortune(pool_name, summon_data, True)
+            pool_name = self.count_fortune(pool_name, summon_data, True, percent)
         elif pool == ZZZBannerType.STANDARD:
             summon_data = self.get_1_pool_data(total, all_five, all_four, no_five_star, no_four_star)
-            pool_name = self.count_fortune(pool_name, summon_data)
-        last_time = data[0].time.strftime("%Y-%m-%d %H:%M")
-        first_time = data[-1].time.strftime("%Y-%m-%d %H:%M")
+            pool_name = self.count_fortune(pool_name, summon_data, percent=percent)
+        last_time = summary.start_time.strftime("%Y-%m-%d %H:%M")
+        first_time = summary.end_time.strftime("%Y-%m-%d %H:%M")
         return {
             "uid": mask_number(player_id),
             "allNum": total,
@@ -618,26 +546,25 @@ class GachaLog(GachaLogOnlineView, GachaLogRanks):
         :param group: 是否群组
         :return: 分析数据
         """
-        gacha_log, status = await self.load_history_info(str(user_id), str(player_id))
+        pool_name = GACHA_TYPE_LIST[pool]
+        gacha_log, status = await self.load_history_info(str(user_id), str(player_id), pools=[pool_name])
         if not status:
             raise GachaLogNotFound
-        pool_name = GACHA_TYPE_LIST[pool]
         if pool_name not in gacha_log.item_list:
             raise GachaLogNotFound
         data = gacha_log.item_list[pool_name]
         total = len(data)
         if total == 0:
             raise GachaLogNotFound
-        all_five, _ = await self.get_all_5_star_items(data, assets, pool_name)
-        all_four, _ = await self.get_all_4_star_items(data, assets)
+        columns = GachaLogColumns(data)
+        summary = self.build_pool_summary(pool_name, columns)
+        all_five = self.get_summary_5_star_items(summary, assets)
+        all_four = self.get_summary_4_star_items(summary, assets)
         pool_data = []
-        up_pool_data = [Pool(**i) for i in get_pool_by_id(pool.value)]
+        # 通过卡池区间索引一次遍历完成分配
+        up_pool_data = get_banner_index(pool.value).assign(all_five + all_four)
         for up_pool in up_pool_data:
-            for item in all_five:
-                up_pool.parse(item)
-            for item in all_four:
-                up_pool.parse(item)
-            up_pool.count_item(data)
+            up_pool.count_columns(columns)
         for up_pool in up_pool_data:
             pool_data.append(
                 {
@@ -675,10 +602,11 @@ class GachaLog(GachaLogOnlineView, GachaLogRanks):
                 to=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 **{"from": "2020-09-28 00:00:00"},
             )
-            all_five, _ = await self.get_all_5_star_items(items, assets, pool_name)
+            columns = GachaLogColumns(items)
+            all_five = self.get_summary_5_star_items(self.build_pool_summary(pool_name, columns), assets)
             for item in all_five:
                 pool.parse(item)
-            pool.count_item(items)
+            pool.count_columns(columns)
             pools.append(pool)
         pool_data = [
             {
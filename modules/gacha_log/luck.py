@@ -0,0 +1,190 @@
+import asyncio
+from abc import abstractmethod
+from typing import Dict, Optional, Tuple
+
+import aiofiles
+
+from modules.gacha_log.const import GACHA_LOG_LUCK_VERSION, GACHA_LOG_SUMMARY_VERSION
+from modules.gacha_log.models import (
+    GachaLogInfo,
+    GachaLogLuckDistribution,
+    GachaLogLuckHistogram,
+    GachaLogPoolSummary,
+    GachaLogSummary,
+)
+from modules.gacha_log.storage import GachaLogStorage
+
+try:
+    import ujson as jsonlib
+except ImportError:
+    import json as jsonlib
+
+# 五星平均抽数的格数，超出范围的计入最后一格
+LUCK_AVG_BINS = 100
+# 小保底不歪概率的格数，0% - 100%
+LUCK_UP_BINS = 101
+# 统计的账号数量不足时不显示排名
+LUCK_MIN_POPULATION = 100
+# 同一目录的运气分布只能同时被一个协程修改
+LUCK_LOCKS: Dict[str, asyncio.Lock] = {}
+
+
+class GachaLogLuck:
+    """全服运气分布
+
+    按卡池统计所有账号五星平均抽数与小保底不歪概率的直方图。每次保存记录时根据新旧统计摘要增量更新，
+    查询排名只需要累加直方图，不需要遍历所有账号的记录。
+    """
+
+    LUCK_FILE = "luck.json"
+    storage: GachaLogStorage
+
+    @abstractmethod
+    async def load_summary(self, user_id: str, uid: str) -> Optional[GachaLogSummary]:
+        """读取统计摘要"""
+
+    @abstractmethod
+    async def update_summary(self, gacha_log: GachaLogInfo) -> Optional[GachaLogSummary]:
+        """更新统计摘要"""
+
+    @staticmethod
+    def get_luck_values(pool_name: str, summary: Optional[GachaLogPoolSummary]) -> Tuple[int, int]:
+        """获取卡池摘要在直方图中所在的格
+        :param pool_name: 卡池名称
+        :param summary: 卡池摘要
+        :return: 五星平均抽数与小保底不歪概率所在的格，没有数据时为 -1
+        """
+        if summary is None or not summary.five:
+            return -1, -1
+        five_star = len(summary.five)
+        avg = min(int((summary.total - summary.no_five_star) / five_star), LUCK_AVG_BINS - 1)
+        up = -1
+        if pool_name == "代理人调频" and five_star != summary.five_star_big:
+            up = int((summary.five_star_up - summary.five_star_big) / (five_star - summary.five_star_big) * 100)
+        return avg, up
+
+    def get_luck_lock(self) -> asyncio.Lock:
+        key = str(self.storage.gacha_log_path)
+        if key not in LUCK_LOCKS:
+            LUCK_LOCKS[key] = asyncio.Lock()
+        return LUCK_LOCKS[key]
+
+    async def load_luck(self) -> Optional[GachaLogLuckDistribution]:
+        """读取运气分布，不存在、损坏或版本不一致时返回 None"""
+        path = self.storage.gacha_log_path / self.LUCK_FILE
+        if not path.exists():
+            return None
+        try:
+            async with aiofiles.open(path, "rb") as f:
+                luck = GachaLogLuckDistribution.parse_obj(jsonlib.loads(await f.read()))
+        except ValueError:
+            return None
+        if luck.version != GACHA_LOG_LUCK_VERSION or luck.summary_version != GACHA_LOG_SUMMARY_VERSION:
+            return None
+        return luck
+
+    async def save_luck(self, luck: GachaLogLuckDistribution):
+        path = self.storage.gacha_log_path / self.LUCK_FILE
+        await self.storage.write_atomic(path, luck.json().encode("utf-8"))
+
+    def apply_luck(
+        self,
+        luck: GachaLogLuckDistribution,
+        summary: Optional[GachaLogSummary],
+        delta: int,
+    ):
+        if summary is None:
+            return
+        for pool_name, pool_summary in summary.pools.items():
+            avg, up = self.get_luck_values(pool_name, pool_summary)
+            if avg == -1:
+                continue
+            histogram = luck.pools.setdefault(
+                pool_name, GachaLogLuckHistogram(avg=[0] * LUCK_AVG_BINS, up=[0] * LUCK_UP_BINS)
+            )
+            histogram.avg[avg] = max(histogram.avg[avg] + delta, 0)
+            if up != -1:
+                histogram.up[up] = max(histogram.up[up] + delta, 0)
+
+    async def update_luck(self, old: Optional[GachaLogSummary], new: Optional[GachaLogSummary]):
+        """使用新旧统计摘要增量更新运气分布，运气分布不可用时重新生成
+        :param old: 保存前的统计摘要，新账号为空
+        :param new: 保存后的统计摘要，删除账号时为空
+        """
+        async with self.get_luck_lock():
+            luck = await self.load_luck()
+            if luck is None:
+                # 重新生成时读取的是已经保存的统计摘要，不需要再应用本次的变化
+                luck = await self.build_luck()
+            else:
+                # 旧摘要的版本与运气分布不一致时没有被统计过
+                if old is not None and old.version == luck.summary_version:
+                    self.apply_luck(luck, old, -1)
+                self.apply_luck(luck, new, 1)
+            await self.save_luck(luck)
+
+    async def build_luck(self) -> GachaLogLuckDistribution:
+        """从所有账号的统计摘要生成运气分布，需要持有 get_luck_lock"""
+        luck = GachaLogLuckDistribution(version=GACHA_LOG_LUCK_VERSION, summary_version=GACHA_LOG_SUMMARY_VERSION)
+        for user_id, uid in self.storage.list_accounts():
+            summary = await self.load_summary(user_id, uid)
+            if summary is None:
+                try:
+                    gacha_log = await self.storage.load(user_id, uid)
+                except ValueError:
+                    continue
+                if gacha_log is None:
+                    continue
+                summary = await self.update_summary(gacha_log)
+                await self.storage.update_manifest(user_id, uid)
+            self.apply_luck(luck, summary, 1)
+        return luck
+
+    async def rebuild_luck(self) -> GachaLogLuckDistribution:
+        """从所有账号的统计摘要重新生成运气分布"""
+        async with self.get_luck_lock():
+            luck = await self.build_luck()
+            await self.save_luck(luck)
+        return luck
+
+    async def check_luck(self) -> bool:
+        """运气分布不可用时重新生成，用于启动时处理版本变化
+        :return: 是否重新生成
+        """
+        async with self.get_luck_lock():
+            if await self.load_luck() is not None:
+                return False
+            await self.save_luck(await self.build_luck())
+        return True
+
+    @staticmethod
+    def get_luck_percent(histogram: GachaLogLuckHistogram, value: int, up: bool = False) -> Optional[float]:
+        """获取排名百分比
+        :param histogram: 卡池直方图
+        :param value: 所在的格
+        :param up: 是否为小保底不歪概率，概率越高排名越靠前；五星平均抽数越低排名越靠前
+        :return: 排名前百分之多少，人数不足时返回 None
+        """
+        bins = histogram.up if up else histogram.avg
+        total = sum(bins)
+        if value == -1 or total < LUCK_MIN_POPULATION:
+            return None
+        better = sum(bins[value:]) if up else sum(bins[: value + 1])
+        return round(better / total * 100, 1)
+
+    async def get_luck_rank(
+        self, pool_name: str, summary: GachaLogPoolSummary
+    ) -> Tuple[Optional[float], Optional[float]]:
+        """获取卡池的全服排名
+        :param pool_name: 卡池名称
+        :param summary: 卡池摘要
+        :return: 五星平均抽数与小保底不歪概率的排名百分比
+        """
+        luck = await self.load_luck()
+        if luck is None:
+            return None, None
+        histogram = luck.pools.get(pool_name)
+        if histogram is None:
+            return None, None
+        avg, up = self.get_luck_values(pool_name, summary)
+        return self.get_luck_percent(histogram, avg), self.get_luck_percent(histogram, up, True)
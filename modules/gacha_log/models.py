@@ -1,12 +1,15 @@
 import datetime
 from enum import Enum
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, TYPE_CHECKING, Union
 
 from pydantic import BaseModel, validator
 
 from metadata.shortname import not_real_roles, roleToId, weaponToId, buddyToId
 from modules.gacha_log.const import ZZZGF_VERSION
 
+if TYPE_CHECKING:
+    from modules.gacha_log.analytics import GachaLogColumns
+
 
 class ImportType(Enum):
     PaiGram = "PaiGram"
@@ -88,6 +91,97 @@ class GachaLogInfo(BaseModel):
             return ImportType.UNKNOWN
 
 
+class GachaLogPoolIndex(BaseModel):
+    """单个卡池记录文件的索引"""
+
+    file: str = ""
+    generation: int = 0
+    count: int = 0
+    size: int = 0
+    last_id: str = ""
+    last_time: Optional[datetime.datetime] = None
+    # 缺少 gacha_id 或 item_id 的旧记录数量，为空时未知
+    incomplete: Optional[int] = None
+
+
+class GachaLogIndex(BaseModel):
+    """调频记录索引头"""
+
+    version: int = 1
+    user_id: str
+    uid: str
+    update_time: datetime.datetime
+    import_type: str = ""
+    pools: Dict[str, GachaLogPoolIndex] = {}
+
+
+class GachaLogManifestItem(BaseModel):
+    """分片清单中的单个账号"""
+
+    user_id: str
+    uid: str
+    size: int = 0
+    mtime: float = 0
+    summary_checksum: str = ""
+
+
+class GachaLogManifest(BaseModel):
+    """分片清单，记录分片内所有账号的文件信息"""
+
+    version: int = 1
+    accounts: Dict[str, GachaLogManifestItem] = {}
+
+
+class GachaLogSummaryItem(BaseModel):
+    """统计摘要中的四星、五星记录"""
+
+    name: str
+    type: str
+    count: int
+    isUp: bool = False
+    isBig: bool = False
+    time: datetime.datetime
+
+
+class GachaLogPoolSummary(BaseModel):
+    """单个卡池的统计摘要"""
+
+    total: int = 0
+    last_id: str = ""
+    start_time: Optional[datetime.datetime] = None
+    end_time: Optional[datetime.datetime] = None
+    no_five_star: int = 0
+    no_four_star: int = 0
+    five_star_up: int = 0
+    five_star_big: int = 0
+    five: List[GachaLogSummaryItem] = []
+    four: List[GachaLogSummaryItem] = []
+
+
+class GachaLogSummary(BaseModel):
+    """调频记录统计摘要"""
+
+    version: int = 0
+    pools: Dict[str, GachaLogPoolSummary] = {}
+
+
+class GachaLogLuckHistogram(BaseModel):
+    """单个卡池全服运气分布"""
+
+    # 五星平均抽数，每抽一格
+    avg: List[int] = []
+    # 小保底不歪概率，每 1% 一格
+    up: List[int] = []
+
+
+class GachaLogLuckDistribution(BaseModel):
+    """全服运气分布"""
+
+    version: int = 0
+    summary_version: int = 0
+    pools: Dict[str, GachaLogLuckHistogram] = {}
+
+
 class Pool:
     def __init__(self, five: List[str], four: List[str], name: str, to: str, **kwargs):
         self.five = five
@@ -125,6 +219,16 @@ class Pool:
                     self.start_init = True
                 self.end = i.time
 
+    def count_columns(self, columns: "GachaLogColumns"):
+        """与 count_item 相同，使用二分查找统计卡池时间范围内的记录"""
+        count, start, end = columns.count_window(self.from_time, self.to_time)
+        if count:
+            self.count += count
+            if not self.start_init:
+                self.start = start
+                self.start_init = True
+            self.end = end
+
     def to_list(self):
         return list(self.dict.values())
 
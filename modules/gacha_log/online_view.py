@@ -1,7 +1,6 @@
 from pathlib import Path
 from typing import Optional
 
-import httpx
 from httpx import URL
 from httpx import HTTPError
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
@@ -9,6 +8,10 @@ from telegram.helpers import create_deep_linked_url
 
 from gram_core.basemodel import Settings
 from modules.gacha_log.error import GachaLogWebNotConfigError, GachaLogWebUploadError, GachaLogNotFound
+from modules.gacha_log.exporter import GachaLogJSONExporter
+from modules.gacha_log.storage import GachaLogStorage
+from modules.gacha_log.uploader import GachaLogUploader
+from modules.gacha_log.writer import GachaLogWriteCoordinator
 
 
 class GachaLogWebConfig(Settings):
@@ -16,6 +19,10 @@ class GachaLogWebConfig(Settings):
 
     url: Optional[str] = ""
     token: Optional[str] = ""
+    # 同时上传的最大数量
+    upload_concurrency: int = 4
+    # 使用 gzip 压缩上传内容，需要服务端支持
+    upload_gzip: bool = False
 
     class Config(Settings.Config):
         env_prefix = "gacha_log_web_"
@@ -29,6 +36,14 @@ class GachaLogOnlineView:
     """抽卡记录在线查询"""
 
     gacha_log_path: Path
+    storage: GachaLogStorage
+    writer: GachaLogWriteCoordinator
+
+    def __init__(self):
+        self.uploader = GachaLogUploader(
+            max_concurrency=gacha_log_web_config.upload_concurrency, compress=gacha_log_web_config.upload_gzip
+        )
+        self.json_exporter = GachaLogJSONExporter()
 
     @staticmethod
     def get_web_upload_button(bot_username: str):
@@ -47,36 +62,37 @@ class GachaLogOnlineView:
     async def web_upload(self, user_id: str, uid: str) -> str:
         if not gacha_log_web_config.url:
             raise GachaLogWebNotConfigError
-        file_path = self.gacha_log_path / f"{user_id}-{uid}.json"
-        if not file_path.exists():
-            raise GachaLogNotFound
-        async with httpx.AsyncClient() as client:
-            with open(file_path, "rb") as file:
-                try:
-                    req = await client.post(
-                        URL(gacha_log_web_config.url).join("upload"),
-                        files={"file": file},
-                        data={
-                            "token": gacha_log_web_config.token,
-                            "uid": uid,
-                            "game": "zzz",
-                        },
-                    )
-                    req.raise_for_status()
-                except HTTPError as e:
-                    raise GachaLogWebUploadError from e
-                account_id = req.json()["account_id"]
-                url = (
-                    URL(gacha_log_web_config.url)
-                    .join("gacha_log")
-                    .copy_merge_params(
-                        {
-                            "account_id": account_id,
-                            "banner_type": DEFAULT_POOL,
-                            "rarities": "3,4,5",
-                            "size": 100,
-                            "page": 1,
-                        }
-                    )
+        # 上传时按卡池依次读取并序列化，持有写入锁避免读取到一半时卡池文件被替换
+        async with self.writer.lock(str(user_id), uid):
+            info = await self.storage.load(str(user_id), uid, pools=[])
+            if info is None:
+                raise GachaLogNotFound
+            data = self.json_exporter.iter_chunks(info, self.storage.iter_pools(str(user_id), uid))
+            try:
+                req = await self.uploader.upload(
+                    URL(gacha_log_web_config.url).join("upload"),
+                    {
+                        "token": gacha_log_web_config.token,
+                        "uid": uid,
+                        "game": "zzz",
+                    },
+                    f"{user_id}-{uid}.json",
+                    data,
                 )
-                return str(url)
+            except (HTTPError, OSError, ValueError) as e:
+                raise GachaLogWebUploadError from e
+        account_id = req.json()["account_id"]
+        url = (
+            URL(gacha_log_web_config.url)
+            .join("gacha_log")
+            .copy_merge_params(
+                {
+                    "account_id": account_id,
+                    "banner_type": DEFAULT_POOL,
+                    "rarities": "3,4,5",
+                    "size": 100,
+                    "page": 1,
+                }
+            )
+        )
+        return str(url)
@@ -1,16 +1,22 @@
 import asyncio
 import contextlib
+import multiprocessing
+import os
+import time
 from abc import abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Optional, TYPE_CHECKING, Dict
+from typing import List, Optional, TYPE_CHECKING, Dict, Tuple, Type
 
 from simnet.models.genshin.wish import BannerType
 from simnet.models.zzz.wish import ZZZBannerType
 
 from core.services.gacha_log_rank.services import GachaLogRankService
 from core.services.gacha_log_rank.models import GachaLogRank, GachaLogTypeEnum, GachaLogQueryTypeEnum
+from core.services.gacha_log_rank.repositories import GachaLogRankBatchRepository
 from modules.gacha_log.error import GachaLogNotFound
 from modules.gacha_log.models import GachaLogInfo, ImportType
+from modules.gacha_log.storage import GachaLogStorage
 from utils.log import logger
 
 if TYPE_CHECKING:
@@ -18,14 +24,53 @@ if TYPE_CHECKING:
     from telegram import Message
 
 
+# 重新统计时每批处理的账号数量，每批结果在一个事务中写入
+RECOUNT_CHUNK_SIZE = 50
+RECOUNT_WORKERS = min(4, os.cpu_count() or 1)
+# 进度消息的最短更新间隔
+RECOUNT_REPORT_INTERVAL = 5
+
+
 class GachaLogError(Exception):
     """抽卡记录异常"""
 
 
+class GachaLogRecountProgress:
+    """排行榜重新统计进度"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.ranks = 0
+        self.start = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    @property
+    def rate(self) -> float:
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def update(self, done: int, failed: int, ranks: int):
+        self.done += done
+        self.failed += failed
+        self.ranks += ranks
+
+    def __str__(self) -> str:
+        return (
+            f"已处理 {self.done}/{self.total} 个文件，失败 {self.failed} 个，"
+            f"写入 {self.ranks} 条数据，{self.rate:.1f} 个/秒，耗时 {self.elapsed:.0f} 秒"
+        )
+
+
 class GachaLogRanks:
     """抽卡记录排行榜"""
 
     gacha_log_path: Path
+    storage: GachaLogStorage
     ITEM_LIST_MAP = {
         "代理人调频": GachaLogTypeEnum.CHARACTER,
         "音擎调频": GachaLogTypeEnum.WEAPON,
@@ -48,13 +93,16 @@ class GachaLogRanks:
     def __init__(
         self,
         gacha_log_rank_service: GachaLogRankService = None,
+        gacha_log_rank_batch: GachaLogRankBatchRepository = None,
     ):
         self.gacha_log_rank_service = gacha_log_rank_service
+        self.gacha_log_rank_batch = gacha_log_rank_batch
 
-    @staticmethod
     @abstractmethod
-    async def load_json(path):
-        """加载json文件"""
+    async def load_history_info(
+        self, user_id: str, uid: str, only_status: bool = False
+    ) -> Tuple[Optional[GachaLogInfo], bool]:
+        """读取历史调频记录数据"""
 
     @abstractmethod
     async def get_analysis_data(self, gacha_log: "GachaLogInfo", pool: BannerType, assets: Optional["AssetsService"]):
@@ -79,10 +127,10 @@ class GachaLogRanks:
                     setattr(rank, gacha_log_type.value, value)
         return rank
 
-    async def recount_one_data(self, file_path: Path) -> List[GachaLogRank]:
-        """重新计算一个文件的数据"""
+    async def recount_one_data(self, user_id: str, uid: str) -> List[GachaLogRank]:
+        """重新计算一个账号的数据"""
         try:
-            gacha_log = GachaLogInfo.parse_obj(await self.load_json(file_path))
+            gacha_log, _ = await self.load_history_info(user_id, uid)
             if gacha_log.get_import_type != ImportType.PaiGram:
                 raise GachaLogError("不支持的抽卡记录类型")
         except ValueError as e:
@@ -100,18 +148,17 @@ class GachaLogRanks:
         return data
 
     async def recount_one_from_uid(self, user_id: int, uid: int):
-        save_path = self.gacha_log_path / f"{user_id}-{uid}.json"
-        await self.recount_one(save_path)
+        await self.recount_one(str(user_id), str(uid))
 
-    async def recount_one(self, file_path: Path):
-        if not file_path.exists():
+    async def recount_one(self, user_id: str, uid: str):
+        if not self.storage.exists(user_id, uid):
             return
         try:
-            ranks = await self.recount_one_data(file_path)
+            ranks = await self.recount_one_data(user_id, uid)
             if ranks:
                 await self.add_or_update(ranks)
         except GachaLogError:
-            logger.warning("更新抽卡排名失败 file[%s]", file_path)
+            logger.warning("更新抽卡排名失败 user_id[%s] uid[%s]", user_id, uid)
 
     async def add_or_update(self, ranks: List["GachaLogRank"]):
         """添加或更新用户数据"""
@@ -125,20 +172,82 @@ class GachaLogRanks:
             else:
                 await self.gacha_log_rank_service.add(rank)
 
-    async def recount_all_data(self, message: "Message"):
-        """重新计算所有数据"""
+    async def add_or_update_many(self, ranks: List["GachaLogRank"]):
+        """批量添加或更新多个用户的数据，数据库不支持 upsert 时逐条添加或更新"""
+        if self.gacha_log_rank_batch is not None and self.gacha_log_rank_batch.supported:
+            await self.gacha_log_rank_batch.add_or_update_many(ranks)
+            return
+        players: Dict[int, List["GachaLogRank"]] = {}
+        for rank in ranks:
+            players.setdefault(rank.player_id, []).append(rank)
+        for player_ranks in players.values():
+            await self.add_or_update(player_ranks)
+
+    async def recount_chunk_data(self, accounts: List[Tuple[str, str]]) -> Tuple[List[Dict], int]:
+        """重新计算一批账号的数据
+        :param accounts: 账号列表
+        :return: 排行数据与失败数量
+        """
+        data, failed = [], 0
+        for user_id, uid in accounts:
+            try:
+                ranks = await self.recount_one_data(user_id, uid)
+            except GachaLogError:
+                failed += 1
+                continue
+            except Exception as exc:  # pylint: disable=W0703
+                logger.warning("更新抽卡排名失败 user_id[%s] uid[%s]", user_id, uid, exc_info=exc)
+                failed += 1
+                continue
+            data.extend(rank.dict() for rank in ranks)
+        return data, failed
+
+    @staticmethod
+    def recount_worker(
+        cls: Type["GachaLogRanks"], gacha_log_path: Path, accounts: List[Tuple[str, str]]
+    ) -> Tuple[List[Dict], int]:
+        """在子进程中重新计算一批账号的数据"""
+        gacha_log = cls(gacha_log_path=gacha_log_path)
+        return asyncio.run(gacha_log.recount_chunk_data(accounts))
+
+    async def del_all_rank_cache(self):
         for key1 in GachaLogTypeEnum:
             for key2 in GachaLogQueryTypeEnum:
                 await self.gacha_log_rank_service.del_all_cache_by_type(key1, key2)  # noqa
-        files = [f for f in self.gacha_log_path.glob("*.json") if len(f.stem.split("-")) == 2]
-        tasks = []
-        for idx, f in enumerate(files):
-            tasks.append(self.recount_one(f))
-            if len(tasks) >= 10:
-                await asyncio.gather(*tasks)
-                tasks.clear()
-            if idx % 10 == 1:
-                with contextlib.suppress(Exception):
-                    await message.edit_text(f"已处理 {idx + 1}/{len(files)} 个文件")
-        if tasks:
-            await asyncio.gather(*tasks)
+
+    async def recount_all_data(self, message: "Message") -> GachaLogRecountProgress:
+        """重新计算所有数据
+
+        文件的读取与统计在进程池中完成，每批结果返回后在一个事务中写入，主事件循环只负责写入数据库。
+        """
+        await self.del_all_rank_cache()
+        accounts = self.storage.list_accounts()
+        chunks = [accounts[i : i + RECOUNT_CHUNK_SIZE] for i in range(0, len(accounts), RECOUNT_CHUNK_SIZE)]
+        progress = GachaLogRecountProgress(len(accounts))
+        loop = asyncio.get_running_loop()
+        executor = ProcessPoolExecutor(max_workers=RECOUNT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+        async def run_chunk(chunk: List[Tuple[str, str]]) -> Tuple[int, List[Dict], int]:
+            _data, _failed = await loop.run_in_executor(
+                executor, self.recount_worker, type(self), self.gacha_log_path, chunk
+            )
+            return len(chunk), _data, _failed
+
+        last_report = time.monotonic()
+        try:
+            for task in asyncio.as_completed([run_chunk(chunk) for chunk in chunks]):
+                count, data, failed = await task
+                ranks = [GachaLogRank(**i) for i in data]
+                if ranks:
+                    await self.add_or_update_many(ranks)
+                progress.update(count, failed, len(ranks))
+                if time.monotonic() - last_report >= RECOUNT_REPORT_INTERVAL:
+                    last_report = time.monotonic()
+                    with contextlib.suppress(Exception):
+                        await message.edit_text(str(progress))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        # 统计期间的实时更新可能会写入缓存，统计完成后再清理一次
+        await self.del_all_rank_cache()
+        logger.success("重新统计抽卡记录排行榜完成 %s", progress)
+        return progress
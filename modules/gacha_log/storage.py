@@ -0,0 +1,566 @@
+import asyncio
+import contextlib
+import datetime
+import os
+import shutil
+import uuid
+import zlib
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+import aiofiles
+
+from modules.gacha_log.const import GACHA_TYPE_LIST_REVERSE
+from modules.gacha_log.models import (
+    GachaItem,
+    GachaLogIndex,
+    GachaLogInfo,
+    GachaLogManifest,
+    GachaLogManifestItem,
+    GachaLogPoolIndex,
+)
+
+try:
+    import ujson as jsonlib
+except ImportError:
+    import json as jsonlib
+
+
+GACHA_LOG_STORAGE_VERSION = 1
+GACHA_LOG_LAYOUT_VERSION = 1
+GACHA_ITEM_FIELDS = tuple(i for i in GachaItem.__fields__ if i != "time")
+# 同一分片的清单只能同时被一个协程修改，不同的存储实例之间共享
+MANIFEST_LOCKS: Dict[str, asyncio.Lock] = {}
+
+
+class GachaLogStorage:
+    """调频记录存储
+
+    每个账号一个目录，目录内为每个卡池一个只追加的记录文件（每行一条记录）以及一个索引头 ``index.json``。
+    索引头记录了每个卡池的记录数、最后一条记录的 id 以及文件的有效长度，写入新记录时只需要追加新增的部分，
+    读取时也可以只读取单个卡池。索引头总是最后写入，因此未提交的追加内容会在下一次写入时被截断。
+
+    账号目录按 user_id 的末两位分片存放，每个分片有一个清单 ``manifest.json``，
+    记录分片内每个账号的记录大小、修改时间以及统计摘要的校验值，枚举账号时只需要读取清单。
+    保存记录时账号的清单项只追加到分片的日志 ``manifest.log`` 中，日志超过一定大小后才合并到清单。
+    """
+
+    INDEX_FILE = "index.json"
+    SUMMARY_FILE = "summary.json"
+    MANIFEST_FILE = "manifest.json"
+    MANIFEST_JOURNAL_FILE = "manifest.log"
+    # 清单日志超过这个大小时合并到清单
+    MANIFEST_COMPACT_SIZE = 256 * 1024
+    LAYOUT_FILE = "layout.json"
+    SHARD_LENGTH = 2
+
+    def __init__(self, gacha_log_path: Path):
+        self.gacha_log_path = gacha_log_path
+
+    @classmethod
+    def get_shard(cls, user_id: str) -> str:
+        # Telegram 用户 id 的末位分布比首位均匀
+        return str(user_id)[-cls.SHARD_LENGTH :].zfill(cls.SHARD_LENGTH)
+
+    def get_shard_path(self, user_id: str) -> Path:
+        return self.gacha_log_path / self.get_shard(user_id)
+
+    def get_manifest_path(self, shard: str) -> Path:
+        return self.gacha_log_path / shard / self.MANIFEST_FILE
+
+    def get_manifest_journal_path(self, shard: str) -> Path:
+        return self.gacha_log_path / shard / self.MANIFEST_JOURNAL_FILE
+
+    def get_layout_path(self) -> Path:
+        return self.gacha_log_path / self.LAYOUT_FILE
+
+    def get_account_path(self, user_id: str, uid: str) -> Path:
+        return self.get_shard_path(user_id) / f"{user_id}-{uid}"
+
+    def get_export_path(self, user_id: str, uid: str) -> Path:
+        """获取 ZZZGF 导出文件的路径"""
+        return self.get_shard_path(user_id) / f"{user_id}-{uid}-zzzgf.json"
+
+    def get_index_path(self, user_id: str, uid: str) -> Path:
+        return self.get_account_path(user_id, uid) / self.INDEX_FILE
+
+    def get_summary_path(self, user_id: str, uid: str) -> Path:
+        return self.get_account_path(user_id, uid) / self.SUMMARY_FILE
+
+    def get_legacy_path(self, user_id: str, uid: str, bak: bool = False) -> Path:
+        """获取旧版单文件格式的路径"""
+        return self.gacha_log_path / f"{user_id}-{uid}.json{'.bak' if bak else ''}"
+
+    @staticmethod
+    def get_pool_file_name(pool_name: str, generation: int) -> str:
+        return f"{GACHA_TYPE_LIST_REVERSE[pool_name].value}-{generation}.log"
+
+    def exists(self, user_id: str, uid: str) -> bool:
+        return self.get_index_path(user_id, uid).exists() or self.get_legacy_path(user_id, uid).exists()
+
+    def list_accounts(self) -> List[Tuple[str, str]]:
+        """列出所有保存了调频记录的账号，从分片清单中读取
+        :return: (user_id, uid) 列表
+        """
+        accounts = set()
+        shards = {path.parent.name for path in self.gacha_log_path.glob(f"*/{self.MANIFEST_FILE}")}
+        shards.update(path.parent.name for path in self.gacha_log_path.glob(f"*/{self.MANIFEST_JOURNAL_FILE}"))
+        for shard in shards:
+            manifest = GachaLogManifest()
+            path = self.get_manifest_path(shard)
+            if path.exists():
+                try:
+                    manifest = GachaLogManifest.parse_obj(jsonlib.loads(path.read_bytes()))
+                except ValueError:
+                    pass
+            journal_path = self.get_manifest_journal_path(shard)
+            if journal_path.exists():
+                self.apply_manifest_journal(manifest, journal_path.read_bytes())
+            accounts.update((i.user_id, i.uid) for i in manifest.accounts.values())
+        if not self.get_layout_path().exists():
+            # 目录结构尚未迁移时还需要包含旧版的单文件记录
+            for path in self.gacha_log_path.glob("*.json"):
+                data = path.stem.split("-")
+                if len(data) == 2:
+                    accounts.add((data[0], data[1]))
+        return sorted(accounts)
+
+    @staticmethod
+    def dump_item(item: GachaItem) -> bytes:
+        data = {k: getattr(item, k) for k in GACHA_ITEM_FIELDS}
+        data["time"] = item.time.strftime("%Y-%m-%d %H:%M:%S")
+        return jsonlib.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n"
+
+    @staticmethod
+    def load_item(line: bytes) -> GachaItem:
+        # 记录写入前已经校验过，读取时无需再次校验
+        data = jsonlib.loads(line)
+        data["time"] = datetime.datetime.fromisoformat(data["time"])
+        return GachaItem.construct(**data)
+
+    @staticmethod
+    def get_temp_path(path: Path) -> Path:
+        # 每次写入使用不同的临时文件，避免同时写入同一个文件时互相覆盖
+        return path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+
+    @classmethod
+    async def write_atomic(cls, path: Path, data: bytes):
+        """先写入临时文件再替换，读取方不会看到写了一半的文件"""
+        temp_path = cls.get_temp_path(path)
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                await f.write(data)
+            os.replace(temp_path, path)
+        finally:
+            with contextlib.suppress(OSError):
+                temp_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def get_manifest_lock(path: Path) -> asyncio.Lock:
+        key = str(path)
+        if key not in MANIFEST_LOCKS:
+            MANIFEST_LOCKS[key] = asyncio.Lock()
+        return MANIFEST_LOCKS[key]
+
+    @staticmethod
+    def apply_manifest_journal(manifest: GachaLogManifest, data: bytes):
+        """将清单日志中的账号变化应用到清单，后写入的覆盖先写入的"""
+        for line in data.splitlines():
+            if not line:
+                continue
+            try:
+                entry = jsonlib.loads(line)
+                item = GachaLogManifestItem.parse_obj(entry["item"]) if entry["item"] else None
+            except (ValueError, KeyError, TypeError):
+                # 写了一半的日志，之后的日志从新的一行开始，不受影响
+                continue
+            if item is None:
+                manifest.accounts.pop(entry["key"], None)
+            else:
+                manifest.accounts[entry["key"]] = item
+
+    async def load_manifest(self, shard: str) -> GachaLogManifest:
+        path = self.get_manifest_path(shard)
+        manifest = GachaLogManifest()
+        if path.exists():
+            try:
+                async with aiofiles.open(path, "rb") as f:
+                    manifest = GachaLogManifest.parse_obj(jsonlib.loads(await f.read()))
+            except ValueError:
+                return await self.scan_manifest(shard)
+        journal_path = self.get_manifest_journal_path(shard)
+        if journal_path.exists():
+            async with aiofiles.open(journal_path, "rb") as f:
+                self.apply_manifest_journal(manifest, await f.read())
+        return manifest
+
+    async def save_manifest(self, shard: str, manifest: GachaLogManifest):
+        """写入完整的清单并清空日志"""
+        path = self.get_manifest_path(shard)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        await self.write_atomic(path, manifest.json().encode("utf-8"))
+        # 清单写入后日志中的内容已经包含在清单中，崩溃时重复应用日志也不会改变结果
+        self.get_manifest_journal_path(shard).unlink(missing_ok=True)
+
+    async def get_manifest_item(
+        self, user_id: str, uid: str, index: Optional[GachaLogIndex] = None
+    ) -> Optional[GachaLogManifestItem]:
+        """根据账号目录生成清单项
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :param index: 已经读取的索引头
+        :return: 清单项，账号不存在时返回 None
+        """
+        index_path = self.get_index_path(user_id, uid)
+        if not index_path.exists():
+            return None
+        if index is None:
+            index = await self.load_index(user_id, uid)
+        summary_checksum = ""
+        summary_path = self.get_summary_path(user_id, uid)
+        if summary_path.exists():
+            async with aiofiles.open(summary_path, "rb") as f:
+                summary_checksum = f"{zlib.crc32(await f.read()):08x}"
+        return GachaLogManifestItem(
+            user_id=user_id,
+            uid=uid,
+            size=sum(i.size for i in index.pools.values()),
+            mtime=index_path.stat().st_mtime,
+            summary_checksum=summary_checksum,
+        )
+
+    async def update_manifest(self, user_id: str, uid: str, index: Optional[GachaLogIndex] = None):
+        """将账号的清单项追加到分片的日志中，账号不存在时记录删除，日志过大时合并到清单
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :param index: 已经读取的索引头
+        """
+        shard = self.get_shard(user_id)
+        item = await self.get_manifest_item(user_id, uid, index)
+        entry = {"key": f"{user_id}-{uid}", "item": item.dict() if item is not None else None}
+        # 每条日志以换行开头，写了一半的日志不会影响下一条
+        data = b"\n" + jsonlib.dumps(entry, ensure_ascii=False).encode("utf-8")
+        journal_path = self.get_manifest_journal_path(shard)
+        journal_path.parent.mkdir(parents=True, exist_ok=True)
+        async with self.get_manifest_lock(self.get_manifest_path(shard)):
+            async with aiofiles.open(journal_path, "ab") as f:
+                await f.write(data)
+            if journal_path.stat().st_size >= self.MANIFEST_COMPACT_SIZE:
+                await self.save_manifest(shard, await self.load_manifest(shard))
+
+    async def scan_manifest(self, shard: str) -> GachaLogManifest:
+        """扫描分片目录重新生成清单，用于清单损坏时恢复
+        :param shard: 分片
+        :return: 分片清单
+        """
+        manifest = GachaLogManifest()
+        shard_path = self.gacha_log_path / shard
+        if shard_path.exists():
+            for path in shard_path.iterdir():
+                data = path.name.split("-")
+                if not path.is_dir() or len(data) != 2:
+                    continue
+                with contextlib.suppress(ValueError):
+                    item = await self.get_manifest_item(data[0], data[1])
+                    if item is not None:
+                        manifest.accounts[path.name] = item
+        await self.save_manifest(shard, manifest)
+        return manifest
+
+    async def load_index(self, user_id: str, uid: str) -> Optional[GachaLogIndex]:
+        index_path = self.get_index_path(user_id, uid)
+        if not index_path.exists():
+            return None
+        async with aiofiles.open(index_path, "rb") as f:
+            return GachaLogIndex.parse_obj(jsonlib.loads(await f.read()))
+
+    async def save_index(self, index: GachaLogIndex):
+        await self.write_atomic(self.get_index_path(index.user_id, index.uid), index.json().encode("utf-8"))
+
+    async def load_pool(self, user_id: str, uid: str, pool_index: GachaLogPoolIndex) -> List[GachaItem]:
+        """读取单个卡池的记录
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :param pool_index: 卡池索引
+        :return: 调频记录
+        """
+        if not pool_index.file or pool_index.size == 0:
+            return []
+        async with aiofiles.open(self.get_account_path(user_id, uid) / pool_index.file, "rb") as f:
+            data = await f.read(pool_index.size)
+        return [self.load_item(line) for line in data.splitlines() if line]
+
+    async def get_watermarks(self, user_id: str, uid: str) -> Dict[str, Optional[str]]:
+        """从索引头获取每个卡池的水位线，即最后一条记录的 id
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :return: 卡池名称与水位线，没有记录或者旧记录缺少 gacha_id 与 item_id 的卡池为空，需要完整获取
+        """
+        index = await self.load_index(user_id, uid)
+        if index is None:
+            return {}
+        watermarks = {}
+        for pool_name, pool_index in index.pools.items():
+            incomplete = pool_index.incomplete
+            if incomplete is None and pool_index.count:
+                # 旧版索引头没有记录这个数量，只读取这个卡池检查一次
+                incomplete = self.count_incomplete(await self.load_pool(user_id, uid, pool_index))
+            watermarks[pool_name] = pool_index.last_id if pool_index.count and not incomplete else None
+        return watermarks
+
+    async def iter_pools(self, user_id: str, uid: str) -> AsyncIterator[Tuple[str, List[GachaItem]]]:
+        """依次读取每个卡池的记录，顺序与 load 相同
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :return: 卡池名称与记录
+        """
+        index = await self.load_index(user_id, uid)
+        if index is None:
+            info = await self.load_legacy(user_id, uid)
+            if info is not None:
+                for pool_name, items in info.item_list.items():
+                    yield pool_name, items
+            return
+        for pool_name, pool_index in index.pools.items():
+            yield pool_name, await self.load_pool(user_id, uid, pool_index)
+
+    async def load_legacy(self, user_id: str, uid: str) -> Optional[GachaLogInfo]:
+        path = self.get_legacy_path(user_id, uid)
+        if not path.exists():
+            return None
+        async with aiofiles.open(path, "rb") as f:
+            return GachaLogInfo.parse_obj(jsonlib.loads(await f.read()))
+
+    async def load(self, user_id: str, uid: str, pools: Optional[Iterable[str]] = None) -> Optional[GachaLogInfo]:
+        """读取调频记录
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :param pools: 需要读取的卡池名称，为空时读取全部卡池
+        :return: 调频记录，不存在时返回 None
+        """
+        index = await self.load_index(user_id, uid)
+        if index is None:
+            info = await self.load_legacy(user_id, uid)
+            if info is not None and pools is not None:
+                info.item_list = {k: v for k, v in info.item_list.items() if k in set(pools)}
+            return info
+        pool_names = list(index.pools.keys()) if pools is None else list(pools)
+        item_list: Dict[str, List[GachaItem]] = {}
+        for pool_name in pool_names:
+            pool_index = index.pools.get(pool_name)
+            item_list[pool_name] = await self.load_pool(user_id, uid, pool_index) if pool_index else []
+        return GachaLogInfo.construct(
+            user_id=index.user_id,
+            uid=index.uid,
+            update_time=index.update_time,
+            import_type=index.import_type,
+            item_list=item_list,
+        )
+
+    async def rewrite_pool(self, account_path: Path, pool_name: str, items: List[GachaItem], old: GachaLogPoolIndex):
+        generation = old.generation + 1
+        file_name = self.get_pool_file_name(pool_name, generation)
+        data = b"".join(self.dump_item(i) for i in items)
+        await self.write_atomic(account_path / file_name, data)
+        return GachaLogPoolIndex(
+            file=file_name,
+            generation=generation,
+            count=len(items),
+            size=len(data),
+            last_id=items[-1].id if items else "",
+            last_time=items[-1].time if items else None,
+            incomplete=self.count_incomplete(items),
+        )
+
+    async def append_pool(self, account_path: Path, items: List[GachaItem], old: GachaLogPoolIndex):
+        path = account_path / old.file
+        # 截断上一次未提交到索引的内容
+        if path.stat().st_size != old.size:
+            os.truncate(path, old.size)
+        new_items = items[old.count :]
+        data = b"".join(self.dump_item(i) for i in new_items)
+        async with aiofiles.open(path, "ab") as f:
+            await f.write(data)
+        if old.incomplete is None:
+            incomplete = self.count_incomplete(items)
+        else:
+            incomplete = old.incomplete + self.count_incomplete(new_items)
+        return GachaLogPoolIndex(
+            file=old.file,
+            generation=old.generation,
+            count=len(items),
+            size=old.size + len(data),
+            last_id=items[-1].id,
+            last_time=items[-1].time,
+            incomplete=incomplete,
+        )
+
+    @staticmethod
+    def count_incomplete(items: List[GachaItem]) -> int:
+        return sum(1 for i in items if not (i.gacha_id and i.item_id))
+
+    @staticmethod
+    def can_append(items: List[GachaItem], pool_index: GachaLogPoolIndex) -> bool:
+        """判断已保存的记录是否为新记录的前缀"""
+        if not pool_index.file or pool_index.count > len(items):
+            return False
+        if pool_index.count == 0:
+            return True
+        return items[pool_index.count - 1].id == pool_index.last_id
+
+    async def save(self, info: GachaLogInfo, rewrite: Optional[Set[str]] = None, manifest: bool = True):
+        """保存调频记录，只写入新增部分
+        :param info: 调频记录，记录需要按时间排序
+        :param rewrite: 需要完整重写的卡池名称（例如旧记录被修改过）
+        :param manifest: 是否更新分片清单，之后还需要写入统计摘要时由调用方在最后更新一次
+        """
+        user_id, uid = info.user_id, info.uid
+        index = await self.load_index(user_id, uid)
+        if index is None and self.get_legacy_path(user_id, uid).exists():
+            index = await self.migrate_legacy(user_id, uid)
+        if index is None:
+            index = GachaLogIndex(
+                version=GACHA_LOG_STORAGE_VERSION, user_id=user_id, uid=uid, update_time=info.update_time
+            )
+        account_path = self.get_account_path(user_id, uid)
+        account_path.mkdir(parents=True, exist_ok=True)
+        old_files = []
+        for pool_name, items in info.item_list.items():
+            old = index.pools.get(pool_name, GachaLogPoolIndex())
+            if rewrite is None or pool_name not in rewrite:
+                if self.can_append(items, old):
+                    if old.count != len(items):
+                        index.pools[pool_name] = await self.append_pool(account_path, items, old)
+                    continue
+            index.pools[pool_name] = await self.rewrite_pool(account_path, pool_name, items, old)
+            if old.file:
+                old_files.append(account_path / old.file)
+        index.update_time = info.update_time
+        index.import_type = info.import_type
+        await self.save_index(index)
+        for path in old_files:
+            with contextlib.suppress(OSError):
+                path.unlink()
+        if manifest:
+            await self.update_manifest(user_id, uid, index)
+
+    async def migrate_legacy(self, user_id: str, uid: str) -> Optional[GachaLogIndex]:
+        """将旧版单文件格式转换为当前格式
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :return: 转换后的索引头
+        """
+        info = await self.load_legacy(user_id, uid)
+        if info is None:
+            return None
+        index = GachaLogIndex(
+            version=GACHA_LOG_STORAGE_VERSION,
+            user_id=user_id,
+            uid=uid,
+            update_time=info.update_time,
+            import_type=info.import_type,
+        )
+        account_path = self.get_account_path(user_id, uid)
+        account_path.mkdir(parents=True, exist_ok=True)
+        for pool_name, items in info.item_list.items():
+            index.pools[pool_name] = await self.rewrite_pool(account_path, pool_name, items, GachaLogPoolIndex())
+        await self.save_index(index)
+        for bak in (False, True):
+            with contextlib.suppress(OSError):
+                self.get_legacy_path(user_id, uid, bak).unlink(missing_ok=True)
+        await self.update_manifest(user_id, uid, index)
+        return index
+
+    async def migrate_layout(self) -> int:
+        """将旧版平铺在同一目录下的记录一次性转换为分片结构，已经转换过时直接返回
+        :return: 转换的账号数量
+        """
+        if self.get_layout_path().exists():
+            return 0
+        count = 0
+        for path in list(self.gacha_log_path.iterdir()):
+            name = path.name
+            if name.endswith("-zzzgf.json") or name.endswith(".tmp"):
+                # 导出文件与临时文件可以重新生成
+                with contextlib.suppress(OSError):
+                    path.unlink()
+                continue
+            if path.is_dir():
+                data = name.split("-")
+                if len(data) != 2 or not (path / self.INDEX_FILE).exists():
+                    continue
+                account_path = self.get_account_path(data[0], data[1])
+                if account_path.exists():
+                    continue
+                account_path.parent.mkdir(parents=True, exist_ok=True)
+                path.rename(account_path)
+                await self.update_manifest(data[0], data[1])
+            elif path.suffix == ".json":
+                data = path.stem.split("-")
+                if len(data) != 2:
+                    continue
+                try:
+                    await self.migrate_legacy(data[0], data[1])
+                except ValueError:
+                    continue
+            else:
+                continue
+            count += 1
+        await self.write_atomic(
+            self.get_layout_path(), jsonlib.dumps({"version": GACHA_LOG_LAYOUT_VERSION}).encode("utf-8")
+        )
+        return count
+
+    async def remove(self, user_id: str, uid: str) -> bool:
+        """删除调频记录
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :return: 是否删除成功
+        """
+        status = False
+        account_path = self.get_account_path(user_id, uid)
+        if account_path.exists():
+            try:
+                shutil.rmtree(account_path)
+                status = True
+            except PermissionError:
+                return False
+            await self.update_manifest(user_id, uid)
+        with contextlib.suppress(Exception):
+            self.get_export_path(user_id, uid).unlink(missing_ok=True)
+        with contextlib.suppress(Exception):
+            self.get_legacy_path(user_id, uid, bak=True).unlink(missing_ok=True)
+        legacy_path = self.get_legacy_path(user_id, uid)
+        if legacy_path.exists():
+            try:
+                legacy_path.unlink()
+                status = True
+            except PermissionError:
+                return False
+        return status
+
+    async def move(self, user_id: str, uid: str, new_user_id: str) -> bool:
+        """移动调频记录到新用户
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :param new_user_id: 新用户id
+        :return: 是否移动成功
+        """
+        if (not self.exists(user_id, uid)) or self.exists(new_user_id, uid):
+            return False
+        try:
+            account_path = self.get_account_path(user_id, uid)
+            if account_path.exists():
+                new_account_path = self.get_account_path(new_user_id, uid)
+                new_account_path.parent.mkdir(parents=True, exist_ok=True)
+                account_path.rename(new_account_path)
+                index = await self.load_index(new_user_id, uid)
+                index.user_id = new_user_id
+                await self.save_index(index)
+                await self.update_manifest(user_id, uid)
+                await self.update_manifest(new_user_id, uid, index)
+            else:
+                self.get_legacy_path(user_id, uid).rename(self.get_legacy_path(new_user_id, uid))
+            return True
+        except PermissionError:
+            return False
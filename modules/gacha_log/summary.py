@@ -0,0 +1,202 @@
+import datetime
+from abc import abstractmethod
+from typing import List, Optional, TYPE_CHECKING
+
+import aiofiles
+
+from modules.gacha_log.analytics import FIVE_STAR_POOLS, FOUR_STAR_TYPES, GachaLogColumns, build_pool_summary
+from modules.gacha_log.const import GACHA_LOG_SUMMARY_VERSION
+from modules.gacha_log.models import (
+    FiveStarItem,
+    FourStarItem,
+    GachaItem,
+    GachaLogInfo,
+    GachaLogPoolSummary,
+    GachaLogSummary,
+    GachaLogSummaryItem,
+)
+from modules.gacha_log.storage import GachaLogStorage
+
+try:
+    import ujson as jsonlib
+except ImportError:
+    import json as jsonlib
+
+if TYPE_CHECKING:
+    from core.dependence.assets import AssetsService
+
+
+class GachaLogSummaries:
+    """调频记录统计摘要
+
+    摘要保存在记录旁，包含每个卡池的保底计数、四星五星列表以及 UP 统计。
+    新记录合并后只需要从上次统计的位置继续计算，摘要版本变化时会完整重新生成一次。
+    """
+
+    storage: GachaLogStorage
+
+    @staticmethod
+    @abstractmethod
+    def check_avatar_up(name: str, gacha_time: datetime.datetime) -> bool:
+        """判断代理人是否为 UP 代理人"""
+
+    def build_pool_summary(self, pool_name: str, columns: GachaLogColumns) -> GachaLogPoolSummary:
+        """从列式数据一次性统计卡池摘要
+        :param pool_name: 卡池名称
+        :param columns: 列式数据
+        :return: 卡池摘要
+        """
+        return build_pool_summary(columns, pool_name, self.check_avatar_up)
+
+    def update_pool_summary(
+        self, pool_name: str, summary: GachaLogPoolSummary, items: List[GachaItem]
+    ) -> GachaLogPoolSummary:
+        """将新记录计入卡池摘要
+        :param pool_name: 卡池名称
+        :param summary: 卡池摘要
+        :param items: 该卡池按时间排序的全部记录，摘要中已经统计的部分需要是它的前缀
+        :return: 更新后的卡池摘要
+        """
+        if summary.total > len(items) or (summary.total and items[summary.total - 1].id != summary.last_id):
+            summary = GachaLogPoolSummary()
+        if summary.total == 0:
+            return self.build_pool_summary(pool_name, GachaLogColumns(items))
+        no_five_star, no_four_star = summary.no_five_star, summary.no_four_star
+        for item in items[summary.total :]:
+            no_five_star += 1
+            no_four_star += 1
+            if item.rank_type == "5":
+                matched = pool_name in FIVE_STAR_POOLS.get(item.item_type, ())
+                is_up, is_big = False, False
+                if item.item_type == "代理人" and pool_name == "代理人调频":
+                    is_up = self.check_avatar_up(item.name, item.time)
+                    is_big = (not summary.five[-1].isUp) if summary.five else False
+                if matched:
+                    summary.five.append(
+                        GachaLogSummaryItem.construct(
+                            name=item.name,
+                            type=item.item_type,
+                            count=no_five_star,
+                            isUp=is_up,
+                            isBig=is_big,
+                            time=item.time,
+                        )
+                    )
+                    summary.five_star_up += int(is_up)
+                    summary.five_star_big += int(is_big)
+                no_five_star = 0
+            if item.rank_type == "4":
+                if item.item_type not in FOUR_STAR_TYPES:
+                    no_four_star = 0
+                    continue
+                summary.four.append(
+                    GachaLogSummaryItem.construct(
+                        name=item.name, type=item.item_type, count=no_four_star, isUp=False, isBig=False, time=item.time
+                    )
+                )
+                no_four_star = 0
+        summary.no_five_star, summary.no_four_star = no_five_star, no_four_star
+        if items:
+            summary.total = len(items)
+            summary.last_id = items[-1].id
+            summary.start_time = items[0].time
+            summary.end_time = items[-1].time
+        return summary
+
+    @staticmethod
+    def get_summary_icon(item: GachaLogSummaryItem, assets: Optional["AssetsService"]) -> str:
+        if not assets:
+            return ""
+        if item.type == "代理人":
+            return assets.avatar.normal(item.name).as_uri()
+        if item.type == "音擎":
+            return assets.weapon.icon(item.name).as_uri()
+        return assets.buddy.icon(item.name).as_uri()
+
+    def get_summary_5_star_items(
+        self, summary: GachaLogPoolSummary, assets: Optional["AssetsService"]
+    ) -> List[FiveStarItem]:
+        """从摘要获取五星列表，顺序与 get_all_5_star_items 相同"""
+        return [
+            FiveStarItem.construct(
+                name=i.name,
+                icon=self.get_summary_icon(i, assets),
+                count=i.count,
+                type=i.type,
+                isUp=i.isUp,
+                isBig=i.isBig,
+                time=i.time,
+            )
+            for i in reversed(summary.five)
+        ]
+
+    def get_summary_4_star_items(
+        self, summary: GachaLogPoolSummary, assets: Optional["AssetsService"]
+    ) -> List[FourStarItem]:
+        """从摘要获取四星列表，顺序与 get_all_4_star_items 相同"""
+        return [
+            FourStarItem.construct(
+                name=i.name, icon=self.get_summary_icon(i, assets), count=i.count, type=i.type, time=i.time
+            )
+            for i in reversed(summary.four)
+        ]
+
+    async def load_summary(self, user_id: str, uid: str) -> Optional[GachaLogSummary]:
+        """读取统计摘要，版本不一致时视为不存在
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :return: 统计摘要
+        """
+        path = self.storage.get_summary_path(user_id, uid)
+        if not path.exists():
+            return None
+        try:
+            async with aiofiles.open(path, "rb") as f:
+                summary = GachaLogSummary.parse_obj(jsonlib.loads(await f.read()))
+        except ValueError:
+            return None
+        if summary.version != GACHA_LOG_SUMMARY_VERSION:
+            return None
+        return summary
+
+    async def save_summary(self, user_id: str, uid: str, summary: GachaLogSummary):
+        summary.version = GACHA_LOG_SUMMARY_VERSION
+        await self.storage.write_atomic(self.storage.get_summary_path(user_id, uid), summary.json().encode("utf-8"))
+
+    async def update_summary(self, gacha_log: GachaLogInfo) -> Optional[GachaLogSummary]:
+        """记录保存后增量更新统计摘要
+        :param gacha_log: 已保存的调频记录
+        :return: 统计摘要
+        """
+        user_id, uid = gacha_log.user_id, gacha_log.uid
+        if not self.storage.get_account_path(user_id, uid).exists():
+            return None
+        summary = await self.load_summary(user_id, uid) or GachaLogSummary()
+        for pool_name, items in gacha_log.item_list.items():
+            summary.pools[pool_name] = self.update_pool_summary(
+                pool_name, summary.pools.get(pool_name, GachaLogPoolSummary()), items
+            )
+        await self.save_summary(user_id, uid, summary)
+        return summary
+
+    async def get_pool_summary(self, user_id: str, uid: str, pool_name: str) -> Optional[GachaLogPoolSummary]:
+        """获取卡池统计摘要，摘要与记录不一致时在内存中重新统计
+
+        读取时不写入摘要，摘要只在保存记录时与运气分布一起更新
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :param pool_name: 卡池名称
+        :return: 卡池统计摘要，记录不是当前存储格式时返回 None
+        """
+        index = await self.storage.load_index(user_id, uid)
+        if index is None:
+            return None
+        pool_index = index.pools.get(pool_name)
+        summary = await self.load_summary(user_id, uid) or GachaLogSummary()
+        pool_summary = summary.pools.get(pool_name, GachaLogPoolSummary())
+        if pool_index is None:
+            return pool_summary
+        if pool_summary.total == pool_index.count and pool_summary.last_id == pool_index.last_id:
+            return pool_summary
+        items = await self.storage.load_pool(user_id, uid, pool_index)
+        return self.update_pool_summary(pool_name, pool_summary, items)
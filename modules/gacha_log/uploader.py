@@ -0,0 +1,125 @@
+import asyncio
+import uuid
+import zlib
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Dict, Optional, Union
+
+import aiofiles
+import httpx
+
+GachaLogUploadSource = Union[bytes, Path, AsyncIterable[bytes]]
+
+
+class GachaLogUploader:
+    """调频记录上传
+
+    所有上传共用一个长期存在的客户端，连接池中的连接会被复用，不需要每次上传都重新握手。
+    请求体按块流式生成，文件通过 aiofiles 读取，可选使用 gzip 压缩整个请求体，同时上传的数量受信号量限制。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        chunk_size: int = 64 * 1024,
+        compress: bool = False,
+        timeout: float = 60.0,
+    ):
+        """
+        :param max_concurrency: 同时上传的最大数量
+        :param chunk_size: 读取文件与生成请求体的块大小
+        :param compress: 是否使用 gzip 压缩请求体，需要服务端支持 Content-Encoding
+        :param timeout: 请求超时时间
+        """
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client: Optional[httpx.AsyncClient] = None
+        self.uploads = 0
+        self.bytes_read = 0
+        self.bytes_sent = 0
+
+    def get_client(self) -> httpx.AsyncClient:
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency
+                ),
+            )
+        return self.client
+
+    async def close(self):
+        if self.client is not None and not self.client.is_closed:
+            await self.client.aclose()
+        self.client = None
+
+    async def iter_source(self, source: GachaLogUploadSource) -> AsyncIterator[bytes]:
+        """按块读取上传内容"""
+        if isinstance(source, bytes):
+            for start in range(0, len(source), self.chunk_size):
+                yield source[start : start + self.chunk_size]
+        elif isinstance(source, Path):
+            async with aiofiles.open(source, "rb") as f:
+                while chunk := await f.read(self.chunk_size):
+                    yield chunk
+        else:
+            async for chunk in source:
+                yield chunk
+
+    @staticmethod
+    def get_part_header(boundary: str, name: str, filename: Optional[str] = None) -> bytes:
+        disposition = f'form-data; name="{name}"'
+        if filename is None:
+            return f"--{boundary}\r\nContent-Disposition: {disposition}\r\n\r\n".encode("utf-8")
+        disposition += f'; filename="{filename}"'
+        header = f"--{boundary}\r\nContent-Disposition: {disposition}\r\nContent-Type: application/json\r\n\r\n"
+        return header.encode("utf-8")
+
+    async def iter_multipart(
+        self, boundary: str, fields: Dict[str, str], filename: str, source: GachaLogUploadSource
+    ) -> AsyncIterator[bytes]:
+        """生成 multipart/form-data 请求体，文件部分按块输出"""
+        for name, value in fields.items():
+            yield self.get_part_header(boundary, name) + str(value).encode("utf-8") + b"\r\n"
+        yield self.get_part_header(boundary, "file", filename)
+        async for chunk in self.iter_source(source):
+            self.bytes_read += len(chunk)
+            yield chunk
+        yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    async def iter_body(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """按需压缩请求体并统计发送的字节数"""
+        compressor = zlib.compressobj(wbits=31) if self.compress else None
+        async for chunk in chunks:
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                self.bytes_sent += len(chunk)
+                yield chunk
+        if compressor is not None:
+            chunk = compressor.flush()
+            self.bytes_sent += len(chunk)
+            yield chunk
+
+    async def upload(
+        self, url: Union[str, httpx.URL], fields: Dict[str, str], filename: str, source: GachaLogUploadSource
+    ) -> httpx.Response:
+        """上传文件
+        :param url: 上传地址
+        :param fields: 表单字段
+        :param filename: 文件名
+        :param source: 文件内容，可以是 bytes、文件路径或异步迭代器
+        :return: 服务端响应，状态码不为 2xx 时抛出 httpx.HTTPStatusError
+        """
+        async with self.semaphore:
+            boundary = uuid.uuid4().hex
+            headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+            if self.compress:
+                headers["Content-Encoding"] = "gzip"
+            body = self.iter_body(self.iter_multipart(boundary, fields, filename, source))
+            response = await self.get_client().post(url, content=body, headers=headers)
+            response.raise_for_status()
+            self.uploads += 1
+            return response
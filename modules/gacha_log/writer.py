@@ -0,0 +1,161 @@
+import asyncio
+import contextlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from modules.gacha_log.models import GachaLogInfo
+
+# 账号写入锁，同一进程内所有 GachaLog 实例共享，没有协程使用时会被删除
+WRITE_LOCKS: Dict[str, List[Any]] = {}
+
+
+class GachaLogUpdate:
+    """单次修改的结果"""
+
+    __slots__ = ("value", "changed", "rewrite")
+
+    def __init__(self, value: Any = None, changed: bool = True, rewrite: Optional[Set[str]] = None):
+        """
+        :param value: 返回给调用方的值
+        :param changed: 是否修改了记录
+        :param rewrite: 旧记录被修改过、需要完整重写的卡池
+        """
+        self.value = value
+        self.changed = changed
+        self.rewrite = rewrite or set()
+
+
+GachaLogMutation = Callable[[GachaLogInfo], Awaitable[GachaLogUpdate]]
+
+
+class GachaLogWriteBatch:
+    __slots__ = ("mutations", "task")
+
+    def __init__(self):
+        self.mutations: List[Tuple[GachaLogMutation, asyncio.Future]] = []
+        self.task: Optional[asyncio.Task] = None
+
+
+class GachaLogWriteCoordinator:
+    """调频记录写入协调
+
+    同一账号的修改串行执行，等待写入期间到达的修改会合并为一批：只读取一次记录，依次应用每个修改后只写入一次。
+    修改只允许向卡池追加记录或补全旧记录的字段，失败的修改会被撤销，不影响同一批中的其他修改。
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str, str], Awaitable[GachaLogInfo]],
+        save: Callable[[str, str, GachaLogInfo, Set[str]], Awaitable[Any]],
+        namespace: str = "",
+        window: float = 0.1,
+    ):
+        """
+        :param load: 读取记录
+        :param save: 保存记录
+        :param namespace: 写入锁的命名空间，通常为记录目录
+        :param window: 合并窗口，第一个修改到达后等待的时间
+        """
+        self.load = load
+        self.save = save
+        self.namespace = namespace
+        self.window = window
+        self.batches: Dict[str, GachaLogWriteBatch] = {}
+        self.requests = 0
+        self.writes = 0
+
+    @property
+    def writes_saved(self) -> int:
+        """合并后节省的写入次数"""
+        return self.requests - self.writes
+
+    def text(self) -> str:
+        return f"修改 {self.requests} 写入 {self.writes} 合并节省 {self.writes_saved} 等待写入 {len(self.batches)}"
+
+    @contextlib.asynccontextmanager
+    async def lock(self, user_id: str, uid: str) -> AsyncIterator[None]:
+        """获取账号写入锁，移动、删除记录时也需要持有"""
+        key = f"{self.namespace}/{user_id}-{uid}"
+        entry = WRITE_LOCKS.get(key)
+        if entry is None:
+            entry = WRITE_LOCKS[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                WRITE_LOCKS.pop(key, None)
+
+    async def update(self, user_id: str, uid: str, mutation: GachaLogMutation) -> Any:
+        """提交一次修改并等待写入完成
+        :param user_id: 用户id
+        :param uid: 玩家uid
+        :param mutation: 修改函数，接收读取到的记录
+        :return: 修改函数返回的值
+        """
+        self.requests += 1
+        key = f"{user_id}-{uid}"
+        batch = self.batches.get(key)
+        if batch is None:
+            batch = self.batches[key] = GachaLogWriteBatch()
+            batch.task = asyncio.create_task(self.flush(user_id, uid, batch))
+        future = asyncio.get_running_loop().create_future()
+        batch.mutations.append((mutation, future))
+        return await future
+
+    @staticmethod
+    def rollback(gacha_log: GachaLogInfo, snapshot: Dict[str, int]):
+        for pool_name in list(gacha_log.item_list.keys()):
+            if pool_name not in snapshot:
+                del gacha_log.item_list[pool_name]
+            else:
+                del gacha_log.item_list[pool_name][snapshot[pool_name] :]
+
+    async def flush(self, user_id: str, uid: str, batch: GachaLogWriteBatch):
+        if self.window:
+            await asyncio.sleep(self.window)
+        async with self.lock(user_id, uid):
+            # 获取到锁之后不再接受新的修改，之后到达的修改进入下一批
+            if self.batches.get(f"{user_id}-{uid}") is batch:
+                del self.batches[f"{user_id}-{uid}"]
+            mutations = [(m, f) for m, f in batch.mutations if not f.done()]
+            if not mutations:
+                return
+            try:
+                gacha_log = await self.load(user_id, uid)
+            except Exception as exc:  # pylint: disable=W0703
+                for _, future in mutations:
+                    if not future.done():
+                        future.set_exception(exc)
+                return
+            results = []
+            changed, rewrite = False, set()
+            for mutation, future in mutations:
+                snapshot = {k: len(v) for k, v in gacha_log.item_list.items()}
+                try:
+                    result = await mutation(gacha_log)
+                except Exception as exc:  # pylint: disable=W0703
+                    self.rollback(gacha_log, snapshot)
+                    if not future.done():
+                        future.set_exception(exc)
+                    continue
+                if result.changed:
+                    changed = True
+                    rewrite |= result.rewrite
+                    for pool_name, items in gacha_log.item_list.items():
+                        if len(items) != snapshot.get(pool_name, 0):
+                            items.sort(key=lambda x: (x.time, x.id))
+                results.append((future, result.value))
+            if changed:
+                try:
+                    await self.save(user_id, uid, gacha_log, rewrite)
+                except Exception as exc:  # pylint: disable=W0703
+                    for future, _ in results:
+                        if not future.done():
+                            future.set_exception(exc)
+                    return
+                self.writes += 1
+            for future, value in results:
+                if not future.done():
+                    future.set_result(value)
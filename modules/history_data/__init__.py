@@ -0,0 +1 @@
+"""历史记录"""
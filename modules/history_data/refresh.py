@@ -0,0 +1,184 @@
+"""历史记录批量刷新"""
+
+import asyncio
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, Optional, TypeVar
+
+from modules.ratelimit.bucket import TokenBucket
+
+try:
+    import ujson as jsonlib
+except ImportError:
+    import json as jsonlib
+
+if TYPE_CHECKING:
+    from simnet.models.zzz.chronicle.challenge import ZZZChallenge
+    from simnet.models.zzz.diary import ZZZDiary
+
+T = TypeVar("T")
+
+
+def get_fingerprint(data_id: int, content: Any) -> str:
+    """数据的指纹，由 data_id 与内容的哈希组成"""
+    data = jsonlib.dumps(content, sort_keys=True, ensure_ascii=False)
+    return f"{data_id}:{hashlib.sha1(data.encode()).hexdigest()}"  # nosec
+
+
+class HistoryFingerprintStore(ABC):
+    """已经保存的数据的指纹"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """获取指纹"""
+
+    @abstractmethod
+    async def set(self, key: str, value: str):
+        """保存指纹"""
+
+
+class HistoryFingerprintMemory(HistoryFingerprintStore):
+    def __init__(self):
+        self.data: Dict[str, str] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        return self.data.get(key)
+
+    async def set(self, key: str, value: str):
+        self.data[key] = value
+
+
+class HistoryRefreshMetrics:
+    """刷新的统计数据"""
+
+    __slots__ = ("users", "failed", "fetched", "skipped", "db_reads", "saved", "start", "end")
+
+    def __init__(self):
+        self.users = 0
+        self.failed = 0
+        # 请求接口的次数
+        self.fetched = 0
+        # 指纹未变化而跳过数据库的次数
+        self.skipped = 0
+        self.db_reads = 0
+        self.saved = 0
+        self.start = time.monotonic()
+        self.end: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end or time.monotonic()) - self.start
+
+    def text(self) -> str:
+        return (
+            f"用户 {self.users} 失败 {self.failed} 请求 {self.fetched} 跳过 {self.skipped} "
+            f"读取数据库 {self.db_reads} 保存 {self.saved} 耗时 {self.elapsed:.1f}s"
+        )
+
+
+class HistoryRefresher:
+    """历史记录批量刷新
+
+    多个用户并发刷新，每个接口的请求速率由令牌桶限制。每次获取的数据计算指纹并与上次保存的指纹比较，
+    没有变化时不再读取数据库。已经结束的月份的绳网月报不会再变化，保存过后不再请求。
+    """
+
+    def __init__(self, store: HistoryFingerprintStore, rates: Dict[str, float], concurrency: int = 8):
+        """
+        :param store: 指纹存储
+        :param rates: 每个接口每秒允许的请求数
+        :param concurrency: 同时刷新的用户数量
+        """
+        self.store = store
+        self.buckets = {endpoint: TokenBucket(rate) for endpoint, rate in rates.items()}
+        self.concurrency = concurrency
+        self.metrics = HistoryRefreshMetrics()
+
+    async def fetch(self, endpoint: str, func: Callable[[], Awaitable[T]]) -> T:
+        """按接口的速率限制请求"""
+        bucket = self.buckets.get(endpoint)
+        if bucket is not None:
+            await bucket.acquire()
+        self.metrics.fetched += 1
+        return await func()
+
+    async def save_abyss_data(
+        self,
+        service,
+        uid: int,
+        fetch: Callable[[], Awaitable["ZZZChallenge"]],
+        save: Callable[["ZZZChallenge"], Awaitable[bool]],
+    ) -> bool:
+        """获取防卫战记录，指纹变化时才交给 save 比较并保存
+        :param service: HistoryDataAbyssServices，用于生成指纹
+        :param uid: 玩家uid
+        :param fetch: 获取本期防卫战记录
+        :param save: 与数据库比较并保存，通常为 ChallengePlugin.save_abyss_data
+        :return: 是否保存了新的记录
+        """
+        abyss_data = await self.fetch("challenge", fetch)
+        if not abyss_data.has_data:
+            return False
+        model = service.create(uid, abyss_data)
+        key = f"abyss:{uid}"
+        fingerprint = get_fingerprint(model.data_id, model.data.get("abyss_data", {}).get("all_floor_detail"))
+        if await self.store.get(key) == fingerprint:
+            self.metrics.skipped += 1
+            return False
+        self.metrics.db_reads += 1
+        saved = await save(abyss_data)
+        if saved:
+            self.metrics.saved += 1
+        await self.store.set(key, fingerprint)
+        return saved
+
+    async def save_ledger_data(
+        self,
+        uid: int,
+        month: str,
+        fetch: Callable[[], Awaitable["ZZZDiary"]],
+        save: Callable[["ZZZDiary"], Awaitable[bool]],
+    ) -> bool:
+        """获取已经结束的月份的绳网月报，保存过的月份不再请求
+        :param uid: 玩家uid
+        :param month: 月份，如 202401
+        :param fetch: 获取该月份的绳网月报
+        :param save: 与数据库比较并保存，通常为 LedgerPlugin.save_ledger_data
+        :return: 是否保存了新的记录
+        """
+        key = f"ledger:{uid}:{month}"
+        if await self.store.get(key):
+            self.metrics.skipped += 1
+            return False
+        diary = await self.fetch("ledger", fetch)
+        # 本月的月报还会变化，不记录指纹
+        if int(diary.current_month) == diary.month:
+            return False
+        self.metrics.db_reads += 1
+        saved = await save(diary)
+        if saved:
+            self.metrics.saved += 1
+        await self.store.set(key, month)
+        return saved
+
+    async def run(self, items: Iterable[T], func: Callable[[T], Awaitable[Any]]) -> HistoryRefreshMetrics:
+        """并发刷新，同时刷新的数量不超过 concurrency
+        :param items: 需要刷新的用户
+        :param func: 刷新单个用户，发生的错误只计入 failed
+        :return: 统计数据
+        """
+        self.metrics = HistoryRefreshMetrics()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _run(item: T):
+            async with semaphore:
+                self.metrics.users += 1
+                try:
+                    await func(item)
+                except Exception:  # pylint: disable=W0703
+                    self.metrics.failed += 1
+
+        await asyncio.gather(*[_run(item) for item in items])
+        self.metrics.end = time.monotonic()
+        return self.metrics
@@ -0,0 +1 @@
+"""消息推送"""
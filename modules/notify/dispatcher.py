@@ -0,0 +1,318 @@
+"""消息推送队列"""
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from telegram.error import BadRequest, RetryAfter
+
+from modules.notify.logger import logger
+from modules.ratelimit.bucket import TokenBucket
+
+NotifyCallback = Callable[[Optional[Exception]], Awaitable[Any]]
+# Telegram 单条消息的最大长度
+MAX_MESSAGE_LENGTH = 4096
+
+
+def get_retry_after(exc: RetryAfter) -> float:
+    retry_after = exc.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class Notification:
+    """等待发送的消息，同一个会话中 key 相同的多条消息会合并为一条"""
+
+    __slots__ = ("chat_id", "parse_mode", "key", "texts", "callbacks", "length", "created", "retries")
+
+    def __init__(self, chat_id: int, parse_mode: Optional[str] = None, key: Optional[str] = None):
+        self.chat_id = chat_id
+        self.parse_mode = parse_mode
+        self.key = key
+        # 合并的每条消息与对应的回调
+        self.texts: List[str] = []
+        self.callbacks: List[Optional[NotifyCallback]] = []
+        self.length = 0
+        self.created = time.monotonic()
+        self.retries = 0
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(self.texts)
+
+    @property
+    def count(self) -> int:
+        """合并的消息数量"""
+        return len(self.texts)
+
+    def add(self, text: str, callback: Optional[NotifyCallback]):
+        self.length += len(text) + (2 if self.texts else 0)
+        self.texts.append(text)
+        self.callbacks.append(callback)
+
+    def split(self) -> List["Notification"]:
+        """拆分为单独发送的消息，拆分后的消息不再合并"""
+        result = []
+        for text, callback in zip(self.texts, self.callbacks):
+            notification = Notification(self.chat_id, self.parse_mode)
+            notification.add(text, callback)
+            notification.created = self.created
+            result.append(notification)
+        return result
+
+
+class NotifyMetrics:
+    """推送的统计数据"""
+
+    __slots__ = ("depth", "queued", "coalesced", "split", "sent", "failed", "retries", "latency_total", "latency_max")
+
+    def __init__(self):
+        # 队列中等待发送的消息数量
+        self.depth = 0
+        self.queued = 0
+        self.coalesced = 0
+        # 发送失败后拆分的合并消息数量
+        self.split = 0
+        # 实际发送的消息数量，合并后的消息只计算一次
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def latency(self) -> float:
+        """平均延迟"""
+        done = self.sent + self.failed
+        return self.latency_total / done if done else 0.0
+
+    def text(self) -> str:
+        return (
+            f"队列 {self.depth} 入队 {self.queued} 合并 {self.coalesced} 拆分 {self.split} "
+            f"发送 {self.sent} 失败 {self.failed} 重试 {self.retries} 平均延迟 {self.latency:.2f}s 最大延迟 {self.latency_max:.2f}s"
+        )
+
+
+class NotifyDispatcher:
+    """消息推送队列
+
+    生产者调用 notify 后立即返回，消息由后台的 workers 发送。全局发送速率与每个会话的发送速率由令牌桶限制，
+    同一个会话中尚未发送且 key 相同的消息会合并为一条，合并后的消息遇到 BadRequest 时拆分后逐条重新发送，
+    错误只交给对应消息的回调。遇到 RetryAfter 时暂停全局令牌桶，消息放回队列稍后重试。
+    """
+
+    def __init__(
+        self,
+        send: Callable[[int, str, Optional[str]], Awaitable[Any]],
+        global_rate: float = 25,
+        chat_rate: float = 1,
+        group_rate: float = 1 / 3,
+        workers: int = 8,
+        max_retries: int = 3,
+        max_length: int = MAX_MESSAGE_LENGTH,
+    ):
+        """
+        :param send: 发送消息，参数为 chat_id text parse_mode
+        :param global_rate: 每秒发送的消息数量
+        :param chat_rate: 每个私聊每秒发送的消息数量
+        :param group_rate: 每个群组每秒发送的消息数量
+        :param workers: 同时发送的消息数量
+        :param max_retries: 遇到 RetryAfter 时最多重试的次数
+        :param max_length: 合并后消息的最大长度
+        """
+        self.send = send
+        self.bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.workers = workers
+        self.max_retries = max_retries
+        self.max_length = max_length
+        self.metrics = NotifyMetrics()
+        self.pending: Dict[int, Deque[Notification]] = {}
+        # 等待发送的会话，按照可以发送的时间排序
+        self.ready: List[Tuple[float, int, int]] = []
+        # 在 ready 中或正在发送的会话
+        self.scheduled: Set[int] = set()
+        # 每个会话下一次可以发送的时间
+        self.chat_next: Dict[int, float] = {}
+        self.counter = itertools.count()
+        self.queue: Optional[asyncio.Queue] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.empty: Optional[asyncio.Event] = None
+        self.tasks: List[asyncio.Task] = []
+
+    def get_interval(self, chat_id: int) -> float:
+        return 1 / (self.group_rate if chat_id < 0 else self.chat_rate)
+
+    def get_events(self) -> Tuple[asyncio.Event, asyncio.Event]:
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+            self.empty = asyncio.Event()
+            self.empty.set()
+        return self.wakeup, self.empty
+
+    def push(self, chat_id: int, when: float):
+        heapq.heappush(self.ready, (when, next(self.counter), chat_id))
+        self.scheduled.add(chat_id)
+        self.get_events()[0].set()
+
+    def notify(
+        self,
+        chat_id: int,
+        text: str,
+        parse_mode: Optional[str] = None,
+        callback: Optional[NotifyCallback] = None,
+        key: Optional[str] = None,
+    ):
+        """加入发送队列，不等待发送完成
+        :param chat_id: 会话ID
+        :param text: 消息内容
+        :param parse_mode: 解析模式，只有解析模式相同的消息会合并
+        :param callback: 发送完成后调用，参数为发送失败时的错误
+        :param key: 合并的分组，通常为生产者的名称，为空时不合并
+        """
+        _, empty = self.get_events()
+        self.metrics.queued += 1
+        self.metrics.depth += 1
+        empty.clear()
+        queue = self.pending.setdefault(chat_id, deque())
+        last = queue[-1] if queue else None
+        if (
+            key is not None
+            and last is not None
+            and last.key == key
+            and last.parse_mode == parse_mode
+            and last.length + len(text) + 2 <= self.max_length
+        ):
+            self.metrics.coalesced += 1
+        else:
+            last = Notification(chat_id, parse_mode, key)
+            queue.append(last)
+        last.add(text, callback)
+        if chat_id not in self.scheduled:
+            self.push(chat_id, max(time.monotonic(), self.chat_next.get(chat_id, 0)))
+
+    def release(self, chat_id: int, when: float):
+        """会话发送完成，还有消息时重新加入等待"""
+        self.chat_next[chat_id] = when
+        if self.pending.get(chat_id):
+            self.push(chat_id, when)
+            return
+        self.pending.pop(chat_id, None)
+        self.scheduled.discard(chat_id)
+
+    def prune(self, now: float):
+        """清理已经可以发送的会话的限速记录"""
+        self.chat_next = {chat_id: when for chat_id, when in self.chat_next.items() if when > now}
+
+    async def finish(self, notification: Notification, error: Optional[Exception]):
+        metrics = self.metrics
+        latency = time.monotonic() - notification.created
+        metrics.depth -= notification.count
+        metrics.latency_total += latency
+        metrics.latency_max = max(metrics.latency_max, latency)
+        if error is None:
+            metrics.sent += 1
+        else:
+            metrics.failed += 1
+        for callback in notification.callbacks:
+            if callback is None:
+                continue
+            try:
+                await callback(error)
+            except Exception as exc:  # pylint: disable=W0703
+                logger.error("推送消息回调执行失败 chat_id[%s]", notification.chat_id, exc_info=exc)
+        if metrics.depth == 0:
+            self.get_events()[1].set()
+
+    async def deliver(self, chat_id: int):
+        notification = self.pending[chat_id].popleft()
+        await self.bucket.acquire()
+        error = None
+        try:
+            await self.send(chat_id, notification.text, notification.parse_mode)
+        except RetryAfter as exc:
+            if notification.retries < self.max_retries:
+                seconds = get_retry_after(exc)
+                notification.retries += 1
+                self.metrics.retries += 1
+                # Telegram 的限流作用于整个 Bot
+                self.bucket.pause(seconds)
+                self.pending[chat_id].appendleft(notification)
+                self.release(chat_id, time.monotonic() + seconds)
+                return
+            error = exc
+        except BadRequest as exc:
+            if notification.count > 1:
+                # 合并的消息中可能只有一条格式错误，拆分后逐条发送
+                self.metrics.split += 1
+                self.pending[chat_id].extendleft(reversed(notification.split()))
+                self.release(chat_id, time.monotonic())
+                return
+            error = exc
+        except Exception as exc:  # pylint: disable=W0703
+            error = exc
+        self.release(chat_id, time.monotonic() + self.get_interval(chat_id))
+        await self.finish(notification, error)
+
+    async def schedule(self):
+        """把到达发送时间的会话交给 workers"""
+        wakeup, _ = self.get_events()
+        while True:
+            wakeup.clear()
+            now = time.monotonic()
+            while self.ready and self.ready[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self.ready)
+                self.queue.put_nowait(chat_id)
+            if not self.ready:
+                self.prune(now)
+            timeout = self.ready[0][0] - now if self.ready else None
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def work(self):
+        while True:
+            chat_id = await self.queue.get()
+            try:
+                await self.deliver(chat_id)
+            finally:
+                self.queue.task_done()
+
+    def start(self):
+        """启动后台发送"""
+        if self.tasks:
+            return
+        self.get_events()
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self.schedule())]
+        self.tasks.extend(asyncio.create_task(self.work()) for _ in range(self.workers))
+
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """等待队列中的消息全部发送
+        :param timeout: 最长等待时间
+        :return: 是否全部发送
+        """
+        _, empty = self.get_events()
+        try:
+            await asyncio.wait_for(empty.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def stop(self, timeout: Optional[float] = None):
+        """等待发送完成后停止
+        :param timeout: 最长等待时间，超时后未发送的消息将被丢弃
+        """
+        if self.tasks:
+            await self.join(timeout)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
@@ -0,0 +1,124 @@
+import asyncio
+from typing import List, Optional, Set
+
+from simnet import GenshinClient
+from simnet.models.genshin.transaction import BaseTransaction, TransactionKind
+
+from modules.pay_log.models import PayLog as PayLogModel, PayLogIndex
+
+
+class PayLogFetcher:
+    """充值记录增量同步
+
+    从最新的记录开始向前翻页，遇到第一条本地已保存的记录时停止，已保存的记录 id 使用集合判断。
+    新记录与旧记录都按时间从新到旧排列，合并时只需要线性归并一次。
+    """
+
+    def __init__(self, page_size: int = 20, page_delay: float = 0.5):
+        """
+        :param page_size: 每页记录数，返回的记录少于该数量时视为最后一页
+        :param page_delay: 两次翻页之间的间隔
+        """
+        self.page_size = page_size
+        self.page_delay = page_delay
+        self.requests = 0
+
+    async def fetch(self, client: GenshinClient, authkey: str, known_ids: Set[int]) -> List[BaseTransaction]:
+        """获取本地没有的新记录
+        :param client: 客户端
+        :param authkey: authkey
+        :param known_ids: 本地已保存的记录 id
+        :return: 新记录，按时间从新到旧排列
+        """
+        result = []
+        end_id = 0
+        while True:
+            self.requests += 1
+            page = await client.transaction_log(authkey=authkey, kind=TransactionKind.CRYSTAL.value, end_id=end_id)
+            for data in page:
+                if data.id in known_ids:
+                    return result
+                result.append(data)
+            if len(page) < self.page_size:
+                break
+            end_id = page[-1].id
+            await asyncio.sleep(self.page_delay)
+        return result
+
+    @staticmethod
+    def merge(old: List[BaseTransaction], new: List[BaseTransaction]) -> List[BaseTransaction]:
+        """合并两个按时间从新到旧排列的记录列表"""
+        result = []
+        i = j = 0
+        while i < len(old) and j < len(new):
+            if (new[j].time, new[j].id) > (old[i].time, old[i].id):
+                result.append(new[j])
+                j += 1
+            else:
+                result.append(old[i])
+                i += 1
+        result.extend(old[i:])
+        result.extend(new[j:])
+        return result
+
+    @staticmethod
+    def merge_ids(old: List[int], new: List[int]) -> List[int]:
+        """合并两个从大到小排列的 id 列表"""
+        result = []
+        i = j = 0
+        while i < len(old) and j < len(new):
+            if new[j] > old[i]:
+                result.append(new[j])
+                j += 1
+            else:
+                result.append(old[i])
+                i += 1
+        result.extend(old[i:])
+        result.extend(new[j:])
+        return result
+
+    @staticmethod
+    def build_index(pay_log: PayLogModel) -> PayLogIndex:
+        """从记录重新生成索引"""
+        ids = sorted((i.id for i in pay_log.list), reverse=True)
+        latest = max(pay_log.list, key=lambda x: (x.time, x.id), default=None)
+        return PayLogIndex(
+            last_id=latest.id if latest else 0,
+            last_time=latest.time if latest else None,
+            ids=ids,
+        )
+
+    @staticmethod
+    def check_index(pay_log: PayLogModel, index: Optional[PayLogIndex]) -> bool:
+        """检查索引是否与记录一致"""
+        if index is None or len(index.ids) != len(pay_log.list):
+            return False
+        if not pay_log.list:
+            return True
+        return index.last_id == pay_log.list[0].id
+
+    async def sync(
+        self, client: GenshinClient, authkey: str, pay_log: PayLogModel, index: PayLogIndex
+    ) -> List[BaseTransaction]:
+        """同步新记录并合并到本地记录中
+        :param client: 客户端
+        :param authkey: authkey
+        :param pay_log: 本地记录，按时间从新到旧排列
+        :param index: 本地记录的索引，会被同步更新
+        :return: 新记录，按时间从新到旧排列
+        """
+        known_ids = set(index.ids)
+        new = []
+        for data in await self.fetch(client, authkey, known_ids):
+            # 翻页期间产生新记录时，同一条记录可能出现在相邻的两页中
+            if data.id not in known_ids:
+                known_ids.add(data.id)
+                new.append(data)
+        if not new:
+            return new
+        new.sort(key=lambda x: (x.time, x.id), reverse=True)
+        pay_log.list = self.merge(pay_log.list, new)
+        index.ids = self.merge_ids(index.ids, sorted((i.id for i in new), reverse=True))
+        index.last_id = pay_log.list[0].id
+        index.last_time = pay_log.list[0].time
+        return new
@@ -1,15 +1,18 @@
 import contextlib
+import os
+import uuid
 from pathlib import Path
 from typing import Tuple, Optional, List, Dict
 
 import aiofiles
 from simnet import GenshinClient, Region
 from simnet.errors import AuthkeyTimeout, InvalidAuthkey
-from simnet.models.genshin.transaction import TransactionKind, BaseTransaction
 from simnet.utils.player import recognize_genshin_server
 
 from modules.pay_log.error import PayLogAuthkeyTimeout, PayLogInvalidAuthkey, PayLogNotFound
-from modules.pay_log.models import PayLog as PayLogModel, BaseInfo
+from modules.pay_log.fetcher import PayLogFetcher
+from modules.pay_log.models import PayLog as PayLogModel, BaseInfo, PayLogIndex, PayLogRollup
+from modules.pay_log.rollup import PayLogRollups
 from utils.const import PROJECT_ROOT
 from utils.uid import mask_number
 
@@ -27,6 +30,7 @@ PAY_LOG_PATH.mkdir(parents=True, exist_ok=True)
 class PayLog:
     def __init__(self, pay_log_path: Path = PAY_LOG_PATH):
         self.pay_log_path = pay_log_path
+        self.fetcher = PayLogFetcher()
 
     @staticmethod
     async def load_json(path):
@@ -52,6 +56,89 @@ class PayLog:
         """
         return self.pay_log_path / f"{user_id}-{uid}.json{'.bak' if bak else ''}"
 
+    def get_index_path(self, user_id: str, uid: str) -> Path:
+        """获取索引文件路径
+        :param user_id: 用户 ID
+        :param uid: UID
+        :return: 文件路径
+        """
+        return self.pay_log_path / f"{user_id}-{uid}.index.json"
+
+    async def load_index(self, user_id: str, uid: str, pay_log: PayLogModel) -> PayLogIndex:
+        """读取记录索引，索引不存在或与记录不一致时重新生成
+        :param user_id: 用户id
+        :param uid: 原神uid
+        :param pay_log: 记录数据
+        :return: 记录索引
+        """
+        index = None
+        file_path = self.get_index_path(user_id, uid)
+        if file_path.exists():
+            with contextlib.suppress(ValueError):
+                index = PayLogIndex.parse_obj(await self.load_json(file_path))
+        if not self.fetcher.check_index(pay_log, index):
+            # 没有索引的旧记录重新排序一次，之后的合并都依赖记录从新到旧排列
+            pay_log.list.sort(key=lambda x: (x.time, x.id), reverse=True)
+            index = self.fetcher.build_index(pay_log)
+        return index
+
+    @staticmethod
+    async def write_atomic(path: Path, data: str):
+        """先写入临时文件再替换，中途失败时不会留下写了一半的文件"""
+        temp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            async with aiofiles.open(temp_path, "w", encoding="utf-8") as f:
+                await f.write(data)
+            os.replace(temp_path, path)
+        finally:
+            with contextlib.suppress(OSError):
+                temp_path.unlink(missing_ok=True)
+
+    async def save_index(self, user_id: str, uid: str, index: PayLogIndex):
+        await self.write_atomic(self.get_index_path(user_id, uid), index.json())
+
+    def get_rollup_path(self, user_id: str, uid: str) -> Path:
+        """获取月份汇总文件路径
+        :param user_id: 用户 ID
+        :param uid: UID
+        :return: 文件路径
+        """
+        return self.pay_log_path / f"{user_id}-{uid}.rollup.json"
+
+    async def load_rollup(self, user_id: str, uid: str, index: PayLogIndex) -> Optional[PayLogRollup]:
+        """读取月份汇总，汇总不存在或与记录索引不一致时返回 None
+        :param user_id: 用户id
+        :param uid: 原神uid
+        :param index: 记录索引
+        :return: 月份汇总
+        """
+        file_path = self.get_rollup_path(user_id, uid)
+        if not file_path.exists():
+            return None
+        try:
+            rollup = PayLogRollup.parse_obj(await self.load_json(file_path))
+        except ValueError:
+            return None
+        return rollup if PayLogRollups.check(rollup, index) else None
+
+    async def save_rollup(self, user_id: str, uid: str, rollup: PayLogRollup):
+        await self.write_atomic(self.get_rollup_path(user_id, uid), rollup.json())
+
+    async def rebuild_rollup(self, user_id: str, uid: str) -> Optional[PayLogRollup]:
+        """从全部记录重新生成索引与月份汇总
+        :param user_id: 用户id
+        :param uid: 原神uid
+        :return: 月份汇总，没有记录时返回 None
+        """
+        pay_log, status = await self.load_history_info(user_id, uid)
+        if not status:
+            return None
+        index = await self.load_index(user_id, uid, pay_log)
+        rollup = PayLogRollups.build(pay_log, index)
+        await self.save_index(user_id, uid, index)
+        await self.save_rollup(user_id, uid, rollup)
+        return rollup
+
     async def load_history_info(
         self,
         user_id: str,
@@ -88,6 +175,10 @@ class PayLog:
         file_bak_path = self.get_file_path(user_id, uid, bak=True)
         with contextlib.suppress(Exception):
             file_bak_path.unlink(missing_ok=True)
+        with contextlib.suppress(Exception):
+            self.get_index_path(user_id, uid).unlink(missing_ok=True)
+        with contextlib.suppress(Exception):
+            self.get_rollup_path(user_id, uid).unlink(missing_ok=True)
         if file_path.exists():
             try:
                 file_path.unlink()
@@ -109,15 +200,33 @@ class PayLog:
             return False
         try:
             old_file_path.rename(new_file_path)
-            return True
         except PermissionError:
             return False
+        # 索引与汇总可以从记录重新生成，移动失败时直接删除
+        for get_path in (self.get_index_path, self.get_rollup_path):
+            old_path = get_path(user_id, uid)
+            with contextlib.suppress(Exception):
+                if old_path.exists():
+                    try:
+                        old_path.rename(get_path(new_user_id, uid))
+                    except PermissionError:
+                        old_path.unlink()
+        return True
 
-    async def save_pay_log_info(self, user_id: str, uid: str, info: PayLogModel) -> None:
+    async def save_pay_log_info(
+        self,
+        user_id: str,
+        uid: str,
+        info: PayLogModel,
+        index: Optional[PayLogIndex] = None,
+        rollup: Optional[PayLogRollup] = None,
+    ) -> None:
         """保存日志记录数据
         :param user_id: 用户id
         :param uid: 原神uid
         :param info: 记录数据
+        :param index: 记录索引，为空时从记录重新生成
+        :param rollup: 月份汇总，为空时从记录重新生成
         """
         save_path = self.pay_log_path / f"{user_id}-{uid}.json"
         save_path_bak = self.pay_log_path / f"{user_id}-{uid}.json.bak"
@@ -129,6 +238,9 @@ class PayLog:
                 save_path.rename(save_path.parent / f"{save_path.name}.bak")
         # 写入数据
         await self.save_json(save_path, info)
+        index = index or self.fetcher.build_index(info)
+        await self.save_index(user_id, uid, index)
+        await self.save_rollup(user_id, uid, rollup or PayLogRollups.build(info, index))
 
     @staticmethod
     def get_game_client(player_id: int) -> GenshinClient:
@@ -148,26 +260,26 @@ class PayLog:
         :param authkey: authkey
         :return: 更新结果
         """
-        new_num = 0
         pay_log, have_old = await self.load_history_info(str(user_id), str(player_id))
-        history_ids = [i.id for i in pay_log.list]
+        index = await self.load_index(str(user_id), str(player_id), pay_log)
+        # 在合并前读取，合并后只需要把新记录计入所在的月份
+        rollup = await self.load_rollup(str(user_id), str(player_id), index)
         client = self.get_game_client(player_id)
         try:
-            transaction_log = await client.transaction_log(authkey=authkey, kind=TransactionKind.CRYSTAL.value)
-            for data in transaction_log:
-                if data.id not in history_ids:
-                    pay_log.list.append(data)
-                    new_num += 1
+            # 只获取最新一条已保存记录之后的新记录
+            new_items = await self.fetcher.sync(client, authkey, pay_log, index)
         except AuthkeyTimeout as exc:
             raise PayLogAuthkeyTimeout from exc
         except InvalidAuthkey as exc:
             raise PayLogInvalidAuthkey from exc
         finally:
             await client.shutdown()
+        new_num = len(new_items)
         if new_num > 0 or have_old:
-            pay_log.list.sort(key=lambda x: (x.time, x.id), reverse=True)
+            if rollup is not None:
+                PayLogRollups.add(rollup, new_items, index)
             pay_log.info.update_now()
-            await self.save_pay_log_info(str(user_id), str(client.player_id), pay_log)
+            await self.save_pay_log_info(str(user_id), str(client.player_id), pay_log, index, rollup)
         return new_num
 
     @staticmethod
@@ -177,39 +289,7 @@ class PayLog:
         :param price_data: 商品数据
         :return: 月份数据
         """
-        all_amount: int = 0
-        months: List[int] = []
-        month_datas: List[Dict] = []
-        last_month: Optional[Dict] = None
-        month_data: List[Optional[BaseTransaction]] = []
-        for i in pay_log.list:
-            if i.amount <= 0:
-                continue
-            all_amount += i.amount
-            if i.time.month not in months:
-                months.append(i.time.month)
-                if last_month:
-                    last_month["amount"] = sum(i.amount for i in month_data)
-                    month_data.clear()
-                if len(months) <= 6:
-                    last_month = {
-                        "month": f"{i.time.month}月",
-                        "amount": 0,
-                    }
-                    month_datas.append(last_month)
-                else:
-                    last_month = None
-            for j in price_data:
-                if i.amount in j["price"]:
-                    j["count"] += 1
-                    break
-            month_data.append(i)
-        if last_month:
-            last_month["amount"] = sum(i.amount for i in month_data)
-            month_data.clear()
-        if not month_datas:
-            raise PayLogNotFound
-        return all_amount, month_datas
+        return PayLogRollups.get_full_month_data(pay_log, price_data)
 
     async def get_analysis(self, user_id: int, player_id: int):
         """获取分析数据
@@ -217,9 +297,20 @@ class PayLog:
         :param player_id: 玩家id
         :return: 分析数据
         """
-        pay_log, status = await self.load_history_info(str(user_id), str(player_id))
+        _, status = await self.load_history_info(str(user_id), str(player_id), only_status=True)
         if not status:
             raise PayLogNotFound
+        rollup = None
+        index_path = self.get_index_path(str(user_id), str(player_id))
+        if index_path.exists():
+            with contextlib.suppress(ValueError):
+                index = PayLogIndex.parse_obj(await self.load_json(index_path))
+                rollup = await self.load_rollup(str(user_id), str(player_id), index)
+        if rollup is None:
+            # 旧版本保存的记录没有汇总，重新生成一次
+            rollup = await self.rebuild_rollup(str(user_id), str(player_id))
+            if rollup is None:
+                raise PayLogNotFound
         # 单双倍结晶数
         price_data = [
             {
@@ -230,7 +321,7 @@ class PayLog:
         ]
         price_data_name = ["大月卡", "小月卡", "648", "328", "198", "98", "30", "6"]
         real_price = [68, 30, 648, 328, 198, 98, 30, 6]
-        all_amount, month_datas = await PayLog.get_month_data(pay_log, price_data)
+        all_amount, month_datas = PayLogRollups.get_month_data(rollup, price_data)
         month_data = sorted(month_datas, key=lambda k: k["amount"], reverse=True)
         all_pay = sum((price_data[i]["count"] * real_price[i]) for i in range(len(price_data)))
         datas = [
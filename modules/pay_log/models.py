@@ -1,5 +1,5 @@
 import datetime
-from typing import Any, List
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, BaseConfig
 from simnet.models.genshin.transaction import BaseTransaction
@@ -38,3 +38,36 @@ class PayLog(BaseModel):
     Config = _ModelConfig
     info: BaseInfo
     list: List[BaseTransaction]
+
+
+class PayLogIndex(BaseModel):
+    """充值记录索引，与记录文件一起保存"""
+
+    Config = _ModelConfig
+    version: int = 1
+    # 水位线，本地已保存的最新记录
+    last_id: int = 0
+    last_time: Optional[datetime.datetime] = None
+    # 已保存的记录 id，从大到小排列
+    ids: List[int] = []
+
+
+class PayLogMonthRollup(BaseModel):
+    """单月充值汇总"""
+
+    Config = _ModelConfig
+    amount: int = 0
+    # 每种充值金额的次数
+    amounts: Dict[int, int] = {}
+
+
+class PayLogRollup(BaseModel):
+    """充值记录按月汇总，与记录文件一起保存"""
+
+    Config = _ModelConfig
+    version: int = 1
+    # 汇总时最新一条记录与记录总数，用于检查是否与记录一致
+    last_id: int = 0
+    count: int = 0
+    # 按 YYYY-MM 索引
+    months: Dict[str, PayLogMonthRollup] = {}
@@ -0,0 +1,132 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from simnet.models.genshin.transaction import BaseTransaction
+
+from modules.pay_log.error import PayLogNotFound
+from modules.pay_log.models import PayLog as PayLogModel, PayLogIndex, PayLogMonthRollup, PayLogRollup
+
+
+class PayLogRollups:
+    """充值记录按月汇总
+
+    每个月保存结晶总数以及每种充值金额的次数，合并新记录时只更新新记录所在的月份，
+    生成充值统计时只需要读取汇总，不需要遍历全部记录。
+    """
+
+    @staticmethod
+    def get_month_key(item: BaseTransaction) -> str:
+        return item.time.strftime("%Y-%m")
+
+    @classmethod
+    def add(cls, rollup: PayLogRollup, items: Iterable[BaseTransaction], index: PayLogIndex) -> PayLogRollup:
+        """将新记录计入所在的月份
+        :param rollup: 汇总数据
+        :param items: 新记录，不能包含已经汇总过的记录
+        :param index: 合并后的记录索引
+        :return: 汇总数据
+        """
+        for item in items:
+            if item.amount <= 0:
+                continue
+            month = rollup.months.setdefault(cls.get_month_key(item), PayLogMonthRollup())
+            month.amount += item.amount
+            month.amounts[item.amount] = month.amounts.get(item.amount, 0) + 1
+        rollup.last_id = index.last_id
+        rollup.count = len(index.ids)
+        return rollup
+
+    @classmethod
+    def build(cls, pay_log: PayLogModel, index: PayLogIndex) -> PayLogRollup:
+        """从全部记录重新生成汇总"""
+        return cls.add(PayLogRollup(), pay_log.list, index)
+
+    @staticmethod
+    def check(rollup: Optional[PayLogRollup], index: PayLogIndex) -> bool:
+        """检查汇总是否与记录索引一致"""
+        if rollup is None or rollup.version != PayLogRollup().version:
+            return False
+        return rollup.last_id == index.last_id and rollup.count == len(index.ids)
+
+    @staticmethod
+    def count_price(price_data: List[Dict], amount: int, count: int):
+        for j in price_data:
+            if amount in j["price"]:
+                j["count"] += count
+                break
+
+    @classmethod
+    def get_month_data(cls, rollup: PayLogRollup, price_data: List[Dict]) -> Tuple[int, List[Dict]]:
+        """从汇总获取月份数据，结果与 get_full_month_data 相同
+        :param rollup: 汇总数据
+        :param price_data: 商品数据
+        :return: 月份数据
+        """
+        all_amount: int = 0
+        months: List[int] = []
+        month_datas: List[Dict] = []
+        last_month: Optional[Dict] = None
+        for key in sorted(rollup.months, reverse=True):
+            data = rollup.months[key]
+            if data.amount <= 0:
+                continue
+            all_amount += data.amount
+            # 与逐条统计时相同，只按月份区分，不同年份的同一月份计入当时正在统计的月份
+            month = int(key[5:])
+            if month not in months:
+                months.append(month)
+                if len(months) <= 6:
+                    last_month = {
+                        "month": f"{month}月",
+                        "amount": 0,
+                    }
+                    month_datas.append(last_month)
+                else:
+                    last_month = None
+            if last_month:
+                last_month["amount"] += data.amount
+            for amount, count in data.amounts.items():
+                cls.count_price(price_data, amount, count)
+        if not month_datas:
+            raise PayLogNotFound
+        return all_amount, month_datas
+
+    @staticmethod
+    def get_full_month_data(pay_log: PayLogModel, price_data: List[Dict]) -> Tuple[int, List[Dict]]:
+        """遍历全部记录获取月份数据
+        :param pay_log: 日志数据
+        :param price_data: 商品数据
+        :return: 月份数据
+        """
+        all_amount: int = 0
+        months: List[int] = []
+        month_datas: List[Dict] = []
+        last_month: Optional[Dict] = None
+        month_data: List[Optional[BaseTransaction]] = []
+        for i in pay_log.list:
+            if i.amount <= 0:
+                continue
+            all_amount += i.amount
+            if i.time.month not in months:
+                months.append(i.time.month)
+                if last_month:
+                    last_month["amount"] = sum(i.amount for i in month_data)
+                    month_data.clear()
+                if len(months) <= 6:
+                    last_month = {
+                        "month": f"{i.time.month}月",
+                        "amount": 0,
+                    }
+                    month_datas.append(last_month)
+                else:
+                    last_month = None
+            for j in price_data:
+                if i.amount in j["price"]:
+                    j["count"] += 1
+                    break
+            month_data.append(i)
+        if last_month:
+            last_month["amount"] = sum(i.amount for i in month_data)
+            month_data.clear()
+        if not month_datas:
+            raise PayLogNotFound
+        return all_amount, month_datas
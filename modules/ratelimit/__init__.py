@@ -0,0 +1 @@
+"""请求速率限制"""
@@ -0,0 +1,64 @@
+"""令牌桶"""
+
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """令牌桶，每秒补充 rate 个令牌，最多保存 capacity 个"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: 每秒补充的令牌数
+        :param capacity: 最多保存的令牌数，默认为一秒的令牌数
+        """
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock: Optional[asyncio.Lock] = None
+
+    def get_lock(self) -> asyncio.Lock:
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        return self.lock
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    async def acquire(self):
+        """取出一个令牌，没有令牌时按先后顺序等待"""
+        async with self.get_lock():
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def try_acquire(self) -> float:
+        """不等待地取出一个令牌
+        :return: 取出成功时为 0，否则为需要等待的秒数
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds: float):
+        """触发限流后清空令牌并暂停补充"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
@@ -0,0 +1 @@
+"""兑换码兑换"""
@@ -0,0 +1,209 @@
+"""兑换码兑换调度"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, List, Optional, Set, TypeVar
+
+from modules.ratelimit.bucket import TokenBucket
+
+T = TypeVar("T")
+
+
+class RedeemPriority(IntEnum):
+    """数值越小越先执行"""
+
+    ADMIN = 0
+    USER = 1
+    # 批量兑换任务
+    JOB = 2
+
+
+class RedeemQueueFull(Exception):
+    pass
+
+
+class RedeemTask(Generic[T]):
+    __slots__ = ("priority", "seq", "key", "func", "done", "future", "retries")
+
+    def __init__(
+        self,
+        priority: int,
+        seq: int,
+        key: Hashable,
+        func: Callable[[], Awaitable[T]],
+        done: Callable[[Optional[T], Optional[Exception]], Awaitable[Any]],
+        future: asyncio.Future,
+    ):
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.func = func
+        self.done = done
+        self.future = future
+        self.retries = 0
+
+    def __lt__(self, other: "RedeemTask") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class RedeemScheduler:
+    """兑换码兑换调度
+
+    每个账号使用一个令牌桶，同一账号的两次兑换间隔不小于 account_interval，触发冷却时暂停该账号的令牌桶后重试。
+    只有取得令牌的账号才会进入优先队列，等待冷却的账号不会占用 workers。交互请求优先于批量任务执行，
+    批量任务等待的数量超过 max_pending 时 submit 会等待，交互请求超过 max_interactive 时抛出 RedeemQueueFull。
+    """
+
+    def __init__(
+        self,
+        is_cooldown: Callable[[Exception], bool],
+        account_interval: float = 5,
+        cooldown: float = 5,
+        cooldown_retries: int = 2,
+        global_rate: float = 5,
+        workers: int = 8,
+        max_pending: int = 64,
+        max_interactive: int = 20,
+    ):
+        """
+        :param is_cooldown: 判断错误是否为兑换冷却
+        :param account_interval: 同一账号两次兑换的最小间隔
+        :param cooldown: 触发冷却后暂停该账号的时间，暂停结束后仍然需要等待 account_interval
+        :param cooldown_retries: 触发冷却后最多重试的次数
+        :param global_rate: 每秒兑换的最大次数
+        :param workers: 同时兑换的数量
+        :param max_pending: 批量任务最多等待的数量
+        :param max_interactive: 交互请求最多等待的数量
+        """
+        self.is_cooldown = is_cooldown
+        self.account_interval = account_interval
+        self.cooldown = cooldown
+        self.cooldown_retries = cooldown_retries
+        self.bucket = TokenBucket(global_rate)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_interactive = max_interactive
+        self.buckets: Dict[Hashable, TokenBucket] = {}
+        self.accounts: Dict[Hashable, List[RedeemTask]] = {}
+        # 在优先队列中、等待令牌或正在兑换的账号
+        self.scheduled: Set[Hashable] = set()
+        self.counter = itertools.count()
+        self.interactive = 0
+        self.retries = 0
+        self.queue: Optional[asyncio.PriorityQueue] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.tasks: List[asyncio.Task] = []
+
+    def get_bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(1 / self.account_interval, 1)
+        return bucket
+
+    def get_slots(self) -> asyncio.Semaphore:
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_pending)
+        return self.slots
+
+    def start(self):
+        if self.tasks:
+            return
+        self.queue = asyncio.PriorityQueue()
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(
+        self,
+        key: Hashable,
+        func: Callable[[], Awaitable[T]],
+        done: Callable[[Optional[T], Optional[Exception]], Awaitable[Any]],
+        priority: int = RedeemPriority.USER,
+    ) -> asyncio.Future:
+        """加入兑换队列
+        :param key: 账号，同一账号的兑换按照间隔依次执行
+        :param func: 兑换，触发冷却时会再次调用
+        :param done: 兑换完成后调用，参数为结果与错误
+        :param priority: 优先级
+        :return: done 完成后结束的 Future
+        """
+        if priority < RedeemPriority.JOB:
+            if self.interactive >= self.max_interactive:
+                raise RedeemQueueFull()
+            self.interactive += 1
+        else:
+            await self.get_slots().acquire()
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        task = RedeemTask(priority, next(self.counter), key, func, done, future)
+        heapq.heappush(self.accounts.setdefault(key, []), task)
+        if key not in self.scheduled:
+            self.scheduled.add(key)
+            self.schedule(key)
+        return future
+
+    def schedule(self, key: Hashable):
+        """账号取得令牌后进入优先队列"""
+        wait = self.get_bucket(key).try_acquire()
+        if wait > 0:
+            asyncio.get_running_loop().call_later(wait, self.schedule, key)
+            return
+        task = self.accounts[key][0]
+        self.queue.put_nowait((task.priority, task.seq, key))
+
+    def release(self, key: Hashable):
+        if self.accounts.get(key):
+            self.schedule(key)
+            return
+        self.accounts.pop(key, None)
+        self.scheduled.discard(key)
+        if len(self.buckets) > 4 * self.max_pending:
+            self.prune(time.monotonic())
+
+    def prune(self, now: float):
+        """清理空闲账号已经补满的令牌桶"""
+        for key, bucket in list(self.buckets.items()):
+            if key not in self.scheduled and now >= max(bucket.updated, bucket.paused_until) + self.account_interval:
+                del self.buckets[key]
+
+    async def finish(self, task: RedeemTask, result: Any, exc: Optional[Exception]):
+        try:
+            await task.done(result, exc)
+        except Exception as _exc:  # pylint: disable=W0703
+            task.future.set_exception(_exc)
+        else:
+            task.future.set_result(result)
+        finally:
+            if task.priority < RedeemPriority.JOB:
+                self.interactive -= 1
+            else:
+                self.get_slots().release()
+
+    async def run_task(self, key: Hashable):
+        task = heapq.heappop(self.accounts[key])
+        await self.bucket.acquire()
+        try:
+            result, exc = await task.func(), None
+        except Exception as _exc:  # pylint: disable=W0703
+            if self.is_cooldown(_exc) and task.retries < self.cooldown_retries:
+                task.retries += 1
+                self.retries += 1
+                self.get_bucket(key).pause(self.cooldown)
+                heapq.heappush(self.accounts[key], task)
+                self.schedule(key)
+                return
+            result, exc = None, _exc
+        self.release(key)
+        await self.finish(task, result, exc)
+
+    async def work(self):
+        while True:
+            _, _, key = await self.queue.get()
+            await self.run_task(key)
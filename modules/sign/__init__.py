@@ -0,0 +1 @@
+"""自动签到"""
@@ -0,0 +1,263 @@
+"""自动签到批量执行"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from modules.ratelimit.bucket import TokenBucket
+
+T = TypeVar("T")
+
+# 当前任务最后请求的接口，触发限流时暂停对应的令牌桶
+_endpoint: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("sign_endpoint", default=None)
+
+
+class SignRateLimiter:
+    """按接口区分的令牌桶"""
+
+    def __init__(self, rates: Dict[str, float], default: float = 5.0):
+        """
+        :param rates: 每个接口每秒允许的请求数
+        :param default: 未配置的接口每秒允许的请求数
+        """
+        self.rates = rates
+        self.default = default
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def get_bucket(self, endpoint: str) -> TokenBucket:
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            bucket = self.buckets[endpoint] = TokenBucket(self.rates.get(endpoint, self.default))
+        return bucket
+
+    async def acquire(self, endpoint: str):
+        """请求接口前调用"""
+        _endpoint.set(endpoint)
+        await self.get_bucket(endpoint).acquire()
+
+    @staticmethod
+    def get_last_endpoint() -> Optional[str]:
+        """当前任务最后请求的接口"""
+        return _endpoint.get()
+
+    def pause(self, endpoint: Optional[str], seconds: float):
+        """暂停接口的令牌桶，接口为空时暂停全部"""
+        buckets = [self.get_bucket(endpoint)] if endpoint else list(self.buckets.values())
+        for bucket in buckets:
+            bucket.pause(seconds)
+
+
+class SignRetryType(Enum):
+    CAPTCHA = 1
+    RATE_LIMIT = 2
+
+
+class SignProgress:
+    """签到进度"""
+
+    __slots__ = (
+        "total",
+        "done",
+        "success",
+        "failed",
+        "errors",
+        "captcha_retries",
+        "rate_limit_retries",
+        "start",
+        "end",
+    )
+
+    def __init__(self, total: int = 0):
+        self.total = total
+        self.done = 0
+        self.success = 0
+        self.failed = 0
+        # 处理结果时发生的错误
+        self.errors = 0
+        self.captcha_retries = 0
+        self.rate_limit_retries = 0
+        self.start = time.monotonic()
+        self.end: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end or time.monotonic()) - self.start
+
+    @property
+    def rate(self) -> float:
+        """每秒完成的数量"""
+        elapsed = self.elapsed
+        return (self.done / elapsed) if elapsed else 0
+
+    def text(self) -> str:
+        return (
+            f"进度 {self.done}/{self.total} 成功 {self.success} 失败 {self.failed} "
+            f"验证码重试 {self.captcha_retries} 限流重试 {self.rate_limit_retries} "
+            f"耗时 {self.elapsed:.1f}s"
+        )
+
+
+class SignExecutor(Generic[T]):
+    """自动签到批量执行
+
+    固定数量的 worker 从队列中取出任务并发执行，请求速率由 SignRateLimiter 的令牌桶限制，
+    总耗时取决于允许的请求速率而不是用户数量。触发验证码与限流的任务分别进入各自的重试队列，
+    等待一段时间后重新执行，重试次数用完后与其他失败一样交给 done 处理。
+    """
+
+    def __init__(
+        self,
+        sign: Callable[[T], Awaitable[Any]],
+        done: Callable[[T, Any, Optional[BaseException]], Awaitable[Any]],
+        classify: Callable[[BaseException], Optional[SignRetryType]],
+        limiter: Optional[SignRateLimiter] = None,
+        workers: int = 16,
+        captcha_retries: int = 1,
+        captcha_delay: float = 60.0,
+        rate_limit_retries: int = 3,
+        rate_limit_delay: float = 30.0,
+        report: Optional[Callable[[SignProgress], Awaitable[Any]]] = None,
+        report_interval: float = 30.0,
+    ):
+        """
+        :param sign: 执行签到，返回签到结果
+        :param done: 处理签到结果或最终的错误
+        :param classify: 判断错误是否需要重试
+        :param limiter: 请求速率限制，触发限流时暂停对应接口
+        :param workers: 同时执行的数量
+        :param captcha_retries: 触发验证码时的重试次数
+        :param captcha_delay: 触发验证码后重试前的等待时间
+        :param rate_limit_retries: 触发限流时的重试次数
+        :param rate_limit_delay: 触发限流后重试前的等待时间，之后每次翻倍
+        :param report: 定时报告进度
+        :param report_interval: 报告进度的间隔
+        """
+        self.sign = sign
+        self.done = done
+        self.classify = classify
+        self.limiter = limiter
+        self.workers = workers
+        self.retries = {SignRetryType.CAPTCHA: captcha_retries, SignRetryType.RATE_LIMIT: rate_limit_retries}
+        self.delays = {SignRetryType.CAPTCHA: captcha_delay, SignRetryType.RATE_LIMIT: rate_limit_delay}
+        self.report = report
+        self.report_interval = report_interval
+        self.progress = SignProgress()
+        self.queue: List[Tuple[T, Dict[SignRetryType, int]]] = []
+        # 重试队列按可以重试的时间排列
+        self.retry_queues: Dict[SignRetryType, List[Tuple[float, int, T, Dict[SignRetryType, int]]]] = {
+            i: [] for i in SignRetryType
+        }
+        self.counter = itertools.count()
+        self.running = 0
+        self.condition: Optional[asyncio.Condition] = None
+
+    def get_condition(self) -> asyncio.Condition:
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        return self.condition
+
+    def next_job(self) -> Optional[Tuple[T, Dict[SignRetryType, int]]]:
+        """优先执行新任务，其次是已经可以重试的任务"""
+        if self.queue:
+            return self.queue.pop()
+        now = time.monotonic()
+        for queue in self.retry_queues.values():
+            if queue and queue[0][0] <= now:
+                _, _, item, attempts = heapq.heappop(queue)
+                return item, attempts
+        return None
+
+    def next_ready(self) -> Optional[float]:
+        """最早可以重试的时间"""
+        ready = [queue[0][0] for queue in self.retry_queues.values() if queue]
+        return min(ready) if ready else None
+
+    def is_finished(self) -> bool:
+        return not self.queue and not self.running and not any(self.retry_queues.values())
+
+    def add_retry(self, kind: SignRetryType, item: T, attempts: Dict[SignRetryType, int]) -> bool:
+        """加入重试队列，重试次数用完时返回 False"""
+        count = attempts.get(kind, 0)
+        if count >= self.retries[kind]:
+            return False
+        attempts[kind] = count + 1
+        delay = self.delays[kind]
+        if kind == SignRetryType.RATE_LIMIT:
+            delay *= 2**count
+            self.progress.rate_limit_retries += 1
+            if self.limiter is not None:
+                self.limiter.pause(self.limiter.get_last_endpoint(), delay)
+        else:
+            self.progress.captcha_retries += 1
+        heapq.heappush(self.retry_queues[kind], (time.monotonic() + delay, next(self.counter), item, attempts))
+        return True
+
+    async def process(self, item: T, attempts: Dict[SignRetryType, int]):
+        result, exc = None, None
+        try:
+            result = await self.sign(item)
+        except Exception as e:  # pylint: disable=W0703
+            kind = self.classify(e)
+            if kind is not None and self.add_retry(kind, item, attempts):
+                return
+            exc = e
+        if exc is None:
+            self.progress.success += 1
+        else:
+            self.progress.failed += 1
+        self.progress.done += 1
+        try:
+            await self.done(item, result, exc)
+        except Exception:  # pylint: disable=W0703
+            self.progress.errors += 1
+
+    async def worker(self):
+        condition = self.get_condition()
+        while True:
+            async with condition:
+                while True:
+                    job = self.next_job()
+                    if job is not None:
+                        self.running += 1
+                        break
+                    if self.is_finished():
+                        return
+                    ready = self.next_ready()
+                    timeout = None if ready is None else max(ready - time.monotonic(), 0)
+                    try:
+                        await asyncio.wait_for(condition.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            try:
+                await self.process(*job)
+            finally:
+                async with condition:
+                    self.running -= 1
+                    condition.notify_all()
+
+    async def reporter(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            await self.report(self.progress)
+
+    async def run(self, items: List[T]) -> SignProgress:
+        """执行全部签到
+        :param items: 需要签到的任务
+        :return: 签到进度
+        """
+        self.progress = SignProgress(len(items))
+        self.queue = [(item, {}) for item in reversed(items)]
+        reporter = asyncio.create_task(self.reporter()) if self.report is not None else None
+        try:
+            await asyncio.gather(*[self.worker() for _ in range(min(self.workers, len(items)))])
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+            self.progress.end = time.monotonic()
+        if self.report is not None:
+            await self.report(self.progress)
+        return self.progress
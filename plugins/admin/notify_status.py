@@ -0,0 +1,18 @@
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from core.plugin import Plugin, handler
+from plugins.tools.notify import NotifySystem
+from utils.log import logger
+
+
+class NotifyStatus(Plugin):
+    def __init__(self, notify: NotifySystem):
+        self.notify = notify
+
+    @handler.command(command="notify_status", block=False, admin=True)
+    async def notify_status(self, update: Update, _: CallbackContext):
+        user = update.effective_user
+        logger.info("用户 %s[%s] notify_status 命令请求", user.full_name, user.id)
+        message = update.effective_message
+        await message.reply_text(f"消息推送队列\n{self.notify.metrics.text()}", quote=True)
@@ -1,14 +1,19 @@
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import CallbackContext
 
 from core.plugin import Plugin, handler
+from modules.checkpoint.store import JobCheckpointRunning, get_daily_run
+from modules.sign.executor import SignProgress
+from plugins.tools.checkpoint import JobCheckpointSystem
 from plugins.tools.sign import SignSystem, SignJobType
 from utils.log import logger
 
 
 class SignAll(Plugin):
-    def __init__(self, sign_system: SignSystem):
+    def __init__(self, sign_system: SignSystem, checkpoint: JobCheckpointSystem):
         self.sign_system = sign_system
+        self.checkpoint = checkpoint
 
     @handler.command(command="sign_all", block=False, admin=True)
     async def sign_all(self, update: Update, context: CallbackContext):
@@ -16,5 +21,21 @@ class SignAll(Plugin):
         logger.info("用户 %s[%s] sign_all 命令请求", user.full_name, user.id)
         message = update.effective_message
         reply = await message.reply_text("正在全部重新签到，请稍后...")
-        await self.sign_system.do_sign_job(context, job_type=SignJobType.START)
-        await reply.edit_text("全部账号重新签到完成")
+
+        async def report(progress: SignProgress):
+            await self.sign_system.log_progress(progress)
+            try:
+                await reply.edit_text(f"正在全部重新签到，请稍后...\n{progress.text()}")
+            except BadRequest:
+                pass
+
+        # 与每日签到使用同一个检查点，每日签到正在运行时不重复签到
+        try:
+            async with self.checkpoint.run("sign", get_daily_run(), reset=True, flush_size=1) as checkpoint:
+                progress = await self.sign_system.do_sign_job(
+                    context, job_type=SignJobType.START, report=report, checkpoint=checkpoint
+                )
+        except JobCheckpointRunning:
+            await reply.edit_text("自动签到正在运行，请等待运行完成")
+            return
+        await reply.edit_text(f"全部账号重新签到完成\n{progress.text()}")
@@ -9,11 +9,11 @@ from simnet import Region
 from simnet.client.components.lab import LabClient
 from simnet.errors import BadRequest as SimnetBadRequest, TimedOut as SimnetTimedOut, InvalidCookies
 from telegram.constants import ParseMode
-from telegram.error import Forbidden, BadRequest
 
 from gram_core.basemodel import RegionEnum
 from gram_core.plugin import Plugin, job, handler
 from gram_core.services.cookies import CookiesService
+from plugins.tools.notify import NotifySystem
 from utils.log import logger
 
 if TYPE_CHECKING:
@@ -32,8 +32,10 @@ class AccompanySystem(Plugin):
     def __init__(
         self,
         cookies_service: CookiesService,
+        notify: NotifySystem,
     ):
         self.cookies_service = cookies_service
+        self.notify = notify
         self.accompany_roles = []
 
     @asynccontextmanager
@@ -126,12 +128,7 @@ class AccompanySystem(Plugin):
             except Exception as exc:
                 logger.error("执行自动角色陪伴时发生错误 user_id[%s]", user_id, exc_info=exc)
             if text:
-                try:
-                    await context.bot.send_message(user_id, text, parse_mode=ParseMode.HTML)
-                except (BadRequest, Forbidden):
-                    continue
-                except Exception as exc:
-                    logger.error("执行自动角色陪伴时发生错误 user_id[%s]", user_id, exc_info=exc)
+                self.notify.notify(user_id, text, ParseMode.HTML, key="accompany")
 
     async def do_accompany_job(self, context: "ContextTypes.DEFAULT_TYPE") -> None:
         accompany_list = await self.cookies_service.get_all(region=RegionEnum.HOYOLAB)
@@ -13,8 +13,12 @@ class NotesJob(Plugin):
     def __init__(self, daily_note_system: DailyNoteSystem):
         self.daily_note_system = daily_note_system
 
-    @job.run_repeating(interval=datetime.timedelta(minutes=20), name="NotesJob")
+    # 每个时间片执行一次，每次只处理一个槽位的用户
+    @job.run_repeating(
+        interval=datetime.timedelta(seconds=DailyNoteSystem.NOTES_INTERVAL / DailyNoteSystem.NOTES_SLOTS),
+        name="NotesJob",
+    )
     async def card(self, context: "ContextTypes.DEFAULT_TYPE"):
-        logger.info("正在执行自动便签提醒")
+        logger.debug("正在执行自动便签提醒")
         await self.daily_note_system.do_get_notes_job(context)
-        logger.success("执行自动便签提醒完成")
+        logger.debug("执行自动便签提醒完成")
@@ -1,5 +1,5 @@
 import datetime
-from typing import TYPE_CHECKING, Dict
+from typing import TYPE_CHECKING, Dict, List
 
 from simnet import Region
 from simnet.client.components.auth import AuthClient
@@ -9,12 +9,15 @@ from simnet.errors import (
     NetworkError as SimnetNetworkError,
     InvalidCookies,
 )
-from sqlalchemy.orm.exc import StaleDataError
 
 from core.plugin import Plugin, job
+from core.services.cookies.repositories import CookiesBatchRepository
 from gram_core.basemodel import RegionEnum
 from gram_core.services.cookies import CookiesService
-from gram_core.services.cookies.models import CookiesStatusEnum
+from gram_core.services.cookies.models import CookiesDataBase as Cookies, CookiesStatusEnum
+from modules.checkpoint.store import JobCheckpoint, JobCheckpointRunning, get_daily_run
+from modules.cookies.refresh import CookiesRefreshPipeline, CookiesRefreshResult
+from plugins.tools.checkpoint import JobCheckpointSystem
 from utils.log import logger
 
 if TYPE_CHECKING:
@@ -27,58 +30,140 @@ REGION = {
 
 
 class RefreshCookiesJob(Plugin):
-    def __init__(self, cookies: CookiesService):
+    # 同时刷新的账号数量
+    REFRESH_CONCURRENCY = 16
+    # 每秒刷新的账号数量，每个账号请求两次接口
+    REFRESH_RATE = 10
+    # 每个事务写入的账号数量
+    REFRESH_BATCH_SIZE = 200
+
+    def __init__(self, cookies: CookiesService, cookies_batch: CookiesBatchRepository, checkpoint: JobCheckpointSystem):
         self.cookies = cookies
+        self.cookies_batch = cookies_batch
+        self.checkpoint = checkpoint
 
-    @job.run_daily(time=datetime.time(hour=0, minute=1, second=0), name="RefreshCookiesJob")
-    async def daily_refresh_cookies(self, _: "ContextTypes.DEFAULT_TYPE"):
-        logger.info("正在执行每日刷新 Cookies 任务")
-        for database_region, client_region in REGION.items():
+    async def initialize(self) -> None:
+        state = await self.checkpoint.get_unfinished("refresh_cookies")
+        if state is None:
+            return
+        # 任务在 23:31 开始，零点之后重启时需要恢复前一天的运行
+        now = datetime.datetime.now()
+        if state["run"] not in (get_daily_run(now), get_daily_run(now - datetime.timedelta(days=1))):
+            return
+        logger.info(
+            "每日刷新 Cookies 任务 run[%s] 没有完成，将在 %s 秒后从检查点恢复",
+            state["run"],
+            self.checkpoint.RESUME_DELAY,
+        )
+        self.application.job_queue.run_once(
+            self.resume_refresh_cookies, self.checkpoint.RESUME_DELAY, data=state["run"], name="RefreshCookiesJobResume"
+        )
+
+    @staticmethod
+    async def refresh_cookies(cookie_model: Cookies) -> CookiesRefreshResult:
+        client_region = REGION[cookie_model.region]
+        try:
+            async with AuthClient(cookies=cookie_model.data, region=client_region) as client:
+                new_cookies: Dict[str, str] = cookie_model.data.copy()
+                new_cookies["cookie_token"] = await client.get_cookie_token_by_stoken()
+                new_cookies["ltoken"] = await client.get_ltoken_by_stoken()
+        except ValueError:
+            logger.warning("用户 user_id[%s] Cookies 不完整", cookie_model.user_id)
+            return CookiesRefreshResult.INVALID
+        except InvalidCookies:
+            logger.info("用户 user_id[%s] Cookies 已经过期", cookie_model.user_id)
+            return CookiesRefreshResult.INVALID
+        except SimnetBadRequest as _exc:
+            logger.warning(
+                "用户 user_id[%s] 刷新 Cookies 时出现错误 [%s]%s",
+                cookie_model.user_id,
+                _exc.ret_code,
+                _exc.original or _exc.message,
+            )
+            return CookiesRefreshResult.SKIPPED
+        except SimnetTimedOut:
+            logger.warning("用户 user_id[%s] 刷新 Cookies 时连接超时", cookie_model.user_id)
+            return CookiesRefreshResult.SKIPPED
+        except SimnetNetworkError:
+            logger.warning("用户 user_id[%s] 刷新 Cookies 时网络错误", cookie_model.user_id)
+            return CookiesRefreshResult.SKIPPED
+        except Exception as _exc:
+            logger.error("用户 user_id[%s] 刷新 Cookies 失败", cookie_model.user_id, exc_info=_exc)
+            return CookiesRefreshResult.SKIPPED
+        cookie_model.data = new_cookies
+        cookie_model.status = CookiesStatusEnum.STATUS_SUCCESS
+        logger.debug("用户 user_id[%s] 刷新 Cookies 成功", cookie_model.user_id)
+        return CookiesRefreshResult.UPDATED
+
+    async def update_cookies(self, cookies: List[Cookies]):
+        try:
+            failed = await self.cookies_batch.update_many(cookies)
+        except Exception as _exc:
+            logger.error("批量更新 %s 个 Cookies 失败", len(cookies), exc_info=_exc)
+            return
+        for cookie_model in failed:
+            logger.warning("用户 user_id[%s] 刷新 Cookies 失败，数据不存在", cookie_model.user_id)
+
+    async def mark_invalid(self, cookies: List[Cookies]):
+        try:
+            await self.cookies_batch.set_status_many(
+                [cookie_model.id for cookie_model in cookies], CookiesStatusEnum.INVALID_COOKIES
+            )
+        except Exception as _exc:
+            logger.error("批量更新 %s 个 Cookies 状态失败", len(cookies), exc_info=_exc)
+
+    async def get_refresh_cookies(self) -> List[Cookies]:
+        cookies = []
+        for database_region in REGION:
             for cookie_model in await self.cookies.get_all(region=database_region):
-                cookies = cookie_model.data
-                if cookies.get("stoken") is not None and cookie_model.status != CookiesStatusEnum.INVALID_COOKIES:
-                    try:
-                        async with AuthClient(cookies=cookies, region=client_region) as client:
-                            new_cookies: Dict[str, str] = cookies.copy()
-                            new_cookies["cookie_token"] = await client.get_cookie_token_by_stoken()
-                            new_cookies["ltoken"] = await client.get_ltoken_by_stoken()
-                            cookie_model.data = new_cookies
-                            cookie_model.status = CookiesStatusEnum.STATUS_SUCCESS
-                    except ValueError:
-                        cookie_model.status = CookiesStatusEnum.INVALID_COOKIES
-                        logger.warning("用户 user_id[%s] Cookies 不完整", cookie_model.user_id)
-                    except InvalidCookies:
-                        cookie_model.status = CookiesStatusEnum.INVALID_COOKIES
-                        logger.info("用户 user_id[%s] Cookies 已经过期", cookie_model.user_id)
-                    except SimnetBadRequest as _exc:
-                        logger.warning(
-                            "用户 user_id[%s] 刷新 Cookies 时出现错误 [%s]%s",
-                            cookie_model.user_id,
-                            _exc.ret_code,
-                            _exc.original or _exc.message,
-                        )
-                        continue
-                    except SimnetTimedOut:
-                        logger.warning("用户 user_id[%s] 刷新 Cookies 时连接超时", cookie_model.user_id)
-                        continue
-                    except SimnetNetworkError:
-                        logger.warning("用户 user_id[%s] 刷新 Cookies 时网络错误", cookie_model.user_id)
-                        continue
-                    except Exception as _exc:
-                        logger.error("用户 user_id[%s] 刷新 Cookies 失败", cookie_model.user_id, exc_info=_exc)
-                        continue
-                    try:
-                        await self.cookies.update(cookie_model)
-                    except StaleDataError as _exc:
-                        if "UPDATE" in str(_exc):
-                            logger.warning("用户 user_id[%s] 刷新 Cookies 失败，数据不存在", cookie_model.user_id)
-                        else:
-                            logger.error(
-                                "用户 user_id[%s] 更新 Cookies 时出现错误", cookie_model.user_id, exc_info=_exc
-                            )
-                    except Exception as _exc:
-                        logger.error("用户 user_id[%s] 更新 Cookies 状态失败", cookie_model.user_id, exc_info=_exc)
-                    else:
-                        logger.debug("用户 user_id[%s] 刷新 Cookies 成功")
-
-        logger.success("执行每日刷新 Cookies 任务完成")
+                if (
+                    cookie_model.data.get("stoken") is not None
+                    and cookie_model.status != CookiesStatusEnum.INVALID_COOKIES
+                ):
+                    cookies.append(cookie_model)
+        return cookies
+
+    # 在每日签到之前完成，避免与签到任务同时请求
+    @job.run_daily(time=datetime.time(hour=23, minute=31, second=0), name="RefreshCookiesJob")
+    async def daily_refresh_cookies(self, _: "ContextTypes.DEFAULT_TYPE"):
+        await self.do_refresh_cookies(get_daily_run())
+
+    async def resume_refresh_cookies(self, context: "ContextTypes.DEFAULT_TYPE"):
+        await self.do_refresh_cookies(context.job.data)
+
+    async def do_refresh_cookies(self, run: str):
+        """执行一次刷新，同一个 run 的检查点已经完成或任务正在运行时跳过
+        :param run: 运行ID，恢复时使用检查点中的运行ID
+        """
+        try:
+            async with self.checkpoint.run("refresh_cookies", run) as checkpoint:
+                await self.refresh_all_cookies(checkpoint)
+        except JobCheckpointRunning:
+            logger.warning("每日刷新 Cookies 任务正在运行，跳过 run[%s]", run)
+
+    async def refresh_all_cookies(self, checkpoint: JobCheckpoint):
+        run = checkpoint.run
+        if checkpoint.finished:
+            return
+        logger.info("正在执行每日刷新 Cookies 任务 run[%s]", run)
+
+        # 写入数据库之后才记录为已完成
+        async def update_cookies(cookies: List[Cookies]):
+            await self.update_cookies(cookies)
+            await checkpoint.mark(*[cookie_model.id for cookie_model in cookies])
+
+        async def mark_invalid(cookies: List[Cookies]):
+            await self.mark_invalid(cookies)
+            await checkpoint.mark(*[cookie_model.id for cookie_model in cookies])
+
+        pipeline = CookiesRefreshPipeline(
+            self.refresh_cookies,
+            update_cookies,
+            mark_invalid,
+            concurrency=self.REFRESH_CONCURRENCY,
+            rate=self.REFRESH_RATE,
+            batch_size=self.REFRESH_BATCH_SIZE,
+        )
+        metrics = await pipeline.run(checkpoint.pending(await self.get_refresh_cookies(), lambda i: i.id))
+        await checkpoint.finish()
+        logger.success("执行每日刷新 Cookies 任务完成 %s", metrics.text())
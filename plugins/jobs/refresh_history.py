@@ -1,6 +1,5 @@
 import datetime
-from asyncio import sleep
-from typing import TYPE_CHECKING, Dict
+from typing import TYPE_CHECKING, Dict, Optional
 
 from simnet.errors import (
     TimedOut as SimnetTimedOut,
@@ -8,8 +7,8 @@ from simnet.errors import (
     InvalidCookies,
 )
 from telegram.constants import ParseMode
-from telegram.error import BadRequest, Forbidden
 
+from core.dependence.redisdb import RedisDB
 from core.plugin import Plugin, job
 from core.services.history_data.services import (
     HistoryDataAbyssServices,
@@ -18,13 +17,18 @@ from core.services.history_data.services import (
 from gram_core.basemodel import RegionEnum
 from gram_core.plugin import handler
 from gram_core.services.cookies import CookiesService
-from gram_core.services.cookies.models import CookiesStatusEnum
-from plugins.zzz.challenge import ChallengePlugin
+from gram_core.services.cookies.models import CookiesStatusEnum, CookiesDataBase
+from modules.checkpoint.store import JobCheckpoint, JobCheckpointRunning, get_daily_run
+from modules.history_data.refresh import HistoryFingerprintStore, HistoryRefresher
+from plugins.tools.checkpoint import JobCheckpointSystem
 from plugins.tools.genshin import GenshinHelper, PlayerNotFoundError, CookiesNotFoundError
+from plugins.tools.notify import NotifySystem
+from plugins.zzz.challenge import ChallengePlugin
 from plugins.zzz.ledger import LedgerPlugin
 from utils.log import logger
 
 if TYPE_CHECKING:
+    from redis import Redis
     from telegram import Update
     from telegram.ext import ContextTypes
 
@@ -37,36 +41,69 @@ UID: %s
 结果: 新的%s已保存，可通过命令回顾"""
 
 
+class HistoryFingerprintRedis(HistoryFingerprintStore):
+    """保存在 Redis 中的指纹，过期后重新与数据库比较"""
+
+    def __init__(self, client: "Redis", qname: str = "history:fingerprint:", ttl: int = 60 * 60 * 24 * 60):
+        self.client = client
+        self.qname = qname
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[str]:
+        data = await self.client.get(f"{self.qname}{key}")
+        return data.decode("utf-8") if data else None
+
+    async def set(self, key: str, value: str):
+        await self.client.set(f"{self.qname}{key}", value, ex=self.ttl)
+
+
 class RefreshHistoryJob(Plugin):
     """历史记录定时刷新"""
 
+    # 同时刷新的用户数量
+    REFRESH_CONCURRENCY = 8
+    # 每个接口每秒允许的请求数
+    REFRESH_RATES = {"challenge": 5, "ledger": 5}
+
     def __init__(
         self,
         cookies: CookiesService,
         genshin_helper: GenshinHelper,
         history_abyss: HistoryDataAbyssServices,
         history_ledger: HistoryDataLedgerServices,
+        redis: RedisDB,
+        notify: NotifySystem,
+        checkpoint: JobCheckpointSystem,
     ):
         self.cookies = cookies
+        self.notify = notify
+        self.checkpoint = checkpoint
         self.genshin_helper = genshin_helper
         self.history_data_abyss = history_abyss
         self.history_data_ledger = history_ledger
+        self.refresher = HistoryRefresher(
+            HistoryFingerprintRedis(redis.client), self.REFRESH_RATES, self.REFRESH_CONCURRENCY
+        )
 
-    @staticmethod
-    async def send_notice(context: "ContextTypes.DEFAULT_TYPE", user_id: int, notice_text: str):
-        try:
-            await context.bot.send_message(user_id, notice_text, parse_mode=ParseMode.HTML)
-        except (BadRequest, Forbidden) as exc:
-            logger.error("执行自动刷新历史记录时发生错误 user_id[%s] Message[%s]", user_id, exc.message)
-        except Exception as exc:
-            logger.error("执行自动刷新历史记录时发生错误 user_id[%s]", user_id, exc_info=exc)
+    async def initialize(self) -> None:
+        state = await self.checkpoint.get_unfinished("refresh_history")
+        if state is not None and state["run"] == get_daily_run():
+            logger.info("每日刷新历史记录任务没有完成，将在 %s 秒后从检查点恢复", self.checkpoint.RESUME_DELAY)
+            self.application.job_queue.run_once(
+                self.daily_refresh_history, self.checkpoint.RESUME_DELAY, name="RefreshHistoryJobResume"
+            )
+
+    async def send_notice(self, context: "ContextTypes.DEFAULT_TYPE", user_id: int, notice_text: str):
+        self.notify.notify(user_id, notice_text, ParseMode.HTML, key="refresh_history")
 
     async def save_abyss_data(self, client: "ZZZClient") -> bool:
         uid = client.player_id
-        abyss_data = await client.get_zzz_challenge(uid, previous=False, lang="zh-cn")
-        if abyss_data.has_data:
-            return await ChallengePlugin.save_abyss_data(self.history_data_abyss, uid, abyss_data)
-        return False
+        return await self.refresher.save_abyss_data(
+            self.history_data_abyss,
+            uid,
+            lambda: client.get_zzz_challenge(uid, previous=False, lang="zh-cn"),
+            lambda data: ChallengePlugin.save_abyss_data(self.history_data_abyss, uid, data),
+        )
 
     async def send_abyss_notice(self, context: "ContextTypes.DEFAULT_TYPE", user_id: int, uid: int):
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -75,8 +112,12 @@ class RefreshHistoryJob(Plugin):
 
     async def _save_ledger_data(self, client: "ZZZClient", year: int, month: int) -> bool:
         req_month = f"{year}0{month}" if month < 10 else f"{year}{month}"
-        diary_info = await client.get_zzz_diary(client.player_id, month=req_month)
-        return await LedgerPlugin.save_ledger_data(self.history_data_ledger, client.player_id, diary_info)
+        return await self.refresher.save_ledger_data(
+            client.player_id,
+            req_month,
+            lambda: client.get_zzz_diary(client.player_id, month=req_month),
+            lambda data: LedgerPlugin.save_ledger_data(self.history_data_ledger, client.player_id, data),
+        )
 
     @staticmethod
     def get_ledger_months() -> Dict[int, int]:
@@ -122,36 +163,63 @@ class RefreshHistoryJob(Plugin):
         logger.info("用户 %s[%s] refresh_all_history 命令请求", user.full_name, user.id)
         message = update.effective_message
         reply = await message.reply_text("正在执行刷新历史记录任务，请稍后...")
-        await self.daily_refresh_history(context)
+        if not await self.do_refresh_history(context, reset=True):
+            await reply.edit_text("刷新历史记录任务正在运行，请等待运行完成")
+            return
         await reply.edit_text("全部账号刷新历史记录任务完成")
 
+    async def refresh_user(self, context: "ContextTypes.DEFAULT_TYPE", cookie_model: CookiesDataBase):
+        user_id = cookie_model.user_id
+        try:
+            async with self.genshin_helper.genshin(user_id) as client:
+                if await self.save_abyss_data(client):
+                    await self.send_abyss_notice(context, user_id, client.player_id)
+                if await self.save_ledger_data(client):
+                    await self.send_ledger_notice(context, user_id, client.player_id)
+        except (InvalidCookies, PlayerNotFoundError, CookiesNotFoundError):
+            return
+        except SimnetBadRequest as exc:
+            logger.warning(
+                "用户 user_id[%s] 请求历史记录失败 [%s]%s", user_id, exc.ret_code, exc.original or exc.message
+            )
+        except SimnetTimedOut:
+            logger.info("用户 user_id[%s] 请求历史记录超时", user_id)
+        except Exception as exc:
+            logger.error("执行自动刷新历史记录时发生错误 user_id[%s]", user_id, exc_info=exc)
+            raise
+
     @job.run_daily(time=datetime.time(hour=6, minute=1, second=0), name="RefreshHistoryJob")
     async def daily_refresh_history(self, context: "ContextTypes.DEFAULT_TYPE"):
+        await self.do_refresh_history(context)
+
+    async def do_refresh_history(self, context: "ContextTypes.DEFAULT_TYPE", reset: bool = False) -> bool:
+        """刷新全部用户的历史记录
+        :param context: 上下文
+        :param reset: 忽略检查点，重新刷新全部用户
+        :return: 任务正在运行时返回 False
+        """
+        try:
+            async with self.checkpoint.run("refresh_history", get_daily_run(), reset) as checkpoint:
+                await self.refresh_all_users(context, checkpoint)
+        except JobCheckpointRunning:
+            logger.warning("每日刷新历史记录任务正在运行，跳过本次运行")
+            return False
+        return True
+
+    async def refresh_all_users(self, context: "ContextTypes.DEFAULT_TYPE", checkpoint: JobCheckpoint):
+        if checkpoint.finished:
+            return
         logger.info("正在执行每日刷新历史记录任务")
+        cookie_list = []
         for database_region in REGION:
-            for cookie_model in await self.cookies.get_all(
-                region=database_region, status=CookiesStatusEnum.STATUS_SUCCESS
-            ):
-                user_id = cookie_model.user_id
-                try:
-                    async with self.genshin_helper.genshin(user_id) as client:
-                        if await self.save_abyss_data(client):
-                            await self.send_abyss_notice(context, user_id, client.player_id)
-                        if await self.save_ledger_data(client):
-                            await self.send_ledger_notice(context, user_id, client.player_id)
-                except (InvalidCookies, PlayerNotFoundError, CookiesNotFoundError):
-                    continue
-                except SimnetBadRequest as exc:
-                    logger.warning(
-                        "用户 user_id[%s] 请求历史记录失败 [%s]%s", user_id, exc.ret_code, exc.original or exc.message
-                    )
-                    continue
-                except SimnetTimedOut:
-                    logger.info("用户 user_id[%s] 请求历史记录超时", user_id)
-                    continue
-                except Exception as exc:
-                    logger.error("执行自动刷新历史记录时发生错误 user_id[%s]", user_id, exc_info=exc)
-                    continue
-                await sleep(1)
-
-        logger.success("执行每日刷新历史记录任务完成")
+            cookie_list.extend(
+                await self.cookies.get_all(region=database_region, status=CookiesStatusEnum.STATUS_SUCCESS)
+            )
+
+        async def refresh_user(cookie_model: CookiesDataBase):
+            await self.refresh_user(context, cookie_model)
+            await checkpoint.mark(cookie_model.user_id)
+
+        metrics = await self.refresher.run(checkpoint.pending(cookie_list, lambda i: i.user_id), refresh_user)
+        await checkpoint.finish()
+        logger.success("执行每日刷新历史记录任务完成 %s", metrics.text())
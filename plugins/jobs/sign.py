@@ -2,6 +2,9 @@ import datetime
 from typing import TYPE_CHECKING
 
 from core.plugin import Plugin, job
+from modules.checkpoint.store import JobCheckpointRunning, get_daily_run
+from plugins.tools.checkpoint import JobCheckpointSystem
+from plugins.tools.notify import NotifySystem
 from plugins.zzz.sign import SignSystem
 from plugins.tools.sign import SignJobType
 from utils.log import logger
@@ -11,17 +14,48 @@ if TYPE_CHECKING:
 
 
 class SignJob(Plugin):
-    def __init__(self, sign_system: SignSystem):
+    # 重签之前等待签到通知发送的最长时间
+    NOTIFY_TIMEOUT = 600
+    # 每完成一个用户就写入检查点，崩溃后恢复时不会重复签到
+    SIGN_FLUSH_SIZE = 1
+
+    def __init__(self, sign_system: SignSystem, notify: NotifySystem, checkpoint: JobCheckpointSystem):
         self.sign_system = sign_system
+        self.notify = notify
+        self.checkpoint = checkpoint
+
+    async def initialize(self) -> None:
+        run = get_daily_run()
+        for name in ("sign", "sign_redo"):
+            state = await self.checkpoint.get_unfinished(name)
+            if state is not None and state["run"] == run:
+                logger.info("自动签到没有完成，将在 %s 秒后从检查点恢复", self.checkpoint.RESUME_DELAY)
+                self.application.job_queue.run_once(self.sign, self.checkpoint.RESUME_DELAY, name="SignJobResume")
+                return
 
     @job.run_daily(time=datetime.time(hour=0, minute=1, second=0), name="SignJob")
     async def sign(self, context: "ContextTypes.DEFAULT_TYPE"):
-        logger.info("正在执行自动签到")
-        await self.sign_system.do_sign_job(context, job_type=SignJobType.START)
-        logger.success("执行自动签到完成")
+        try:
+            async with self.checkpoint.run("sign", get_daily_run(), flush_size=self.SIGN_FLUSH_SIZE) as checkpoint:
+                logger.info("正在执行自动签到")
+                progress = await self.sign_system.do_sign_job(
+                    context, job_type=SignJobType.START, checkpoint=checkpoint
+                )
+        except JobCheckpointRunning:
+            logger.warning("自动签到正在运行，跳过本次运行")
+            return
+        logger.success("执行自动签到完成 %s", progress.text())
+        # 通知发送失败时会更新签到状态，重签需要读取更新后的状态
+        if not await self.notify.join(self.NOTIFY_TIMEOUT):
+            logger.warning("等待签到通知发送超时 %s", self.notify.metrics.text())
         await self.re_sign(context)
 
     async def re_sign(self, context: "ContextTypes.DEFAULT_TYPE"):
-        logger.info("正在执行自动重签")
-        await self.sign_system.do_sign_job(context, job_type=SignJobType.REDO)
-        logger.success("执行自动重签完成")
+        try:
+            async with self.checkpoint.run("sign_redo", get_daily_run(), flush_size=self.SIGN_FLUSH_SIZE) as checkpoint:
+                logger.info("正在执行自动重签")
+                progress = await self.sign_system.do_sign_job(context, job_type=SignJobType.REDO, checkpoint=checkpoint)
+        except JobCheckpointRunning:
+            logger.warning("自动重签正在运行，跳过本次运行")
+            return
+        logger.success("执行自动重签完成 %s", progress.text())
@@ -1,5 +1,5 @@
-from asyncio import sleep
-
+import asyncio
+import time
 from typing import TYPE_CHECKING
 
 from simnet.errors import (
@@ -12,7 +12,8 @@ from core.services.self_help.services import ActionLogService
 from gram_core.basemodel import RegionEnum
 from gram_core.plugin import Plugin
 from gram_core.services.cookies import CookiesService
-from gram_core.services.cookies.models import CookiesStatusEnum
+from gram_core.services.cookies.models import CookiesStatusEnum, CookiesDataBase as Cookies
+from modules.ratelimit.bucket import TokenBucket
 from plugins.tools.genshin import GenshinHelper, PlayerNotFoundError, CookiesNotFoundError
 from utils.log import logger
 
@@ -21,6 +22,11 @@ if TYPE_CHECKING:
 
     from simnet import ZZZClient
 
+# 每日导入时同时处理的用户数
+IMPORT_CONCURRENCY = 8
+# 每日导入时两个用户开始请求之间的最短间隔，由上游接口的频率限制决定
+IMPORT_INTERVAL = 0.2
+
 
 class ActionLogSystem(Plugin):
     """登录记录系统"""
@@ -35,7 +41,7 @@ class ActionLogSystem(Plugin):
         self.helper = helper
         self.action_log_service = action_log_service
 
-    async def import_action_log(self, client: "ZZZClient", authkey: str) -> bool:
+    async def import_action_log(self, client: "ZZZClient", authkey: str, wait: bool = True) -> bool:
         data = await client.get_zzz_action_log(authkey=authkey)
         # 确保第一个数据为登出、最后一条数据为登入
         if not data:
@@ -44,37 +50,61 @@ class ActionLogSystem(Plugin):
             data.pop(0)
         if data[-1].status == 0:
             data.pop(-1)
-        return await self.action_log_service.add(data)
+        return await self.action_log_service.add(data, wait)
+
+    async def import_user(self, cookie_model: Cookies, limiter: TokenBucket):
+        user_id = cookie_model.user_id
+        cookies = cookie_model.data
+        if cookies.get("stoken") is None:
+            return
+        await limiter.acquire()
+        try:
+            async with self.helper.genshin(user_id, region=RegionEnum.HYPERION) as client:
+                client: "ZZZClient"
+                try:
+                    authkey = await client.get_authkey_by_stoken("csc")
+                except ValueError:
+                    logger.warning("用户 user_id[%s] 请求登录记录失败 无 stoken", user_id)
+                    return
+                # 记录进入批量写入队列，不等待写入完成
+                await self.import_action_log(client, authkey, wait=False)
+        except (InvalidCookies, PlayerNotFoundError, CookiesNotFoundError):
+            return
+        except SimnetBadRequest as exc:
+            logger.warning(
+                "用户 user_id[%s] 请求登录记录失败 [%s]%s", user_id, exc.ret_code, exc.original or exc.message
+            )
+        except SimnetTimedOut:
+            logger.info("用户 user_id[%s] 请求登录记录超时", user_id)
+        except Exception as exc:
+            logger.error("执行自动刷新登录记录时发生错误 user_id[%s]", user_id, exc_info=exc)
 
     async def daily_import_login(self, _: "ContextTypes.DEFAULT_TYPE"):
         logger.info("正在执行每日刷新登录记录任务")
-        for cookie_model in await self.cookies.get_all(
-            region=RegionEnum.HYPERION, status=CookiesStatusEnum.STATUS_SUCCESS
-        ):
-            user_id = cookie_model.user_id
-            cookies = cookie_model.data
-            if cookies.get("stoken") is None:
-                continue
-            try:
-                async with self.helper.genshin(user_id, region=RegionEnum.HYPERION) as client:
-                    client: "StarRailClient"
-                    try:
-                        authkey = await client.get_authkey_by_stoken("csc")
-                    except ValueError:
-                        logger.warning("用户 user_id[%s] 请求登录记录失败 无 stoken", user_id)
-                        continue
-                    await self.import_action_log(client, authkey)
-            except (InvalidCookies, PlayerNotFoundError, CookiesNotFoundError):
-                continue
-            except SimnetBadRequest as exc:
-                logger.warning(
-                    "用户 user_id[%s] 请求登录记录失败 [%s]%s", user_id, exc.ret_code, exc.original or exc.message
-                )
-                continue
-            except SimnetTimedOut:
-                logger.info("用户 user_id[%s] 请求登录记录超时", user_id)
-                continue
-            except Exception as exc:
-                logger.error("执行自动刷新登录记录时发生错误 user_id[%s]", user_id, exc_info=exc)
-                continue
-            await sleep(1)
+        start = time.perf_counter()
+        cookie_models = await self.cookies.get_all(region=RegionEnum.HYPERION, status=CookiesStatusEnum.STATUS_SUCCESS)
+        semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+        # 容量为 1 的令牌桶，两个用户开始请求之间至少间隔 IMPORT_INTERVAL
+        limiter = TokenBucket(1 / IMPORT_INTERVAL, 1)
+
+        async def worker(cookie_model: Cookies):
+            async with semaphore:
+                await self.import_user(cookie_model, limiter)
+
+        await asyncio.gather(*[worker(i) for i in cookie_models])
+        await self.action_log_service.wait_pending()
+        metrics = self.action_log_service.writer.metrics
+        logger.success(
+            "每日刷新登录记录任务完成 用户 %s 耗时 %.1fs 写入 %s 条 %s 次 平均 %.0f 条 最大 %s 条 "
+            "最大队列 %s 最大延迟 %.2fs 重试 %s 次 失败 %s 条",
+            len(cookie_models),
+            time.perf_counter() - start,
+            metrics.written,
+            metrics.flushes,
+            metrics.avg_flush,
+            metrics.max_flush,
+            metrics.max_queue_depth,
+            metrics.max_lag,
+            metrics.retries,
+            metrics.failed,
+        )
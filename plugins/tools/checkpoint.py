@@ -0,0 +1,72 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from core.dependence.redisdb import RedisDB
+from core.plugin import Plugin
+from modules.checkpoint.store import (
+    JobCheckpoint,
+    JobCheckpointFile,
+    JobCheckpointManager,
+    JobCheckpointRedis,
+    JobCheckpointStore,
+)
+from utils.const import PROJECT_ROOT
+from utils.log import logger
+
+CHECKPOINT_PATH = PROJECT_ROOT.joinpath("data", "checkpoint")
+
+
+class JobCheckpointSystem(Plugin):
+    # 重启后等待多久恢复没有完成的任务
+    RESUME_DELAY = 60
+
+    def __init__(self, redis: RedisDB):
+        self.redis = redis
+        self.manager: Optional[JobCheckpointManager] = None
+        self.lock = asyncio.Lock()
+
+    async def get_store(self) -> JobCheckpointStore:
+        """Redis 不可用或者使用 fakeredis 时检查点保存在本地文件中"""
+        client = self.redis.client
+        if not type(client).__module__.startswith("fakeredis"):
+            try:
+                await client.ping()
+                return JobCheckpointRedis(client)
+            except Exception as exc:  # pylint: disable=W0703
+                logger.warning("任务检查点无法使用 Redis %s", str(exc))
+        logger.info("任务检查点保存在 %s", CHECKPOINT_PATH)
+        return JobCheckpointFile(CHECKPOINT_PATH)
+
+    async def get_manager(self) -> JobCheckpointManager:
+        async with self.lock:
+            if self.manager is None:
+                self.manager = JobCheckpointManager(await self.get_store())
+        return self.manager
+
+    @asynccontextmanager
+    async def run(
+        self, job: str, run: str, reset: bool = False, flush_size: Optional[int] = None
+    ) -> AsyncIterator[JobCheckpoint]:
+        """开始或恢复一次任务运行，同一个任务正在运行时抛出 JobCheckpointRunning
+        :param job: 任务名称
+        :param run: 运行ID
+        :param reset: 忽略检查点，重新开始运行
+        :param flush_size: 每完成多少个用户写入一次存储
+        :return: 检查点
+        """
+        manager = await self.get_manager()
+        async with manager.run(job, run, reset, flush_size) as checkpoint:
+            if checkpoint.resumed:
+                logger.info("任务 %s 从检查点恢复，跳过已经完成的 %s 个用户", job, checkpoint.resumed)
+            yield checkpoint
+
+    async def get_unfinished(self, job: str) -> Optional[Dict[str, Any]]:
+        """获取没有运行完成的任务状态"""
+        manager = await self.get_manager()
+        return await manager.get_unfinished(job)
+
+    async def get_unfinished_many(self, prefix: str) -> List[Dict[str, Any]]:
+        """获取名称以 prefix 开头的没有运行完成的任务状态"""
+        manager = await self.get_manager()
+        return await manager.get_unfinished_many(prefix)
@@ -1,6 +1,6 @@
 import base64
-from datetime import datetime
-from typing import TYPE_CHECKING, List, Optional, Union
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
 
 from pydantic import BaseModel, validator
 from simnet.errors import BadRequest as SimnetBadRequest, InvalidCookies, TimedOut as SimnetTimedOut
@@ -13,7 +13,11 @@ from core.plugin import Plugin
 from core.services.task.models import Task as TaskUser, TaskStatusEnum
 from core.services.task.services import TaskResinServices, TaskExpeditionServices, TaskDailyServices
 from gram_core.plugin.methods.migrate_data import IMigrateData, MigrateDataException
+from modules.daily_note.predict import NotesPredictor
+from modules.daily_note.scheduler import NotesScheduler
+from modules.notify.dispatcher import NotifyCallback
 from plugins.tools.genshin import GenshinHelper, PlayerNotFoundError, CookiesNotFoundError
+from plugins.tools.notify import NotifySystem
 from utils.log import logger
 
 if TYPE_CHECKING:
@@ -124,17 +128,30 @@ class DailyNoteTaskUser:
 
 
 class DailyNoteSystem(Plugin):
+    # 每个用户的请求间隔
+    NOTES_INTERVAL = 20 * 60
+    # 每个周期分为多少个时间片，每个时间片执行一次
+    NOTES_SLOTS = 20
+    # 同一时间片内同时请求的用户数量
+    NOTES_CONCURRENCY = 8
+
     def __init__(
         self,
         genshin_helper: GenshinHelper,
         resin_service: TaskResinServices,
         expedition_service: TaskExpeditionServices,
         daily_service: TaskDailyServices,
+        notify: NotifySystem,
     ):
         self.genshin_helper = genshin_helper
+        self.notify = notify
         self.resin_service = resin_service
         self.expedition_service = expedition_service
         self.daily_service = daily_service
+        self.scheduler: NotesScheduler[DailyNoteTaskUser] = NotesScheduler(
+            self.NOTES_INTERVAL, self.NOTES_SLOTS, self.NOTES_CONCURRENCY
+        )
+        self.predictor = NotesPredictor(interval=timedelta(seconds=self.NOTES_INTERVAL))
 
     async def get_single_task_user(self, user_id: int) -> DailyNoteTaskUser:
         resin_db = await self.resin_service.get_by_user_id(user_id)
@@ -199,6 +216,10 @@ class DailyNoteSystem(Plugin):
         notes = await client.get_zzz_notes()
         if not user:
             return []
+        return DailyNoteSystem.get_notices(user, notes)
+
+    @staticmethod
+    def get_notices(user: DailyNoteTaskUser, notes: Union["ZZZNote"]) -> List[str]:
         notices = [
             DailyNoteSystem.get_resin_notice(user, notes),
             DailyNoteSystem.get_expedition_notice(user, notes),
@@ -211,22 +232,11 @@ class DailyNoteSystem(Plugin):
         resin_list = await self.resin_service.get_all()
         expedition_list = await self.expedition_service.get_all()
         daily_list = await self.daily_service.get_all()
-        user_list = set()
-        for i in resin_list:
-            user_list.add(i.user_id)
-        for i in expedition_list:
-            user_list.add(i.user_id)
-        for i in daily_list:
-            user_list.add(i.user_id)
-        return [
-            DailyNoteTaskUser(
-                user_id=i,
-                resin_db=next((x for x in resin_list if x.user_id == i), None),
-                expedition_db=next((x for x in expedition_list if x.user_id == i), None),
-                daily_db=next((x for x in daily_list if x.user_id == i), None),
-            )
-            for i in user_list
-        ]
+        tasks: Dict[int, Dict[str, TaskUser]] = {}
+        for key, task_list in (("resin_db", resin_list), ("expedition_db", expedition_list), ("daily_db", daily_list)):
+            for i in task_list:
+                tasks.setdefault(i.user_id, {}).setdefault(key, i)
+        return [DailyNoteTaskUser(user_id=user_id, **task) for user_id, task in tasks.items()]
 
     async def remove_task_user(self, user: DailyNoteTaskUser):
         if user.resin_db:
@@ -335,66 +345,121 @@ class DailyNoteSystem(Plugin):
             await self.import_web_config_daily(user, web_config)
         user.save()
         await self.update_task_user(user)
+        await self.reload_task_user(user_id)
+
+    async def reload_task_user(self, user_id: int):
+        """订阅变化后更新调度中的用户"""
+        user = await self.get_single_task_user(user_id)
+        if user.resin_db or user.expedition_db or user.daily_db:
+            self.scheduler.add(user_id, user)
+            # 提醒设置可能改变，下一个时间片重新请求
+            self.scheduler.schedule(user_id, datetime.now().timestamp())
+        else:
+            self.scheduler.remove(user_id)
+
+    def schedule_next(self, user: DailyNoteTaskUser, notes: Union["ZZZNote"]):
+        """根据便签安排下一次请求，预测之前不再请求"""
+        next_time = self.predictor.predict(
+            notes,
+            datetime.now(),
+            resin=user.resin.notice_num if user.resin else None,
+            resin_noticed=bool(user.resin and user.resin.noticed),
+            expedition=user.expedition is not None,
+            daily_hour=user.daily.notice_hour if user.daily else None,
+            offset=timedelta(seconds=self.scheduler.get_slot(user.user_id) * self.scheduler.tick),
+        )
+        self.scheduler.schedule(user.user_id, next_time.timestamp())
 
     async def do_get_notes_job(self, context: "ContextTypes.DEFAULT_TYPE"):
+        """处理当前时间片到期的用户，每个周期重新读取一次全部用户"""
+        if self.scheduler.need_load():
+            task_list = await self.get_all_task_users()
+            self.scheduler.load({i.user_id: i for i in task_list})
+        task_list = self.scheduler.due()
+        if not task_list:
+            return
+        logger.debug("自动便签提醒 - 本次处理 %s / %s 个用户", len(task_list), len(self.scheduler.users))
+        results = await self.scheduler.run(task_list, lambda task_db: self.do_get_notes(context, task_db))
+        for task_db, result in zip(task_list, results):
+            if isinstance(result, Exception):
+                logger.error("执行自动便签提醒时发生错误 user_id[%s]", task_db.user_id, exc_info=result)
+
+    def get_notice_callback(self, task_db: DailyNoteTaskUser, task_user_db: TaskUser) -> NotifyCallback:
+        """提醒发送失败时更新提醒状态"""
+        user_id = task_db.user_id
+
+        async def callback(exc: Optional[Exception]):
+            if isinstance(exc, BadRequest):
+                logger.error("执行自动便签提醒时发生错误 user_id[%s] Message[%s]", user_id, exc.message)
+                task_user_db.status = TaskStatusEnum.BAD_REQUEST
+            elif isinstance(exc, Forbidden):
+                logger.error("执行自动便签提醒时发生错误 user_id[%s] message[%s]", user_id, exc.message)
+                task_user_db.status = TaskStatusEnum.FORBIDDEN
+            else:
+                if exc is not None:
+                    logger.error("执行自动便签提醒时发生错误 user_id[%s]", user_id, exc_info=exc)
+                return
+            await self.update_task_user(task_db)
+
+        return callback
+
+    async def do_get_notes(self, context: "ContextTypes.DEFAULT_TYPE", task_db: DailyNoteTaskUser):
         include_status: List[TaskStatusEnum] = [
             TaskStatusEnum.STATUS_SUCCESS,
             TaskStatusEnum.TIMEOUT_ERROR,
         ]
-        task_list = await self.get_all_task_users()
-        for task_db in task_list:
-            if task_db.status not in include_status:
-                continue
-            user_id = task_db.user_id
-            logger.debug("自动便签提醒 - 请求便签信息 user_id[%s]", user_id)
-            try:
-                async with self.genshin_helper.genshin(user_id) as client:
-                    text = await self.start_get_notes(client, task_db)
-            except InvalidCookies:
-                text = "自动便签提醒执行失败，Cookie无效"
-                task_db.status = TaskStatusEnum.INVALID_COOKIES
-            except SimnetBadRequest as exc:
-                text = f"自动便签提醒执行失败，API返回信息为 {str(exc)}"
-                task_db.status = TaskStatusEnum.GENSHIN_EXCEPTION
-            except SimnetTimedOut:
-                logger.info("用户 user_id[%s] 请求便签超时", user_id)
-                continue
-            except PlayerNotFoundError:
-                logger.info("用户 user_id[%s] 玩家不存在 关闭并移除自动便签提醒", user_id)
-                await self.remove_task_user(task_db)
+        if task_db.status not in include_status:
+            return
+        user_id = task_db.user_id
+        logger.debug("自动便签提醒 - 请求便签信息 user_id[%s]", user_id)
+        try:
+            async with self.genshin_helper.genshin(user_id) as client:
+                notes = await client.get_zzz_notes()
+            text = self.get_notices(task_db, notes)
+            self.schedule_next(task_db, notes)
+        except InvalidCookies:
+            text = "自动便签提醒执行失败，Cookie无效"
+            task_db.status = TaskStatusEnum.INVALID_COOKIES
+        except SimnetBadRequest as exc:
+            text = f"自动便签提醒执行失败，API返回信息为 {str(exc)}"
+            task_db.status = TaskStatusEnum.GENSHIN_EXCEPTION
+        except SimnetTimedOut:
+            logger.info("用户 user_id[%s] 请求便签超时", user_id)
+            return
+        except PlayerNotFoundError:
+            logger.info("用户 user_id[%s] 玩家不存在 关闭并移除自动便签提醒", user_id)
+            await self.remove_task_user(task_db)
+            self.scheduler.remove(user_id)
+            return
+        except CookiesNotFoundError:
+            logger.info("用户 user_id[%s] cookie 不存在 关闭并移除自动便签提醒", user_id)
+            await self.remove_task_user(task_db)
+            self.scheduler.remove(user_id)
+            return
+        except Exception as exc:
+            logger.error("执行自动便签提醒时发生错误 user_id[%s]", user_id, exc_info=exc)
+            text = "获取便签失败了呜呜呜 ~ 执行自动便签提醒时发生错误"
+        else:
+            task_db.status = TaskStatusEnum.STATUS_SUCCESS
+        for idx, task_user_db in enumerate([task_db.resin_db, task_db.expedition_db, task_db.daily_db]):
+            if task_user_db is None:
                 continue
-            except CookiesNotFoundError:
-                logger.info("用户 user_id[%s] cookie 不存在 关闭并移除自动便签提醒", user_id)
-                await self.remove_task_user(task_db)
+            notice_text = text[idx] if isinstance(text, list) else text
+            if not notice_text:
                 continue
-            except Exception as exc:
-                logger.error("执行自动便签提醒时发生错误 user_id[%s]", user_id, exc_info=exc)
-                text = "获取便签失败了呜呜呜 ~ 执行自动便签提醒时发生错误"
-            else:
-                task_db.status = TaskStatusEnum.STATUS_SUCCESS
-            for idx, task_user_db in enumerate([task_db.resin_db, task_db.expedition_db, task_db.daily_db]):
-                if task_user_db is None:
-                    continue
-                notice_text = text[idx] if isinstance(text, list) else text
-                if not notice_text:
-                    continue
-                if task_user_db.chat_id < 0:
-                    notice_text = (
-                        f'<a href="tg://user?id={task_user_db.user_id}">'
-                        f"NOTICE {task_user_db.user_id}</a>\n\n{notice_text}"
-                    )
-                try:
-                    await context.bot.send_message(task_user_db.chat_id, notice_text, parse_mode=ParseMode.HTML)
-                except BadRequest as exc:
-                    logger.error("执行自动便签提醒时发生错误 user_id[%s] Message[%s]", user_id, exc.message)
-                    task_user_db.status = TaskStatusEnum.BAD_REQUEST
-                except Forbidden as exc:
-                    logger.error("执行自动便签提醒时发生错误 user_id[%s] message[%s]", user_id, exc.message)
-                    task_user_db.status = TaskStatusEnum.FORBIDDEN
-                except Exception as exc:
-                    logger.error("执行自动便签提醒时发生错误 user_id[%s]", user_id, exc_info=exc)
-                    continue
-            await self.update_task_user(task_db)
+            if task_user_db.chat_id < 0:
+                notice_text = (
+                    f'<a href="tg://user?id={task_user_db.user_id}">'
+                    f"NOTICE {task_user_db.user_id}</a>\n\n{notice_text}"
+                )
+            self.notify.notify(
+                task_user_db.chat_id,
+                notice_text,
+                ParseMode.HTML,
+                self.get_notice_callback(task_db, task_user_db),
+                key="daily_note",
+            )
+        await self.update_task_user(task_db)
 
     async def get_migrate_data(self, old_user_id: int, new_user_id: int, _) -> Optional["TaskMigrate"]:
         return await TaskMigrate.create(
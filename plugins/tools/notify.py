@@ -0,0 +1,77 @@
+from typing import Optional
+
+from telegram.error import BadRequest, Forbidden
+
+from core.plugin import Plugin
+from modules.notify.dispatcher import NotifyCallback, NotifyDispatcher, NotifyMetrics
+from utils.log import logger
+
+
+class NotifySystem(Plugin):
+    # 每秒发送的消息数量
+    NOTIFY_GLOBAL_RATE = 25
+    # 每个私聊每秒发送的消息数量
+    NOTIFY_CHAT_RATE = 1
+    # 每个群组每分钟最多发送 20 条消息
+    NOTIFY_GROUP_RATE = 20 / 60
+    NOTIFY_WORKERS = 8
+    # 关闭时等待队列中的消息发送的最长时间
+    NOTIFY_STOP_TIMEOUT = 30
+
+    def __init__(self):
+        self.dispatcher = NotifyDispatcher(
+            self.send,
+            global_rate=self.NOTIFY_GLOBAL_RATE,
+            chat_rate=self.NOTIFY_CHAT_RATE,
+            group_rate=self.NOTIFY_GROUP_RATE,
+            workers=self.NOTIFY_WORKERS,
+        )
+
+    async def initialize(self) -> None:
+        self.dispatcher.start()
+
+    async def shutdown(self) -> None:
+        if self.dispatcher.metrics.depth:
+            logger.info("正在发送队列中的 %s 条消息", self.dispatcher.metrics.depth)
+        await self.dispatcher.stop(self.NOTIFY_STOP_TIMEOUT)
+
+    async def send(self, chat_id: int, text: str, parse_mode: Optional[str]):
+        await self.application.bot.send_message(chat_id, text, parse_mode=parse_mode)
+
+    @staticmethod
+    def log_error(chat_id: int) -> NotifyCallback:
+        async def callback(exc: Optional[Exception]):
+            if isinstance(exc, (BadRequest, Forbidden)):
+                logger.warning("推送消息失败 chat_id[%s] message[%s]", chat_id, exc.message)
+            elif exc is not None:
+                logger.error("推送消息失败 chat_id[%s]", chat_id, exc_info=exc)
+
+        return callback
+
+    def notify(
+        self,
+        chat_id: int,
+        text: str,
+        parse_mode: Optional[str] = None,
+        callback: Optional[NotifyCallback] = None,
+        key: Optional[str] = None,
+    ):
+        """加入推送队列，立即返回
+        :param chat_id: 会话ID
+        :param text: 消息内容
+        :param parse_mode: 解析模式
+        :param callback: 发送完成后调用，参数为发送失败时的错误，默认只记录日志
+        :param key: 合并的分组，只有同一个任务的消息会合并，为空时不合并
+        """
+        self.dispatcher.notify(chat_id, text, parse_mode, callback or self.log_error(chat_id), key)
+
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """等待队列中的消息全部发送
+        :param timeout: 最长等待时间
+        :return: 是否全部发送
+        """
+        return await self.dispatcher.join(timeout)
+
+    @property
+    def metrics(self) -> NotifyMetrics:
+        return self.dispatcher.metrics
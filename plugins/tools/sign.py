@@ -3,10 +3,17 @@ import datetime
 import random
 import time
 from enum import Enum
-from typing import Optional, Tuple, List, TYPE_CHECKING
+from typing import Optional, Tuple, List, TYPE_CHECKING, Callable, Awaitable, Any
 
 from httpx import TimeoutException
-from simnet.errors import BadRequest as SimnetBadRequest, AlreadyClaimed, InvalidCookies, TimedOut as SimnetTimedOut
+from simnet.errors import (
+    BadRequest as SimnetBadRequest,
+    AlreadyClaimed,
+    InvalidCookies,
+    TimedOut as SimnetTimedOut,
+    TooManyRequests,
+    VisitsTooFrequently,
+)
 from sqlalchemy.orm.exc import StaleDataError
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
@@ -20,13 +27,17 @@ from core.services.task.models import TaskStatusEnum
 from core.services.task.services import SignServices
 from core.services.users.services import UserService
 from modules.apihelper.client.components.verify import Verify
+from modules.checkpoint.store import JobCheckpoint
+from modules.sign.executor import SignExecutor, SignProgress, SignRateLimiter, SignRetryType
 from plugins.tools.genshin import PlayerNotFoundError, CookiesNotFoundError, GenshinHelper
+from plugins.tools.notify import NotifySystem
 from plugins.tools.recognize import RecognizeSystem
 from utils.log import logger
 
 if TYPE_CHECKING:
     from simnet import ZZZClient
     from telegram.ext import ContextTypes
+    from core.services.task.models import Task as SignUser
 
 
 class SignJobType(Enum):
@@ -49,6 +60,12 @@ class NeedChallenge(Exception):
 
 
 class SignSystem(Plugin):
+    # 自动签到同时执行的数量
+    SIGN_WORKERS = 16
+    # 每个接口每秒允许的请求数
+    SIGN_RATES = {"rewards": 10, "info": 10, "sign": 5}
+    SIGN_REPORT_INTERVAL = 60
+
     def __init__(
         self,
         redis: RedisDB,
@@ -56,8 +73,10 @@ class SignSystem(Plugin):
         cookies_service: CookiesService,
         sign_service: SignServices,
         genshin_helper: GenshinHelper,
+        notify: NotifySystem,
     ):
         self.cookies_service = cookies_service
+        self.notify = notify
         self.user_service = user_service
         self.sign_service = sign_service
         self.genshin_helper = genshin_helper
@@ -102,6 +121,11 @@ class SignSystem(Plugin):
         )
         return InlineKeyboardMarkup([[InlineKeyboardButton("请尽快点我进行手动验证", url=url)]])
 
+    @staticmethod
+    async def acquire(limiter: Optional[SignRateLimiter], endpoint: str):
+        if limiter is not None:
+            await limiter.acquire(endpoint)
+
     async def start_sign(
         self,
         client: "ZZZClient",
@@ -110,10 +134,12 @@ class SignSystem(Plugin):
         is_sleep: bool = False,
         is_raise: bool = False,
         title: Optional[str] = "签到结果",
+        limiter: Optional[SignRateLimiter] = None,
     ) -> str:
         if is_sleep:
             await asyncio.sleep(random.randint(0, 3))  # nosec
         try:
+            await self.acquire(limiter, "rewards")
             rewards = await client.get_monthly_rewards(lang="zh-cn")
         except SimnetBadRequest as error:
             logger.warning("UID[%s] 获取签到信息失败，API返回信息为 %s", client.player_id, str(error))
@@ -121,6 +147,7 @@ class SignSystem(Plugin):
                 raise error
             return f"获取签到信息失败，API返回信息为 {str(error)}"
         try:
+            await self.acquire(limiter, "info")
             daily_reward_info = await client.get_reward_info(lang="zh-cn")  # 获取签到信息失败
         except SimnetBadRequest as error:
             logger.warning("UID[%s] 获取签到状态失败，API返回信息为 %s", client.player_id, str(error))
@@ -133,6 +160,7 @@ class SignSystem(Plugin):
                     logger.info(
                         "UID[%s] 正在尝试通过验证码\nchallenge[%s]\nvalidate[%s]", client.player_id, challenge, validate
                     )
+                await self.acquire(limiter, "sign")
                 request_daily_reward = await client.request_daily_reward(
                     "sign",
                     method="POST",
@@ -154,6 +182,7 @@ class SignSystem(Plugin):
                     )
                     if validate:
                         logger.success("ajax 通过验证成功\nchallenge[%s]\nvalidate[%s]", challenge, validate)
+                        await self.acquire(limiter, "sign")
                         request_daily_reward = await client.request_daily_reward(
                             "sign",
                             method="POST",
@@ -173,6 +202,7 @@ class SignSystem(Plugin):
                         # 如果无法绕过 检查配置文件是否配置识别 API 尝试请求绕过
                         # 注意 需要重新获取没有进行任何请求的 Challenge
                         logger.info("UID[%s] 正在使用 recognize 重新请求签到", client.player_id)
+                        await self.acquire(limiter, "sign")
                         _request_daily_reward = await client.request_daily_reward(
                             "sign",
                             method="POST",
@@ -188,6 +218,7 @@ class SignSystem(Plugin):
                                 logger.success(
                                     "recognize 通过验证成功\nchallenge[%s]\nvalidate[%s]", _challenge, _validate
                                 )
+                                await self.acquire(limiter, "sign")
                                 request_daily_reward = await client.request_daily_reward(
                                     "sign",
                                     method="POST",
@@ -209,6 +240,7 @@ class SignSystem(Plugin):
                                     )
                                 logger.success("UID[%s] 通过 recognize 签到成功", client.player_id)
                             else:
+                                await self.acquire(limiter, "sign")
                                 request_daily_reward = await client.request_daily_reward(
                                     "sign", method="POST", lang="zh-cn"
                                 )
@@ -219,6 +251,7 @@ class SignSystem(Plugin):
                                 )
                                 raise NeedChallenge(uid=client.player_id, gt=gt, challenge=challenge)
                     else:
+                        await self.acquire(limiter, "sign")
                         request_daily_reward = await client.request_daily_reward("sign", method="POST", lang="zh-cn")
                         gt = request_daily_reward.get("gt", "")
                         challenge = request_daily_reward.get("challenge", "")
@@ -264,7 +297,95 @@ class SignSystem(Plugin):
         )
         return message
 
-    async def do_sign_job(self, context: "ContextTypes.DEFAULT_TYPE", job_type: SignJobType):
+    @staticmethod
+    def classify_sign_error(exc: BaseException) -> Optional[SignRetryType]:
+        """触发验证码与限流的签到稍后重试"""
+        if isinstance(exc, NeedChallenge):
+            return SignRetryType.CAPTCHA
+        if isinstance(exc, (VisitsTooFrequently, TooManyRequests)):
+            return SignRetryType.RATE_LIMIT
+        return None
+
+    @staticmethod
+    async def log_progress(progress: SignProgress):
+        logger.info("自动签到%s", progress.text())
+
+    async def update_sign(self, sign_db: "SignUser"):
+        try:
+            await self.sign_service.update(sign_db)
+        except StaleDataError:
+            logger.warning("用户 user_id[%s] 自动签到数据过期，跳过更新数据", sign_db.user_id)
+
+    async def finish_sign(self, sign_db: "SignUser", text: Optional[str], exc: Optional[BaseException]):
+        """保存签到状态并通知用户，通知在关闭时被丢弃也不影响签到状态"""
+        user_id = sign_db.user_id
+        try:
+            if exc is not None:
+                raise exc
+        except InvalidCookies:
+            text = "自动签到执行失败，Cookie无效"
+            sign_db.status = TaskStatusEnum.INVALID_COOKIES
+        except AlreadyClaimed:
+            text = "今天绳匠已经签到过了~"
+            sign_db.status = TaskStatusEnum.ALREADY_CLAIMED
+        except SimnetBadRequest as exc_:
+            text = f"自动签到执行失败，API返回信息为 {str(exc_)}"
+            sign_db.status = TaskStatusEnum.GENSHIN_EXCEPTION
+        except SimnetTimedOut:
+            text = "签到失败了呜呜呜 ~ 服务器连接超时 服务器熟啦 ~ "
+            sign_db.status = TaskStatusEnum.TIMEOUT_ERROR
+        except NeedChallenge:
+            text = "签到失败，触发验证码风控"
+            sign_db.status = TaskStatusEnum.NEED_CHALLENGE
+        except PlayerNotFoundError:
+            logger.info("用户 user_id[%s] 玩家不存在 关闭并移除自动签到", user_id)
+            await self.sign_service.remove(sign_db)
+            return
+        except CookiesNotFoundError:
+            logger.info("用户 user_id[%s] cookie 不存在 关闭并移除自动签到", user_id)
+            await self.sign_service.remove(sign_db)
+            return
+        except Exception as exc_:
+            logger.error("执行自动签到时发生错误 user_id[%s]", user_id, exc_info=exc_)
+            text = "签到失败了呜呜呜 ~ 执行自动签到时发生错误"
+        else:
+            sign_db.status = TaskStatusEnum.STATUS_SUCCESS
+        await self.update_sign(sign_db)
+        if sign_db.chat_id < 0:
+            text = f'<a href="tg://user?id={sign_db.user_id}">NOTICE {sign_db.user_id}</a>\n\n{text}'
+
+        async def callback(exc_: Optional[Exception]):
+            # 只有通知失败时才需要再次更新签到状态
+            if isinstance(exc_, BadRequest):
+                logger.error("执行自动签到时发生错误 user_id[%s] Message[%s]", user_id, exc_.message)
+                sign_db.status = TaskStatusEnum.BAD_REQUEST
+            elif isinstance(exc_, Forbidden):
+                logger.error("执行自动签到时发生错误 user_id[%s] message[%s]", user_id, exc_.message)
+                sign_db.status = TaskStatusEnum.FORBIDDEN
+            else:
+                if exc_ is not None:
+                    logger.error("执行自动签到时发生错误 user_id[%s]", user_id, exc_info=exc_)
+                return
+            await self.update_sign(sign_db)
+
+        self.notify.notify(sign_db.chat_id, text, ParseMode.HTML, callback, key="sign")
+
+    async def do_sign_job(
+        self,
+        context: "ContextTypes.DEFAULT_TYPE",
+        job_type: SignJobType,
+        report: Optional[Callable[[SignProgress], Awaitable[Any]]] = None,
+        checkpoint: Optional[JobCheckpoint] = None,
+    ) -> SignProgress:
+        """执行自动签到
+        :param context: 上下文
+        :param job_type: 签到类型
+        :param report: 定时报告进度，默认写入日志
+        :param checkpoint: 检查点，跳过已经完成的用户
+        :return: 签到进度
+        """
+        if checkpoint is not None and checkpoint.finished:
+            return SignProgress()
         include_status: List[TaskStatusEnum] = [
             TaskStatusEnum.STATUS_SUCCESS,
             TaskStatusEnum.TIMEOUT_ERROR,
@@ -277,58 +398,30 @@ class SignSystem(Plugin):
             include_status.remove(TaskStatusEnum.STATUS_SUCCESS)
         else:
             raise ValueError
-        sign_list = await self.sign_service.get_all()
-        for sign_db in sign_list:
-            if sign_db.status not in include_status:
-                continue
-            user_id = sign_db.user_id
-            try:
-                async with self.genshin_helper.genshin(user_id) as client:
-                    text = await self.start_sign(client, is_sleep=True, is_raise=True, title=title)
-            except InvalidCookies:
-                text = "自动签到执行失败，Cookie无效"
-                sign_db.status = TaskStatusEnum.INVALID_COOKIES
-            except AlreadyClaimed:
-                text = "今天绳匠已经签到过了~"
-                sign_db.status = TaskStatusEnum.ALREADY_CLAIMED
-            except SimnetBadRequest as exc:
-                text = f"自动签到执行失败，API返回信息为 {str(exc)}"
-                sign_db.status = TaskStatusEnum.GENSHIN_EXCEPTION
-            except SimnetTimedOut:
-                text = "签到失败了呜呜呜 ~ 服务器连接超时 服务器熟啦 ~ "
-                sign_db.status = TaskStatusEnum.TIMEOUT_ERROR
-            except NeedChallenge:
-                text = "签到失败，触发验证码风控"
-                sign_db.status = TaskStatusEnum.NEED_CHALLENGE
-            except PlayerNotFoundError:
-                logger.info("用户 user_id[%s] 玩家不存在 关闭并移除自动签到", user_id)
-                await self.sign_service.remove(sign_db)
-                continue
-            except CookiesNotFoundError:
-                logger.info("用户 user_id[%s] cookie 不存在 关闭并移除自动签到", user_id)
-                await self.sign_service.remove(sign_db)
-                continue
-            except Exception as exc:
-                logger.error("执行自动签到时发生错误 user_id[%s]", user_id, exc_info=exc)
-                text = "签到失败了呜呜呜 ~ 执行自动签到时发生错误"
-            else:
-                sign_db.status = TaskStatusEnum.STATUS_SUCCESS
-            if sign_db.chat_id < 0:
-                text = f'<a href="tg://user?id={sign_db.user_id}">NOTICE {sign_db.user_id}</a>\n\n{text}'
-            try:
-                await context.bot.send_message(sign_db.chat_id, text, parse_mode=ParseMode.HTML)
-            except BadRequest as exc:
-                logger.error("执行自动签到时发生错误 user_id[%s] Message[%s]", user_id, exc.message)
-                sign_db.status = TaskStatusEnum.BAD_REQUEST
-            except Forbidden as exc:
-                logger.error("执行自动签到时发生错误 user_id[%s] message[%s]", user_id, exc.message)
-                sign_db.status = TaskStatusEnum.FORBIDDEN
-            except Exception as exc:
-                logger.error("执行自动签到时发生错误 user_id[%s]", user_id, exc_info=exc)
-                continue
-            else:
-                sign_db.status = TaskStatusEnum.STATUS_SUCCESS
-            try:
-                await self.sign_service.update(sign_db)
-            except StaleDataError:
-                logger.warning("用户 user_id[%s] 自动签到数据过期，跳过更新数据", user_id)
+        sign_list = [i for i in await self.sign_service.get_all() if i.status in include_status]
+        if checkpoint is not None:
+            sign_list = checkpoint.pending(sign_list, lambda i: i.user_id)
+        limiter = SignRateLimiter(self.SIGN_RATES)
+
+        async def sign(sign_db: "SignUser") -> str:
+            async with self.genshin_helper.genshin(sign_db.user_id) as client:
+                return await self.start_sign(client, is_raise=True, title=title, limiter=limiter)
+
+        async def done(sign_db: "SignUser", text: Optional[str], exc: Optional[BaseException]):
+            await self.finish_sign(sign_db, text, exc)
+            if checkpoint is not None:
+                await checkpoint.mark(sign_db.user_id)
+
+        executor = SignExecutor(
+            sign,
+            done,
+            self.classify_sign_error,
+            limiter=limiter,
+            workers=self.SIGN_WORKERS,
+            report=report or self.log_progress,
+            report_interval=self.SIGN_REPORT_INTERVAL,
+        )
+        progress = await executor.run(sign_list)
+        if checkpoint is not None:
+            await checkpoint.finish()
+        return progress
@@ -10,7 +10,7 @@ from gram_core.config import config
 from gram_core.plugin import Plugin, handler
 from gram_core.plugin.methods.inline_use_data import IInlineUseData
 from gram_core.services.template.services import TemplateService
-from modules.action_log.client import ActionLogAnalyse
+from modules.action_log.client import ActionLogSummaryAnalyse
 from plugins.tools.action_log_system import ActionLogSystem
 from plugins.tools.genshin import GenshinHelper
 from plugins.tools.player_info import PlayerInfoSystem
@@ -81,11 +81,11 @@ class ActionLogPlugins(Plugin):
                 self.add_delete_message_job(msg, delay=60)
 
     async def get_render_data(self, uid: int):
-        r = await self.action_log_service.get_data(uid, 63)
-        r2 = await self.action_log_service.count_uptime_period(uid)
-        if not r or not r2:
+        # 历史日期使用缓存的单日汇总，只有今天的记录实时查询
+        summary = await self.action_log_service.get_summary(uid, 180)
+        d = ActionLogSummaryAnalyse(summary, 63)
+        if not d.data:
             raise NotSupport("未查询到登录记录")
-        d = ActionLogAnalyse(r, r2)
         data = d.get_data()
         line_data = d.get_line_data()
         records = d.get_record_data()
@@ -1,12 +1,11 @@
 import asyncio
 import contextlib
 import time
-from asyncio import sleep
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 from simnet import Region
 from telegram import Update, Message
-from telegram.error import BadRequest, Forbidden
+from telegram.error import BadRequest
 from telegram.ext import CallbackContext
 from telegram.ext import filters
 
@@ -15,8 +14,11 @@ from gram_core.basemodel import RegionEnum
 from gram_core.services.cookies import CookiesService
 from gram_core.services.cookies.models import CookiesStatusEnum
 from gram_core.services.users.services import UserAdminService
-from plugins.zzz.redeem.runner import RedeemRunner, RedeemResult, RedeemQueueFull
+from modules.checkpoint.store import JobCheckpoint, JobCheckpointRunning
+from plugins.zzz.redeem.runner import RedeemRunner, RedeemResult, RedeemQueueFull, RedeemPriority
+from plugins.tools.checkpoint import JobCheckpointSystem
 from plugins.tools.genshin import GenshinHelper
+from plugins.tools.notify import NotifySystem
 from utils.log import logger
 
 
@@ -40,19 +42,45 @@ REDEEM_ALL_FAIL_TEXT = """#### 批量兑换 ####
 class Redeem(Plugin):
     """兑换码兑换"""
 
+    # 重启后恢复批量兑换任务的最长时间
+    REDEEM_RESUME_TIME = 24 * 60 * 60
+
     def __init__(
         self,
         genshin_helper: GenshinHelper,
         user_admin_service: UserAdminService,
         cookies_service: CookiesService,
+        notify: NotifySystem,
+        checkpoint: JobCheckpointSystem,
     ):
         self.genshin_helper = genshin_helper
+        self.notify = notify
+        self.checkpoint = checkpoint
         self.user_admin_service = user_admin_service
         self.max_code_in_pri_message = 5
         self.max_code_in_pub_message = 3
         self.redeem_runner = RedeemRunner(genshin_helper)
         self.cookies_service = cookies_service
 
+    @staticmethod
+    def get_checkpoint_job(code: str) -> str:
+        """每个兑换码使用单独的检查点"""
+        return f"redeem:{code}"
+
+    async def initialize(self) -> None:
+        for state in await self.checkpoint.get_unfinished_many(self.get_checkpoint_job("")):
+            # 兑换码有效期较短，只恢复一天内开始的批量兑换任务
+            if time.time() - state.get("time", 0) >= self.REDEEM_RESUME_TIME:
+                continue
+            code = state["run"]
+            logger.info("批量兑换任务 code[%s] 没有完成，将在 %s 秒后从检查点恢复", code, self.checkpoint.RESUME_DELAY)
+            self.application.job_queue.run_once(
+                self.resume_redeem_job, self.checkpoint.RESUME_DELAY, data=code, name=f"RedeemJobResume:{code}"
+            )
+
+    async def shutdown(self) -> None:
+        await self.redeem_runner.stop()
+
     async def _callback(self, data: "RedeemResult") -> None:
         code = data.code
         uid = data.uid if data.uid else "未知"
@@ -82,7 +110,10 @@ class Redeem(Plugin):
             task_data.error = "此服务器暂不支持进行兑换哦~"
             await self._callback(task_data)
             return
-        priority = 1 if await self.user_admin_service.is_admin(user_id) else 2
+        if await self.user_admin_service.is_admin(user_id):
+            priority = RedeemPriority.ADMIN
+        else:
+            priority = RedeemPriority.USER
         try:
             await self.redeem_runner.run(task_data, self._callback, priority)
         except RedeemQueueFull:
@@ -136,42 +167,61 @@ class Redeem(Plugin):
         today = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
         text = REDEEM_TEXT.format(today, uid, code, msg)
-        try:
-            await self.application.bot.send_message(user_id, text)
-        except BadRequest as exc:
-            logger.warning("执行自动兑换兑换码时发生错误 user_id[%s] Message[%s]", user_id, exc.message)
-        except Forbidden as exc:
-            logger.warning("执行自动兑换兑换码时发生错误 user_id[%s] message[%s]", user_id, exc.message)
-        except Exception as exc:
-            logger.warning("执行自动兑换兑换码时发生错误 user_id[%s]", user_id, exc_info=exc)
-
-    async def job_redeem_one_code(self, user_id: int, code: str, count: List[int]):
+        self.notify.notify(user_id, text, key="redeem")
+
+    async def job_redeem_one_code(
+        self, user_id: int, code: str, count: List[int], checkpoint: Optional[JobCheckpoint] = None
+    ) -> asyncio.Future:
+        """加入批量兑换队列，队列已满时等待
+        :return: 兑换完成后结束的 Future
+        """
         task_data = RedeemResult(user_id=user_id, code=code, count=count)
-        priority = 1 if await self.user_admin_service.is_admin(user_id) else 2
-        try:
-            await self.redeem_runner.run(task_data, self._job_callback, priority, True)
-        except RedeemQueueFull:
-            await sleep(5)
-            await self.job_redeem_one_code(user_id, code, count)
 
-    async def do_redeem_job(self, message: "Message", code: str) -> Tuple[int, int]:
+        async def callback(data: "RedeemResult") -> None:
+            await self._job_callback(data)
+            if checkpoint is not None:
+                await checkpoint.mark(data.user_id)
+
+        return await self.redeem_runner.submit(task_data, callback, RedeemPriority.JOB, True)
+
+    async def do_redeem_job(self, message: Optional["Message"], code: str) -> Tuple[int, int]:
+        """批量兑换，同一个兑换码正在兑换时抛出 JobCheckpointRunning"""
+        job = self.get_checkpoint_job(code)
+        # 已经完成的兑换码再次兑换时重新开始
+        reset = await self.checkpoint.get_unfinished(job) is None
+        async with self.checkpoint.run(job, code, reset) as checkpoint:
+            return await self.redeem_all(message, code, checkpoint)
+
+    async def redeem_all(self, message: Optional["Message"], code: str, checkpoint: JobCheckpoint) -> Tuple[int, int]:
         count = [0, 0]
         task_list = await self.cookies_service.get_all(
             region=RegionEnum.HOYOLAB, status=CookiesStatusEnum.STATUS_SUCCESS
         )
+        task_list = checkpoint.pending(task_list, lambda i: i.user_id)
         task_len = len(task_list)
+        futures = []
         for idx, task_db in enumerate(task_list):
-            user_id = task_db.user_id
-            try:
-                await self.job_redeem_one_code(user_id, code, count)
-            except Exception as exc:
-                logger.warning("执行自动兑换兑换码时发生错误 user_id[%s]", user_id, exc_info=exc)
-            if idx % 10 == 0:
-                text = REDEEM_ALL_TEXT.format(code, idx, task_len)
+            futures.append(await self.job_redeem_one_code(task_db.user_id, code, count, checkpoint))
+            if message is not None and idx % 10 == 0:
+                text = REDEEM_ALL_TEXT.format(code, count[0] + count[1], task_len)
                 with contextlib.suppress(Exception):
                     await message.edit_text(text)
+        for task_db, result in zip(task_list, await asyncio.gather(*futures, return_exceptions=True)):
+            if isinstance(result, Exception):
+                logger.warning("执行自动兑换兑换码时发生错误 user_id[%s]", task_db.user_id, exc_info=result)
+        await checkpoint.finish()
         return count[0], count[1]
 
+    async def resume_redeem_job(self, context: CallbackContext) -> None:
+        code = context.job.data
+        logger.info("从检查点恢复批量兑换任务 code[%s]", code)
+        try:
+            success, failed = await self.do_redeem_job(None, code)
+        except JobCheckpointRunning:
+            logger.warning("批量兑换任务 code[%s] 正在运行，跳过恢复", code)
+            return
+        logger.success("批量兑换任务完成 code[%s] 成功 %s 失败 %s", code, success, failed)
+
     @handler.command(command="redeem_all", admin=True, block=False)
     async def redeem_all_command_start(self, update: Update, context: CallbackContext) -> None:
         message = update.effective_message
@@ -182,7 +232,11 @@ class Redeem(Plugin):
             return
         code = codes[0]
         reply = await message.reply_text("开始运行批量兑换任务，请等待...")
-        success, failed = await self.do_redeem_job(reply, code)
+        try:
+            success, failed = await self.do_redeem_job(reply, code)
+        except JobCheckpointRunning:
+            await reply.edit_text("该兑换码的批量兑换任务正在运行，请等待运行完成")
+            return
         text = REDEEM_ALL_FAIL_TEXT.format(code, success, failed)
         await message.reply_text(text)
         self.add_delete_message_job(reply, delay=1)
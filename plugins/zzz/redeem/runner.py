@@ -1,14 +1,16 @@
 import asyncio
 from dataclasses import dataclass
-from queue import PriorityQueue
-from typing import Coroutine, Any, Optional, List, TYPE_CHECKING, Union
+from typing import Coroutine, Any, Optional, List, TYPE_CHECKING
 
 from simnet.errors import RegionNotSupported, RedemptionInvalid, RedemptionClaimed, RedemptionCooldown
 from telegram import Message
 
 from gram_core.basemodel import RegionEnum
+from modules.redeem.scheduler import RedeemPriority, RedeemQueueFull, RedeemScheduler
 from plugins.tools.genshin import GenshinHelper
 
+__all__ = ("RedeemResult", "RedeemRunner", "RedeemPriority", "RedeemQueueFull")
+
 if TYPE_CHECKING:
     from simnet import ZZZClient
 
@@ -23,77 +25,82 @@ class RedeemResult:
     count: Optional[List[int]] = None
 
 
-class RedeemRunnerTask:
-    def __init__(self, task: Coroutine[Any, Any, None]):
-        self.task = task
-
-    def __lt__(self, other: "RedeemRunnerTask") -> bool:
-        return False
-
-    async def run(self) -> None:
-        await self.task
-
-
-class RedeemQueueFull(Exception):
-    pass
-
-
 class RedeemRunner:
+    # 同时兑换的数量
+    REDEEM_WORKERS = 8
+    # 每秒兑换的最大次数
+    REDEEM_RATE = 5
+    # 同一账号两次兑换的最小间隔，与上游的冷却时间相同
+    ACCOUNT_INTERVAL = 5
+    # 批量任务最多等待的数量
+    MAX_PENDING = 64
+    # 交互请求最多等待的数量
+    MAX_INTERACTIVE = 20
+
     def __init__(self, genshin_helper: GenshinHelper):
-        self.gcsim_version: Optional[str] = None
-        self.sema = asyncio.BoundedSemaphore(1)
-        self.queue_size = 21
-        self.queue: PriorityQueue[List[Union[int, RedeemRunnerTask]]] = PriorityQueue(maxsize=self.queue_size)
         self.genshin_helper = genshin_helper
-
-    @staticmethod
-    async def _execute_queue(
-        redeem_task: Coroutine[Any, Any, RedeemResult],
+        self.scheduler = RedeemScheduler(
+            lambda exc: isinstance(exc, RedemptionCooldown),
+            account_interval=self.ACCOUNT_INTERVAL,
+            cooldown=self.ACCOUNT_INTERVAL,
+            global_rate=self.REDEEM_RATE,
+            workers=self.REDEEM_WORKERS,
+            max_pending=self.MAX_PENDING,
+            max_interactive=self.MAX_INTERACTIVE,
+        )
+
+    async def submit(
+        self,
+        data: RedeemResult,
         callback_task: "(result: RedeemResult) -> Coroutine[Any, Any, None]",
-    ) -> None:
-        data = await redeem_task
-        await callback_task(data)
+        priority: int = RedeemPriority.USER,
+        only_region: bool = False,
+    ) -> asyncio.Future:
+        """加入兑换队列，批量任务在队列已满时等待
+        :param data: 兑换数据
+        :param callback_task: 兑换完成后调用
+        :param priority: 优先级
+        :param only_region: 只使用国际服账号
+        :return: 兑换完成后结束的 Future
+        """
+
+        async def done(_, exc: Optional[Exception]):
+            data.error = self.get_error(exc) if exc is not None else None
+            await callback_task(data)
+
+        return await self.scheduler.submit(data.user_id, lambda: self.redeem(data, only_region), done, priority)
 
     async def run(
         self,
         data: RedeemResult,
         callback_task: "(result: RedeemResult) -> Coroutine[Any, Any, None]",
-        priority: int = 2,
+        priority: int = RedeemPriority.USER,
         only_region: bool = False,
     ) -> None:
-        redeem_task = self.redeem_code(data, only_region)
-        queue_task = RedeemRunnerTask(self._execute_queue(redeem_task, callback_task))
-        if priority == 2 and self.queue.qsize() >= (self.queue_size - 1):
-            raise RedeemQueueFull()
-        if self.queue.full():
-            raise RedeemQueueFull()
-        self.queue.put([priority, queue_task])
-        async with self.sema:
-            if not self.queue.empty():
-                _, task = self.queue.get()
-                await task.run()
-                await asyncio.sleep(5)
-
-    async def redeem_code(self, result: RedeemResult, only_region: bool) -> RedeemResult:
-        error = None
-        try:
-            async with self.genshin_helper.genshin(
-                result.user_id,
-                region=RegionEnum.HOYOLAB if only_region else None,
-                player_id=result.uid,
-            ) as client:
-                client: "ZZZClient"
-                result.uid = client.player_id
-                await client.redeem_code_by_hoyolab(result.code)
-        except RegionNotSupported:
-            error = "此服务器暂不支持进行兑换哦~"
-        except RedemptionInvalid:
-            error = "兑换码格式不正确，请确认。"
-        except RedemptionClaimed:
-            error = "此兑换码已经兑换过了。"
-        except RedemptionCooldown as e:
-            error = e.message
-        except Exception as e:
-            error = str(e)[:500]
-        result.error = error
-        return result
+        """兑换并等待完成，交互请求在队列已满时抛出 RedeemQueueFull"""
+        await (await self.submit(data, callback_task, priority, only_region))
+
+    async def stop(self):
+        await self.scheduler.stop()
+
+    async def redeem(self, result: RedeemResult, only_region: bool):
+        async with self.genshin_helper.genshin(
+            result.user_id,
+            region=RegionEnum.HOYOLAB if only_region else None,
+            player_id=result.uid,
+        ) as client:
+            client: "ZZZClient"
+            result.uid = client.player_id
+            await client.redeem_code_by_hoyolab(result.code)
+
+    @staticmethod
+    def get_error(exc: Exception) -> str:
+        if isinstance(exc, RegionNotSupported):
+            return "此服务器暂不支持进行兑换哦~"
+        if isinstance(exc, RedemptionInvalid):
+            return "兑换码格式不正确，请确认。"
+        if isinstance(exc, RedemptionClaimed):
+            return "此兑换码已经兑换过了。"
+        if isinstance(exc, RedemptionCooldown):
+            return exc.message
+        return str(exc)[:500]
@@ -5,7 +5,7 @@ from urllib.parse import urlencode
 
 from simnet import ZZZClient, Region
 from simnet.models.zzz.wish import ZZZBannerType
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputFile, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.constants import ChatAction
 from telegram.ext import ConversationHandler, filters
 from telegram.helpers import create_deep_linked_url
@@ -13,6 +13,7 @@ from telegram.helpers import create_deep_linked_url
 from core.dependence.assets import AssetsService
 from core.plugin import Plugin, conversation, handler
 from core.services.cookies import CookiesService
+from core.services.gacha_log_rank.repositories import GachaLogRankBatchRepository
 from core.services.players import PlayersService
 from core.services.template.models import FileType
 from core.services.template.services import TemplateService
@@ -80,15 +81,30 @@ class WishLogPlugin(Plugin.Conversation):
         cookie_service: CookiesService,
         player_info: PlayerInfoSystem,
         gacha_log_rank: GachaLogRankService,
+        gacha_log_rank_batch: GachaLogRankBatchRepository,
     ):
         self.template_service = template_service
         self.players_service = players_service
         self.assets_service = assets
         self.cookie_service = cookie_service
-        self.gacha_log = GachaLog(gacha_log_rank_service=gacha_log_rank)
+        self.gacha_log = GachaLog(gacha_log_rank_service=gacha_log_rank, gacha_log_rank_batch=gacha_log_rank_batch)
         self.wish_photo = None
         self.player_info = player_info
 
+    async def initialize(self) -> None:
+        count = await self.gacha_log.storage.migrate_layout()
+        if count:
+            logger.success("调频记录目录结构迁移完成，共迁移 %s 个账号", count)
+        # 版本变化后全服运气分布需要从所有账号重新生成，在后台执行
+        self.application.job_queue.run_once(self.check_luck, 0, name="GachaLogLuckCheck")
+
+    async def check_luck(self, _: "ContextTypes.DEFAULT_TYPE") -> None:
+        if await self.gacha_log.check_luck():
+            logger.success("全服运气分布重新生成完成")
+
+    async def shutdown(self) -> None:
+        await self.gacha_log.uploader.close()
+
     async def get_player_id(self, user_id: int, player_id: int, offset: int) -> int:
         """获取绑定的游戏ID"""
         logger.debug("尝试获取已绑定的绝区零账号")
@@ -318,10 +334,13 @@ class WishLogPlugin(Plugin.Conversation):
         try:
             await message.reply_chat_action(ChatAction.TYPING)
             player_id = await self.get_player_id(user.id, uid, offset)
-            path = await self.gacha_log.gacha_log_to_zzzgf(str(user.id), str(player_id))
+            out = BytesIO()
+            await self.gacha_log.gacha_log_to_zzzgf(str(user.id), str(player_id), out)
+            out.seek(0)
             await message.reply_chat_action(ChatAction.UPLOAD_DOCUMENT)
             await message.reply_document(
-                document=open(path, "rb+"), caption=f"调频记录导出文件 - ZZZGF {ZZZGF_VERSION}"
+                document=InputFile(out, filename=f"{user.id}-{player_id}-zzzgf.json"),
+                caption=f"调频记录导出文件 - ZZZGF {ZZZGF_VERSION}",
             )
         except GachaLogNotFound:
             logger.info("未找到用户 %s[%s] 的调频记录", user.full_name, user.id)
@@ -631,8 +650,17 @@ class WishLogPlugin(Plugin.Conversation):
         logger.info("用户 %s[%s] signal_log_rank_recount 命令请求", user.full_name, user.id)
         message = update.effective_message
         reply = await message.reply_text("正在重新统计抽卡记录排行榜")
-        await self.gacha_log.recount_all_data(reply)
-        await reply.edit_text("重新统计完成")
+        progress = await self.gacha_log.recount_all_data(reply)
+        # 同时重新生成全服运气分布
+        await self.gacha_log.rebuild_luck()
+        await reply.edit_text(f"重新统计完成\n{progress}")
+
+    @handler.command(command="signal_log_status", block=False, admin=True)
+    async def signal_log_status(self, update: "Update", _: "ContextTypes.DEFAULT_TYPE") -> None:
+        user = update.effective_user
+        logger.info("用户 %s[%s] signal_log_status 命令请求", user.full_name, user.id)
+        message = update.effective_message
+        await message.reply_text(f"调频记录写入\n{self.gacha_log.writer.text()}", quote=True)
 
     @staticmethod
     async def get_migrate_data(
@@ -0,0 +1,116 @@
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from simnet.models.zzz.self_help import ZZZSelfHelpActionLog, ZZZSelfHelpActionLogReason
+
+from modules.action_log.client import ActionLogAnalyse
+from modules.action_log.date import TZ
+from modules.action_log.models import ActionLogPair, ActionLogSession
+
+UID = 10000001
+
+
+def random_history(rng: random.Random, days: int, end: datetime) -> List[ZZZSelfHelpActionLog]:
+    """从新到旧生成交替的登录、登出记录"""
+    records = []
+    time_ = end - timedelta(minutes=rng.randint(1, 60))
+    while time_ > end - timedelta(days=days):
+        logout = time_
+        login = logout - timedelta(minutes=rng.randint(1, 120))
+        records.append((logout, "登出"))
+        records.append((login, "登录"))
+        time_ = login - timedelta(minutes=rng.randint(5, 240))
+    return [
+        ZZZSelfHelpActionLog(id=idx, uid=UID, datetime=t, action_name=reason, client_ip="127.0.0.1")
+        for idx, (t, reason) in enumerate(reversed(records))
+    ]
+
+
+def init_pair(data: List[ZZZSelfHelpActionLog]) -> List[ActionLogPair]:
+    """原先的登录、登出记录配对"""
+    pairs = []
+    start = None
+    for d in data:
+        if start:
+            if d.reason == ZZZSelfHelpActionLogReason.LOG_OUT:
+                pairs.append(ActionLogPair(start=start, end=d))
+                start = None
+        elif d.reason == ZZZSelfHelpActionLogReason.LOG_IN:
+            start = d
+    return pairs
+
+
+class LegacyAnalyse(ActionLogAnalyse):
+    """每次查看时重新配对，并为每项统计单独遍历会话"""
+
+    def __init__(self, data: List[ZZZSelfHelpActionLog], data2):
+        super().__init__(data, data2, [])
+        self.pairs = init_pair(data)
+        self.periods = {}
+        for name in ("this_week", "last_week", "this_month", "last_month"):
+            period = getattr(self, name)
+            self.periods[name] = [d for d in self.pairs if period.start <= d.start_time < period.end]
+
+    def get_this_week_duration(self) -> int:
+        return sum(d.duration.seconds for d in self.periods["this_week"])
+
+    def get_last_week_duration(self) -> int:
+        return sum(d.duration.seconds for d in self.periods["last_week"])
+
+    def get_this_month_duration(self) -> int:
+        return sum(d.duration.seconds for d in self.periods["this_month"])
+
+    def get_last_month_duration(self) -> int:
+        return sum(d.duration.seconds for d in self.periods["last_month"])
+
+    def get_this_month_avg_duration(self) -> float:
+        data = self.periods["this_month"]
+        return (self.get_this_month_duration() / len(data)) if data else 0
+
+    def get_last_month_avg_duration(self) -> float:
+        data = self.periods["last_month"]
+        return (self.get_last_month_duration() / len(data)) if data else 0
+
+    def get_this_week_long_duration(self) -> int:
+        return max((d.duration.seconds for d in self.periods["this_week"]), default=0)
+
+    def get_this_week_short_duration(self) -> int:
+        return min((d.duration.seconds for d in self.periods["this_week"]), default=0)
+
+    def get_this_month_long_duration(self) -> int:
+        return max((d.duration.seconds for d in self.periods["this_month"]), default=0)
+
+    def get_this_month_short_duration(self) -> int:
+        return min((d.duration.seconds for d in self.periods["this_month"]), default=0)
+
+
+def test_sessions_match_pairs():
+    records = random_history(random.Random(0), 30, datetime.now(tz=TZ))
+    pairs = init_pair(records)
+    sessions = ActionLogAnalyse.init_sessions(records)
+    assert [(i.start_time, i.end_time, i.duration.seconds) for i in pairs] == [
+        (i.start, i.end, i.duration) for i in sessions
+    ]
+    # 与数据库中读取的会话相同
+    assert [ActionLogSession.parse_raw(i.json()) for i in sessions] == sessions
+    assert isinstance(pairs[0], ActionLogPair)
+
+
+def test_view_cpu():
+    records = random_history(random.Random(1), 180, datetime.now(tz=TZ))
+    data2 = {k: random.randint(0, 180) for k in range(24)}
+    # 会话在导入时生成，查看时直接读取
+    sessions = ActionLogAnalyse.init_sessions(records)
+
+    def run(func, times: int = 5):
+        start = time.process_time()
+        for _ in range(times):
+            result = func()
+        return result, time.process_time() - start
+
+    legacy, legacy_time = run(lambda: LegacyAnalyse(records, data2).get_data())
+    result, result_time = run(lambda: ActionLogAnalyse(records, data2, sessions).get_data())
+    assert result == legacy
+    assert result_time * 5 < legacy_time
@@ -0,0 +1,158 @@
+import random
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+import pytest
+from simnet.models.zzz.self_help import ZZZSelfHelpActionLog
+
+from modules.action_log.client import ActionLogAnalyse, ActionLogSummaryAnalyse
+from modules.action_log.date import TZ, get_day
+from modules.action_log.models import ActionLogDay, ActionLogSession
+from modules.action_log.query import ActionLogQuery, ActionLogSource
+
+UID = 10000001
+
+
+class FakeSource(ActionLogSource):
+    """内存中的 InfluxDB 替身，统计扫描的原始记录数"""
+
+    def __init__(self, records: List[ZZZSelfHelpActionLog], sessions: Optional[List[ActionLogSession]] = None):
+        self.records = records
+        self.sessions = sessions or []
+        self.days = {}
+        self.scanned = 0
+        self.day_queries = 0
+
+    async def get_records(self, uid: int, start: datetime, end: datetime) -> List[ZZZSelfHelpActionLog]:
+        result = [i for i in self.records if i.uid == uid and start <= i.time < end]
+        self.scanned += len(result)
+        return result
+
+    async def get_sessions(self, uid: int, start: datetime, end: datetime) -> List[ActionLogSession]:
+        result = [i for i in self.sessions if start <= i.start < end]
+        self.scanned += len(result)
+        return result
+
+    async def get_days(self, uid: int, start: date, end: date) -> List[ActionLogDay]:
+        self.day_queries += 1
+        return [v for (u, d), v in self.days.items() if u == uid and start <= d < end]
+
+    async def add_days(self, uid: int, days: List[ActionLogDay]):
+        for i in days:
+            self.days[(uid, i.day)] = ActionLogDay.parse_raw(i.json(by_alias=True))
+
+    async def delete_days(self, uid: int, start: date, end: date):
+        for key in [k for k in self.days if k[0] == uid and start <= k[1] < end]:
+            del self.days[key]
+
+
+def random_history(rng: random.Random, days: int, end: datetime) -> List[ZZZSelfHelpActionLog]:
+    """从新到旧生成交替的登录、登出记录"""
+    records = []
+    time = end - timedelta(minutes=rng.randint(1, 120))
+    while time > end - timedelta(days=days):
+        logout = time
+        login = logout - timedelta(minutes=rng.randint(1, 300))
+        records.append((logout, "登出"))
+        records.append((login, "登录"))
+        time = login - timedelta(minutes=rng.randint(10, 1500))
+    return [
+        ZZZSelfHelpActionLog(id=idx, uid=UID, datetime=t, action_name=reason, client_ip="127.0.0.1")
+        for idx, (t, reason) in enumerate(reversed(records))
+    ]
+
+
+def hourly_count(records: List[ZZZSelfHelpActionLog]):
+    """与 count_uptime_period 的查询相同，统计每个整点窗口是否有登录"""
+    windows = {i.time.replace(minute=0, second=0, microsecond=0) for i in records if i.status == 1}
+    data = {k: 0 for k in range(24)}
+    for window in windows:
+        data[(window + timedelta(hours=1)).hour] += 1
+    return data
+
+
+def full_analyse(records: List[ZZZSelfHelpActionLog], now: datetime):
+    data = [i for i in records if i.time >= now - timedelta(days=63)]
+    analyse = ActionLogAnalyse(data, hourly_count(records))
+    return analyse.get_data(), analyse.get_line_data(), analyse.get_record_data()
+
+
+def summary_analyse(summary):
+    analyse = ActionLogSummaryAnalyse(summary, 63)
+    return analyse.get_data(), analyse.get_line_data(), analyse.get_record_data()
+
+
+@pytest.mark.parametrize("seed", range(6))
+async def test_summary_equivalence(seed: int):
+    rng = random.Random(seed)
+    now = datetime.now(tz=TZ)
+    records = random_history(rng, 170, now)
+    # 部分记录在导入时已经生成会话，更早的旧记录需要在汇总时配对
+    cutoff = now - timedelta(days=rng.choice([0, 30, 100, 170]))
+    imported = [i for i in records if i.time >= cutoff]
+    if imported and imported[0].status == 0:
+        imported = imported[1:]
+    query = ActionLogQuery(FakeSource(records, ActionLogAnalyse.init_sessions(imported)))
+    summary = await query.get_summary(UID, 180, now)
+    assert summary_analyse(summary) == full_analyse(records, now)
+
+
+async def test_view_load():
+    rng = random.Random(0)
+    now = datetime.now(tz=TZ)
+    for days in (20, 170):
+        records = random_history(rng, days, now)
+        source = FakeSource(records)
+        query = ActionLogQuery(source)
+        await query.get_summary(UID, 180, now)
+        assert source.day_queries == 1
+        # 之后的查询只扫描今天的记录，与历史长度无关
+        source.scanned = 0
+        summary = await query.get_summary(UID, 180, now)
+        today = summary.days[-1].day
+        assert source.scanned == len([i for i in records if i.time >= TZ.localize(datetime(*today.timetuple()[:3], 4))])
+        assert source.day_queries == 1
+        # 缓存失效后直接读取已保存的汇总
+        query.cache.clear()
+        source.scanned = 0
+        await query.get_summary(UID, 180, now)
+        assert source.day_queries == 2
+        assert source.scanned <= 20
+
+
+async def test_invalidate():
+    rng = random.Random(1)
+    now = datetime.now(tz=TZ)
+    records = random_history(rng, 60, now)
+    # 最近十天的记录稍后才导入
+    recent = [i for i in records if i.time >= now - timedelta(days=10)]
+    source = FakeSource([i for i in records if i.time < now - timedelta(days=10)])
+    query = ActionLogQuery(source)
+    await query.get_summary(UID, 180, now)
+    source.records = records
+    await query.invalidate(UID, recent)
+    summary = await query.get_summary(UID, 180, now)
+    assert summary_analyse(summary) == full_analyse(records, now)
+
+
+async def test_invalidate_unchanged():
+    rng = random.Random(2)
+    now = datetime.now(tz=TZ)
+    records = random_history(rng, 60, now)
+    cutoff = now - timedelta(days=5)
+    source = FakeSource([i for i in records if i.time < cutoff])
+    query = ActionLogQuery(source)
+    await query.get_summary(UID, 180, now)
+    days = dict(source.days)
+    # 每日导入完整的历史记录，没有新记录时保留已保存的汇总与缓存
+    await query.invalidate(UID, source.records)
+    assert source.days == days
+    assert query.cache
+    # 有新记录时只删除最早的新记录前一天及之后的汇总
+    source.records = records
+    await query.invalidate(UID, records)
+    first = min(key[1] for key in days if key not in source.days)
+    assert first >= get_day(cutoff) - timedelta(days=2)
+    assert all(v == days[k] for k, v in source.days.items())
+    summary = await query.get_summary(UID, 180, now)
+    assert summary_analyse(summary) == full_analyse(records, now)
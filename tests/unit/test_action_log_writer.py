@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import pytest
+
+from modules.action_log.writer import ActionLogBatchWriter
+
+
+class FakeInflux:
+    """记录每次写入的 InfluxDB 替身"""
+
+    def __init__(self, latency: float = 0.01, failures: int = 0):
+        self.latency = latency
+        self.failures = failures
+        self.batches = []
+
+    async def write(self, items):
+        await asyncio.sleep(self.latency)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError
+        self.batches.append(list(items))
+        return True
+
+
+async def test_batch_size():
+    influx = FakeInflux()
+    writer = ActionLogBatchWriter(influx.write, batch_size=100, flush_interval=0.05)
+
+    async def user(idx: int):
+        await asyncio.sleep(idx * 0.001)
+        future = await writer.put([f"action_log,uid={idx} status={i}i" for i in range(20)])
+        await future
+
+    await asyncio.gather(*[user(i) for i in range(200)])
+    await writer.close()
+    items = [i for batch in influx.batches for i in batch]
+    assert len(items) == len(set(items)) == 4000
+    assert all(len(batch) <= 100 for batch in influx.batches)
+    assert writer.metrics.flushes == len(influx.batches) < 200
+    assert writer.metrics.written == 4000
+    assert writer.metrics.max_flush <= 100
+    assert writer.metrics.queue_depth == 0
+
+
+async def test_flush_interval():
+    influx = FakeInflux(latency=0)
+    writer = ActionLogBatchWriter(influx.write, batch_size=1000, flush_interval=0.1)
+    start = time.perf_counter()
+    await (await writer.put(["a", "b"]))
+    elapsed = time.perf_counter() - start
+    assert 0.1 <= elapsed < 0.5
+    assert influx.batches == [["a", "b"]]
+    assert writer.metrics.max_lag >= 0.1
+    await writer.close()
+
+
+async def test_retry():
+    influx = FakeInflux(failures=2)
+    writer = ActionLogBatchWriter(influx.write, flush_interval=0, retry_delay=0.01)
+    await (await writer.put(["a"]))
+    assert writer.metrics.retries == 2
+    assert influx.batches == [["a"]]
+
+    influx.failures = 10
+    future = await writer.put(["b", "c"])
+    with pytest.raises(ConnectionError):
+        await future
+    assert writer.metrics.failed == 2
+    await writer.close()
+
+
+async def test_backpressure():
+    influx = FakeInflux(latency=0.02)
+    writer = ActionLogBatchWriter(influx.write, batch_size=50, flush_interval=0.01, max_queue=100)
+    depths = []
+
+    async def user(idx: int):
+        await writer.put([f"{idx}-{i}" for i in range(30)])
+        depths.append(writer.queue_size)
+
+    await asyncio.gather(*[user(i) for i in range(50)])
+    await writer.close()
+    assert max(depths) <= 100
+    assert writer.metrics.max_queue_depth <= 100
+    assert writer.metrics.written == 1500
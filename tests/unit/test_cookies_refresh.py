@@ -0,0 +1,68 @@
+import asyncio
+import math
+import time
+from types import SimpleNamespace
+from typing import List
+
+from modules.cookies.refresh import CookiesRefreshPipeline, CookiesRefreshResult
+
+LATENCY = 0.05
+
+
+class MemoryCookiesWriter:
+    """内存中的 CookiesBatchRepository 替身，统计事务数量"""
+
+    def __init__(self):
+        self.rows = {}
+        self.invalid = set()
+        self.commits = 0
+
+    async def update_many(self, cookies: List[SimpleNamespace]):
+        await asyncio.sleep(0.001)
+        self.commits += 1
+        for cookie in cookies:
+            self.rows[cookie.id] = dict(cookie.data)
+
+    async def mark_invalid(self, cookies: List[SimpleNamespace]):
+        await asyncio.sleep(0.001)
+        self.commits += 1
+        self.invalid.update(cookie.id for cookie in cookies)
+
+
+async def refresh(cookie: SimpleNamespace) -> CookiesRefreshResult:
+    await asyncio.sleep(LATENCY)
+    if cookie.id % 10 == 0:
+        return CookiesRefreshResult.INVALID
+    if cookie.id % 10 == 1:
+        return CookiesRefreshResult.SKIPPED
+    if cookie.id % 10 == 2:
+        raise ValueError
+    cookie.data = {"cookie_token": f"token{cookie.id}"}
+    return CookiesRefreshResult.UPDATED
+
+
+async def test_refresh():
+    cookies = [SimpleNamespace(id=i, data={}) for i in range(500)]
+    writer = MemoryCookiesWriter()
+    pipeline = CookiesRefreshPipeline(
+        refresh, writer.update_many, writer.mark_invalid, concurrency=32, rate=1000, batch_size=100
+    )
+    metrics = await pipeline.run(cookies)
+    assert metrics.updated == 350 and metrics.invalid == 50 and metrics.skipped == 100
+    assert len(writer.rows) == 350 and writer.rows[3] == {"cookie_token": "token3"}
+    assert writer.invalid == {i for i in range(500) if i % 10 == 0}
+    assert metrics.commits == writer.commits == math.ceil(350 / 100) + math.ceil(50 / 100)
+    # 逐个刷新需要 500 * LATENCY
+    assert metrics.elapsed < 500 * LATENCY / 8
+
+
+async def test_rate_limit():
+    cookies = [SimpleNamespace(id=i, data={}) for i in range(3, 63)]
+    writer = MemoryCookiesWriter()
+    pipeline = CookiesRefreshPipeline(
+        refresh, writer.update_many, writer.mark_invalid, concurrency=60, rate=40, batch_size=100
+    )
+    start = time.monotonic()
+    await pipeline.run(cookies)
+    # 前 40 个令牌可以立即使用，之后每秒 40 个
+    assert 0.5 - 0.05 <= time.monotonic() - start < 1.5
@@ -0,0 +1,140 @@
+import random
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import pytest
+from simnet.models.zzz.chronicle.notes import ZZZNote
+
+from modules.daily_note.predict import NotesPredictor
+
+MAX_STAMINA = 240
+START = datetime(2024, 1, 1)
+INTERVAL = timedelta(minutes=20)
+
+
+def get_notes(stamina: int, progress: int, sale_state: str = "SaleStateNo") -> ZZZNote:
+    """progress 为距离恢复下一点电量已经经过的分钟数"""
+    restore = max((MAX_STAMINA - stamina) * 6 - progress, 0) * 60 if stamina < MAX_STAMINA else 0
+    return ZZZNote.parse_obj(
+        {
+            "energy": {"progress": {"max": MAX_STAMINA, "current": stamina}, "restore": restore},
+            "vitality": {"max": 400, "current": 0},
+            "vhs_sale": {"sale_state": sale_state},
+            "card_sign": "CardSignNo",
+            "abyss_refresh": 0,
+        }
+    )
+
+
+class SimUser:
+    """模拟玩家的电量，每 6 分钟恢复一点，每天随机使用几次电量，偶尔使用道具恢复"""
+
+    def __init__(self, rng: random.Random, minutes: int):
+        self.threshold = rng.choice([120, 140, 160, 180])
+        self.stamina = [0] * minutes
+        self.progress = [0] * minutes
+        stamina, progress = rng.randint(0, MAX_STAMINA), 0
+        events = {}
+        for day in range(minutes // 1440):
+            for _ in range(rng.randint(1, 3)):
+                events[day * 1440 + rng.randrange(8 * 60, 24 * 60)] = -rng.randint(40, 240)
+            if rng.random() < 0.1:
+                events[day * 1440 + rng.randrange(1440)] = 60
+        for minute in range(minutes):
+            if stamina < MAX_STAMINA:
+                progress += 1
+                if progress == 6:
+                    stamina, progress = stamina + 1, 0
+            else:
+                progress = 0
+            if minute in events:
+                stamina = max(stamina + events[minute], 0)
+            self.stamina[minute] = stamina
+            self.progress[minute] = progress
+
+    def crossings(self) -> List[int]:
+        return [i for i in range(1, len(self.stamina)) if self.stamina[i - 1] < self.threshold <= self.stamina[i]]
+
+
+def simulate(user: SimUser, predictor: Optional[NotesPredictor], offset: int):
+    """返回请求次数与每次提醒的时间"""
+    minute, noticed, calls, notices = offset, False, 0, []
+    while minute < len(user.stamina):
+        calls += 1
+        stamina = user.stamina[minute]
+        # 与 DailyNoteSystem.get_resin_notice 相同
+        if stamina >= user.threshold:
+            if not noticed:
+                notices.append(minute)
+                noticed = True
+        else:
+            noticed = False
+        if predictor is None:
+            minute += INTERVAL.seconds // 60
+            continue
+        now = START + timedelta(minutes=minute)
+        notes = get_notes(stamina, user.progress[minute])
+        next_time = predictor.predict(notes, now, resin=user.threshold, resin_noticed=noticed)
+        # 调度器的最小间隔为一个时间片
+        minute = max(minute + 1, int((next_time - START).total_seconds() // 60))
+    return calls, notices
+
+
+def delays(crossings: List[int], notices: List[int]) -> List[int]:
+    """每次电量达到提醒数值之后多久收到提醒"""
+    result = []
+    for crossing in crossings:
+        after = [i for i in notices if i >= crossing]
+        if after:
+            result.append(after[0] - crossing)
+    return result
+
+
+def test_stamina_time():
+    now = START
+    predictor = NotesPredictor()
+    notes = get_notes(100, 2)
+    # 40 点电量需要 240 分钟，当前一点已经恢复了 2 分钟
+    assert predictor.get_stamina_time(notes, 140, now) == now + timedelta(minutes=238)
+    assert predictor.get_stamina_time(get_notes(140, 0), 140, now) is None
+    assert predictor.predict(notes, now, resin=140) == now + timedelta(minutes=239)
+
+
+def test_fixed_moments():
+    predictor = NotesPredictor()
+    now = datetime(2024, 1, 1, 21, 30)
+    notes = get_notes(MAX_STAMINA, 0)
+    # 每日任务提醒时间与下一个小时
+    assert predictor.predict(notes, now, daily_hour=22) == datetime(2024, 1, 1, 22)
+    assert predictor.predict(notes, datetime(2024, 1, 1, 22, 5), daily_hour=22) == datetime(2024, 1, 1, 23)
+    # 每日刷新
+    assert predictor.predict(notes, datetime(2024, 1, 1, 3), resin=240, resin_noticed=True) == datetime(2024, 1, 1, 4)
+    # 录像店经营中无法预测
+    doing = get_notes(MAX_STAMINA, 0, "SaleStateDoing")
+    assert predictor.predict(doing, now, expedition=True) == now + INTERVAL
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_simulation(seed: int):
+    rng = random.Random(seed)
+    minutes = 7 * 1440
+    predictor = NotesPredictor(interval=INTERVAL)
+    fixed_calls = predicted_calls = 0
+    fixed_delays, predicted_delays = [], []
+    fixed_notices = predicted_notices = 0
+    for _ in range(50):
+        user = SimUser(rng, minutes)
+        offset = rng.randrange(20)
+        calls, notices = simulate(user, None, offset)
+        fixed_calls += calls
+        fixed_notices += len(notices)
+        fixed_delays.extend(delays(user.crossings(), notices))
+        calls, notices = simulate(user, predictor, offset)
+        predicted_calls += calls
+        predicted_notices += len(notices)
+        predicted_delays.extend(delays(user.crossings(), notices))
+    # 模拟中请求次数约为固定间隔的 1/8
+    assert predicted_calls * 7 <= fixed_calls
+    # 提醒次数基本相同，达到提醒数值后收到提醒的时间不比固定间隔晚
+    assert predicted_notices >= fixed_notices * 0.9
+    assert sorted(predicted_delays)[len(predicted_delays) // 2] <= sorted(fixed_delays)[len(fixed_delays) // 2]
@@ -0,0 +1,75 @@
+import asyncio
+import random
+from collections import Counter
+
+from modules.daily_note.scheduler import NotesScheduler, TimerWheel
+
+
+def test_timer_wheel():
+    wheel = TimerWheel(8)
+    wheel.schedule("a", 3)
+    wheel.schedule("b", 3 + 8)
+    wheel.schedule("c", 5)
+    assert wheel.advance(3) == ["a"]
+    # 超过一圈的键保留到下一次经过
+    assert wheel.advance(4) == []
+    wheel.remove("c")
+    assert wheel.advance(10) == []
+    assert wheel.advance(11) == ["b"]
+    assert len(wheel) == 0
+
+
+def test_timer_wheel_catch_up():
+    wheel = TimerWheel(8)
+    wheel.advance(0)
+    for i in range(1, 6):
+        wheel.schedule(i, i)
+    # 跳过的时间片在下一次前进时补上
+    assert sorted(wheel.advance(5)) == [1, 2, 3, 4, 5]
+
+
+def test_spread():
+    rng = random.Random(0)
+    scheduler = NotesScheduler(interval=1200, slots=20)
+    user_ids = rng.sample(range(10**9), 2000)
+    scheduler.load({i: i for i in user_ids}, tick=0)
+    processed = Counter()
+    sizes = []
+    for tick in range(1, 61):
+        due = scheduler.due(tick)
+        sizes.append(len(due))
+        processed.update(due)
+    # 每个用户每个周期处理一次，每个时间片只处理约 1/20 的用户
+    assert set(processed) == set(user_ids)
+    assert set(processed.values()) == {3}
+    assert max(sizes) < 2000 / 20 * 1.5
+
+
+def test_load_keeps_schedule():
+    scheduler = NotesScheduler(interval=1200, slots=20)
+    scheduler.load({1: "a", 2: "b"}, tick=0)
+    assert scheduler.due(1) == ["a"]
+    scheduler.load({1: "A", 3: "c"}, tick=1)
+    assert scheduler.wheel.get(1) == 21
+    assert 2 not in scheduler.wheel
+    assert [scheduler.due(i) for i in (2, 3, 21)] == [[], ["c"], ["A"]]
+
+
+async def test_bounded_concurrency():
+    scheduler = NotesScheduler(concurrency=4)
+    running, peak = 0, 0
+
+    async def func(user: int):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if user == 5:
+            raise ValueError
+        return user
+
+    results = await scheduler.run(range(20), func)
+    assert peak == 4
+    assert isinstance(results[5], ValueError)
+    assert results[6] == 6
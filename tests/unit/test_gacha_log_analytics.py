@@ -0,0 +1,157 @@
+import datetime
+import random
+
+import pytest
+
+from metadata.pool.pool import get_pool_by_id
+from modules.gacha_log.analytics import GachaLogColumns, build_pool_summary, get_banner_index
+from modules.gacha_log.models import FiveStarItem, GachaItem, GachaLogPoolSummary, Pool
+from modules.gacha_log.summary import GachaLogSummaries
+
+POOL_NAMES = ["代理人调频", "音擎调频", "常驻调频", "邦布调频"]
+ITEM_NAMES = {
+    "代理人": ["艾莲", "雅", "朱鸢", "猫又", "莱卡恩", "安比", "妮可"],
+    "音擎": ["深海访客", "硫磺石", "啜泣摇篮", "街头巨星"],
+    "邦布": ["阿全", "鲨牙布", "企鹅布"],
+}
+
+
+def check_avatar_up(name: str, _: datetime.datetime) -> bool:
+    return name not in {"莱卡恩", "猫又", "格莉丝", "丽娜", "「11号」", "珂蕾妲"}
+
+
+class Summaries(GachaLogSummaries):
+    check_avatar_up = staticmethod(check_avatar_up)
+
+
+def random_history(rng: random.Random, size: int):
+    time = datetime.datetime(2024, 7, 4, 10)
+    items = []
+    for idx in range(size):
+        # 十连内的记录时间相同
+        if idx % 10 == 0:
+            time += datetime.timedelta(hours=rng.randint(1, 72))
+        item_type = rng.choice(list(ITEM_NAMES))
+        items.append(
+            GachaItem.construct(
+                id=str(1000000 + idx),
+                name=rng.choice(ITEM_NAMES[item_type]),
+                gacha_type="2",
+                item_type=item_type,
+                rank_type=rng.choices(["3", "4", "5"], [85, 13, 2])[0],
+                time=time,
+            )
+        )
+    return items
+
+
+def legacy_star_items(data, pool_name: str, rank: str):
+    """逐条统计的四星、五星列表"""
+    count = 0
+    result = []
+    for item in data:
+        count += 1
+        if item.rank_type == rank:
+            if rank == "4" or pool_name in {
+                "代理人": {"代理人调频", "常驻调频"},
+                "音擎": {"音擎调频", "常驻调频"},
+                "邦布": {"邦布调频"},
+            }.get(item.item_type, ()):
+                is_up, is_big = False, False
+                if rank == "5" and item.item_type == "代理人" and pool_name == "代理人调频":
+                    is_up = check_avatar_up(item.name, item.time)
+                    is_big = (not result[-1][4]) if result else False
+                result.append((item.name, item.item_type, count, item.time, is_up, is_big))
+            count = 0
+    return result, count
+
+
+def legacy_numbers(total: int, five: list, no_five_star: int):
+    five_star = len(five)
+    five_star_up = len([i for i in five if i[4]])
+    five_star_big = len([i for i in five if i[5]])
+    five_star_avg = round((total - no_five_star) / five_star, 2) if five_star != 0 else 0
+    small_protect = (
+        round((five_star_up - five_star_big) / (five_star - five_star_big) * 100.0, 1)
+        if five_star - five_star_big != 0
+        else "0.0"
+    )
+    return five_star_avg, small_protect, sum(i[2] * 160 for i in five if i[4])
+
+
+def summary_items(items):
+    return [(i.name, i.type, i.count, i.time, i.isUp, i.isBig) for i in items]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_build_pool_summary_parity(seed: int):
+    rng = random.Random(seed)
+    history = random_history(rng, rng.randint(0, 3000))
+    for pool_name in POOL_NAMES:
+        summary = build_pool_summary(GachaLogColumns(history), pool_name, check_avatar_up)
+        five, no_five_star = legacy_star_items(history, pool_name, "5")
+        four, no_four_star = legacy_star_items(history, pool_name, "4")
+        assert summary_items(summary.five) == five
+        assert [i[:4] for i in summary_items(summary.four)] == [i[:4] for i in four]
+        assert summary.no_five_star == no_five_star
+        assert summary.no_four_star == no_four_star
+        assert summary.total == len(history)
+        assert summary.five_star_up == len([i for i in five if i[4]])
+        assert summary.five_star_big == len([i for i in five if i[5]])
+        assert legacy_numbers(summary.total, summary_items(summary.five), summary.no_five_star) == legacy_numbers(
+            len(history), five, no_five_star
+        )
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_incremental_summary_parity(seed: int):
+    rng = random.Random(seed)
+    history = random_history(rng, rng.randint(1, 2000))
+    summaries = Summaries()
+    for pool_name in POOL_NAMES:
+        summary = summaries.update_pool_summary(pool_name, GachaLogPoolSummary(), history[:1])
+        cut = 1
+        while cut < len(history):
+            cut = min(len(history), cut + rng.randint(1, 200))
+            summary = summaries.update_pool_summary(pool_name, summary, history[:cut])
+        expected = build_pool_summary(GachaLogColumns(history), pool_name, check_avatar_up)
+        assert summary.dict() == expected.dict()
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_count_window_parity(seed: int):
+    rng = random.Random(seed)
+    history = random_history(rng, rng.randint(0, 2000))
+    columns = GachaLogColumns(history)
+    for _ in range(50):
+        start = datetime.datetime(2024, 7, 1) + datetime.timedelta(hours=rng.randint(0, 24 * 500))
+        end = start + datetime.timedelta(hours=rng.randint(0, 24 * 30))
+        kwargs = {"from": start.strftime("%Y-%m-%d %H:%M:%S")}
+        old = Pool(five=["a"], four=[], name="a", to=end.strftime("%Y-%m-%d %H:%M:%S"), **kwargs)
+        new = Pool(five=["a"], four=[], name="a", to=end.strftime("%Y-%m-%d %H:%M:%S"), **kwargs)
+        old.count_item(history)
+        new.count_columns(columns)
+        assert (old.count, old.start, old.end) == (new.count, new.start, new.end)
+
+
+@pytest.mark.parametrize("pool_type", [1, 2, 3, 5])
+def test_banner_index_parity(pool_type: int):
+    rng = random.Random(pool_type)
+    definitions = get_pool_by_id(pool_type)
+    index = get_banner_index(pool_type)
+    assert get_banner_index(pool_type) is index
+    items = []
+    for _ in range(3000):
+        time = datetime.datetime(2024, 6, 1) + datetime.timedelta(seconds=rng.randint(0, 86400 * 200))
+        if rng.random() < 0.1:
+            # 卡池边界
+            data = rng.choice(definitions)
+            time = datetime.datetime.strptime(data[rng.choice(["from", "to"])], "%Y-%m-%d %H:%M:%S")
+        items.append(
+            FiveStarItem.construct(name=rng.choice(ITEM_NAMES["代理人"]), icon="", count=1, type="代理人", time=time)
+        )
+    expected = [Pool(**i) for i in definitions]
+    for pool in expected:
+        for item in items:
+            pool.parse(item)
+    assert [i.to_list() for i in index.assign(items)] == [i.to_list() for i in expected]
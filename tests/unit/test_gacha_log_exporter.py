@@ -0,0 +1,117 @@
+import datetime
+import json
+import tracemalloc
+from io import BytesIO
+
+import pytest
+
+from modules.gacha_log.exporter import GachaLogJSONExporter, ZZZGFExporter
+from modules.gacha_log.models import GachaItem, GachaLogInfo, ImportType, ZZZGFInfo, ZZZGFItem, ZZZGFModel
+from modules.gacha_log.storage import GachaLogStorage
+
+ITEMS = [("代理人", "艾莲", "5"), ("音擎", "深海访客", "4"), ("邦布", "鲨牙布", "3")]
+
+
+def gacha_items(size: int):
+    start = datetime.datetime(2024, 7, 4)
+    return [
+        GachaItem.construct(
+            id=str(1720000000000000000 + idx),
+            name=ITEMS[idx % 3][1],
+            gacha_id="2001" if idx % 2 else "",
+            gacha_type=["1", "2", "3", "5"][idx % 4],
+            item_id="",
+            item_type=ITEMS[idx % 3][0],
+            rank_type=ITEMS[idx % 3][2],
+            time=start + datetime.timedelta(minutes=idx),
+        )
+        for idx in range(size)
+    ]
+
+
+def legacy_export(info: ZZZGFInfo, items) -> bytes:
+    """原先先构造完整模型再序列化的导出方式"""
+    model = ZZZGFModel(info=info, list=[])
+    for item in items:
+        model.list.append(
+            ZZZGFItem(
+                id=item.id,
+                name=item.name,
+                gacha_id=item.gacha_id,
+                gacha_type=item.gacha_type,
+                item_id=item.item_id,
+                item_type=item.item_type,
+                rank_type=item.rank_type,
+                time=item.time.strftime("%Y-%m-%d %H:%M:%S"),
+            )
+        )
+    return json.dumps(json.loads(model.json()), ensure_ascii=False, indent=4).encode("utf-8")
+
+
+@pytest.mark.parametrize("size", [0, 1, 3, 2500])
+async def test_export_compatible(size: int):
+    items = gacha_items(size)
+    info = ZZZGFInfo(uid="10000001", export_app=ImportType.PaiGram.value, export_app_version="v4")
+    exporter = ZZZGFExporter(batch_size=1000)
+    out = BytesIO()
+    await exporter.write(out, info, iter(items))
+    assert out.getvalue() == legacy_export(info, items)
+
+
+@pytest.mark.parametrize("size", [0, 1, 2500])
+async def test_export_pools_compatible(size: int, tmp_path):
+    storage = GachaLogStorage(tmp_path)
+    items = sorted(gacha_items(size), key=lambda x: x.gacha_type)
+    item_list = {}
+    for pool_name, gacha_type in (("代理人调频", "2"), ("音擎调频", "3"), ("常驻调频", "1"), ("邦布调频", "5")):
+        item_list[pool_name] = [GachaItem(**i.dict()) for i in items if i.gacha_type == gacha_type]
+    await storage.save(
+        GachaLogInfo(user_id="1", uid="10000001", update_time=datetime.datetime(2024, 7, 4), item_list=item_list)
+    )
+    info = ZZZGFInfo(uid="10000001", export_app=ImportType.PaiGram.value, export_app_version="v4")
+    exporter = ZZZGFExporter(batch_size=100)
+    out = BytesIO()
+    size = await exporter.write_pools(out, info, storage.iter_pools("1", "10000001"))
+    loaded = await storage.load("1", "10000001")
+    expected = legacy_export(info, [item for pool in loaded.item_list.values() for item in pool])
+    assert out.getvalue() == expected
+    assert size == len(expected)
+
+
+class CountingSink:
+    """只统计写入字节数的缓冲区"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.size += len(data)
+
+
+async def test_export_memory():
+    items = gacha_items(50000)
+    info = ZZZGFInfo(uid="10000001", export_app=ImportType.PaiGram.value, export_app_version="v4")
+    sink = CountingSink()
+    tracemalloc.start()
+    size = await ZZZGFExporter().write(sink, info, iter(items))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # 除写入的缓冲区之外，峰值内存只与单批记录有关，与文档大小无关
+    assert size == sink.size
+    assert peak < size / 4
+
+
+@pytest.mark.parametrize("size", [0, 1, 2500])
+async def test_json_export_compatible(size: int, tmp_path):
+    storage = GachaLogStorage(tmp_path)
+    items = sorted(gacha_items(size), key=lambda x: x.gacha_type)
+    item_list = {"代理人调频": [], "音擎调频": [], "常驻调频": [], "邦布调频": []}
+    for pool_name, gacha_type in (("代理人调频", "2"), ("音擎调频", "3"), ("常驻调频", "1"), ("邦布调频", "5")):
+        item_list[pool_name] = [GachaItem(**i.dict()) for i in items if i.gacha_type == gacha_type]
+    info = GachaLogInfo(user_id="1", uid="10000001", update_time=datetime.datetime(2024, 7, 4), item_list=item_list)
+    await storage.save(info)
+    header = await storage.load("1", "10000001", pools=[])
+    chunks = GachaLogJSONExporter(batch_size=100).iter_chunks(header, storage.iter_pools("1", "10000001"))
+    data = b"".join([chunk async for chunk in chunks])
+    assert data == (await storage.load("1", "10000001")).json().encode("utf-8")
+    assert GachaLogInfo.parse_raw(data) == info
@@ -0,0 +1,77 @@
+import asyncio
+import datetime
+import time
+
+import pytest
+from simnet.models.zzz.wish import ZZZBannerType
+
+from modules.gacha_log.fetcher import GachaLogFetcher
+
+BANNERS = [ZZZBannerType.STANDARD, ZZZBannerType.CHARACTER, ZZZBannerType.WEAPON, ZZZBannerType.BANGBOO]
+
+
+class FakeZZZClient:
+    """按页返回调频记录的 ZZZClient 替身"""
+
+    def __init__(self, sizes: dict, latency: float = 0.02):
+        self.latency = latency
+        self.requests = 0
+        self.history = {}
+        start = datetime.datetime(2024, 7, 4)
+        for banner_type, size in sizes.items():
+            # 从新到旧
+            self.history[banner_type.value] = [
+                {
+                    "uid": "10000001",
+                    "id": str(1720000000000000000 + banner_type.value * 100000 + idx),
+                    "item_type": "代理人",
+                    "item_id": "1191",
+                    "name": "艾莲",
+                    "rank_type": "2",
+                    "time": (start + datetime.timedelta(minutes=idx)).strftime("%Y-%m-%d %H:%M:%S"),
+                    "gacha_id": "2001",
+                    "gacha_type": str(banner_type.value),
+                }
+                for idx in reversed(range(size))
+            ]
+
+    async def get_wish_page(self, end_id, banner_type, game, size=20, lang=None, authkey=None):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        items = self.history[banner_type]
+        if end_id:
+            items = [i for i in items if int(i["id"]) < int(end_id)]
+        return {"list": items[:size]}
+
+
+async def test_full_fetch():
+    client = FakeZZZClient({i: 95 for i in BANNERS})
+    fetcher = GachaLogFetcher(page_delay=0)
+    result = await fetcher.fetch(client, "authkey", {i: None for i in BANNERS})
+    assert all(len(result[i]) == 95 for i in BANNERS)
+    assert client.requests == fetcher.requests == 4 * 5
+
+
+async def test_watermark_fetch():
+    client = FakeZZZClient({i: 2000 for i in BANNERS})
+    watermarks = {i: client.history[i.value][3]["id"] for i in BANNERS}
+    fetcher = GachaLogFetcher(page_delay=0)
+    result = await fetcher.fetch(client, "authkey", watermarks)
+    assert all(len(result[i]) == 3 for i in BANNERS)
+    assert all(int(result[i][-1].id) > int(watermarks[i]) for i in BANNERS)
+    # 每个卡池只需要一页
+    assert client.requests == 4
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+async def test_concurrent_fetch(concurrency: int):
+    client = FakeZZZClient({i: 100 for i in BANNERS}, latency=0.05)
+    fetcher = GachaLogFetcher(concurrency=concurrency, page_delay=0)
+    start = time.perf_counter()
+    await fetcher.fetch(client, "authkey", {i: None for i in BANNERS})
+    elapsed = time.perf_counter() - start
+    sequential = client.requests * client.latency
+    if concurrency == 1:
+        assert elapsed >= sequential
+    else:
+        assert elapsed < sequential / 2
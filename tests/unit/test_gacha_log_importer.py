@@ -0,0 +1,85 @@
+import datetime
+import time
+import tracemalloc
+
+import pytest
+from pydantic import ValidationError
+
+from modules.gacha_log.importer import GachaLogImporter
+from modules.gacha_log.models import GachaItem, GachaLogInfo
+
+ITEMS = [("代理人", "艾莲", "5"), ("音擎", "深海访客", "5"), ("代理人", "妮可", "4"), ("音擎", "街头巨星", "3")]
+
+
+def zzzgf_rows(size: int, start_id: int = 1720000000000000000):
+    """生成 ZZZGF 格式的调频记录"""
+    start = datetime.datetime(2024, 7, 4)
+    for idx in range(size):
+        item_type, name, rank_type = ITEMS[idx % len(ITEMS)] if idx % 20 < 4 else ITEMS[3]
+        yield {
+            "gacha_id": "2001",
+            "gacha_type": str([1, 2, 3, 5][idx % 4]),
+            "item_id": "",
+            "count": "1",
+            "time": (start + datetime.timedelta(minutes=idx // 10)).strftime("%Y-%m-%d %H:%M:%S"),
+            "name": name,
+            "item_type": item_type,
+            "rank_type": rank_type,
+            "id": str(start_id + idx),
+        }
+
+
+def new_gacha_log() -> GachaLogInfo:
+    return GachaLogInfo(user_id="1", uid="10000001", update_time=datetime.datetime.now())
+
+
+def test_fast_path_parity():
+    importer = GachaLogImporter()
+    for row in zzzgf_rows(100):
+        assert importer.parse_item(row).dict() == GachaItem(**row).dict()
+    # 非字符串字段交由完整校验处理
+    row = next(zzzgf_rows(1))
+    row["id"], row["gacha_type"] = 1720000000000000000, 1
+    assert importer.parse_item(row).dict() == GachaItem(**row).dict()
+
+
+def test_invalid_item():
+    importer = GachaLogImporter()
+    row = next(zzzgf_rows(1))
+    row["name"] = "不存在的代理人"
+    with pytest.raises(ValidationError):
+        importer.parse_item(row)
+
+
+def test_import_merge():
+    gacha_log = new_gacha_log()
+    importer = GachaLogImporter()
+    assert importer.import_items(zzzgf_rows(1000), gacha_log) == 1000
+    assert sum(len(i) for i in gacha_log.item_list.values()) == 1000
+    # 重复导入只会新增不存在的记录
+    importer = GachaLogImporter()
+    assert importer.import_items(zzzgf_rows(1200), gacha_log) == 200
+    assert importer.total == 1200
+    assert sum(len(i) for i in gacha_log.item_list.values()) == 1200
+    assert importer.changed_pools == set(gacha_log.item_list)
+
+
+def run_import(size: int):
+    rows = list(zzzgf_rows(size))
+    gacha_log = new_gacha_log()
+    start = time.perf_counter()
+    GachaLogImporter().import_items(rows, gacha_log)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    GachaLogImporter().import_items(rows, new_gacha_log())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def test_import_benchmark():
+    small_time, small_peak = run_import(25000)
+    large_time, large_peak = run_import(100000)
+    # 数据量增加 4 倍，耗时与每条记录的内存占用应保持线性
+    assert large_time < small_time * 8
+    assert large_peak / 100000 < small_peak / 25000 * 1.5
@@ -0,0 +1,137 @@
+import datetime
+import random
+
+from modules.gacha_log.luck import LUCK_AVG_BINS, LUCK_UP_BINS, GachaLogLuck
+from modules.gacha_log.models import (
+    GachaItem,
+    GachaLogInfo,
+    GachaLogLuckHistogram,
+    GachaLogPoolSummary,
+    GachaLogSummaryItem,
+)
+from modules.gacha_log.storage import GachaLogStorage
+from modules.gacha_log.summary import GachaLogSummaries
+
+
+class Luck(GachaLogSummaries, GachaLogLuck):
+    def __init__(self, gacha_log_path):
+        self.storage = GachaLogStorage(gacha_log_path)
+
+    @staticmethod
+    def check_avatar_up(name: str, _: datetime.datetime) -> bool:
+        return name != "猫又"
+
+    async def save(self, info: GachaLogInfo):
+        old = await self.load_summary(info.user_id, info.uid)
+        await self.storage.save(info)
+        await self.update_luck(old, await self.update_summary(info))
+
+
+def random_history(rng: random.Random, size: int, start_id: int = 0):
+    """按五星概率随机生成的代理人调频记录"""
+    rate = rng.uniform(0.01, 0.03)
+    start = datetime.datetime(2024, 7, 4)
+    return [
+        GachaItem.construct(
+            id=str(1720000000000000000 + start_id + idx),
+            name=rng.choice(["艾莲", "猫又"]) if rng.random() < rate else "妮可",
+            gacha_id="",
+            gacha_type="2",
+            item_id="",
+            item_type="代理人",
+            rank_type="5" if rng.random() < rate else "4",
+            time=start + datetime.timedelta(minutes=start_id + idx),
+        )
+        for idx in range(size)
+    ]
+
+
+def pool_summary(avg: int, five: int) -> GachaLogPoolSummary:
+    items = [
+        GachaLogSummaryItem(name="艾莲", type="代理人", count=avg, time=datetime.datetime(2024, 7, 4))
+        for _ in range(five)
+    ]
+    return GachaLogPoolSummary(total=avg * five, five=items)
+
+
+def test_luck_percent():
+    rng = random.Random(0)
+    population = [rng.randint(30, 90) for _ in range(1000)]
+    histogram = GachaLogLuckHistogram(avg=[0] * LUCK_AVG_BINS, up=[0] * LUCK_UP_BINS)
+    for avg in population:
+        histogram.avg[Luck.get_luck_values("常驻调频", pool_summary(avg, 3))[0]] += 1
+    for avg in (30, 45, 60, 75, 90):
+        value, _ = Luck.get_luck_values("常驻调频", pool_summary(avg, 3))
+        expected = round(len([i for i in population if i <= avg]) / len(population) * 100, 1)
+        assert Luck.get_luck_percent(histogram, value) == expected
+    # 人数不足时不显示排名
+    histogram.avg = [0] * LUCK_AVG_BINS
+    histogram.avg[50] = 10
+    assert Luck.get_luck_percent(histogram, 50) is None
+
+
+async def test_incremental_luck(tmp_path):
+    rng = random.Random(1)
+    luck = Luck(tmp_path)
+    accounts = {}
+    for idx in range(150):
+        info = GachaLogInfo(
+            user_id=str(idx),
+            uid=str(10000000 + idx),
+            update_time=datetime.datetime.now(),
+            item_list={"代理人调频": random_history(rng, rng.randint(0, 600))},
+        )
+        accounts[idx] = info
+        await luck.save(info)
+    # 部分账号追加新记录，部分账号删除
+    for idx in rng.sample(list(accounts), 50):
+        info = accounts[idx]
+        items = info.item_list["代理人调频"]
+        info.item_list["代理人调频"] = items + random_history(rng, rng.randint(1, 300), len(items))
+        await luck.save(info)
+    for idx in rng.sample(list(accounts), 20):
+        info = accounts.pop(idx)
+        summary = await luck.load_summary(info.user_id, info.uid)
+        await luck.storage.remove(info.user_id, info.uid)
+        await luck.update_luck(summary, None)
+    incremental = await luck.load_luck()
+    rebuilt = await luck.rebuild_luck()
+    assert incremental.dict() == rebuilt.dict()
+    histogram = rebuilt.pools["代理人调频"]
+    with_five = [i for i in accounts.values() if any(j.rank_type == "5" for j in i.item_list["代理人调频"])]
+    assert sum(histogram.avg) == len(with_five)
+    summary = await luck.get_pool_summary(with_five[0].user_id, with_five[0].uid, "代理人调频")
+    avg_percent, up_percent = await luck.get_luck_rank("代理人调频", summary)
+    assert 0 < avg_percent <= 100
+    assert up_percent is None or 0 < up_percent <= 100
+
+
+async def test_luck_invalid(tmp_path):
+    rng = random.Random(2)
+    luck = Luck(tmp_path)
+    infos = []
+    for idx in range(20):
+        info = GachaLogInfo(
+            user_id=str(idx),
+            uid=str(10000000 + idx),
+            update_time=datetime.datetime.now(),
+            item_list={"代理人调频": random_history(rng, rng.randint(100, 600))},
+        )
+        infos.append(info)
+        await luck.save(info)
+    path = tmp_path / Luck.LUCK_FILE
+    outdated = (await luck.load_luck()).copy(update={"version": 0}).json().encode()
+    # 写了一半的文件、格式错误与旧版本
+    for content in (b'{"version"', b'{"pools": []}', outdated):
+        path.write_bytes(content)
+        assert await luck.load_luck() is None
+        # 运气分布损坏或版本变化时从所有账号重新生成，不会出现负数
+        info = infos[rng.randrange(len(infos))]
+        info.item_list["代理人调频"] += random_history(rng, 100, 1000)
+        await luck.save(info)
+        incremental = await luck.load_luck()
+        assert all(i >= 0 for i in incremental.pools["代理人调频"].avg)
+        assert incremental.dict() == (await luck.rebuild_luck()).dict()
+    path.unlink()
+    assert await luck.check_luck()
+    assert not await luck.check_luck()
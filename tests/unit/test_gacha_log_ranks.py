@@ -0,0 +1,159 @@
+import asyncio
+import datetime
+import random
+import time
+from collections import Counter
+from typing import List
+
+from modules.gacha_log import ranks as ranks_module
+from modules.gacha_log.log import GachaLog
+from modules.gacha_log.models import GachaItem, GachaLogInfo, ImportType
+
+SCORES = ("player_id", "type", "score_1", "score_2", "score_3", "score_4", "score_5")
+
+
+class FakeRankBatch:
+    """记录每一批写入的排行数据"""
+
+    def __init__(self, supported: bool = True):
+        self.supported = supported
+        self.batches: List[list] = []
+
+    async def add_or_update_many(self, ranks) -> int:
+        self.batches.append(list(ranks))
+        return len(ranks)
+
+
+class FakeRankService:
+    def __init__(self):
+        self.cleared = 0
+        self.ranks = {}
+        self.added = 0
+        self.updated = 0
+
+    async def del_all_cache_by_type(self, *_):
+        self.cleared += 1
+
+    async def get_rank_by_user_id(self, player_id: int):
+        return [rank for key, rank in self.ranks.items() if key[0] == player_id]
+
+    async def add(self, rank):
+        self.added += 1
+        self.ranks[(rank.player_id, rank.type)] = rank
+
+    async def update(self, rank):
+        self.updated += 1
+        self.ranks[(rank.player_id, rank.type)] = rank
+
+
+class FakeMessage:
+    def __init__(self):
+        self.texts: List[str] = []
+
+    async def edit_text(self, text: str):
+        self.texts.append(text)
+
+
+class LoopMonitor:
+    """记录事件循环被堵塞的最长时间"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.max_block = 0.0
+        self.task = None
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.max_block = max(self.max_block, time.perf_counter() - start - self.interval)
+
+    async def __aenter__(self):
+        self.task = asyncio.create_task(self.run())
+        await asyncio.sleep(0)
+        return self
+
+    async def __aexit__(self, *_):
+        self.task.cancel()
+
+
+def gacha_log_info(rng: random.Random, user_id: str, uid: str, import_type: ImportType) -> GachaLogInfo:
+    start = datetime.datetime(2024, 7, 4)
+    item_list = {}
+    for pool_name, gacha_type, item_type in (("代理人调频", "2", "代理人"), ("音擎调频", "3", "音擎")):
+        item_list[pool_name] = [
+            GachaItem(
+                id=str(1720000000000000000 + idx),
+                name=rng.choice(["艾莲", "猫又"]) if item_type == "代理人" else "深海访客",
+                gacha_type=gacha_type,
+                item_type=item_type,
+                rank_type=rng.choices(["5", "4", "3"], [0.02, 0.1, 0.88])[0],
+                time=start + datetime.timedelta(minutes=idx),
+            )
+            for idx in range(rng.randint(100, 400))
+        ]
+    return GachaLogInfo(
+        user_id=user_id,
+        uid=uid,
+        update_time=start,
+        import_type=import_type.value,
+        item_list=item_list,
+    )
+
+
+async def test_recount_all_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(ranks_module, "RECOUNT_CHUNK_SIZE", 5)
+    monkeypatch.setattr(ranks_module, "RECOUNT_REPORT_INTERVAL", 0)
+    batch, service = FakeRankBatch(), FakeRankService()
+    gacha_log = GachaLog(gacha_log_path=tmp_path, gacha_log_rank_service=service, gacha_log_rank_batch=batch)
+    rng = random.Random(0)
+    accounts = []
+    for idx in range(25):
+        # 其他工具导入的记录不参与排行
+        import_type = ImportType.UNKNOWN if idx in (3, 17) else ImportType.PaiGram
+        user_id, uid = str(1000 + idx), str(10000000 + idx)
+        await gacha_log.storage.save(gacha_log_info(rng, user_id, uid, import_type))
+        accounts.append((user_id, uid, import_type))
+    expected = []
+    for user_id, uid, import_type in accounts:
+        if import_type == ImportType.PaiGram:
+            expected.extend(await gacha_log.recount_one_data(user_id, uid))
+
+    message = FakeMessage()
+    async with LoopMonitor() as monitor:
+        progress = await gacha_log.recount_all_data(message)
+
+    # 每批账号的结果在一次写入中完成，子进程统计的结果与在主进程中统计的相同
+    assert len(batch.batches) == 5
+    assert all(len(i) <= 5 * len(GachaLog.BANNER_TYPE_MAP) for i in batch.batches)
+    written = Counter(tuple(getattr(rank, i) for i in SCORES) for ranks in batch.batches for rank in ranks)
+    assert written == Counter(tuple(getattr(rank, i) for i in SCORES) for rank in expected)
+    assert (progress.total, progress.done, progress.failed, progress.ranks) == (25, 25, 2, len(expected))
+    assert message.texts and message.texts[-1].startswith("已处理 25/25 个文件，失败 2 个")
+    assert service.cleared > 0
+    # 统计在子进程中完成，主事件循环只负责写入
+    assert monitor.max_block < 0.5
+
+
+def test_recount_progress():
+    progress = ranks_module.GachaLogRecountProgress(10)
+    progress.update(5, 1, 8)
+    progress.update(5, 0, 12)
+    assert (progress.done, progress.failed, progress.ranks) == (10, 1, 20)
+    assert str(progress).startswith("已处理 10/10 个文件，失败 1 个，写入 20 条数据")
+
+
+async def test_unsupported_batch(tmp_path):
+    # 数据库不支持 upsert 时逐条添加或更新
+    batch, service = FakeRankBatch(supported=False), FakeRankService()
+    gacha_log = GachaLog(gacha_log_path=tmp_path, gacha_log_rank_service=service, gacha_log_rank_batch=batch)
+    rng = random.Random(0)
+    ranks = []
+    for idx in range(3):
+        user_id, uid = str(1000 + idx), str(10000000 + idx)
+        await gacha_log.storage.save(gacha_log_info(rng, user_id, uid, ImportType.PaiGram))
+        ranks.extend(await gacha_log.recount_one_data(user_id, uid))
+    await gacha_log.add_or_update_many(ranks)
+    await gacha_log.add_or_update_many(ranks)
+    assert not batch.batches
+    assert (service.added, service.updated) == (len(ranks), len(ranks))
@@ -0,0 +1,209 @@
+import datetime
+import json
+
+import pytest
+
+from modules.gacha_log.models import GachaItem, GachaLogInfo, GachaLogPoolIndex
+from modules.gacha_log.storage import GachaLogStorage
+
+
+def gacha_log_info(user_id: str, uid: str, size: int) -> GachaLogInfo:
+    start = datetime.datetime(2024, 7, 4)
+    items = [
+        GachaItem(
+            id=str(1720000000000000000 + idx),
+            name="艾莲",
+            gacha_type="2",
+            item_type="代理人",
+            rank_type="3",
+            time=start + datetime.timedelta(minutes=idx),
+        )
+        for idx in range(size)
+    ]
+    return GachaLogInfo(
+        user_id=user_id,
+        uid=uid,
+        update_time=start,
+        item_list={"代理人调频": items, "音擎调频": [], "常驻调频": [], "邦布调频": []},
+    )
+
+
+async def test_manifest(tmp_path):
+    storage = GachaLogStorage(tmp_path)
+    await storage.save(gacha_log_info("123456", "10000001", 10))
+    await storage.save(gacha_log_info("654356", "10000002", 5))
+    assert storage.get_account_path("123456", "10000001").parent.name == "56"
+    assert storage.list_accounts() == [("123456", "10000001"), ("654356", "10000002")]
+    manifest = await storage.load_manifest("56")
+    item = manifest.accounts["123456-10000001"]
+    assert item.size == storage.get_account_path("123456", "10000001").joinpath("2-1.log").stat().st_size
+    # 追加记录后清单随之更新
+    await storage.save(gacha_log_info("123456", "10000001", 20))
+    assert (await storage.load_manifest("56")).accounts["123456-10000001"].size > item.size
+    assert await storage.move("123456", "10000001", "777")
+    assert storage.list_accounts() == [("654356", "10000002"), ("777", "10000001")]
+    assert (await storage.load("777", "10000001")).user_id == "777"
+    assert await storage.remove("777", "10000001")
+    assert storage.list_accounts() == [("654356", "10000002")]
+    assert not list(tmp_path.rglob("*.tmp"))
+
+
+async def test_broken_manifest(tmp_path):
+    storage = GachaLogStorage(tmp_path)
+    await storage.save(gacha_log_info("123456", "10000001", 10))
+    storage.get_manifest_path("56").write_text("{", encoding="utf-8")
+    await storage.save(gacha_log_info("123456", "10000002", 10))
+    assert storage.list_accounts() == [("123456", "10000001"), ("123456", "10000002")]
+
+
+async def test_migrate_layout(tmp_path):
+    legacy = gacha_log_info("100", "10000001", 30)
+    tmp_path.joinpath("100-10000001.json").write_text(legacy.json(), encoding="utf-8")
+    tmp_path.joinpath("100-10000001.json.bak").write_text("{}", encoding="utf-8")
+    tmp_path.joinpath("100-10000001-zzzgf.json").write_text("{}", encoding="utf-8")
+    # 分片之前按账号分目录的记录
+    flat = GachaLogStorage(tmp_path / "flat")
+    await flat.save(gacha_log_info("201", "10000002", 10))
+    flat.get_account_path("201", "10000002").rename(tmp_path / "201-10000002")
+    storage = GachaLogStorage(tmp_path)
+    assert storage.list_accounts() == [("100", "10000001")]
+    assert await storage.migrate_layout() == 2
+    assert await storage.migrate_layout() == 0
+    assert json.loads(storage.get_layout_path().read_text(encoding="utf-8"))["version"] == 1
+    assert storage.list_accounts() == [("100", "10000001"), ("201", "10000002")]
+    assert sorted(i.name for i in tmp_path.iterdir() if i.is_file()) == ["layout.json"]
+    info = await storage.load("100", "10000001")
+    assert [i.id for i in info.item_list["代理人调频"]] == [i.id for i in legacy.item_list["代理人调频"]]
+    assert len((await storage.load("201", "10000002")).item_list["代理人调频"]) == 10
+
+
+async def test_append_pool(tmp_path):
+    storage = GachaLogStorage(tmp_path)
+    await storage.save(gacha_log_info("100", "10000001", 10))
+    index = await storage.load_index("100", "10000001")
+    pool_index = index.pools["代理人调频"]
+    path = storage.get_account_path("100", "10000001") / pool_index.file
+    size = path.stat().st_size
+    assert (pool_index.count, pool_index.size, pool_index.last_id) == (10, size, "1720000000000000009")
+    # 新记录以已保存的记录为前缀时只追加新增的部分
+    await storage.save(gacha_log_info("100", "10000001", 15))
+    new_index = (await storage.load_index("100", "10000001")).pools["代理人调频"]
+    assert new_index.file == pool_index.file and new_index.generation == pool_index.generation
+    assert new_index.count == 15 and new_index.size == path.stat().st_size > size
+    info = await storage.load("100", "10000001", ["代理人调频"])
+    assert [i.id for i in info.item_list["代理人调频"]] == [str(1720000000000000000 + i) for i in range(15)]
+
+
+async def test_can_append():
+    items = gacha_log_info("100", "10000001", 5).item_list["代理人调频"]
+    pool_index = GachaLogPoolIndex(file="2-1.log", count=3, last_id=items[2].id)
+    assert GachaLogStorage.can_append(items, pool_index)
+    assert GachaLogStorage.can_append(items, GachaLogPoolIndex(file="2-1.log"))
+    # 没有文件、已保存的记录更多或者最后一条记录不同时需要重写
+    assert not GachaLogStorage.can_append(items, GachaLogPoolIndex(count=3, last_id=items[2].id))
+    assert not GachaLogStorage.can_append(items[:2], pool_index)
+    assert not GachaLogStorage.can_append(items, GachaLogPoolIndex(file="2-1.log", count=3, last_id=items[1].id))
+
+
+async def test_rewrite_pool(tmp_path):
+    storage = GachaLogStorage(tmp_path)
+    await storage.save(gacha_log_info("100", "10000001", 10))
+    old = (await storage.load_index("100", "10000001")).pools["代理人调频"]
+    info = gacha_log_info("100", "10000001", 10)
+    info.item_list["代理人调频"][3].name = "莱卡恩"
+    await storage.save(info, rewrite={"代理人调频"})
+    new = (await storage.load_index("100", "10000001")).pools["代理人调频"]
+    account_path = storage.get_account_path("100", "10000001")
+    assert new.generation == old.generation + 1 and not (account_path / old.file).exists()
+    assert (await storage.load("100", "10000001")).item_list["代理人调频"][3].name == "莱卡恩"
+
+
+async def test_truncate_uncommitted(tmp_path):
+    storage = GachaLogStorage(tmp_path)
+    await storage.save(gacha_log_info("100", "10000001", 10))
+    pool_index = (await storage.load_index("100", "10000001")).pools["代理人调频"]
+    path = storage.get_account_path("100", "10000001") / pool_index.file
+    # 模拟追加之后、写入索引头之前崩溃
+    with path.open("ab") as f:
+        f.write(b'{"id": "broken"')
+    assert len((await storage.load("100", "10000001")).item_list["代理人调频"]) == 10
+    await storage.save(gacha_log_info("100", "10000001", 12))
+    assert path.stat().st_size == (await storage.load_index("100", "10000001")).pools["代理人调频"].size
+    info = await storage.load("100", "10000001")
+    assert [i.id for i in info.item_list["代理人调频"]] == [str(1720000000000000000 + i) for i in range(12)]
+
+
+async def test_migrate_legacy(tmp_path):
+    legacy = gacha_log_info("100", "10000001", 20)
+    storage = GachaLogStorage(tmp_path)
+    storage.get_legacy_path("100", "10000001").write_text(legacy.json(), encoding="utf-8")
+    storage.get_legacy_path("100", "10000001", bak=True).write_text("{}", encoding="utf-8")
+    assert storage.exists("100", "10000001")
+    index = await storage.migrate_legacy("100", "10000001")
+    assert index.pools["代理人调频"].count == 20 and index.pools["音擎调频"].count == 0
+    assert not storage.get_legacy_path("100", "10000001").exists()
+    assert not storage.get_legacy_path("100", "10000001", bak=True).exists()
+    info = await storage.load("100", "10000001")
+    assert info.item_list["代理人调频"] == legacy.item_list["代理人调频"]
+    assert await storage.migrate_legacy("100", "10000001") is None
+
+
+async def test_write_atomic(tmp_path):
+    path = tmp_path / "index.json"
+    await GachaLogStorage.write_atomic(path, b"old")
+    await GachaLogStorage.write_atomic(path, b"new")
+    assert path.read_bytes() == b"new"
+    # 写入失败时保留原文件，并清理临时文件
+    with pytest.raises(IsADirectoryError):
+        await GachaLogStorage.write_atomic(tmp_path, b"broken")
+    assert path.read_bytes() == b"new"
+    assert not list(tmp_path.rglob("*.tmp"))
+
+
+async def test_watermarks(tmp_path):
+    storage = GachaLogStorage(tmp_path)
+    assert await storage.get_watermarks("100", "10000001") == {}
+    info = gacha_log_info("100", "10000001", 10)
+    await storage.save(info)
+    # 旧记录缺少 gacha_id 与 item_id 时需要完整获取
+    watermarks = await storage.get_watermarks("100", "10000001")
+    assert watermarks["代理人调频"] is None and watermarks["音擎调频"] is None
+    for item in info.item_list["代理人调频"]:
+        item.gacha_id, item.item_id = "2001", "1011"
+    await storage.save(info, rewrite={"代理人调频"})
+    info.item_list["代理人调频"].extend(gacha_log_info("100", "10000001", 12).item_list["代理人调频"][10:])
+    info.item_list["代理人调频"][-1].gacha_id = ""
+    await storage.save(info)
+    assert (await storage.load_index("100", "10000001")).pools["代理人调频"].incomplete == 2
+    info.item_list["代理人调频"][-2].item_id = info.item_list["代理人调频"][-1].item_id = "1011"
+    info.item_list["代理人调频"][-2].gacha_id = info.item_list["代理人调频"][-1].gacha_id = "2001"
+    await storage.save(info, rewrite={"代理人调频"})
+    assert (await storage.get_watermarks("100", "10000001"))["代理人调频"] == "1720000000000000011"
+    # 旧版索引头没有记录缺少字段的数量时读取卡池检查
+    index = await storage.load_index("100", "10000001")
+    index.pools["代理人调频"].incomplete = None
+    await storage.save_index(index)
+    assert (await storage.get_watermarks("100", "10000001"))["代理人调频"] == "1720000000000000011"
+
+
+async def test_manifest_journal(tmp_path):
+    storage = GachaLogStorage(tmp_path)
+    for idx in range(3):
+        await storage.save(gacha_log_info(f"{idx}56", "10000001", 10))
+    # 保存时只追加日志，不重写清单
+    assert not storage.get_manifest_path("56").exists()
+    journal_path = storage.get_manifest_journal_path("56")
+    assert len([i for i in journal_path.read_bytes().splitlines() if i]) == 3
+    # 写了一半的日志不影响之后的日志
+    with journal_path.open("ab") as f:
+        f.write(b'\n{"key": "956-10000001", "item": {"user_')
+    await storage.save(gacha_log_info("356", "10000001", 10))
+    assert storage.list_accounts() == [(f"{idx}56", "10000001") for idx in range(4)]
+    assert await storage.remove("156", "10000001")
+    # 日志超过大小后合并到清单
+    storage.MANIFEST_COMPACT_SIZE = 1
+    await storage.save(gacha_log_info("056", "10000001", 20))
+    assert not journal_path.exists()
+    manifest = await storage.load_manifest("56")
+    assert sorted(manifest.accounts) == ["056-10000001", "256-10000001", "356-10000001"]
+    assert storage.list_accounts() == [("056", "10000001"), ("256", "10000001"), ("356", "10000001")]
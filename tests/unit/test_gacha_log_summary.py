@@ -0,0 +1,100 @@
+import datetime
+import random
+
+import pytest
+
+from modules.gacha_log.analytics import GachaLogColumns
+from modules.gacha_log.const import GACHA_LOG_SUMMARY_VERSION
+from modules.gacha_log.models import GachaItem, GachaLogInfo, GachaLogPoolSummary, GachaLogSummary
+from modules.gacha_log.storage import GachaLogStorage
+from modules.gacha_log.summary import GachaLogSummaries
+
+POOLS = {
+    "代理人调频": ("2", "代理人", ["艾莲", "猫又", "朱鸢"]),
+    "音擎调频": ("3", "音擎", ["深海访客", "钢铁肉垫"]),
+    "常驻调频": ("1", "代理人", ["猫又", "丽娜"]),
+    "邦布调频": ("5", "邦布", ["阿全", "鲨牙布"]),
+}
+
+
+class Summaries(GachaLogSummaries):
+    def __init__(self, gacha_log_path):
+        self.storage = GachaLogStorage(gacha_log_path)
+
+    @staticmethod
+    def check_avatar_up(name: str, _: datetime.datetime) -> bool:
+        return name != "猫又"
+
+
+def random_history(rng: random.Random, pool_name: str, size: int):
+    gacha_type, item_type, names = POOLS[pool_name]
+    start = datetime.datetime(2024, 7, 4)
+    items = []
+    for idx in range(size):
+        rank_type = rng.choices(["5", "4", "3"], [0.02, 0.1, 0.88])[0]
+        # 四星中混入不同类型的物品，检查不计入四星列表时的保底计数
+        four_type = rng.choice([item_type, "音擎", "邦布"])
+        items.append(
+            GachaItem(
+                id=str(1720000000000000000 + idx),
+                name=rng.choice(names),
+                gacha_type=gacha_type,
+                item_type=item_type if rank_type != "4" else four_type,
+                rank_type=rank_type,
+                time=start + datetime.timedelta(minutes=idx),
+            )
+        )
+    return items
+
+
+@pytest.mark.parametrize("pool_name", list(POOLS))
+def test_incremental_summary(pool_name, tmp_path):
+    summaries = Summaries(tmp_path)
+    rng = random.Random(pool_name)
+    items = random_history(rng, pool_name, 2000)
+    summary = GachaLogPoolSummary()
+    end = 0
+    while end < len(items):
+        end = min(end + rng.randint(1, 300), len(items))
+        summary = summaries.update_pool_summary(pool_name, summary, items[:end])
+    full = summaries.build_pool_summary(pool_name, GachaLogColumns(items))
+    assert summary.dict() == full.dict()
+    assert summary.total == 2000 and summary.last_id == items[-1].id
+
+
+def test_summary_prefix_check(tmp_path):
+    summaries = Summaries(tmp_path)
+    items = random_history(random.Random(0), "代理人调频", 500)
+    summary = summaries.update_pool_summary("代理人调频", GachaLogPoolSummary(), items[:300])
+    # 已统计的记录不是新记录的前缀时重新统计
+    changed = items[:299] + [GachaItem(**{**items[299].dict(), "id": "1"})] + items[300:]
+    rebuilt = summaries.update_pool_summary("代理人调频", summary.copy(deep=True), changed)
+    assert rebuilt.dict() == summaries.build_pool_summary("代理人调频", GachaLogColumns(changed)).dict()
+    shorter = summaries.update_pool_summary("代理人调频", summary.copy(deep=True), items[:100])
+    assert shorter.dict() == summaries.build_pool_summary("代理人调频", GachaLogColumns(items[:100])).dict()
+
+
+async def test_summary_version(tmp_path):
+    summaries = Summaries(tmp_path)
+    items = random_history(random.Random(1), "代理人调频", 300)
+    info = GachaLogInfo(
+        user_id="100", uid="10000001", update_time=datetime.datetime(2024, 7, 4), item_list={"代理人调频": items}
+    )
+    await summaries.storage.save(info)
+    summary = await summaries.update_summary(info)
+    assert (await summaries.load_summary("100", "10000001")).dict() == summary.dict()
+    # 摘要版本变化时视为不存在，读取时在内存中重新统计，不写入文件
+    path = summaries.storage.get_summary_path("100", "10000001")
+    stale = GachaLogSummary(version=GACHA_LOG_SUMMARY_VERSION + 1, pools={"代理人调频": GachaLogPoolSummary()})
+    path.write_text(stale.json(), encoding="utf-8")
+    assert await summaries.load_summary("100", "10000001") is None
+    pool_summary = await summaries.get_pool_summary("100", "10000001", "代理人调频")
+    assert pool_summary.dict() == summary.pools["代理人调频"].dict()
+    assert GachaLogSummary.parse_raw(path.read_bytes()).version == GACHA_LOG_SUMMARY_VERSION + 1
+    # 保存记录时重新生成
+    info.item_list["代理人调频"] = items + random_history(random.Random(2), "代理人调频", 310)[300:]
+    await summaries.storage.save(info)
+    summary = await summaries.update_summary(info)
+    assert summary.version == GACHA_LOG_SUMMARY_VERSION and summary.pools["代理人调频"].total == 310
+    full = summaries.build_pool_summary("代理人调频", GachaLogColumns(info.item_list["代理人调频"]))
+    assert summary.pools["代理人调频"].dict() == full.dict()
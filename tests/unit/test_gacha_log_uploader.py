@@ -0,0 +1,164 @@
+import asyncio
+import datetime
+import time
+
+import httpx
+import pytest
+from aiohttp import web
+
+from modules.gacha_log.models import GachaItem, GachaLogInfo
+from modules.gacha_log.uploader import GachaLogUploader
+
+
+class StandInServer:
+    """本地的在线查询上传接口替身，记录收到的文件、连接数与同时处理的请求数"""
+
+    def __init__(self):
+        self.files = []
+        self.connections = set()
+        self.running = 0
+        self.max_running = 0
+        self.runner = None
+        self.url = ""
+
+    async def upload(self, request: web.Request) -> web.Response:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            self.connections.add(id(request.transport))
+            form = await request.post()
+            self.files.append((form["uid"], form["file"].file.read()))
+            await asyncio.sleep(0.01)
+            return web.json_response({"account_id": form["uid"]})
+        finally:
+            self.running -= 1
+
+    async def __aenter__(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/upload", self.upload)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # pylint: disable=W0212
+        self.url = f"http://127.0.0.1:{port}/upload"
+        return self
+
+    async def __aexit__(self, *_):
+        await self.runner.cleanup()
+
+
+class LoopMonitor:
+    """记录事件循环被堵塞的最长时间"""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.max_block = 0.0
+        self.task = None
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.max_block = max(self.max_block, time.perf_counter() - start - self.interval)
+
+    async def __aenter__(self):
+        self.task = asyncio.create_task(self.run())
+        await asyncio.sleep(0)
+        return self
+
+    async def __aexit__(self, *_):
+        self.task.cancel()
+
+
+def gacha_log_file(path, uid: str, size: int):
+    start = datetime.datetime(2024, 7, 4)
+    items = [
+        GachaItem.construct(
+            id=str(1720000000000000000 + idx),
+            name="街头巨星",
+            gacha_id="",
+            gacha_type="3",
+            item_id="",
+            item_type="音擎",
+            rank_type="3",
+            time=start + datetime.timedelta(minutes=idx),
+        )
+        for idx in range(size)
+    ]
+    info = GachaLogInfo.construct(
+        user_id="1", uid=uid, import_type="", update_time=start, item_list={"音擎调频": items}
+    )
+    path.write_bytes(info.json().encode("utf-8"))
+    return path
+
+
+async def legacy_upload(url: str, uid: str, path) -> httpx.Response:
+    """原来的上传方式：每次上传新建客户端并同步读取文件"""
+    with open(path, "rb") as f:
+        file = (path.name, f.read())
+    async with httpx.AsyncClient() as client:
+        response = await client.post(url, files={"file": file}, data={"uid": uid})
+        response.raise_for_status()
+        return response
+
+
+async def measure(uploads):
+    async with LoopMonitor() as monitor:
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*uploads)
+        total = time.perf_counter() - start
+    return total, max(latencies), monitor.max_block
+
+
+async def timed(coroutine):
+    start = time.perf_counter()
+    await coroutine
+    return time.perf_counter() - start
+
+
+@pytest.mark.parametrize("compress", [False, True])
+async def test_upload(tmp_path, compress: bool):
+    files = {
+        str(10000000 + idx): gacha_log_file(tmp_path / f"{idx}.json", str(10000000 + idx), 5000) for idx in range(8)
+    }
+    expected = {uid: path.read_bytes() for uid, path in files.items()}
+
+    async with StandInServer() as server:
+        legacy = await measure([timed(legacy_upload(server.url, uid, path)) for uid, path in files.items()])
+        assert len(server.connections) == len(files)
+        assert dict(server.files) == expected
+
+    uploader = GachaLogUploader(max_concurrency=2, chunk_size=16 * 1024, compress=compress)
+    async with StandInServer() as server:
+        pooled = await measure(
+            [timed(uploader.upload(server.url, {"uid": uid}, path.name, path)) for uid, path in files.items()]
+        )
+        # 第二轮上传复用连接池中的连接
+        await asyncio.gather(
+            *[uploader.upload(server.url, {"uid": uid}, path.name, path) for uid, path in files.items()]
+        )
+        await uploader.close()
+        assert dict(server.files) == expected
+        assert len(server.connections) <= 2
+        assert server.max_running <= 2
+    assert uploader.uploads == len(files) * 2
+    assert uploader.bytes_read == sum(len(i) for i in expected.values()) * 2
+    if compress:
+        assert uploader.bytes_sent * 5 < uploader.bytes_read
+    else:
+        assert uploader.bytes_sent > uploader.bytes_read
+    print(
+        f"legacy: total {legacy[0]:.3f}s, latency {legacy[1]:.3f}s, loop blocked {legacy[2] * 1000:.1f}ms; "
+        f"pooled: total {pooled[0]:.3f}s, latency {pooled[1]:.3f}s, loop blocked {pooled[2] * 1000:.1f}ms"
+    )
+
+
+async def test_upload_error(tmp_path):
+    async with StandInServer() as server:
+        uploader = GachaLogUploader()
+        with pytest.raises(httpx.HTTPStatusError):
+            await uploader.upload(server.url.replace("upload", "missing"), {"uid": "1"}, "1.json", b"{}")
+        response = await uploader.upload(server.url, {"uid": "10000000"}, "1.json", b"{}")
+        assert response.json() == {"account_id": "10000000"}
+        await uploader.close()
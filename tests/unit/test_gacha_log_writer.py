@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import random
+
+import pytest
+
+from modules.gacha_log.importer import GachaLogImporter
+from modules.gacha_log.models import GachaLogInfo
+from modules.gacha_log.storage import GachaLogStorage
+from modules.gacha_log.writer import GachaLogUpdate, GachaLogWriteCoordinator
+
+POOL_TYPES = ["1", "2", "3", "5"]
+
+
+class CountingStorage(GachaLogStorage):
+    """统计写入字节数的存储"""
+
+    def __init__(self, gacha_log_path):
+        super().__init__(gacha_log_path)
+        self.bytes_written = 0
+
+    async def write_atomic(self, path, data: bytes):
+        self.bytes_written += len(data)
+        await super().write_atomic(path, data)
+
+    async def append_pool(self, account_path, items, old):
+        new = await super().append_pool(account_path, items, old)
+        self.bytes_written += new.size - old.size
+        return new
+
+
+def zzzgf_rows(size: int):
+    start = datetime.datetime(2024, 7, 4)
+    return [
+        {
+            "id": str(1720000000000000000 + idx),
+            "name": "艾莲" if idx % 40 == 0 else "街头巨星",
+            "gacha_type": POOL_TYPES[idx % 4],
+            "item_type": "代理人" if idx % 40 == 0 else "音擎",
+            "rank_type": "5" if idx % 40 == 0 else "3",
+            "time": (start + datetime.timedelta(minutes=idx)).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        for idx in range(size)
+    ]
+
+
+def create_writer(storage: GachaLogStorage, window: float = 0.05) -> GachaLogWriteCoordinator:
+    async def load(user_id: str, uid: str) -> GachaLogInfo:
+        info = await storage.load(user_id, uid)
+        return info or GachaLogInfo(user_id=user_id, uid=uid, update_time=datetime.datetime.now())
+
+    async def save(user_id: str, uid: str, info: GachaLogInfo, rewrite):
+        info.user_id, info.uid = user_id, uid
+        await storage.save(info, rewrite)
+
+    return GachaLogWriteCoordinator(load, save, namespace=str(storage.gacha_log_path), window=window)
+
+
+def import_mutation(rows):
+    async def mutation(gacha_log: GachaLogInfo) -> GachaLogUpdate:
+        await asyncio.sleep(0)
+        return GachaLogUpdate(GachaLogImporter().import_items(rows, gacha_log))
+
+    return mutation
+
+
+def split_rows(rows, parts: int, seed: int):
+    """打乱后切分为互相重叠的多份导入文件"""
+    rng = random.Random(seed)
+    return [rng.sample(rows, len(rows) // 3) for _ in range(parts)]
+
+
+async def test_concurrent_imports(tmp_path):
+    rows = zzzgf_rows(4000)
+    imports = split_rows(rows, 20, 0)
+    expected = {i["id"] for part in imports for i in part}
+    storage = CountingStorage(tmp_path / "concurrent")
+    writer = create_writer(storage)
+    results = await asyncio.gather(*[writer.update("1", "10000001", import_mutation(i)) for i in imports])
+    info = await storage.load("1", "10000001")
+    items = [i for pool in info.item_list.values() for i in pool]
+    # 没有丢失的修改，每条记录只计入一次
+    assert {i.id for i in items} == expected
+    assert len(items) == sum(results) == len(expected)
+    for pool in info.item_list.values():
+        assert pool == sorted(pool, key=lambda x: (x.time, x.id))
+    assert writer.requests == 20
+    assert writer.writes == 1
+    assert writer.writes_saved == 19
+    assert writer.text() == "修改 20 写入 1 合并节省 19 等待写入 0"
+
+    serial = CountingStorage(tmp_path / "serial")
+    serial_writer = create_writer(serial, window=0)
+    for i in imports:
+        await serial_writer.update("1", "10000001", import_mutation(i))
+    assert serial_writer.writes == 20
+    assert storage.bytes_written * 5 < serial.bytes_written
+
+
+async def test_failed_mutation(tmp_path):
+    storage = CountingStorage(tmp_path)
+    writer = create_writer(storage)
+    rows = zzzgf_rows(100)
+
+    async def broken(gacha_log: GachaLogInfo) -> GachaLogUpdate:
+        GachaLogImporter().import_items(zzzgf_rows(200), gacha_log)
+        raise ValueError
+
+    results = await asyncio.gather(
+        writer.update("1", "10000001", import_mutation(rows[:50])),
+        writer.update("1", "10000001", broken),
+        writer.update("1", "10000001", import_mutation(rows[50:])),
+        return_exceptions=True,
+    )
+    assert results[0] == 50 and results[2] == 50
+    assert isinstance(results[1], ValueError)
+    info = await storage.load("1", "10000001")
+    assert sum(len(i) for i in info.item_list.values()) == 100
+
+
+@pytest.mark.parametrize("seed", range(3))
+async def test_interleaved_batches(tmp_path, seed: int):
+    rows = zzzgf_rows(2000)
+    imports = split_rows(rows, 12, seed)
+    storage = CountingStorage(tmp_path)
+    writer = create_writer(storage, window=0.01)
+    rng = random.Random(seed)
+
+    async def delayed(part):
+        await asyncio.sleep(rng.random() * 0.05)
+        return await writer.update("1", "10000001", import_mutation(part))
+
+    await asyncio.gather(*[delayed(i) for i in imports])
+    info = await storage.load("1", "10000001")
+    assert {i.id for pool in info.item_list.values() for i in pool} == {i["id"] for part in imports for i in part}
+    assert writer.writes + writer.writes_saved == 12
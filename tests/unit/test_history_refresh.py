@@ -0,0 +1,136 @@
+import asyncio
+import random
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+from modules.history_data.refresh import HistoryFingerprintMemory, HistoryRefresher
+
+LATENCY = 0.02
+
+
+class FakeZZZClient:
+    """注入延迟的 ZZZClient 替身，防卫战记录随机变化"""
+
+    def __init__(self, player_id: int, rng: random.Random):
+        self.player_id = player_id
+        self.rng = rng
+        self.season = 1
+        self.floors = [{"floor": i, "star": rng.randint(0, 3)} for i in range(3)]
+
+    def play(self):
+        self.floors[self.rng.randrange(3)]["star"] = 3
+
+    async def get_zzz_challenge(self):
+        await asyncio.sleep(LATENCY)
+        return SimpleNamespace(has_data=True, season=self.season, floors=[dict(i) for i in self.floors])
+
+    async def get_zzz_diary(self, month: str):
+        await asyncio.sleep(LATENCY)
+        return SimpleNamespace(current_month="202402", month=int(month), data_id=int(month))
+
+
+class MemoryHistoryService:
+    """内存中的 HistoryData 服务，统计读取次数"""
+
+    def __init__(self):
+        self.rows: Dict[Tuple[int, int], List[SimpleNamespace]] = {}
+        self.reads = 0
+
+    @staticmethod
+    def create(user_id: int, data):
+        if hasattr(data, "floors"):
+            return SimpleNamespace(
+                user_id=user_id, data_id=data.season, data={"abyss_data": {"all_floor_detail": data.floors}}
+            )
+        return SimpleNamespace(user_id=user_id, data_id=data.data_id, data={"diary_data": {}})
+
+    @staticmethod
+    def exists_data(data, old_data) -> bool:
+        floors = data.data.get("abyss_data", {}).get("all_floor_detail")
+        return any(d.data.get("abyss_data", {}).get("all_floor_detail") == floors for d in old_data)
+
+    async def get_by_user_id_data_id(self, user_id: int, data_id: int):
+        self.reads += 1
+        await asyncio.sleep(0.001)
+        return list(self.rows.get((user_id, data_id), []))
+
+    async def add(self, model):
+        self.rows.setdefault((model.user_id, model.data_id), []).append(model)
+
+
+async def save_abyss_data(service: MemoryHistoryService, uid: int, abyss_data) -> bool:
+    """模拟 ChallengePlugin.save_abyss_data"""
+    model = service.create(uid, abyss_data)
+    old_data = await service.get_by_user_id_data_id(uid, model.data_id)
+    if not service.exists_data(model, old_data):
+        await service.add(model)
+        return True
+    return False
+
+
+async def save_ledger_data(service: MemoryHistoryService, uid: int, diary) -> bool:
+    """模拟 LedgerPlugin.save_ledger_data"""
+    if int(diary.current_month) == diary.month:
+        return False
+    model = service.create(uid, diary)
+    if not await service.get_by_user_id_data_id(uid, model.data_id):
+        await service.add(model)
+        return True
+    return False
+
+
+async def refresh_all(refresher: HistoryRefresher, clients, abyss, ledger):
+    async def refresh(client: FakeZZZClient):
+        uid = client.player_id
+        await refresher.save_abyss_data(
+            abyss, uid, client.get_zzz_challenge, lambda data: save_abyss_data(abyss, uid, data)
+        )
+        for month in ("202312", "202401"):
+            await refresher.save_ledger_data(
+                uid, month, lambda m=month: client.get_zzz_diary(m), lambda data: save_ledger_data(ledger, uid, data)
+            )
+
+    return await refresher.run(clients, refresh)
+
+
+async def test_refresh():
+    rng = random.Random(0)
+    clients = [FakeZZZClient(i, rng) for i in range(200)]
+    abyss, ledger = MemoryHistoryService(), MemoryHistoryService()
+    refresher = HistoryRefresher(HistoryFingerprintMemory(), {"challenge": 1000, "ledger": 1000}, concurrency=16)
+
+    metrics = await refresh_all(refresher, clients, abyss, ledger)
+    assert metrics.users == 200 and metrics.failed == 0
+    assert metrics.saved == 600
+    assert abyss.reads + ledger.reads == 600
+    # 逐个用户请求三次接口需要的时间
+    assert metrics.elapsed < 200 * 3 * LATENCY / 4
+
+    # 部分用户的防卫战记录变化，其他数据不再读取数据库，已经保存的月报不再请求
+    changed = rng.sample(clients, 20)
+    for client in changed:
+        client.play()
+    abyss.reads = ledger.reads = 0
+    metrics = await refresh_all(refresher, clients, abyss, ledger)
+    assert metrics.fetched == 200
+    assert abyss.reads == metrics.db_reads <= 20
+    assert ledger.reads == 0
+    saved = sum(len(v) for v in abyss.rows.values())
+    assert saved == 200 + metrics.saved
+
+    # 变化之后又回到已经保存过的数据时不会重复保存
+    for client in changed:
+        client.floors = [dict(i) for i in abyss.rows[(client.player_id, 1)][0].data["abyss_data"]["all_floor_detail"]]
+    metrics = await refresh_all(refresher, changed, abyss, ledger)
+    assert metrics.saved == 0
+    assert sum(len(v) for v in abyss.rows.values()) == saved
+
+
+async def test_rate_limit():
+    rng = random.Random(1)
+    clients = [FakeZZZClient(i, rng) for i in range(30)]
+    refresher = HistoryRefresher(HistoryFingerprintMemory(), {"challenge": 20}, concurrency=30)
+    abyss, ledger = MemoryHistoryService(), MemoryHistoryService()
+    metrics = await refresh_all(refresher, clients, abyss, ledger)
+    # 前 20 个令牌可以立即使用，之后每秒 20 个
+    assert metrics.elapsed >= 0.5
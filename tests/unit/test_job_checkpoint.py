@@ -0,0 +1,112 @@
+import asyncio
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+from modules.checkpoint.store import (
+    JobCheckpointFile,
+    JobCheckpointManager,
+    JobCheckpointMemory,
+    JobCheckpointRunning,
+    get_daily_run,
+)
+
+
+class Crash(Exception):
+    pass
+
+
+async def run_job(manager: JobCheckpointManager, users, calls: Counter, crash_after: int = -1):
+    """并发处理用户，处理 crash_after 个用户后模拟重启"""
+    checkpoint = await manager.start("sign", "20240101")
+    if checkpoint.finished:
+        return checkpoint
+    semaphore = asyncio.Semaphore(8)
+
+    async def process(user_id: int):
+        async with semaphore:
+            if crash_after >= 0 and sum(calls.values()) >= crash_after:
+                raise Crash
+            calls[user_id] += 1
+            await asyncio.sleep(0.001)
+            await checkpoint.mark(user_id)
+
+    await asyncio.gather(*[process(i) for i in checkpoint.pending(users, lambda i: i)])
+    await checkpoint.finish()
+    return checkpoint
+
+
+@pytest.mark.parametrize("store_type", ["memory", "file"])
+async def test_resume(store_type, tmp_path):
+    def get_store():
+        return JobCheckpointMemory() if store_type == "memory" else JobCheckpointFile(tmp_path)
+
+    store = get_store()
+    users = list(range(500))
+    calls = Counter()
+    with pytest.raises(Crash):
+        await run_job(JobCheckpointManager(store, flush_size=20), users, calls, crash_after=300)
+    assert sum(calls.values()) == 300
+
+    # 重启后只处理剩余的用户，没有写入的最后一批用户会重复处理
+    if store_type == "file":
+        store = get_store()
+    manager = JobCheckpointManager(store, flush_size=20)
+    assert (await manager.get_unfinished("sign"))["run"] == "20240101"
+    checkpoint = await run_job(manager, users, calls)
+    assert set(calls) == set(users)
+    assert 280 <= checkpoint.resumed <= 300
+    assert sum(calls.values()) - len(users) <= 20
+    assert await manager.get_unfinished("sign") is None
+
+    # 已经完成的运行不再执行
+    calls.clear()
+    checkpoint = await run_job(manager, users, calls)
+    assert checkpoint.finished and not calls
+
+    # 新的运行重新开始
+    checkpoint = await manager.start("sign", "20240102")
+    assert not checkpoint.finished and checkpoint.pending(users, lambda i: i) == users
+    checkpoint = await manager.start("sign", "20240102", reset=True)
+    assert checkpoint.resumed == 0
+
+
+def test_daily_run():
+    assert get_daily_run(datetime(2024, 1, 2, 23, 59)) == "20240102"
+
+
+@pytest.mark.parametrize("store_type", ["memory", "file"])
+async def test_unfinished_many(store_type, tmp_path):
+    store = JobCheckpointMemory() if store_type == "memory" else JobCheckpointFile(tmp_path)
+    manager = JobCheckpointManager(store, flush_size=1)
+    first = await manager.start("redeem:A", "A")
+    second = await manager.start("redeem:B", "B")
+    await manager.start("redeem_other", "C")
+    await first.mark(1)
+    await second.mark(2)
+    await second.finish()
+    # 不同任务的检查点互不影响
+    assert (await manager.start("redeem:A", "A")).pending([1, 2], lambda i: i) == [2]
+    assert [state["run"] for state in await manager.get_unfinished_many("redeem:")] == ["A"]
+
+
+async def test_single_run():
+    manager = JobCheckpointManager(JobCheckpointMemory(), flush_size=20)
+    async with manager.run("sign", "20240101") as checkpoint:
+        await checkpoint.mark(1, 2)
+        # 同一个任务正在运行时不能再次开始，也不会清空已经完成的用户
+        with pytest.raises(JobCheckpointRunning):
+            async with manager.run("sign", "20240101", reset=True):
+                pass
+        assert manager.is_running("sign")
+        async with manager.run("sign_redo", "20240101"):
+            pass
+    assert not manager.is_running("sign")
+    # 运行出错时已经完成的用户也会写入存储
+    with pytest.raises(Crash):
+        async with manager.run("sign", "20240101") as checkpoint:
+            await checkpoint.mark(3)
+            raise Crash
+    checkpoint = await manager.start("sign", "20240101")
+    assert checkpoint.pending([1, 2, 3, 4], lambda i: i) == [4]
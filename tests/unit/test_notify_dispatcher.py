@@ -0,0 +1,153 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from modules.notify.dispatcher import NotifyDispatcher
+
+
+class FakeBot:
+    """记录发送时间的 Bot 替身，可以注入延迟与错误"""
+
+    def __init__(self, latency: float = 0.005):
+        self.latency = latency
+        self.messages: List[Tuple[float, int, str]] = []
+        self.slow: Dict[int, float] = {}
+        self.retry_after: Dict[int, int] = {}
+        self.forbidden = set()
+
+    async def send(self, chat_id: int, text: str, _: Optional[str]):
+        await asyncio.sleep(self.slow.get(chat_id, self.latency))
+        if self.retry_after.get(chat_id):
+            self.retry_after[chat_id] -= 1
+            raise RetryAfter(1)
+        if "<b>" in text and "</b>" not in text:
+            raise BadRequest("Can't parse entities")
+        if chat_id in self.forbidden:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        self.messages.append((time.monotonic(), chat_id, text))
+
+
+async def test_rate_limit():
+    bot = FakeBot()
+    dispatcher = NotifyDispatcher(bot.send, global_rate=50, chat_rate=10, workers=8)
+    dispatcher.start()
+    start = time.monotonic()
+    for chat_id in range(100):
+        dispatcher.notify(chat_id, f"hello {chat_id}")
+    # 生产者不等待发送
+    assert time.monotonic() - start < 0.01
+    assert dispatcher.metrics.depth == 100
+    assert await dispatcher.join(5)
+    elapsed = time.monotonic() - start
+    await dispatcher.stop()
+    assert len(bot.messages) == 100 and dispatcher.metrics.depth == 0
+    # 前 50 个令牌可以立即使用，之后每秒 50 个
+    assert 0.9 <= elapsed < 2
+
+
+async def test_coalesce():
+    bot = FakeBot()
+    dispatcher = NotifyDispatcher(bot.send, global_rate=100, chat_rate=10, group_rate=10, max_length=30)
+    dispatcher.start()
+    results = []
+
+    async def callback(exc):
+        results.append(exc)
+
+    for i in range(6):
+        dispatcher.notify(-1, f"notice {i}", callback=callback, key="notice")
+    dispatcher.notify(-1, "html", parse_mode="HTML", key="notice")
+    dispatcher.notify(-1, "other", key="other")
+    assert await dispatcher.join(2)
+    await dispatcher.stop()
+    texts = [text for _, chat_id, text in bot.messages if chat_id == -1]
+    # key 与解析模式相同的消息按长度合并
+    assert texts == ["notice 0\n\nnotice 1\n\nnotice 2", "notice 3\n\nnotice 4\n\nnotice 5", "html", "other"]
+    assert dispatcher.metrics.coalesced == 4 and dispatcher.metrics.sent == 4
+    assert results == [None] * 6
+    # 同一个会话的发送间隔
+    times = [t for t, chat_id, _ in bot.messages if chat_id == -1]
+    assert all(b - a >= 0.09 for a, b in zip(times, times[1:]))
+
+
+async def test_slow_chat():
+    bot = FakeBot()
+    bot.forbidden.add(2)
+    bot.slow[3] = 1
+    dispatcher = NotifyDispatcher(bot.send, global_rate=100, workers=4)
+    dispatcher.start()
+    errors = {}
+
+    def get_callback(chat_id: int):
+        async def callback(exc):
+            errors[chat_id] = exc
+
+        return callback
+
+    for chat_id in (3, 2, *range(10, 20)):
+        dispatcher.notify(chat_id, "hello", callback=get_callback(chat_id))
+    await asyncio.sleep(0.3)
+    # 发送缓慢的会话不会阻塞其他会话
+    assert {chat_id for _, chat_id, _ in bot.messages} == set(range(10, 20))
+    assert isinstance(errors[2], Forbidden)
+    assert 3 not in errors
+    assert await dispatcher.join(2)
+    await dispatcher.stop()
+    assert errors[3] is None
+    assert dispatcher.metrics.failed == 1 and dispatcher.metrics.sent == 11
+
+
+async def test_retry_after():
+    bot = FakeBot()
+    bot.retry_after[1] = 1
+    bot.retry_after[2] = 5
+    dispatcher = NotifyDispatcher(bot.send, global_rate=100, max_retries=1)
+    dispatcher.start()
+    errors = {}
+
+    def get_callback(chat_id: int):
+        async def callback(exc):
+            errors[chat_id] = exc
+
+        return callback
+
+    start = time.monotonic()
+    dispatcher.notify(1, "hello", callback=get_callback(1), key="notice")
+    await asyncio.sleep(0.1)
+    dispatcher.notify(1, "world", callback=get_callback(1), key="notice")
+    dispatcher.notify(2, "hello", callback=get_callback(2))
+    assert await dispatcher.join(5)
+    await dispatcher.stop()
+    # 触发限流后暂停全部发送，放回队列的消息与之后的新消息合并
+    assert [text for _, chat_id, text in bot.messages] == ["hello\n\nworld"]
+    assert all(t - start >= 1 for t, _, _ in bot.messages)
+    assert errors[1] is None and isinstance(errors[2], RetryAfter)
+    assert dispatcher.metrics.retries == 2 and dispatcher.metrics.failed == 1
+
+
+async def test_split_bad_request():
+    bot = FakeBot()
+    dispatcher = NotifyDispatcher(bot.send, global_rate=100, chat_rate=100, group_rate=100)
+    dispatcher.start()
+    errors = {}
+
+    def get_callback(idx: int):
+        async def callback(exc):
+            errors[idx] = exc
+
+        return callback
+
+    async def failed_callback(_):
+        raise ValueError
+
+    for idx, text in enumerate(["ok 0", "<b>bad", "ok 2"]):
+        dispatcher.notify(-1, text, "HTML", get_callback(idx), key="sign")
+    dispatcher.notify(-1, "ok 3", "HTML", failed_callback, key="sign")
+    assert await dispatcher.join(2)
+    await dispatcher.stop()
+    # 合并的消息发送失败后逐条发送，错误只交给格式错误的消息
+    assert [text for _, _, text in bot.messages] == ["ok 0", "ok 2", "ok 3"]
+    assert errors[0] is None and errors[2] is None and isinstance(errors[1], BadRequest)
+    assert dispatcher.metrics.split == 1 and dispatcher.metrics.depth == 0
@@ -0,0 +1,77 @@
+import datetime
+
+from simnet.models.genshin.transaction import Transaction, TransactionKind
+
+from modules.pay_log.fetcher import PayLogFetcher
+from modules.pay_log.models import BaseInfo, PayLog as PayLogModel
+
+
+def transaction(idx: int) -> Transaction:
+    return Transaction(
+        kind=TransactionKind.CRYSTAL,
+        id=1700000000 + idx,
+        datetime=datetime.datetime(2023, 1, 1) + datetime.timedelta(hours=idx),
+        add_num=[60, 300, 980, 1980, 3280, 6480][idx % 6],
+        reason="充值",
+    )
+
+
+class FakeGenshinClient:
+    """按页返回充值记录的 GenshinClient 替身"""
+
+    def __init__(self, size: int):
+        self.requests = 0
+        # 从新到旧
+        self.history = [transaction(idx) for idx in reversed(range(size))]
+
+    def add(self, size: int):
+        start = len(self.history)
+        self.history = [transaction(idx) for idx in reversed(range(start, start + size))] + self.history
+
+    async def transaction_log(self, authkey, kind=None, *, limit=None, lang=None, end_id=0):
+        self.requests += 1
+        items = self.history
+        if end_id:
+            items = [i for i in items if i.id < end_id]
+        return items[:20]
+
+
+def empty_pay_log() -> PayLogModel:
+    return PayLogModel(info=BaseInfo(uid="100000001"), list=[])
+
+
+async def test_incremental_sync():
+    client = FakeGenshinClient(1000)
+    fetcher = PayLogFetcher(page_delay=0)
+    pay_log = empty_pay_log()
+    index = fetcher.build_index(pay_log)
+    assert len(await fetcher.sync(client, "authkey", pay_log, index)) == 1000
+    assert client.requests == 51
+    assert [i.id for i in pay_log.list] == [i.id for i in client.history]
+
+    # 长期使用的账号重复刷新只需要一页
+    for new in (0, 3, 19):
+        client.requests = 0
+        client.add(new)
+        assert len(await fetcher.sync(client, "authkey", pay_log, index)) == new
+        assert client.requests == 1
+    assert [i.id for i in pay_log.list] == [i.id for i in client.history]
+    assert index.ids == [i.id for i in pay_log.list]
+    assert index.last_id == client.history[0].id
+    assert fetcher.check_index(pay_log, index)
+    assert fetcher.build_index(pay_log) == index
+
+    # 新记录超过一页时继续翻页，直到遇到已保存的记录
+    client.requests = 0
+    client.add(45)
+    assert len(await fetcher.sync(client, "authkey", pay_log, index)) == 45
+    assert client.requests == 3
+    assert [i.id for i in pay_log.list] == [i.id for i in client.history]
+
+
+def test_merge():
+    old = [transaction(idx) for idx in reversed(range(0, 100, 2))]
+    new = [transaction(idx) for idx in reversed(range(1, 100, 2))]
+    merged = PayLogFetcher.merge(old, new)
+    assert merged == sorted(old + new, key=lambda x: (x.time, x.id), reverse=True)
+    assert PayLogFetcher.merge_ids([i.id for i in old], [i.id for i in new]) == [i.id for i in merged]
@@ -0,0 +1,83 @@
+import copy
+import datetime
+import random
+
+import pytest
+from simnet.models.genshin.transaction import Transaction, TransactionKind
+
+from modules.pay_log.error import PayLogNotFound
+from modules.pay_log.fetcher import PayLogFetcher
+from modules.pay_log.models import BaseInfo, PayLog as PayLogModel, PayLogRollup
+from modules.pay_log.rollup import PayLogRollups
+
+AMOUNTS = [60, 120, 300, 330, 600, 680, 980, 1090, 1960, 1980, 2240, 3280, 3880, 3960, 6480, 6560, 8080, 12960, -60]
+PRICES = [[680], [300], [8080, 12960], [3880, 6560], [2240, 3960], [1090, 1960], [330, 600], [60, 120]]
+
+
+def price_data():
+    return [{"price": price, "count": 0} for price in PRICES]
+
+
+def random_history(rng: random.Random, size: int, days: int):
+    start = datetime.datetime(2022, 1, 1)
+    times = sorted((start + datetime.timedelta(minutes=rng.randrange(days * 1440)) for _ in range(size)), reverse=True)
+    return [
+        Transaction(
+            kind=TransactionKind.CRYSTAL,
+            id=1600000000 + size - idx,
+            datetime=time,
+            add_num=rng.choice(AMOUNTS),
+            reason="充值",
+        )
+        for idx, time in enumerate(times)
+    ]
+
+
+def full_result(pay_log: PayLogModel):
+    prices = price_data()
+    return PayLogRollups.get_full_month_data(pay_log, prices), prices
+
+
+def rollup_result(rollup: PayLogRollup):
+    prices = price_data()
+    return PayLogRollups.get_month_data(rollup, prices), prices
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_rollup_equivalence(seed: int):
+    rng = random.Random(seed)
+    # 覆盖少于六个月、跨年以及同一月份出现在不同年份的情况
+    days = rng.choice([20, 120, 300, 500, 1000])
+    history = random_history(rng, rng.randint(1, 400), days)
+    pay_log = PayLogModel(info=BaseInfo(uid="100000001"), list=history)
+    index = PayLogFetcher.build_index(pay_log)
+    rollup = PayLogRollup.parse_raw(PayLogRollups.build(pay_log, index).json())
+    assert PayLogRollups.check(rollup, index)
+    if all(i.amount <= 0 for i in history):
+        with pytest.raises(PayLogNotFound):
+            full_result(pay_log)
+        with pytest.raises(PayLogNotFound):
+            rollup_result(rollup)
+        return
+    assert rollup_result(rollup) == full_result(pay_log)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_rollup(seed: int):
+    rng = random.Random(seed)
+    history = random_history(rng, 600, 700)
+    split = rng.randint(1, 599)
+    pay_log = PayLogModel(info=BaseInfo(uid="100000001"), list=copy.copy(history[split:]))
+    index = PayLogFetcher.build_index(pay_log)
+    rollup = PayLogRollups.build(pay_log, index)
+    # 只有新记录所在的月份被修改
+    new = history[:split]
+    pay_log.list = PayLogFetcher.merge(pay_log.list, new)
+    index = PayLogFetcher.build_index(pay_log)
+    touched = {PayLogRollups.get_month_key(i) for i in new if i.amount > 0}
+    before = copy.deepcopy(rollup.months)
+    PayLogRollups.add(rollup, new, index)
+    assert {k for k, v in rollup.months.items() if before.get(k) != v} <= touched
+    assert rollup == PayLogRollups.build(pay_log, index)
+    assert PayLogRollups.check(rollup, index)
+    assert rollup_result(rollup) == full_result(pay_log)
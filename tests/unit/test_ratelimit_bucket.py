@@ -0,0 +1,21 @@
+import time
+
+from modules.ratelimit.bucket import TokenBucket
+
+
+async def test_token_bucket_pause():
+    bucket = TokenBucket(100)
+    bucket.pause(0.1)
+    start = time.monotonic()
+    await bucket.acquire()
+    assert time.monotonic() - start >= 0.1
+
+
+def test_token_bucket_try_acquire():
+    bucket = TokenBucket(10, 2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    # 令牌用完后返回补充一个令牌需要等待的时间
+    assert 0 < bucket.try_acquire() <= 0.1
+    bucket.pause(1)
+    assert 0.9 < bucket.try_acquire() <= 1
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import pytest
+
+from modules.redeem.scheduler import RedeemPriority, RedeemQueueFull, RedeemScheduler
+
+LATENCY = 0.02
+
+
+class Cooldown(Exception):
+    pass
+
+
+class FakeRedeem:
+    """注入延迟的兑换接口替身，同一账号间隔过短时触发冷却"""
+
+    def __init__(self, cooldown: float = 0.0):
+        self.cooldown = cooldown
+        self.calls: Dict[int, List[float]] = defaultdict(list)
+        self.order: List[str] = []
+        self.running = 0
+        self.max_running = 0
+        self.results: List[Optional[Exception]] = []
+
+    def get_func(self, key: int, name: str = ""):
+        async def redeem():
+            now = time.monotonic()
+            calls = self.calls[key]
+            calls.append(now)
+            if len(calls) > 1 and now - calls[-2] < self.cooldown:
+                raise Cooldown
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            await asyncio.sleep(LATENCY)
+            self.running -= 1
+            self.order.append(name)
+            return name
+
+        return redeem
+
+    async def done(self, _, exc: Optional[Exception]):
+        self.results.append(exc)
+
+
+def get_scheduler(**kwargs) -> RedeemScheduler:
+    kwargs.setdefault("global_rate", 1000)
+    return RedeemScheduler(lambda exc: isinstance(exc, Cooldown), **kwargs)
+
+
+async def test_broadcast():
+    api = FakeRedeem()
+    scheduler = get_scheduler(account_interval=5, workers=16, max_pending=64)
+    start = time.monotonic()
+    futures = [await scheduler.submit(i, api.get_func(i), api.done, RedeemPriority.JOB) for i in range(200)]
+    await asyncio.gather(*futures)
+    elapsed = time.monotonic() - start
+    await scheduler.stop()
+    assert len(api.results) == 200 and not any(api.results)
+    # 不同账号之间不需要等待冷却
+    assert elapsed < 200 * LATENCY / 8
+    assert api.max_running <= 16
+
+
+async def test_account_interval_and_cooldown():
+    api = FakeRedeem(cooldown=0.2)
+    scheduler = get_scheduler(account_interval=0.1, cooldown=0.1, cooldown_retries=3)
+    futures = [await scheduler.submit(1, api.get_func(1, str(i)), api.done) for i in range(3)]
+    assert await asyncio.gather(*futures) == ["0", "1", "2"]
+    await scheduler.stop()
+    calls = api.calls[1]
+    assert all(b - a >= 0.09 for a, b in zip(calls, calls[1:]))
+    # 间隔小于上游冷却时间时暂停后重试
+    assert scheduler.retries == len(calls) - 3 > 0
+    assert api.results == [None] * 3
+
+
+async def test_priority():
+    api = FakeRedeem()
+    scheduler = get_scheduler(account_interval=0.01, workers=1)
+    futures = [await scheduler.submit(i, api.get_func(i, f"job{i}"), api.done, RedeemPriority.JOB) for i in range(5)]
+    await asyncio.sleep(LATENCY / 2)
+    futures.append(await scheduler.submit(10, api.get_func(10, "user"), api.done, RedeemPriority.USER))
+    futures.append(await scheduler.submit(11, api.get_func(11, "admin"), api.done, RedeemPriority.ADMIN))
+    await asyncio.gather(*futures)
+    await scheduler.stop()
+    # 交互请求在正在执行的批量任务之后立即执行
+    assert api.order[:3] == ["job0", "admin", "user"]
+
+
+async def test_backpressure():
+    api = FakeRedeem()
+    scheduler = get_scheduler(account_interval=0.01, workers=2, max_pending=4, max_interactive=1)
+    futures = []
+    for i in range(10):
+        futures.append(await scheduler.submit(i, api.get_func(i), api.done, RedeemPriority.JOB))
+        # 批量任务等待执行的数量不超过 max_pending
+        assert sum(not f.done() for f in futures) <= 4
+    futures.append(await scheduler.submit(10, api.get_func(10), api.done, RedeemPriority.USER))
+    with pytest.raises(RedeemQueueFull):
+        await scheduler.submit(11, api.get_func(11), api.done, RedeemPriority.USER)
+    await asyncio.gather(*futures)
+    await scheduler.stop()
+    assert len(api.results) == 11
@@ -0,0 +1,145 @@
+import asyncio
+import random
+import time
+from typing import Dict, Optional, Set
+
+import pytest
+from simnet.errors import BadRequest, VisitsTooFrequently
+
+from modules.sign.executor import SignExecutor, SignProgress, SignRateLimiter, SignRetryType
+
+
+class NeedChallenge(Exception):
+    pass
+
+
+class FakeZZZClient:
+    """注入延迟与错误的 ZZZClient 替身，记录每个接口的请求时间"""
+
+    def __init__(
+        self,
+        latency: float = 0.02,
+        rate_limit: int = 0,
+        captcha: Optional[Set[int]] = None,
+        errors: Optional[Set[int]] = None,
+    ):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.captcha = captcha or set()
+        self.errors = errors or set()
+        self.calls: Dict[str, list] = {"rewards": [], "info": [], "sign": []}
+        self.signed: Set[int] = set()
+
+    async def request(self, endpoint: str):
+        self.calls[endpoint].append(time.monotonic())
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))  # nosec
+        if self.rate_limit:
+            self.rate_limit -= 1
+            raise VisitsTooFrequently()
+
+    async def get_monthly_rewards(self, player_id: int):
+        await self.request("rewards")
+        if player_id in self.errors:
+            raise BadRequest(message="error")
+
+    async def get_reward_info(self, player_id: int):
+        await self.request("info")
+
+    async def request_daily_reward(self, player_id: int):
+        await self.request("sign")
+        if player_id in self.captcha:
+            self.captcha.remove(player_id)
+            raise NeedChallenge
+        self.signed.add(player_id)
+
+
+def classify(exc: BaseException) -> Optional[SignRetryType]:
+    if isinstance(exc, NeedChallenge):
+        return SignRetryType.CAPTCHA
+    if isinstance(exc, VisitsTooFrequently):
+        return SignRetryType.RATE_LIMIT
+    return None
+
+
+async def run_sign(client: FakeZZZClient, users: int, limiter: SignRateLimiter, **kwargs):
+    results = {}
+
+    async def sign(player_id: int):
+        # 与 SignSystem.start_sign 相同，请求每个接口前取出令牌
+        await limiter.acquire("rewards")
+        await client.get_monthly_rewards(player_id)
+        await limiter.acquire("info")
+        await client.get_reward_info(player_id)
+        await limiter.acquire("sign")
+        await client.request_daily_reward(player_id)
+        return "OK"
+
+    async def done(player_id: int, result: Optional[str], exc: Optional[BaseException]):
+        results[player_id] = result if exc is None else exc
+
+    executor = SignExecutor(sign, done, classify, limiter=limiter, **kwargs)
+    progress = await executor.run(list(range(users)))
+    return progress, results
+
+
+def max_rate(calls: list, window: float = 0.5) -> float:
+    """滑动窗口内的最大请求速率"""
+    calls = sorted(calls)
+    start, result = 0, 0
+    for end, value in enumerate(calls):
+        while value - calls[start] > window:
+            start += 1
+        result = max(result, end - start + 1)
+    return result / window
+
+
+@pytest.mark.parametrize("rate", [40, 80])
+async def test_duration_scales_with_rate(rate: int):
+    users = 120
+    client = FakeZZZClient()
+    limiter = SignRateLimiter({"rewards": rate, "info": rate, "sign": rate})
+    progress, results = await run_sign(client, users, limiter, workers=64)
+    assert progress.done == progress.success == users
+    assert client.signed == set(range(users))
+    # 第一秒可以使用桶中保存的令牌，之后按允许的速率执行
+    expected = (users - rate) / rate
+    assert expected <= progress.elapsed < expected + 0.5
+    for calls in client.calls.values():
+        assert max_rate(calls, 1) <= rate * 2
+
+
+async def test_retry_queues():
+    reports = []
+
+    async def report(progress: SignProgress):
+        reports.append(progress.done)
+
+    client = FakeZZZClient(rate_limit=2, captcha={3, 5}, errors={7})
+    limiter = SignRateLimiter({}, default=1000)
+    progress, results = await run_sign(
+        client,
+        20,
+        limiter,
+        workers=4,
+        captcha_delay=0.05,
+        rate_limit_delay=0.05,
+        report=report,
+        report_interval=0.01,
+    )
+    assert progress.done == 20
+    assert progress.captcha_retries == 2
+    assert progress.rate_limit_retries == 2
+    assert progress.failed == 1 and isinstance(results[7], BadRequest)
+    assert client.signed == set(range(20)) - {7}
+    assert reports and reports[-1] == 20
+
+
+async def test_retry_exhausted():
+    client = FakeZZZClient(rate_limit=100, latency=0)
+    limiter = SignRateLimiter({}, default=1000)
+    progress, results = await run_sign(
+        client, 2, limiter, workers=2, rate_limit_retries=2, rate_limit_delay=0.01, captcha_retries=0
+    )
+    assert progress.failed == 2
+    assert progress.rate_limit_retries == 4
+    assert all(isinstance(i, VisitsTooFrequently) for i in results.values())